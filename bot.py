@@ -1,4 +1,7 @@
 # tg_zov/bot.py
+from services.registry import start_import_timer, startup_report, lazy_callable, loaded
+start_import_timer()  # ⏱ до aiogram и handlers — отчёт о старте см. startup_report()
+
 import asyncio
 import os
 import datetime
@@ -10,11 +13,14 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 from config import BOT_TOKEN, ADMIN_IDS
 from handlers import start, callback, accounts
-from services.event_manager import run_full_event_cycle
-from services.scheduler import ensure_scheduler_started, trigger_daily_flag
-from services.event_checker import check_all_events  # ✅ для мгновенной проверки
 from services.logger import logger, cleanup_old_logs  # ← добавить сюда импорт
 
+# Playwright-сервисы грузятся при первом использовании, а не при старте бота
+run_full_event_cycle = lazy_callable("services.event_manager", "run_full_event_cycle")
+ensure_scheduler_started = lazy_callable("services.scheduler", "ensure_scheduler_started")
+trigger_daily_flag = lazy_callable("services.scheduler", "trigger_daily_flag")
+check_all_events = lazy_callable("services.event_checker", "check_all_events")  # ✅ для мгновенной проверки
+
 # ────────────────────────────────────────────────
 # ⚙️ Настройки автозапуска
 # ────────────────────────────────────────────────
@@ -104,7 +110,18 @@ async def main() -> None:
     print("🚀 Бот запущен и готов к работе!")
 
     await on_startup(bot)
-    await dp.start_polling(bot)
+    startup_report()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # 🧩 закрываем тёплые сессии (cookies сохраняются) и общий пул браузеров —
+        # только если модули вообще загружались за время работы
+        warm = loaded("services.warm_sessions")
+        if warm is not None:
+            await warm.close_warm_sessions()
+        patches = loaded("services.browser_patches")
+        if patches is not None:
+            await patches.close_browser_pool()
 
 # ────────────────────────────────────────────────
 # 🏁 Точка входа
@@ -8,6 +8,7 @@ TOKEN_FILE = f"{DATA_DIR}/token.txt"
 ACCOUNTS_FILE = f"{DATA_DIR}/accounts.json"
 USER_ACCOUNTS_FILE = f"{DATA_DIR}/user_accounts.json"
 COOKIES_FILE = f"{DATA_DIR}/cookies.json"
+COOKIES_DB_FILE = f"{DATA_DIR}/cookies.sqlite3"
 HEADLESS_MODE = False  # поменяй на True, если не хочешь видеть браузер
 ADMIN_IDS = [1662209988]  # 🔹 твой Telegram ID
 TESTER_IDS = []  # 🔸 Telegram ID тестировщиков (без прав админа)
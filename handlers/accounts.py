@@ -1,20 +1,20 @@
 # tg_zov/handlers/accounts.py
-import json
-import os
-
 from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from config import USER_ACCOUNTS_FILE
 from services.accounts_manager import (
     add_account,
     remove_account,
     get_all_accounts,
     get_active_account,
-    set_active_account
+    set_active_account,
+    get_all_users_accounts,
 )
-from services.castle_api import extract_player_info_from_page, refresh_cookies_mvp
+from services.registry import lazy_callable
+
+extract_player_info_from_page = lazy_callable("services.castle_api", "extract_player_info_from_page")
+refresh_cookies_mvp = lazy_callable("services.castle_api", "refresh_cookies_mvp")
 
 router = Router()
 
@@ -31,14 +31,7 @@ class AccountManagementStates(StatesGroup):
 # 💾 Загрузка всех пользователей (для проверки дублей UID)
 # =============================
 def load_all_users() -> dict:
-    if not os.path.exists(USER_ACCOUNTS_FILE):
-        return {}
-    try:
-        with open(USER_ACCOUNTS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data if isinstance(data, dict) else {}
-    except Exception:
-        return {}
+    return get_all_users_accounts()
 
 
 # =============================
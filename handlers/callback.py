@@ -8,13 +8,19 @@ from aiogram import Router, types, F
 from aiogram.types import Message
 
 from config import ADMIN_IDS
-from services.flop_pair import run_flop_pair, find_flop_pairs
-from services.castle_api import refresh_cookies_mvp
-from services.castle_machine import run_castle_machine
-from services.thanksgiving_event import run_thanksgiving_event
-from services.promo_code import run_promo_code, load_promo_history, save_promo_history
 from services.accounts_manager import get_active_account, load_all_users
-from services.event_manager import run_full_event_cycle
+from services.registry import lazy_callable
+
+# Сервисы с Playwright грузятся при первом использовании (services.registry)
+run_flop_pair = lazy_callable("services.flop_pair", "run_flop_pair")
+find_flop_pairs = lazy_callable("services.flop_pair", "find_flop_pairs")
+refresh_cookies_mvp = lazy_callable("services.castle_api", "refresh_cookies_mvp")
+run_castle_machine = lazy_callable("services.castle_machine", "run_castle_machine")
+run_thanksgiving_event = lazy_callable("services.thanksgiving_event", "run_thanksgiving_event")
+run_promo_code = lazy_callable("services.promo_code", "run_promo_code")
+load_promo_history = lazy_callable("services.promo_code", "load_promo_history")
+save_promo_history = lazy_callable("services.promo_code", "save_promo_history")
+run_full_event_cycle = lazy_callable("services.event_manager", "run_full_event_cycle")
 
 router = Router()
 logger = logging.getLogger("callback")
@@ -259,7 +265,7 @@ async def handle_manual_autocollect(message: Message):
 # ---------------------------------------
 # 🧩 Маленькая помощь (GAS) — асинхронно
 # ---------------------------------------
-from services.gas_event import run_gas_event
+run_gas_event = lazy_callable("services.gas_event", "run_gas_event")
 
 @router.message(F.text == "🧩 Маленькая помощь")
 async def handle_gas_event(message: Message):
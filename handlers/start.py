@@ -18,44 +18,46 @@ from aiogram.fsm.context import FSMContext
 from html import escape
 import asyncio, logging
 
-from services.puzzle_exchange_auto import (
-    get_fragments,
-    exchange,
-    start_session,
-    close_session,
-    get_exchange_items,
-)
+from services.registry import lazy_callable, lazy_module
 
 from config import ADMIN_IDS, TESTER_IDS
-import services.login_and_refresh as lr1
-import services.login_and_refresh_2 as lr2
-from services.lucky_wheel_auto import run_lucky_wheel
-from services.magic_wheel_auto import run_magic_wheel
-from services.puzzle_claim_auto import claim_puzzle
 from services.puzzle_claim import issue_puzzle_codes, issue_specific_puzzle
-from services.dragon_quest import run_dragon_quest
-from services.puzzle_claim_auto2 import auto_claim_puzzle2, claim_puzzles_batch
+from services.claim_ledger import get_ledger as get_claim_ledger
+from services.stats_view import StatsView
+from services import accounts_manager
 from services.accounts_manager import load_all_users, ensure_user_exists, ensure_users_exist
-from services.farm_puzzles_auto import (
-    is_farm_running,
-    start_farm,
-    stop_farm,
-    has_saved_state
-)
-from services.farm_puzzles_duplicates_auto import (
-    start_farm as start_duplicates_farm,
-    is_farm_running as is_duplicates_running,
-    stop_farm as stop_duplicates_farm,
-)
 
-from services.castle_api import (
-    extract_player_info_from_page,
-    refresh_cookies_mvp,
-    login_shop_email,
-    start_shop_login_igg,
-    complete_shop_login_igg,
-)
-from services.event_manager import run_full_event_cycle
+# Сервисы с Playwright/aiohttp грузятся при первом использовании (services.registry)
+get_fragments = lazy_callable("services.puzzle_exchange_auto", "get_fragments")
+exchange = lazy_callable("services.puzzle_exchange_auto", "exchange")
+start_session = lazy_callable("services.puzzle_exchange_auto", "start_session")
+close_session = lazy_callable("services.puzzle_exchange_auto", "close_session")
+get_exchange_items = lazy_callable("services.puzzle_exchange_auto", "get_exchange_items")
+
+lr = lazy_module("services.login_and_refresh")
+run_lucky_wheel = lazy_callable("services.lucky_wheel_auto", "run_lucky_wheel")
+run_magic_wheel = lazy_callable("services.magic_wheel_auto", "run_magic_wheel")
+puzzle_claim_auto = lazy_module("services.puzzle_claim_auto")
+claim_puzzle = lazy_callable("services.puzzle_claim_auto", "claim_puzzle")
+get_warm_sessions = lazy_callable("services.warm_sessions", "get_warm_sessions")
+run_dragon_quest = lazy_callable("services.dragon_quest", "run_dragon_quest")
+auto_claim_puzzle2 = lazy_callable("services.puzzle_claim_auto2", "auto_claim_puzzle2")
+claim_puzzles_batch = lazy_callable("services.puzzle_claim_auto2", "claim_puzzles_batch")
+
+is_farm_running = lazy_callable("services.farm_puzzles_auto", "is_farm_running")
+start_farm = lazy_callable("services.farm_puzzles_auto", "start_farm")
+stop_farm = lazy_callable("services.farm_puzzles_auto", "stop_farm")
+has_saved_state = lazy_callable("services.farm_puzzles_auto", "has_saved_state")
+start_duplicates_farm = lazy_callable("services.farm_puzzles_duplicates_auto", "start_farm")
+is_duplicates_running = lazy_callable("services.farm_puzzles_duplicates_auto", "is_farm_running")
+stop_duplicates_farm = lazy_callable("services.farm_puzzles_duplicates_auto", "stop_farm")
+
+extract_player_info_from_page = lazy_callable("services.castle_api", "extract_player_info_from_page")
+refresh_cookies_mvp = lazy_callable("services.castle_api", "refresh_cookies_mvp")
+login_shop_email = lazy_callable("services.castle_api", "login_shop_email")
+start_shop_login_igg = lazy_callable("services.castle_api", "start_shop_login_igg")
+complete_shop_login_igg = lazy_callable("services.castle_api", "complete_shop_login_igg")
+run_full_event_cycle = lazy_callable("services.event_manager", "run_full_event_cycle")
 from keyboards.inline import (
     get_delete_accounts_kb,
     get_puzzle_accounts_kb,
@@ -76,7 +78,7 @@ from keyboards.reply import (
     get_admin_manage_menu as build_admin_manage_menu,
     get_admin_puzzles_menu as build_admin_puzzles_menu,
 )
-from services.event_checker import check_all_events
+check_all_events = lazy_callable("services.event_checker", "check_all_events")
 from services.accounts_manager import get_all_accounts
 router = Router()
 USER_ACCOUNTS_FILE = "data/user_accounts.json"
@@ -96,19 +98,10 @@ for path in (
 
 CLAIM_PUZZLES_CB = "claim_puzzles"
 
-PUZZLE_CLAIM_LOG = Path("data/puzzle_claim_log.json")
 START_USERS_LOG = Path("data/start_users.json")
+BROADCAST_REPORT = Path("data/broadcast_report.json")
 
-
-def _load_puzzle_claim_log() -> dict:
-    if not PUZZLE_CLAIM_LOG.exists():
-        return {}
-    try:
-        with open(PUZZLE_CLAIM_LOG, "r", encoding="utf-8") as f:
-            return json.load(f) or {}
-    except Exception as exc:
-        logger.warning("[STATS] ⚠️ Не удалось прочитать puzzle_claim_log.json: %s", exc)
-        return {}
+STATS_VIEW = StatsView(START_USERS_LOG, BROADCAST_REPORT)
 
 
 def _load_start_users_log() -> dict:
@@ -128,6 +121,12 @@ def _save_start_users_log(data: dict) -> None:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+def _save_broadcast_report(report: dict) -> None:
+    BROADCAST_REPORT.parent.mkdir(parents=True, exist_ok=True)
+    with open(BROADCAST_REPORT, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
 def _register_started_user(tg_user: types.User | None) -> None:
     if tg_user is None:
         return
@@ -142,58 +141,9 @@ def _register_started_user(tg_user: types.User | None) -> None:
     _save_start_users_log(log_data)
 
 
-def _extract_user_stats(log_data: dict, user_id: str) -> tuple[int, str, str]:
-    """
-    Возвращает (total_puzzles, tg_name, tg_tag) для user_id,
-    поддерживая оба формата puzzle_claim_log.json:
-    1) users.{tg_user_id}.{iggid}.{count}
-    2) {tg_user_id: {count, claimed_ec_params, tg_name, tg_tag, ...}}
-    """
-    total_puzzles = 0
-    name = ""
-    tag = ""
-    user_id = str(user_id)
-
-    if not isinstance(log_data, dict):
-        return total_puzzles, name, tag
-
-    # Формат auto-claim
-    users_section = log_data.get("users", {})
-    if isinstance(users_section, dict):
-        u = users_section.get(user_id, {})
-        if isinstance(u, dict):
-            for entry in u.values():
-                if isinstance(entry, dict):
-                    try:
-                        total_puzzles += int(entry.get("count", 0) or 0)
-                    except (TypeError, ValueError):
-                        pass
-
-    # Формат ручной выдачи / кодов (верхний уровень)
-    top_entry = log_data.get(user_id, {})
-    if isinstance(top_entry, dict):
-        name = top_entry.get("tg_name", "") or name
-        tag = top_entry.get("tg_tag", "") or tag
-        try:
-            total_puzzles += int(top_entry.get("count", 0) or 0)
-        except (TypeError, ValueError):
-            pass
-        claimed_codes = top_entry.get("claimed_ec_params", [])
-        if isinstance(claimed_codes, list):
-            # Добавляем пазлы, которые брались кодами (если они не вошли в count)
-            try:
-                total_puzzles = max(total_puzzles, len(claimed_codes))
-            except Exception:
-                pass
-
-    return total_puzzles, name, tag
-
-
 def _collect_known_user_ids(
     users: dict,
-    log_users: dict,
-    users_meta: dict,
-    top_level_logged_users: set[str],
+    logged_users: set[str],
     started_users: dict,
 ) -> list[str]:
     def _sort_key(val: str):
@@ -201,129 +151,15 @@ def _collect_known_user_ids(
 
     return sorted(
         {str(uid) for uid in users.keys()}
-        | {str(uid) for uid in log_users.keys()}
-        | {str(uid) for uid in users_meta.keys()}
-        | top_level_logged_users
+        | logged_users
         | {str(uid) for uid in started_users.keys()},
         key=_sort_key,
     )
 
 
 def _build_stats_page(page: int, page_size: int = 7) -> tuple[str, InlineKeyboardMarkup | None]:
-    users = load_all_users()
-
-    log_data = _load_puzzle_claim_log()
-    log_users = log_data.get("users", {}) if isinstance(log_data, dict) else {}
-    users_meta = log_data.get("users_meta", {}) if isinstance(log_data, dict) else {}
-    start_data = _load_start_users_log()
-    started_users = start_data.get("users", {}) if isinstance(start_data, dict) else {}
-    top_level_logged_users = {
-        str(k) for k, v in log_data.items()
-        if isinstance(log_data, dict) and str(k).isdigit() and isinstance(v, dict)
-    }
-
-    # Показываем всех: и тех, у кого есть аккаунты, и тех, кто только получал пазлы.
-    user_ids = _collect_known_user_ids(
-        users=users,
-        log_users=log_users,
-        users_meta=users_meta,
-        top_level_logged_users=top_level_logged_users,
-        started_users=started_users,
-    )
-
-    # Синхронизируем "исторических" пользователей в общей базе аккаунтов,
-    # чтобы они учитывались в user_accounts.json даже без повторного /start.
-    ensure_users_exist(user_ids)
-
-    total_users = len(user_ids)
-    total_accounts = sum(len(accs) for accs in users.values() if isinstance(accs, list))
-
-    total_pages = max(1, (total_users + page_size - 1) // page_size)
-    page = max(0, min(page, total_pages - 1))
-    start = page * page_size
-    end = start + page_size
-
-    lines = [
-        "📊 <b>Статистика аккаунтов</b>",
-        f"👥 Пользователей в базе: <b>{total_users}</b>",
-        f"👤 Всего аккаунтов: <b>{total_accounts}</b>",
-        "",
-        f"👥 <b>Аккаунты по пользователям (страница {page + 1}/{total_pages}):</b>",
-    ]
-
-    if total_users == 0:
-        lines.append("— нет данных")
-    else:
-        for user_id in user_ids[start:end]:
-            accs = users.get(user_id, []) or []
-            user_log = log_users.get(str(user_id), {}) if isinstance(log_users, dict) else {}
-            total_puzzles, direct_name, direct_tag = _extract_user_stats(log_data, user_id)
-
-            meta = users_meta.get(str(user_id), {})
-            started = started_users.get(str(user_id), {}) if isinstance(started_users, dict) else {}
-            auto_name = user_log.get("tg_name", "") if isinstance(user_log, dict) else ""
-            auto_tag = user_log.get("tg_tag", "") if isinstance(user_log, dict) else ""
-            first_account_name = ""
-            if accs and isinstance(accs[0], dict):
-                first_account_name = str(accs[0].get("username", "") or "")
-
-            display_name = (
-                meta.get("name")
-                or started.get("name")
-                or auto_name
-                or direct_name
-                or first_account_name
-            )
-            display_tag = (
-                meta.get("tag")
-                or started.get("tag")
-                or auto_tag
-                or direct_tag
-                or meta.get("username")
-                or started.get("username")
-            )
-            display_bits = " ".join(bit for bit in [display_name, f"@{display_tag}" if display_tag else ""] if bit)
-            label = f"{user_id}"
-            if display_bits:
-                label = f"{label} ({display_bits})"
-            lines.append(
-                f"• <code>{label}</code> — <b>{len(accs)}</b> аккаунтов, 🧩 <b>{total_puzzles}</b>"
-            )
-            acc_details = []
-            for acc in accs:
-                uid = str(acc.get("uid", ""))
-                entry = user_log.get(uid, {})
-                count = entry.get("count", 0) if isinstance(entry, dict) else 0
-                acc_details.append(f"{uid}:{count}")
-            if acc_details:
-                lines.append(f"  └ {', '.join(acc_details)}")
-
-    summary_path = Path("data/puzzle_summary.json")
-    if summary_path.exists():
-        try:
-            with open(summary_path, "r", encoding="utf-8") as f:
-                summary = json.load(f)
-            totals = summary.get("totals", {})
-            all_dup = summary.get("all_duplicates", 0)
-            lines.extend([
-                "",
-                "🧩 <b>Пазлы (итоги)</b>",
-                f"Всего дубликатов: <b>{all_dup}</b>",
-                " | ".join(f"{pid}🧩x{totals.get(str(pid), 0)}" for pid in range(1, 10)),
-            ])
-        except Exception:
-            lines.append("\n⚠️ Не удалось прочитать puzzle_summary.json")
-
-    broadcast_report = _load_broadcast_report()
-    if broadcast_report:
-        lines.extend([
-            "",
-            "📣 <b>Последняя рассылка</b>",
-            f"🕒 {broadcast_report.get('timestamp', '—')}",
-            f"👥 Известно пользователей: <b>{broadcast_report.get('known_total', 0)}</b>",
-            f"✅ Доставлено: <b>{broadcast_report.get('sent', 0)}</b>",
-            f"❌ Ошибок: <b>{broadcast_report.get('failed', 0)}</b>",
-        ])
+    # Строки пользователей предрасчитаны в STATS_VIEW и пересчитываются только при изменении источников
+    text, page, total_pages = STATS_VIEW.render_page(page, page_size)
 
     keyboard = []
     if total_pages > 1:
@@ -336,7 +172,7 @@ def _build_stats_page(page: int, page_size: int = 7) -> tuple[str, InlineKeyboar
             keyboard.append(row)
 
     markup = InlineKeyboardMarkup(inline_keyboard=keyboard) if keyboard else None
-    return "\n".join(lines), markup
+    return text, markup
 
 
 class AddAccountState(StatesGroup):
@@ -379,12 +215,7 @@ def _collect_broadcast_user_ids() -> list[int]:
     if isinstance(started_users, dict):
         ids |= {str(uid) for uid in started_users.keys()}
 
-    log_data = _load_puzzle_claim_log()
-    if isinstance(log_data, dict):
-        log_users = log_data.get("users", {})
-        if isinstance(log_users, dict):
-            ids |= {str(uid) for uid in log_users.keys()}
-        ids |= {str(k) for k, v in log_data.items() if str(k).isdigit() and isinstance(v, dict)}
+    ids |= get_claim_ledger().user_ids()
 
     result = []
     for uid in ids:
@@ -448,21 +279,12 @@ async def sync_users_to_accounts_db(message: types.Message):
         return
 
     users = load_all_users()
-    log_data = _load_puzzle_claim_log()
-    log_users = log_data.get("users", {}) if isinstance(log_data, dict) else {}
-    users_meta = log_data.get("users_meta", {}) if isinstance(log_data, dict) else {}
     start_data = _load_start_users_log()
     started_users = start_data.get("users", {}) if isinstance(start_data, dict) else {}
-    top_level_logged_users = {
-        str(k) for k, v in log_data.items()
-        if isinstance(log_data, dict) and str(k).isdigit() and isinstance(v, dict)
-    }
 
     user_ids = _collect_known_user_ids(
         users=users,
-        log_users=log_users,
-        users_meta=users_meta,
-        top_level_logged_users=top_level_logged_users,
+        logged_users=get_claim_ledger().user_ids(),
         started_users=started_users,
     )
     added = ensure_users_exist(user_ids)
@@ -572,6 +394,16 @@ async def do_broadcast(message: types.Message, state: FSMContext):
         except Exception:
             failed += 1
 
+    try:
+        _save_broadcast_report({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "known_total": len(user_ids),
+            "sent": sent,
+            "failed": failed,
+        })
+    except Exception as exc:
+        logger.warning("[BROADCAST] ⚠️ Не удалось сохранить отчёт: %s", exc)
+
     await state.clear()
     await message.answer(
         f"✅ Рассылка завершена.\n"
@@ -800,10 +632,8 @@ async def add_account_by_email_password(message: types.Message, state: FSMContex
     accounts.append(new_acc)
     save_accounts(user_id, accounts)
 
-    from services.cookies_io import load_all_cookies, save_all_cookies
-    all_cookies = load_all_cookies()
-    all_cookies.setdefault(user_id, {})[uid] = cookies
-    save_all_cookies(all_cookies)
+    from services import cookie_store
+    cookie_store.put_cookies(user_id, uid, cookies or {})
 
     if cookies:
         await message.answer(
@@ -893,10 +723,8 @@ async def add_account_by_igg_code(message: types.Message, state: FSMContext):
     save_accounts(user_id, accounts)
 
     if cookies:
-        from services.cookies_io import load_all_cookies, save_all_cookies
-        all_cookies = load_all_cookies()
-        all_cookies.setdefault(user_id, {})[uid] = cookies
-        save_all_cookies(all_cookies)
+        from services import cookie_store
+        cookie_store.put_cookies(user_id, uid, cookies)
 
     await message.answer(
         f"✅ Аккаунт <b>{username}</b> (IGG ID: <code>{uid}</code>) добавлен!",
@@ -1046,7 +874,7 @@ async def check_events_cmd(message: types.Message):
 # ------------------------------------ 🧩 ОБНОВИТЬ COOKIES В БАЗЕ ------------------------------------
 @router.message(F.text == "🧩 Обновить cookies в базе")
 async def refresh_cookies_in_database(message: types.Message):
-    """Фоновое обновление cookies всех аккаунтов через два независимых процесса."""
+    """Фоновое обновление cookies всех аккаунтов: PARALLEL_REFRESH_PROCESSES воркеров на общей очереди."""
     user_id = message.from_user.id
     if user_id not in ADMIN_IDS:
         await message.answer("🚫 У тебя нет доступа к этой функции.")
@@ -1103,22 +931,16 @@ async def refresh_cookies_in_database(message: types.Message):
 
         await update_status(combined_percent, combined_done, combined_total)
 
-    async def cb1(worker_id: int, percent: float, done: int, total: int):
-        await handle_progress(worker_id, percent, done, total)
-
-    async def cb2(worker_id: int, percent: float, done: int, total: int):
-        await handle_progress(worker_id, percent, done, total)
-
     async def run_update():
         nonlocal status_msg
         global COOKIE_REFRESH_TASKS, COOKIE_REFRESH_STATUS_MESSAGE
         try:
-            lr1.clear_stop_request()
-            lr2.clear_stop_request()
+            lr.clear_stop_request()
 
-            task1 = asyncio.create_task(lr1.process_all_files(progress_callback=cb1))
-            task2 = asyncio.create_task(lr2.process_all_files(progress_callback=cb2))
-            COOKIE_REFRESH_TASKS = [task1, task2]
+            task = asyncio.create_task(lr.process_all_files(
+                progress_callback=handle_progress, workers=PARALLEL_REFRESH_PROCESSES,
+            ))
+            COOKIE_REFRESH_TASKS = [task]
 
             results = await asyncio.gather(*COOKIE_REFRESH_TASKS, return_exceptions=True)
             for result in results:
@@ -1146,8 +968,7 @@ async def refresh_cookies_in_database(message: types.Message):
                 pass
         finally:
             COOKIE_REFRESH_TASKS.clear()
-            lr1.clear_stop_request()
-            lr2.clear_stop_request()
+            lr.clear_stop_request()
             COOKIE_REFRESH_STATUS_MESSAGE = None
 
     asyncio.create_task(run_update())
@@ -1167,8 +988,7 @@ async def stop_cookie_refresh(message: types.Message):
         )
         return
 
-    lr1.request_stop()
-    lr2.request_stop()
+    lr.request_stop()
 
     status_msg = COOKIE_REFRESH_STATUS_MESSAGE
     if status_msg:
@@ -1375,6 +1195,8 @@ async def give_30_puzzles_cb(callback: CallbackQuery):
 @router.callback_query(F.data.startswith("puzzle_acc:"))
 async def select_puzzle_account(callback: CallbackQuery):
     uid = callback.data.split(":")[1]
+    # 🔥 пока пользователь выбирает номер пазла — заранее открываем страницу события
+    get_warm_sessions().prewarm(str(callback.from_user.id), uid, puzzle_claim_auto.EVENT_PAGE)
     await callback.message.edit_text(
         f"🧩 Аккаунт выбран: <b>{uid}</b>\nТеперь выбери номер пазла для получения:",
         parse_mode="HTML",
@@ -1460,9 +1282,8 @@ async def start_exchange(callback: types.CallbackQuery, state: FSMContext):
 
     try:
         # ------------------- Получаем cookies -------------------
-        from services.cookies_io import load_all_cookies  # твоя функция для загрузки cookies
-        cookies_db = load_all_cookies()  # должно возвращать {user_id: {iggid: [...]}}
-        user_cookies = cookies_db.get(user_id, {}).get(uid)
+        from services import cookie_store
+        user_cookies = cookie_store.get_cookies(user_id, uid)
         if not user_cookies:
             await msg.edit_text("⚠️ Нет cookies для выбранного аккаунта.")
             return
@@ -1749,21 +1570,10 @@ async def handle_dragon_quest(message: types.Message):
         pass
 
 # ------------------------------------ ⚙️ Работа с JSON ------------------------------------
+# Все чтения/записи user_accounts.json идут через общий AccountStore (services.accounts_manager)
 def load_all_users():
-    if not os.path.exists(USER_ACCOUNTS_FILE):
-        return {}
-    try:
-        with open(USER_ACCOUNTS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data if isinstance(data, dict) else {}
-    except Exception:
-        return {}
+    return accounts_manager.load_all_users()
 def load_accounts(user_id: str):
-    data = load_all_users()
-    return data.get(user_id, [])
+    return accounts_manager.get_all_accounts(user_id)
 def save_accounts(user_id: str, accounts: list):
-    data = load_all_users()
-    data[user_id] = accounts
-    os.makedirs(os.path.dirname(USER_ACCOUNTS_FILE), exist_ok=True)
-    with open(USER_ACCOUNTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    accounts_manager.save_accounts(user_id, accounts)
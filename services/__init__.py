@@ -8,5 +8,25 @@ __all__ = [
     "event_manager",
     "puzzle_claim",
     "puzzle_claim_auto2",
-    "cookies_io"
+    "cookies_io",
+    "cookie_store",
+    "puzzle_log",
+    "donor_index",
+    "data_corpus",
+    "claim_ledger",
+    "persist",
+    "warm_sessions",
+    "profile_manager",
+    "net_policy",
+    "event_http",
+    "registry",
+    "concurrency",
+    "rate_limit",
+    "retry_queue",
+    "event_planner",
+    "process_pool",
+    "job_queue",
+    "job_worker",
+    "checkpoint",
+    "daily_ledger",
 ]
\ No newline at end of file
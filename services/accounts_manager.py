@@ -1,10 +1,21 @@
 # tg_zov/services/accounts_manager.py
+import atexit
+import copy
 import json
+import logging
 import os
-from typing import List, Dict, Optional
+import threading
+from typing import List, Dict, Optional, Tuple
+
+from services import persist
 
 USER_ACCOUNTS_FILE = "data/user_accounts.json"
 
+# Задержка отложенной записи (сек): несколько изменений подряд сливаются в одну запись файла
+FLUSH_DELAY = 0.5
+
+logger = logging.getLogger("accounts_manager")
+
 
 # -------------------------------
 # ⚙️ Вспомогательные функции
@@ -22,10 +33,15 @@ def _load_data() -> Dict[str, list]:
 
 
 def _save_data(data: Dict[str, list]):
-    """Сохраняет JSON со всеми пользователями."""
-    os.makedirs(os.path.dirname(USER_ACCOUNTS_FILE), exist_ok=True)
-    with open(USER_ACCOUNTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """Сохраняет JSON со всеми пользователями (атомарно, под межпроцессной блокировкой)."""
+    persist.write_json(USER_ACCOUNTS_FILE, data)
+
+
+def _file_mtime() -> Optional[int]:
+    try:
+        return os.stat(USER_ACCOUNTS_FILE).st_mtime_ns
+    except OSError:
+        return None
 
 
 # -------------------------------
@@ -62,38 +78,304 @@ def _ensure_account_schema(account: Dict) -> bool:
 
 
 # -------------------------------
-# 👥 Все пользователи и аккаунты
+# 🗂 Хранилище аккаунтов в памяти
 # -------------------------------
-def get_all_users_accounts() -> Dict[str, List[Dict]]:
-    """Возвращает словарь user_id -> нормализованный список аккаунтов."""
-    data = _load_data()
-    normalized: Dict[str, List[Dict]] = {}
-    data_changed = False
-
-    for user_id, raw_accounts in data.items():
-        accounts_list: List[Dict] = []
-        user_changed = False
-
-        if not isinstance(raw_accounts, list):
-            user_changed = True
-        else:
-            for acc in raw_accounts:
+class AccountStore:
+    """
+    Общий на процесс кэш user_accounts.json.
+
+    Файл читается один раз и перечитывается только при смене mtime
+    (например, если его поправили руками). Индексы:
+      • user_id -> {uid -> аккаунт}
+      • uid -> user_id
+    Изменения копятся в наборе «грязных» пользователей и пишутся
+    одной записью файла через FLUSH_DELAY секунд (write-behind).
+    Наружу всегда отдаются копии, чтобы вызывающий код не менял кэш в обход save_accounts;
+    all_users() — общий снимок только для чтения, копируются лишь изменившиеся пользователи.
+    version растёт при любом изменении; changes_since() говорит, каких
+    пользователей затронули (для производных представлений вроде статистики).
+    """
+
+    def __init__(self, path: str = USER_ACCOUNTS_FILE, flush_delay: float = FLUSH_DELAY):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._lock = threading.RLock()
+        self._data: Dict[str, List[Dict]] = {}
+        self._by_user: Dict[str, Dict[str, Dict]] = {}
+        self._owner: Dict[str, str] = {}
+        self._mtime: Optional[int] = None
+        self._loaded = False
+        self._dirty: set[str] = set()
+        self._timer: Optional[threading.Timer] = None
+        self.version = 0
+        self._reset_version = 0
+        self._changed: Dict[str, int] = {}
+        self._snapshot: Optional[Dict[str, List[Dict]]] = None
+        self._snapshot_version = 0
+
+    # ───── загрузка / индексы ─────
+    def _reindex_user(self, user_id: str):
+        accounts = self._data.get(user_id, [])
+        index: Dict[str, Dict] = {}
+        for acc in accounts:
+            uid = acc.get("uid", "")
+            index.setdefault(uid, acc)
+            self._owner.setdefault(uid, user_id)
+        self._by_user[user_id] = index
+
+    def _reload(self):
+        raw = _load_data()
+        self._data = {}
+        self._by_user = {}
+        self._owner = {}
+        self._dirty = set()
+
+        for user_id, raw_accounts in raw.items():
+            user_id = str(user_id)
+            accounts: List[Dict] = []
+            changed = not isinstance(raw_accounts, list)
+            for acc in raw_accounts if isinstance(raw_accounts, list) else []:
                 if not isinstance(acc, dict):
-                    user_changed = True
+                    changed = True
                     continue
                 if _ensure_account_schema(acc):
-                    user_changed = True
-                accounts_list.append(acc)
-
-        normalized[str(user_id)] = accounts_list
-        if user_changed:
-            data[user_id] = accounts_list
-            data_changed = True
+                    changed = True
+                accounts.append(acc)
+            self._data[user_id] = accounts
+            self._reindex_user(user_id)
+            if changed:
+                self._dirty.add(user_id)
+
+        self._mtime = _file_mtime()
+        self._loaded = True
+        self.version += 1
+        self._reset_version = self.version
+        self._changed = {}
+        if self._dirty:
+            self._schedule_flush()
+
+    def _ensure_fresh(self):
+        # Пока есть несохранённые изменения — кэш главнее файла
+        if self._loaded and (self._dirty or _file_mtime() == self._mtime):
+            return
+        self._reload()
+
+    # ───── write-behind ─────
+    def _schedule_flush(self):
+        if self.flush_delay <= 0:
+            self._flush_locked()
+            return
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(self.flush_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return
+        try:
+            # Пишем только «грязных» пользователей поверх свежей версии файла:
+            # правки других процессов (lr1/lr2, второй бот) не затираются.
+            with persist.transaction(self.path, {}) as data:
+                external = _file_mtime() != self._mtime
+                if isinstance(data, dict):
+                    for user_id in self._dirty:
+                        data[user_id] = self._data.get(user_id, [])
+                else:
+                    external = False
+                    _save_data(self._data)
+            self._mtime = _file_mtime()
+            self._dirty.clear()
+            if external:
+                self._reload()
+        except Exception as e:
+            logger.warning(f"[ACCOUNTS] Ошибка записи {self.path}: {e}")
+
+    def flush(self):
+        """Немедленно записывает все отложенные изменения."""
+        with self._lock:
+            self._flush_locked()
+
+    def _touch(self, user_id: str):
+        self.version += 1
+        self._changed[user_id] = self.version
+
+    def _mark_dirty(self, user_id: str):
+        self._dirty.add(user_id)
+        self._touch(user_id)
+        self._schedule_flush()
+
+    # ───── чтение ─────
+    def all_users(self) -> Dict[str, List[Dict]]:
+        """
+        Снимок user_id -> аккаунты, общий для всех вызывающих: его нельзя менять
+        (правки — через save_accounts/upsert). Пока ничего не менялось, отдаётся
+        тот же объект; после изменений копируются только затронутые пользователи.
+        """
+        with self._lock:
+            self._ensure_fresh()
+            if self._snapshot is not None and self._snapshot_version == self.version:
+                return self._snapshot
+            if self._snapshot is None or self._snapshot_version < self._reset_version:
+                snapshot = {user_id: copy.deepcopy(accs) for user_id, accs in self._data.items()}
+            else:
+                snapshot = dict(self._snapshot)
+                for user_id, v in self._changed.items():
+                    if v <= self._snapshot_version:
+                        continue
+                    if user_id in self._data:
+                        snapshot[user_id] = copy.deepcopy(self._data[user_id])
+                    else:
+                        snapshot.pop(user_id, None)
+            self._snapshot, self._snapshot_version = snapshot, self.version
+            return snapshot
+
+    def user_ids(self) -> List[str]:
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._data.keys())
+
+    def has_user(self, user_id: str) -> bool:
+        with self._lock:
+            self._ensure_fresh()
+            return str(user_id) in self._data
+
+    def accounts(self, user_id: str) -> List[Dict]:
+        with self._lock:
+            self._ensure_fresh()
+            return copy.deepcopy(self._data.get(str(user_id), []))
+
+    def get(self, user_id: str, uid: str) -> Optional[Dict]:
+        with self._lock:
+            self._ensure_fresh()
+            acc = self._by_user.get(str(user_id), {}).get(str(uid))
+            return dict(acc) if acc is not None else None
+
+    def owner_of(self, uid: str) -> Optional[str]:
+        """Возвращает user_id владельца аккаунта по UID."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._owner.get(str(uid))
+
+    def active(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            self._ensure_fresh()
+            for acc in self._data.get(str(user_id), []):
+                if acc.get("active"):
+                    return dict(acc)
+            return None
+
+    def changes_since(self, version: int) -> Tuple[int, Optional[List[str]]]:
+        """
+        (текущая версия, пользователи, изменённые после version).
+        None вместо списка — файл перечитывался целиком, менять нужно всё.
+        """
+        with self._lock:
+            self._ensure_fresh()
+            if version < self._reset_version:
+                return self.version, None
+            return self.version, [uid for uid, v in self._changed.items() if v > version]
+
+    # ───── запись ─────
+    def replace(self, user_id: str, accounts: List[Dict]):
+        user_id = str(user_id)
+        with self._lock:
+            self._ensure_fresh()
+            for uid, owner in list(self._owner.items()):
+                if owner == user_id:
+                    del self._owner[uid]
+            self._data[user_id] = copy.deepcopy(accounts)
+            self._reindex_user(user_id)
+            self._mark_dirty(user_id)
+
+    def ensure_users(self, user_ids: List[str]) -> int:
+        added = 0
+        with self._lock:
+            self._ensure_fresh()
+            for user_id in user_ids:
+                user_id = str(user_id)
+                if user_id not in self._data:
+                    self._data[user_id] = []
+                    self._by_user[user_id] = {}
+                    self._dirty.add(user_id)
+                    self._touch(user_id)
+                    added += 1
+            if added:
+                self._schedule_flush()
+        return added
+
+    def upsert(self, user_id: str, account: Dict) -> Tuple[Dict, bool]:
+        """Добавляет или обновляет аккаунт. Возвращает (запись, создан_ли)."""
+        user_id = str(user_id)
+        uid = str(account.get("uid", ""))
+        with self._lock:
+            self._ensure_fresh()
+            accounts = self._data.setdefault(user_id, [])
+            index = self._by_user.setdefault(user_id, {})
+            existing = index.get(uid)
+            if existing is not None:
+                existing.update(account)
+                created = False
+                result = existing
+            else:
+                result = dict(account)
+                _ensure_account_schema(result)
+                accounts.append(result)
+                index[uid] = result
+                self._owner.setdefault(uid, user_id)
+                created = True
+            self._mark_dirty(user_id)
+            return dict(result), created
+
+    def set_active(self, user_id: str, uid: str) -> bool:
+        user_id = str(user_id)
+        uid = str(uid)
+        with self._lock:
+            self._ensure_fresh()
+            if uid not in self._by_user.get(user_id, {}):
+                return False
+            for acc in self._data.get(user_id, []):
+                acc["active"] = acc.get("uid") == uid
+            self._mark_dirty(user_id)
+            return True
+
+    def remove(self, user_id: str, uid: str) -> bool:
+        user_id = str(user_id)
+        uid = str(uid)
+        with self._lock:
+            self._ensure_fresh()
+            accounts = self._data.get(user_id, [])
+            if uid not in self._by_user.get(user_id, {}):
+                return False
+
+            removed_active = any(acc.get("uid") == uid and acc.get("active") for acc in accounts)
+            new_list = [acc for acc in accounts if acc.get("uid") != uid]
+            # Если удалён активный — активным сделать первый оставшийся
+            if removed_active and new_list:
+                new_list[0]["active"] = True
+
+            if self._owner.get(uid) == user_id:
+                del self._owner[uid]
+            self._data[user_id] = new_list
+            self._reindex_user(user_id)
+            self._mark_dirty(user_id)
+            return True
+
+
+store = AccountStore()
+atexit.register(store.flush)
 
-    if data_changed:
-        _save_data(data)
 
-    return normalized
+# -------------------------------
+# 👥 Все пользователи и аккаунты
+# -------------------------------
+def get_all_users_accounts() -> Dict[str, List[Dict]]:
+    """Возвращает словарь user_id -> нормализованный список аккаунтов (общий снимок, только для чтения)."""
+    return store.all_users()
 
 
 def load_all_users() -> Dict[str, List[Dict]]:
@@ -106,34 +388,12 @@ def load_all_users() -> Dict[str, List[Dict]]:
 # -------------------------------
 def get_all_accounts(user_id: str) -> List[Dict]:
     """Возвращает список всех аккаунтов пользователя, нормализуя структуру."""
-    data = _load_data()
-    raw_accounts = data.get(str(user_id), [])
-
-    if not isinstance(raw_accounts, list):
-        return []
-
-    accounts: List[Dict] = []
-    changed = False
-
-    for acc in raw_accounts:
-        if isinstance(acc, dict):
-            if _ensure_account_schema(acc):
-                changed = True
-            accounts.append(acc)
-        else:
-            changed = True
-
-    if changed or len(accounts) != len(raw_accounts):
-        save_accounts(user_id, accounts)
-
-    return accounts
+    return store.accounts(user_id)
 
 
 def save_accounts(user_id: str, accounts: List[Dict]):
     """Сохраняет список аккаунтов конкретного пользователя."""
-    data = _load_data()
-    data[str(user_id)] = accounts
-    _save_data(data)
+    store.replace(user_id, accounts)
 
 
 def ensure_user_exists(user_id: str) -> bool:
@@ -142,13 +402,7 @@ def ensure_user_exists(user_id: str) -> bool:
     Создаёт запись с пустым списком аккаунтов при первом появлении.
     Возвращает True, если пользователь был добавлен, иначе False.
     """
-    data = _load_data()
-    uid = str(user_id)
-    if uid in data:
-        return False
-    data[uid] = []
-    _save_data(data)
-    return True
+    return store.ensure_users([user_id]) > 0
 
 
 def ensure_users_exist(user_ids: List[str]) -> int:
@@ -156,16 +410,7 @@ def ensure_users_exist(user_ids: List[str]) -> int:
     Массово гарантирует наличие пользователей в user_accounts.json.
     Возвращает количество добавленных записей.
     """
-    data = _load_data()
-    added = 0
-    for user_id in user_ids:
-        uid = str(user_id)
-        if uid not in data:
-            data[uid] = []
-            added += 1
-    if added:
-        _save_data(data)
-    return added
+    return store.ensure_users(user_ids)
 
 
 def add_account(
@@ -182,16 +427,13 @@ def add_account(
     """
     user_id = str(user_id)
     uid = str(uid)
-    accounts = get_all_accounts(user_id)
 
-    for acc in accounts:
-        if acc.get("uid") == uid:
-            acc["username"] = username
-            acc["mvp_url"] = mvp_url
-            if token:
-                acc["gpc_sso_token"] = token
-            save_accounts(user_id, accounts)
-            return False  # обновлён
+    if store.get(user_id, uid) is not None:
+        update = {"uid": uid, "username": username, "mvp_url": mvp_url}
+        if token:
+            update["gpc_sso_token"] = token
+        store.upsert(user_id, update)
+        return False  # обновлён
 
     new_acc = {
         "uid": uid,
@@ -200,42 +442,20 @@ def add_account(
         "gpc_sso_token": token or "",
         "mail": "",
         "paswd": "",
-        "active": len(accounts) == 0,
+        "active": not store.accounts(user_id),
     }
-    _ensure_account_schema(new_acc)
-    accounts.append(new_acc)
-    save_accounts(user_id, accounts)
-    return True
+    _, created = store.upsert(user_id, new_acc)
+    return created
 
 
 def remove_account(user_id: str, uid: str) -> bool:
     """Удаляет аккаунт по UID."""
-    user_id = str(user_id)
-    uid = str(uid)
-    accounts = get_all_accounts(user_id)
-    if not accounts:
-        return False
-
-    new_list = [acc for acc in accounts if acc.get("uid") != uid]
-    if len(new_list) == len(accounts):
-        return False
-
-    # Если удалён активный — активным сделать первый оставшийся
-    removed_active = any(acc.get("uid") == uid and acc.get("active") for acc in accounts)
-    if removed_active and new_list:
-        new_list[0]["active"] = True
-
-    save_accounts(user_id, new_list)
-    return True
+    return store.remove(user_id, uid)
 
 
 def get_account_by_uid(user_id: str, uid: str) -> Optional[Dict]:
     """Находит аккаунт по UID."""
-    uid = str(uid)
-    for acc in get_all_accounts(user_id):
-        if acc.get("uid") == uid:
-            return acc
-    return None
+    return store.get(user_id, uid)
 
 
 # -------------------------------
@@ -243,26 +463,9 @@ def get_account_by_uid(user_id: str, uid: str) -> Optional[Dict]:
 # -------------------------------
 def get_active_account(user_id: str) -> Optional[Dict]:
     """Возвращает активный аккаунт пользователя."""
-    for acc in get_all_accounts(user_id):
-        if acc.get("active"):
-            return acc
-    return None
+    return store.active(user_id)
 
 
 def set_active_account(user_id: str, uid: str) -> bool:
     """Устанавливает активный аккаунт по UID."""
-    user_id = str(user_id)
-    uid = str(uid)
-    accounts = get_all_accounts(user_id)
-    found = False
-
-    for acc in accounts:
-        if acc.get("uid") == uid:
-            acc["active"] = True
-            found = True
-        else:
-            acc["active"] = False
-
-    if found:
-        save_accounts(user_id, accounts)
-    return found
+    return store.set_active(user_id, uid)
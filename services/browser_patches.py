@@ -7,30 +7,39 @@
 - silence_asyncio_exceptions(loop, context)     — приглушаем «шумные» asyncio-исключения
 - get_random_browser_profile()                  — профиль браузера (UA, viewport, locale, tz, …)
 - humanize_pre_action(page)                     — лёгкая «очеловеченная» активность
-- jitter(base, variance)                        — джиттер для задержек
+- jitter(base, variance)                        — джиттер для задержек (services.rate_limit)
 - cookies_to_playwright(cookies, domain)        — {name: value} -> cookies Playwright
 - apply_headless_patches(context, ...)          — init-скрипты маскировки headless + stealth
 - launch_masked_persistent_context(...)         — запуск persistent context с патчами
+- BrowserPool / get_browser_pool()              — пул долгоживущих браузеров с лёгкими контекстами
 - update_new_data_files_with_cookies(...)       — обновление cookies в new_data*.json
 - run_event_with_browser(...)                   — единый раннер события (подставляет куки, открывает URL, зовёт handler)
+- browser_handoff(...) / HttpHandoff            — браузер только до получения cookies/UA, дальше — aiohttp
+- run_event_with_handoff(...)                   — раннер события поверх browser_handoff (handler получает HttpHandoff)
 """
 
 from __future__ import annotations
 
 import asyncio
 import inspect
-import json
 import logging
 import os
 import random
 import re
 import platform
 import shutil
+import threading
+import time
+import weakref
+from contextlib import AsyncExitStack, asynccontextmanager
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from services.logger import logger
-from services.cookies_io import load_all_cookies, save_all_cookies
+from services import cookie_store, persist
+from services.data_corpus import get_corpus
+from services.net_policy import DEFAULT_POLICY, apply_policy
+from services.rate_limit import jitter, throttle  # jitter — реэкспорт для старых вызовов (см. шапку модуля)
 from playwright.async_api import Page, BrowserContext, async_playwright
 
 logger = logging.getLogger("browser_patches")
@@ -82,17 +91,34 @@ def detect_chromium_path() -> str | None:
         if path and os.path.exists(path):
             return path
 
-    print("⚠️ [detect_chromium_path] Chrome/Chromium не найден, Playwright сам выберет встроенный.")
+    logger.warning("⚠️ [detect_chromium_path] Chrome/Chromium не найден, Playwright сам выберет встроенный.")
     return None
 
 
-# ✅ Глобальный путь (используй эту переменную везде)
-BROWSER_PATH = detect_chromium_path()
-print(f"[browser_patches] Используется браузер: {BROWSER_PATH}")
+# ✅ Путь к браузеру ищется один раз — при первом запуске, а не при импорте модуля
+_browser_path: Optional[str] = None
+_browser_path_detected = False
+_browser_path_lock = threading.Lock()
+
+
+def get_browser_path() -> Optional[str]:
+    global _browser_path, _browser_path_detected
+    with _browser_path_lock:
+        if not _browser_path_detected:
+            _browser_path = detect_chromium_path()
+            _browser_path_detected = True
+            logger.info(f"[browser_patches] Используется браузер: {_browser_path}")
+        return _browser_path
+
+
+def __getattr__(name: str):
+    # старое имя BROWSER_PATH — вычисляется при первом обращении
+    if name == "BROWSER_PATH":
+        return get_browser_path()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 PROFILE_DIR = Path("data/chrome_profiles")
-PROFILE_DIR.mkdir(parents=True, exist_ok=True)
 
 
 # ───────────────────────────────────────────────────────────────────────────────
@@ -214,12 +240,6 @@ async def humanize_pre_action(page: Page):
         pass
 
 
-def jitter(base: float, variance: float = 0.5) -> float:
-    """Случайная задержка: base ± (0..variance*base)."""
-    delta = random.uniform(-variance * base, variance * base)
-    return max(0.1, base + delta)
-
-
 # ───────────────────────────────────────────────────────────────────────────────
 # Cookies helpers
 # ───────────────────────────────────────────────────────────────────────────────
@@ -322,14 +342,53 @@ async def launch_masked_persistent_context(
     extra_args: Optional[List[str]] = None,
     apply_patches: bool = True,
     set_extra_headers: bool = True,
+    policy: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     Удобный wrapper для запуска persistent context с маскировкой.
+    policy — политика перехвата запросов ("api-only" / "render-light" / "full", см. net_policy).
     Возвращает: {"context": BrowserContext, "page": Page, "profile": dict}
     """
     if profile is None:
         profile = get_random_browser_profile()
 
+    launch_kwargs = dict(
+        headless=headless,
+        slow_mo=slow_mo,
+        **_context_kwargs(profile),
+        args=chromium_launch_args(extra_args),
+    )
+    if browser_path:
+        launch_kwargs["executable_path"] = browser_path
+
+    context = await p.chromium.launch_persistent_context(user_data_dir, **launch_kwargs)
+    if policy is not None:
+        await apply_policy(context, policy, label=Path(user_data_dir).name)
+
+    page = await context.new_page()
+    if apply_patches:
+        try:
+            await apply_headless_patches(
+                context,
+                page=page,
+                profile=profile,
+                stealth_callable=stealth_callable,
+            )
+        except Exception:
+            pass
+
+    if set_extra_headers:
+        try:
+            await context.set_extra_http_headers(
+                {"Accept-Language": profile.get("accept_language", "en-US,en")}
+            )
+        except Exception:
+            pass
+
+    return {"context": context, "page": page, "profile": profile}
+
+
+def chromium_launch_args(extra_args: Optional[List[str]] = None) -> List[str]:
     window_args = [
         "--headless=new",
         "--disable-gpu",
@@ -349,10 +408,12 @@ async def launch_masked_persistent_context(
     ]
     if extra_args:
         window_args.extend(extra_args)
+    return window_args
 
-    launch_kwargs = dict(
-        headless=headless,
-        slow_mo=slow_mo,
+
+def _context_kwargs(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Параметры контекста из профиля (общие для persistent и пуловых контекстов)."""
+    return dict(
         viewport=profile["viewport"],
         user_agent=profile["user_agent"],
         locale=profile["locale"],
@@ -360,34 +421,304 @@ async def launch_masked_persistent_context(
         is_mobile=profile["is_mobile"],
         device_scale_factor=profile["device_scale_factor"],
         java_script_enabled=True,
-        args=window_args,
     )
-    if browser_path:
-        launch_kwargs["executable_path"] = browser_path
 
-    context = await p.chromium.launch_persistent_context(user_data_dir, **launch_kwargs)
 
-    page = await context.new_page()
-    if apply_patches:
-        try:
-            await apply_headless_patches(
-                context,
-                page=page,
-                profile=profile,
-                stealth_callable=stealth_callable,
-            )
-        except Exception:
-            pass
+# ───────────────────────────────────────────────────────────────────────────────
+# Пул браузеров
+# ───────────────────────────────────────────────────────────────────────────────
 
-    if set_extra_headers:
+POOL_BROWSERS = 2               # сколько процессов Chromium держим одновременно
+POOL_CONTEXTS_PER_BROWSER = 8   # сколько одновременных контекстов на один браузер
+POOL_RECYCLE_AFTER = 200        # после стольких контекстов браузер перезапускается
+
+
+class _PooledBrowser:
+    __slots__ = ("browser", "active", "served", "draining", "dead")
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.active = 0
+        self.served = 0
+        self.draining = False
+        self.dead = False
+
+
+class BrowserPool:
+    """
+    Несколько долгоживущих процессов Chromium, из которых раздаются
+    изолированные контексты (new_context) — вместо launch_persistent_context
+    на каждый аккаунт. Контекст создаётся за миллисекунды, а память делится
+    между аккаунтами одного браузера.
+
+      • не больше max_contexts одновременных контекстов на браузер
+        (остальные ждут освобождения);
+      • браузер, раздавший recycle_after контекстов, больше не получает новых
+        и закрывается, когда его последний контекст закрыт;
+      • упавший браузер убирается из пула, следующий запрос запускает новый.
+
+    Слот освобождается по событию close контекста, поэтому вызывающему коду
+    достаточно, как и раньше, сделать await context.close().
+    """
+
+    def __init__(
+        self,
+        playwright=None,
+        *,
+        size: int = POOL_BROWSERS,
+        max_contexts: int = POOL_CONTEXTS_PER_BROWSER,
+        recycle_after: int = POOL_RECYCLE_AFTER,
+        browser_path: Optional[str] = None,
+        headless: bool = True,
+        slow_mo: int = 0,
+        extra_args: Optional[List[str]] = None,
+    ):
+        self._pw = playwright
+        self._own_pw = playwright is None
+        self.size = max(1, size)
+        self.max_contexts = max(1, max_contexts)
+        self.recycle_after = max(1, recycle_after)
+        self.browser_path = browser_path  # None — путь определяется при первом запуске
+        self.headless = headless
+        self.slow_mo = slow_mo
+        self.extra_args = extra_args
+        self._browsers: List[_PooledBrowser] = []
+        self._cond: Optional[asyncio.Condition] = None
+        self.closed = False
+        self.launched = 0
+        self.contexts_served = 0
+        self.crashes = 0
+        self.setup_ms_total = 0.0
+        self.last_setup_ms = 0.0
+
+    # ───── браузеры ─────
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def _launch(self) -> _PooledBrowser:
+        if self._pw is None:
+            self._pw = await async_playwright().start()
+        kwargs = dict(headless=self.headless, slow_mo=self.slow_mo, args=chromium_launch_args(self.extra_args))
+        browser_path = self.browser_path if self.browser_path is not None else get_browser_path()
+        if browser_path:
+            kwargs["executable_path"] = browser_path
+        browser = await self._pw.chromium.launch(**kwargs)
+        slot = _PooledBrowser(browser)
+        browser.on("disconnected", lambda _browser: self._on_disconnected(slot))
+        self._browsers.append(slot)
+        self.launched += 1
+        logger.info("[POOL] 🚀 Запущен браузер #%s (в пуле: %s)", self.launched, len(self._browsers))
+        return slot
+
+    def _on_disconnected(self, slot: _PooledBrowser):
+        if slot.dead:
+            return
+        if not slot.draining:
+            self.crashes += 1
+            logger.warning("[POOL] 💥 Браузер упал, при следующем запросе будет запущен новый")
+        slot.dead = slot.draining = True
+        if slot in self._browsers:
+            self._browsers.remove(slot)
+        self._wake()
+
+    def _wake(self):
+        cond = self._cond
+        if cond is None:
+            return
+
+        async def _notify():
+            async with cond:
+                cond.notify_all()
+
+        asyncio.ensure_future(_notify())
+
+    async def _acquire_slot(self) -> _PooledBrowser:
+        cond = self._condition()
+        async with cond:
+            while True:
+                if self.closed:
+                    raise RuntimeError("BrowserPool закрыт")
+                ready = [b for b in self._browsers if not b.draining and b.active < self.max_contexts]
+                if ready:
+                    slot = min(ready, key=lambda b: b.active)
+                    break
+                if sum(1 for b in self._browsers if not b.draining) < self.size:
+                    slot = await self._launch()
+                    break
+                await cond.wait()
+
+            slot.active += 1
+            slot.served += 1
+            self.contexts_served += 1
+            if slot.served >= self.recycle_after:
+                # новые контексты пойдут в свежий браузер, этот закроется после последнего
+                slot.draining = True
+            return slot
+
+    async def _release(self, slot: _PooledBrowser):
+        cond = self._condition()
+        async with cond:
+            slot.active = max(0, slot.active - 1)
+            retire = slot.draining and not slot.dead and slot.active == 0
+            if retire:
+                slot.dead = True
+                if slot in self._browsers:
+                    self._browsers.remove(slot)
+            cond.notify_all()
+        if retire:
+            try:
+                await slot.browser.close()
+                logger.info("[POOL] ♻️ Браузер перезапущен после %s контекстов", slot.served)
+            except Exception:
+                pass
+
+    # ───── контексты ─────
+    async def new_context(self, profile: Optional[Dict[str, Any]] = None, *, policy: Optional[str] = None,
+                          label: str = "", **overrides) -> BrowserContext:
+        """
+        Голый изолированный контекст с параметрами профиля (init-скрипты — на вызывающем).
+        policy — политика перехвата запросов для всего контекста (см. net_policy).
+        """
+        if profile is None:
+            profile = get_random_browser_profile()
+        kwargs = {**_context_kwargs(profile), **overrides}
+        t0 = time.perf_counter()
+
+        for attempt in range(2):
+            slot = await self._acquire_slot()
+            try:
+                context = await slot.browser.new_context(**kwargs)
+            except Exception:
+                await self._release(slot)
+                if attempt == 0 and not slot.browser.is_connected():
+                    self._on_disconnected(slot)
+                    continue
+                raise
+
+            released = False
+
+            def _on_close(_context, slot=slot):
+                nonlocal released
+                if not released:
+                    released = True
+                    asyncio.ensure_future(self._release(slot))
+
+            context.on("close", _on_close)
+            if policy is not None:
+                try:
+                    await apply_policy(context, policy, label=label)
+                except Exception:
+                    await _close_quietly(context)  # слот освободит _on_close
+                    raise
+            # время подготовки контекста для аккаунта (вместо запуска Chromium с новым профилем)
+            self.last_setup_ms = (time.perf_counter() - t0) * 1000
+            self.setup_ms_total += self.last_setup_ms
+            return context
+        raise RuntimeError("BrowserPool: не удалось создать контекст")
+
+    async def new_session(
+        self,
+        profile: Optional[Dict[str, Any]] = None,
+        *,
+        cookies: Optional[Dict[str, str]] = None,
+        cookie_domain: str = ".event-eu-cc.igg.com",
+        stealth_callable=None,
+        apply_patches: bool = True,
+        set_extra_headers: bool = True,
+        policy: Optional[str] = DEFAULT_POLICY,
+        label: str = "",
+    ) -> Dict[str, Any]:
+        """
+        Контекст с маскировкой, заголовками и cookies + открытая страница.
+        Возвращает то же, что launch_masked_persistent_context: {"context", "page", "profile"}.
+        """
+        if profile is None:
+            profile = get_random_browser_profile()
+        context = await self.new_context(profile, policy=policy, label=label)
         try:
-            await context.set_extra_http_headers(
-                {"Accept-Language": profile.get("accept_language", "en-US,en")}
-            )
+            if apply_patches:
+                await apply_headless_patches(context, profile=profile)
+            if set_extra_headers:
+                try:
+                    await context.set_extra_http_headers(
+                        {"Accept-Language": profile.get("accept_language", "en-US,en")}
+                    )
+                except Exception:
+                    pass
+            if cookies:
+                await context.add_cookies(cookies_to_playwright(cookies, cookie_domain))
+            page = await context.new_page()
+            if stealth_callable is not None:
+                await _maybe_call_stealth(stealth_callable, page)
         except Exception:
-            pass
+            try:
+                await context.close()
+            except Exception:
+                pass
+            raise
+        return {"context": context, "page": page, "profile": profile}
+
+    @asynccontextmanager
+    async def session(self, profile: Optional[Dict[str, Any]] = None, **kwargs):
+        """async with pool.session(...) as ctx — контекст закрывается (и слот освобождается) на выходе."""
+        ctx = await self.new_session(profile, **kwargs)
+        try:
+            yield ctx
+        finally:
+            try:
+                await ctx["context"].close()
+            except Exception:
+                pass
 
-    return {"context": context, "page": page, "profile": profile}
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "browsers": len(self._browsers),
+            "active_contexts": sum(b.active for b in self._browsers),
+            "launched": self.launched,
+            "contexts_served": self.contexts_served,
+            "crashes": self.crashes,
+            "last_setup_ms": round(self.last_setup_ms, 1),
+            "avg_setup_ms": round(self.setup_ms_total / self.contexts_served, 1) if self.contexts_served else 0.0,
+        }
+
+    async def close(self):
+        self.closed = True
+        browsers, self._browsers = self._browsers, []
+        for slot in browsers:
+            slot.dead = slot.draining = True
+            try:
+                await slot.browser.close()
+            except Exception:
+                pass
+        if self._own_pw and self._pw is not None:
+            try:
+                await self._pw.stop()
+            except Exception:
+                pass
+            self._pw = None
+        self._wake()
+
+
+# Общий пул на event loop (объекты Playwright привязаны к своему циклу)
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, BrowserPool]" = weakref.WeakKeyDictionary()
+
+
+def get_browser_pool() -> BrowserPool:
+    """Общий пул браузеров текущего event loop (для интерактивных действий бота)."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None or pool.closed:
+        pool = _pools[loop] = BrowserPool(slow_mo=30)
+    return pool
+
+
+async def close_browser_pool():
+    loop = asyncio.get_running_loop()
+    pool = _pools.pop(loop, None)
+    if pool is not None:
+        await pool.close()
 
 
 # ───────────────────────────────────────────────────────────────────────────────
@@ -395,50 +726,28 @@ async def launch_masked_persistent_context(
 # ───────────────────────────────────────────────────────────────────────────────
 
 def atomic_write_json(path: Path, data):
-    tmp = path.with_suffix(path.suffix + ".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    os.replace(str(tmp), str(path))
+    persist.write_json(path, data)
 
 
 def update_new_data_files_with_cookies(data_dir: Path, uid: str, cookie_dict: Dict[str, str]) -> int:
     """
-    Для каждого файла new_data*.json в data_dir, если находим запись с ключом == uid,
-    подменяем значение на cookie_dict. Возвращает количество изменённых файлов.
+    Находит запись с ключом == uid в new_data*.json (через индекс корпуса
+    services.data_corpus) и подменяет значение на cookie_dict.
+    Возвращает количество изменённых файлов.
     """
-    changed_count = 0
     if not data_dir.exists():
         logger.warning("update_new_data_files_with_cookies: data_dir не найден: %s", data_dir)
         return 0
 
-    for file_path in sorted(data_dir.glob("new_data*.json")):
-        modified = False
-        try:
-            with open(file_path, "r", encoding="utf-8") as fh:
-                data = json.load(fh)
-        except Exception as e:
-            logger.warning("Не удалось прочитать %s: %s", file_path, e)
-            continue
-
-        if isinstance(data, list):
-            for entry in data:
-                if isinstance(entry, dict) and str(uid) in entry and isinstance(entry.get(str(uid)), dict):
-                    entry[str(uid)] = cookie_dict
-                    modified = True
-                    break
-        else:
-            # Неожиданный формат — пропускаем
-            pass
-
-        if modified:
-            try:
-                atomic_write_json(file_path, data)
-                logger.info("Cookies обновлены в %s для uid=%s", file_path.name, uid)
-                changed_count += 1
-            except Exception as e:
-                logger.warning("Ошибка при записи %s: %s", file_path, e)
-
-    return changed_count
+    corpus = get_corpus(data_dir)
+    file_path = corpus.set_cookies(str(uid), cookie_dict)
+    if file_path is None:
+        return 0
+    if not corpus.flush_file_sync(file_path):
+        logger.warning("Ошибка при записи %s", file_path)
+        return 0
+    logger.info("Cookies обновлены в %s для uid=%s", file_path.name, uid)
+    return 1
 
 
 # ───────────────────────────────────────────────
@@ -456,7 +765,6 @@ async def run_event_with_existing_context(
     Выполняет обработчик события в уже открытой сессии (context).
     """
     user_id, uid = str(user_id), str(uid)
-    cookies_db = load_all_cookies()
 
     page = await context.new_page()
     try:
@@ -468,8 +776,7 @@ async def run_event_with_existing_context(
 
         fresh = await context.cookies()
         fresh_map = {c["name"]: c["value"] for c in fresh if "name" in c}
-        cookies_db.setdefault(user_id, {})[uid] = fresh_map
-        save_all_cookies(cookies_db)
+        cookie_store.put_cookies(user_id, uid, fresh_map)
         logger.info(f"[{event_name}] 🔄 Cookies обновлены для {uid}")
 
         return {
@@ -500,9 +807,7 @@ async def run_event_with_browser(
     handler_fn(page) -> {"success": bool, "message": str}
     """
     user_id, uid = str(user_id), str(uid)
-    cookies_db = load_all_cookies()
-    user_cookies = cookies_db.get(user_id, {})
-    acc_cookies = user_cookies.get(uid, {})
+    acc_cookies = cookie_store.get_cookies(user_id, uid)
 
     if context is not None:
         return await run_event_with_existing_context(
@@ -514,27 +819,21 @@ async def run_event_with_browser(
             handler_fn,
         )
 
-    async with async_playwright() as p:
-        profile = get_random_browser_profile()
-        ctx = await launch_masked_persistent_context(
-            p,
-            user_data_dir=str(PROFILE_DIR / uid),
-            browser_path=BROWSER_PATH,
-            headless=True,  # 👈 можно вынести в config
-            slow_mo=30,
-            profile=profile,
-        )
-        context, page = ctx["context"], ctx["page"]
+    from services.warm_sessions import get_warm_sessions
 
-        try:
-            # 🍪 применяем cookies
-            if acc_cookies:
-                await context.add_cookies(cookies_to_playwright(acc_cookies))
+    # 🔥 тёплая сессия (user_id, uid): повторные действия идут в уже открытую страницу
+    async with get_warm_sessions().acquire(user_id, uid, cookies=acc_cookies) as session:
+        context, page = session.context, session.page
+        warm = session.page.url.startswith("http")  # страница уже открывалась — браузер «прогрет»
 
-            # 🌍 переходим на страницу акции
+        try:
+            # 🌍 переходим на страницу акции (обработчику нужна свежезагруженная страница)
             await page.goto(event_url, wait_until="domcontentloaded", timeout=45_000)
-            await asyncio.sleep(2)
-            await humanize_pre_action(page)
+            if warm:
+                await asyncio.sleep(0.3)
+            else:
+                await asyncio.sleep(2)
+                await humanize_pre_action(page)
 
             # ⚙️ выполняем обработчик события
             result = await handler_fn(page)
@@ -542,8 +841,7 @@ async def run_event_with_browser(
             # 🔄 сохраняем свежие cookies
             fresh = await context.cookies()
             fresh_map = {c["name"]: c["value"] for c in fresh if "name" in c}
-            cookies_db.setdefault(user_id, {})[uid] = fresh_map
-            save_all_cookies(cookies_db)
+            cookie_store.put_cookies(user_id, uid, fresh_map)
             logger.info(f"[{event_name}] 🔄 Cookies обновлены для {uid}")
 
             return {
@@ -554,11 +852,224 @@ async def run_event_with_browser(
 
         except Exception as e:
             logger.exception(f"[{event_name}] ❌ Ошибка выполнения: {e}")
-            return {"success": False, "message": f"❌ Ошибка при выполнении {event_name}: {e}", "event": event_name}
-
-        finally:
-            try:
-                await page.close()
-                await context.close()
-            except Exception:
-                pass
\ No newline at end of file
+            await get_warm_sessions().close_session(user_id, uid)
+            return {"success": False, "message": f"❌ Ошибка при выполнении {event_name}: {e}", "event": event_name}
+
+
+# ───────────────────────────────────────────────
+# 🤝 Передача сессии из браузера в HTTP
+# ───────────────────────────────────────────────
+# Браузеру остаётся только загрузить страницу (Akamai выставляет ak_bmsc/bm_sz,
+# сервер — PHPSESSID); ajax-запросы события дальше идут через общий коннектор
+# services.event_http, а слот пула освобождается сразу после загрузки.
+HANDOFF_POLICY = "api-only"
+HANDOFF_NAV_TIMEOUT = 45_000
+
+_PAGE_FETCH_JS = """
+async ({url, method, referer}) => {
+    const res = await fetch(url, {
+        method,
+        credentials: 'include',
+        headers: {'X-Requested-With': 'XMLHttpRequest', 'Referer': referer}
+    });
+    return {status: res.status, text: await res.text()};
+}
+"""
+
+_handoff_stats = {"handoffs": 0, "escalated": 0, "browser_seconds": 0.0}
+
+
+def handoff_stats() -> Dict[str, Any]:
+    n = _handoff_stats["handoffs"]
+    return {
+        "handoffs": n,
+        "escalated": _handoff_stats["escalated"],
+        "avg_browser_seconds": round(_handoff_stats["browser_seconds"] / n, 2) if n else 0.0,
+    }
+
+
+async def _close_quietly(obj):
+    try:
+        await obj.close()
+    except Exception:
+        pass
+
+
+class HttpHandoff:
+    """
+    Что снято с браузера: cookies (в CookieJar http-сессии), User-Agent, HTML страницы
+    и page_data (результат page_fn). fetch() идёт по HTTP; если сервер ответил 403 /
+    проверкой Akamai — один раз поднимается контекст из пула с текущими cookies,
+    и дальше запросы выполняются fetch()'ем из страницы.
+    """
+
+    def __init__(self, user_id: str, uid: str, event_url: str, user_agent: str, html: str,
+                 page_data: Any, http, stack: AsyncExitStack, policy: str):
+        self.user_id = user_id
+        self.uid = uid
+        self.event_url = event_url
+        self.user_agent = user_agent
+        self.html = html
+        self.page_data = page_data
+        self.http = http
+        self.context = None
+        self.page = None
+        self.escalated = False
+        self._stack = stack
+        self._policy = policy
+
+    async def fetch(self, url: str, *, method: str = "GET") -> Tuple[int, str]:
+        """GET/POST на ajax-URL события → (status, text)."""
+        if self.page is None:
+            from services.event_http import EscalateToBrowser
+            try:
+                return await self.http.fetch(url, method=method)
+            except EscalateToBrowser as e:
+                logger.warning("[HANDOFF] 🛡 %s: %s — продолжаю в браузере", self.uid, e)
+                await self._to_browser()
+        await throttle(url)
+        resp = await self.page.evaluate(
+            _PAGE_FETCH_JS, {"url": url, "method": method.upper(), "referer": self.event_url}
+        )
+        return resp.get("status", 0), resp.get("text", "")
+
+    async def _to_browser(self):
+        from services.event_http import jar_to_playwright
+
+        self.escalated = True
+        _handoff_stats["escalated"] += 1
+        ctx = await get_browser_pool().new_session(policy=self._policy, label=self.uid)
+        self._stack.push_async_callback(_close_quietly, ctx["context"])
+        self.context, self.page = ctx["context"], ctx["page"]
+        cookies = jar_to_playwright(self.http.session.cookie_jar)
+        if cookies:
+            await self.context.add_cookies(cookies)
+        await self.page.goto(self.event_url, wait_until="domcontentloaded", timeout=HANDOFF_NAV_TIMEOUT)
+        await asyncio.sleep(2)
+        await humanize_pre_action(self.page)
+
+    async def fresh_cookies(self) -> Dict[str, str]:
+        if self.page is not None:
+            return {c["name"]: c["value"] for c in await self.context.cookies() if "name" in c}
+        return self.http.cookies()
+
+    async def push_cookies(self, context):
+        """Возвращает cookies HTTP-фазы (сервер мог их сменить) в контекст, из которого снята страница."""
+        from services.event_http import jar_to_playwright
+
+        if self.page is not None:
+            cookies = [c for c in await self.context.cookies() if c.get("name")]
+        else:
+            cookies = jar_to_playwright(self.http.session.cookie_jar)
+        if cookies:
+            await context.add_cookies(cookies)
+
+
+@asynccontextmanager
+async def browser_handoff(
+    user_id: str,
+    uid: str,
+    event_url: str,
+    *,
+    context=None,
+    warm: bool = False,
+    page_fn=None,
+    policy: str = HANDOFF_POLICY,
+):
+    """
+    async with browser_handoff(user_id, uid, event_url) as h:
+        status, text = await h.fetch(f"{event_url}ajax.req.php?action=...")
+
+    Источник страницы:
+      • context — новая вкладка в уже открытом контексте (закрывается после загрузки);
+      • warm=True — тёплая сессия (services.warm_sessions), отпускается после загрузки;
+      • иначе — контекст из общего BrowserPool, закрывается после загрузки.
+    page_fn(page) — снять со страницы то, что нужно дальше (таймеры, кнопки), до её закрытия.
+    Свежие cookies сохраняются в cookie_store при выходе без ошибки; чужой context
+    получает их обратно — следующий обработчик в нём не начнёт со старых.
+    """
+    from services.event_http import get_event_http, jar_from_playwright
+
+    user_id, uid = str(user_id), str(uid)
+    t0 = time.perf_counter()
+    shared_context = context
+
+    async with AsyncExitStack() as stack:
+        async with AsyncExitStack() as browser:
+            if context is not None:
+                page = await context.new_page()
+                browser.push_async_callback(_close_quietly, page)
+                profile: Dict[str, Any] = {}
+            elif warm:
+                from services.warm_sessions import get_warm_sessions
+                session = await browser.enter_async_context(
+                    get_warm_sessions().acquire(user_id, uid, event_url)
+                )
+                context, page, profile = session.context, session.page, session.profile or {}
+            else:
+                ctx = await get_browser_pool().new_session(
+                    cookies=cookie_store.get_cookies(user_id, uid) or None, policy=policy, label=uid,
+                )
+                context, page, profile = ctx["context"], ctx["page"], ctx["profile"]
+                browser.push_async_callback(_close_quietly, context)
+
+            if not warm:
+                await page.goto(event_url, wait_until="domcontentloaded", timeout=HANDOFF_NAV_TIMEOUT)
+                await asyncio.sleep(2)
+                await humanize_pre_action(page)
+
+            user_agent = await page.evaluate("() => navigator.userAgent")
+            html = await page.content()
+            page_data = await page_fn(page) if page_fn is not None else None
+            pw_cookies = await context.cookies()
+
+        held = time.perf_counter() - t0
+        _handoff_stats["handoffs"] += 1
+        _handoff_stats["browser_seconds"] += held
+        logger.info("[HANDOFF] 🤝 %s: браузер отпущен через %.1f с, дальше HTTP", uid, held)
+
+        http = await stack.enter_async_context(get_event_http().session(
+            profile={**profile, "user_agent": user_agent},
+            uid=uid,
+            page_url=event_url,
+            jar=jar_from_playwright(pw_cookies),
+        ))
+        handoff = HttpHandoff(user_id, uid, event_url, user_agent, html, page_data, http, stack, policy)
+        yield handoff
+
+        fresh = await handoff.fresh_cookies()
+        if fresh:
+            cookie_store.put_cookies(user_id, uid, fresh, merge=True)
+        if shared_context is not None:
+            try:
+                await handoff.push_cookies(shared_context)
+            except Exception as e:
+                logger.warning("[HANDOFF] ⚠️ %s: cookies не возвращены в контекст: %s", uid, e)
+
+
+async def run_event_with_handoff(
+    user_id: str,
+    uid: str,
+    event_url: str,
+    event_name: str,
+    handler_fn,
+    context=None,
+    page_fn=None,
+):
+    """
+    Как run_event_with_browser, но обработчик получает HttpHandoff вместо страницы:
+    handler_fn(handoff) -> {"success": bool, "message": str}
+    """
+    user_id, uid = str(user_id), str(uid)
+    try:
+        async with browser_handoff(user_id, uid, event_url, context=context, page_fn=page_fn) as handoff:
+            result = await handler_fn(handoff)
+        logger.info(f"[{event_name}] 🔄 Cookies обновлены для {uid}")
+        return {
+            "success": bool(result.get("success")),
+            "message": result.get("message", "❓ Нет сообщения"),
+            "event": event_name,
+        }
+    except Exception as e:
+        logger.exception(f"[{event_name}] ❌ Ошибка выполнения: {e}")
+        return {"success": False, "message": f"❌ Ошибка при выполнении {event_name}: {e}", "event": event_name}
@@ -16,14 +16,14 @@ from playwright.async_api import (
 )
 from services.logger import logger
 from services.browser_patches import (
-    BROWSER_PATH,
+    get_browser_path,
     get_random_browser_profile,
     humanize_pre_action,
     jitter,
     launch_masked_persistent_context,
 )
-from services.cookies_io import load_all_cookies, save_all_cookies
-from config import COOKIES_FILE
+from services.profile_manager import get_profile_manager
+from services import cookie_store
 REQUIRED_COOKIES = {
     "ak_bmsc",
     "RT",
@@ -53,14 +53,9 @@ class PlayerInfoResult(TypedDict):
 
 
 def load_cookies_for_account(user_id: str, uid: str) -> dict:
-    """Возвращает cookies конкретного аккаунта из cookies.json"""
-    if not os.path.exists(COOKIES_FILE):
-        logger.warning("[COOKIES] ⚠️ Файл cookies.json не найден")
-        return {}
+    """Возвращает cookies конкретного аккаунта (точечный запрос к cookie_store)"""
     try:
-        with open(COOKIES_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data.get(str(user_id), {}).get(str(uid), {})
+        return cookie_store.get_cookies(user_id, uid)
     except Exception as e:
         logger.error(f"[COOKIES] ❌ Ошибка загрузки cookies: {e}")
         return {}
@@ -69,20 +64,8 @@ def load_cookies_for_account(user_id: str, uid: str) -> dict:
 def load_first_account_cookies(exclude: set[str] | None = None) -> dict:
     if exclude is None:
         exclude = set()
-    if not os.path.exists(COOKIES_FILE):
-        logger.warning("[COOKIES] ⚠️ Файл cookies.json не найден")
-        return {}
     try:
-        with open(COOKIES_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if not isinstance(data, dict) or not data:
-            return {}
-        first_user = next(iter(data.values()))
-        if not isinstance(first_user, dict) or not first_user:
-            return {}
-        first_uid = next(iter(first_user.values()))
-        if not isinstance(first_uid, dict):
-            return {}
+        first_uid = cookie_store.first_account_cookies()
         return {k: v for k, v in first_uid.items() if k not in exclude and v}
     except Exception as e:
         logger.error(f"[COOKIES] ❌ Ошибка загрузки cookies первого аккаунта: {e}")
@@ -665,7 +648,7 @@ async def login_shop_email(email: str, password: str) -> dict[str, Any]:
     try:
         from playwright.async_api import async_playwright
 
-        async with async_playwright() as p:
+        async with async_playwright() as p, get_profile_manager().profile("_shop_email", p) as user_data_dir:
             profile = get_random_browser_profile()
             profile.update(
                 {
@@ -681,8 +664,8 @@ async def login_shop_email(email: str, password: str) -> dict[str, Any]:
             logger.info("[SHOP] ▶ Запуск браузера для входа по email")
             ctx = await launch_masked_persistent_context(
                 p,
-                user_data_dir="data/chrome_profiles/_shop_email",
-                browser_path=BROWSER_PATH,
+                user_data_dir=user_data_dir,
+                browser_path=get_browser_path(),
                 headless=True,
                 slow_mo=EMAIL_LOGIN_SLOW_MO,
                 profile=profile,
@@ -936,7 +919,7 @@ async def start_shop_login_igg(igg_id: str) -> dict[str, Any]:
         ctx = await launch_masked_persistent_context(
             playwright,
             user_data_dir=f"data/chrome_profiles/_shop_igg_{igg_id}",
-            browser_path=BROWSER_PATH,
+            browser_path=get_browser_path(),
             headless=True,
             slow_mo=SLOW_MO,
             profile=profile,
@@ -1229,9 +1212,7 @@ async def refresh_cookies_mvp(user_id: str, uid: str) -> dict[str, Any]:
                 "cookies": None,
             }
 
-        all_data = load_all_cookies()
-        all_data.setdefault(str(user_id), {})[str(uid)] = cookies_result
-        save_all_cookies(all_data)
+        cookie_store.put_cookies(user_id, uid, cookies_result)
 
         logger.info("[COOKIES] 💾 Cookies обновлены через email для UID=%s", uid)
         return {
@@ -1254,12 +1235,12 @@ async def refresh_cookies_mvp(user_id: str, uid: str) -> dict[str, Any]:
     try:
         from playwright.async_api import async_playwright
 
-        async with async_playwright() as p:
+        async with async_playwright() as p, get_profile_manager().profile(uid, p) as user_data_dir:
             profile = get_random_browser_profile()
             ctx = await launch_masked_persistent_context(
                 p,
-                user_data_dir=f"data/chrome_profiles/{uid}",
-                browser_path=BROWSER_PATH,
+                user_data_dir=user_data_dir,
+                browser_path=get_browser_path(),
                 headless=True,
                 slow_mo=SLOW_MO,
                 profile=profile,
@@ -1280,9 +1261,7 @@ async def refresh_cookies_mvp(user_id: str, uid: str) -> dict[str, Any]:
             cookies_list = await context.cookies()
             cookies_result = {c["name"]: c["value"] for c in cookies_list}
 
-            all_data = load_all_cookies()
-            all_data.setdefault(str(user_id), {})[str(uid)] = cookies_result
-            save_all_cookies(all_data)
+            cookie_store.put_cookies(user_id, uid, cookies_result)
             cookies_saved = True
 
             logger.info(f"[COOKIES] 💾 Cookies обновлены для UID={uid}")
@@ -1363,12 +1342,12 @@ async def extract_player_info_from_page(url: str) -> PlayerInfoResult:
     from playwright.async_api import async_playwright
 
     try:
-        async with async_playwright() as p:
+        async with async_playwright() as p, get_profile_manager().profile("_extract_tmp", p) as user_data_dir:
             profile = get_random_browser_profile()
             ctx = await launch_masked_persistent_context(
                 p,
-                user_data_dir="data/chrome_profiles/_extract_tmp",
-                browser_path=BROWSER_PATH,
+                user_data_dir=user_data_dir,
+                browser_path=get_browser_path(),
                 headless=True,
                 slow_mo=SLOW_MO,
                 profile=profile,
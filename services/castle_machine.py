@@ -2,9 +2,10 @@
 import json
 import logging
 
-from services.browser_patches import run_event_with_browser
+from services.browser_patches import run_event_with_handoff
 from services.accounts_manager import get_all_accounts
 from services.castle_api import load_cookies_for_account
+from services.daily_ledger import records_daily
 
 BASE_URL = "https://event-eu-cc.igg.com/event/castle_machine/"
 MAKE_URL = f"{BASE_URL}ajax.req.php?action=make&type=free"
@@ -61,6 +62,7 @@ def format_rewards(data: dict) -> str:
     return "\n🎁 " + "\n🎁 ".join(rewards)
 
 
+@records_daily("castle_machine")
 async def run_castle_machine(user_id: str, uid: str = None, context=None) -> dict:
     logger.info(f"[CASTLE_MACHINE] ▶ Запуск для user_id={user_id}, uid={uid}")
 
@@ -82,27 +84,8 @@ async def run_castle_machine(user_id: str, uid: str = None, context=None) -> dic
         return {"success": False, "message": f"⚠️ Cookies не найдены ({username})."}
     logger.info(f"[CASTLE_MACHINE] 🍪 Cookies загружены для {username} ({uid}) — {len(cookies_dict)} шт.")
 
-    async def handler(page):
-        html = (await page.content()).lower()
-        if any(x in html for x in ["событие еще не началось", "уже завершилось"]):
-            return {"success": True, "message": f"⚠️ {username} ({uid}) — событие ещё не началось или завершилось."}
-
-        # === Определяем фазу по датам ===
-        try:
-            from services.event_checker import check_event_active
-            phase = await check_event_active("castle_machine")
-            if phase == 1:
-                logger.info(f"[CASTLE_MACHINE] 🏗 Текущая фаза: 1 (Создание)")
-            elif phase == 2:
-                logger.info(f"[CASTLE_MACHINE] 🎁 Текущая фаза: 2 (Розыгрыш)")
-            else:
-                logger.warning(f"[CASTLE_MACHINE] ⚠️ Фаза не определена или акция не активна.")
-                return {"success": True, "message": f"⚠️ {username} ({uid}) — акция не активна или вне даты."}
-        except Exception as e:
-            logger.warning(f"[CASTLE_MACHINE] ⚠️ Ошибка при определении фазы: {e}")
-            phase = None
-
-        # --- Получаем таймер ---
+    async def read_page(page):
+        """Таймер и этапы — со страницы, пока она открыта (дальше работаем по HTTP)."""
         formatted_time = None
         try:
             timer_div = await page.query_selector("#count-down")
@@ -116,14 +99,9 @@ async def run_castle_machine(user_id: str, uid: str = None, context=None) -> dic
                         sec = int(left_attr)
                         h, m, s = sec // 3600, (sec % 3600) // 60, sec % 60
                         formatted_time = f"{h:02}:{m:02}:{s:02}"
-            if formatted_time:
-                logger.info(f"[CASTLE_MACHINE] Таймер найден: {formatted_time}")
-            else:
-                logger.info(f"[CASTLE_MACHINE] Таймер не найден или пуст.")
         except Exception:
             pass
 
-        # --- Этапы ---
         stage_text = "неизвестно"
         try:
             times = await page.query_selector_all("div.event-time-group .event-time")
@@ -133,6 +111,37 @@ async def run_castle_machine(user_id: str, uid: str = None, context=None) -> dic
         except Exception:
             pass
 
+        return {"timer": formatted_time, "stages": stage_text}
+
+    async def handler(h):
+        html = h.html.lower()
+        if any(x in html for x in ["событие еще не началось", "уже завершилось"]):
+            return {"success": True, "message": f"⚠️ {username} ({uid}) — событие ещё не началось или завершилось."}
+
+        # === Определяем фазу по датам ===
+        try:
+            from services.event_checker import check_event_active
+            phase = await check_event_active("castle_machine")
+            if phase == 1:
+                logger.info(f"[CASTLE_MACHINE] 🏗 Текущая фаза: 1 (Создание)")
+            elif phase == 2:
+                logger.info(f"[CASTLE_MACHINE] 🎁 Текущая фаза: 2 (Розыгрыш)")
+            else:
+                logger.warning(f"[CASTLE_MACHINE] ⚠️ Фаза не определена или акция не активна.")
+                return {"success": True, "message": f"⚠️ {username} ({uid}) — акция не активна или вне даты."}
+        except Exception as e:
+            logger.warning(f"[CASTLE_MACHINE] ⚠️ Ошибка при определении фазы: {e}")
+            phase = None
+
+        # --- Таймер и этапы (сняты со страницы в read_page) ---
+        page_info = h.page_data or {}
+        formatted_time = page_info.get("timer")
+        if formatted_time:
+            logger.info(f"[CASTLE_MACHINE] Таймер найден: {formatted_time}")
+        else:
+            logger.info(f"[CASTLE_MACHINE] Таймер не найден или пуст.")
+        stage_text = page_info.get("stages") or "неизвестно"
+
         # === Выбираем URL в зависимости от фазы ===
         if phase == 1:
             action_url = MAKE_URL
@@ -145,49 +154,10 @@ async def run_castle_machine(user_id: str, uid: str = None, context=None) -> dic
 
         logger.info(f"[CASTLE_MACHINE] ▶ Отправляю запрос {action_name} для {uid}")
 
-        # === Лог сетевых запросов ===
-        page.on("request", lambda req: logger.info(f"🌍 REQUEST → {req.method} {req.url}"))
-        page.on("response", lambda res: logger.info(f"📩 RESPONSE ← {res.status} {res.url}"))
-
-        # === Выполняем fetch с полными заголовками и fallback через XHR ===
+        # === Запрос по HTTP (cookies и User-Agent сняты с браузера) ===
         try:
-            resp = await page.evaluate(f"""
-                async () => {{
-                    // Основной запрос через fetch
-                    let res;
-                    try {{
-                        const r = await fetch("{action_url}", {{
-                            method: "GET",
-                            credentials: "include",
-                            headers: {{
-                                "X-Requested-With": "XMLHttpRequest",
-                                "Referer": "{BASE_URL}",
-                                "Accept": "application/json, text/javascript, */*; q=0.01",
-                                "User-Agent": navigator.userAgent
-                            }}
-                        }});
-                        res = await r.text();
-                    }} catch (e) {{
-                        res = "fetch_error:" + e;
-                    }}
-
-                    // Если fetch вернул пусто — fallback на XHR
-                    if (!res) {{
-                        const xhrResp = await new Promise((resolve) => {{
-                            const xhr = new XMLHttpRequest();
-                            xhr.open("GET", "{action_url}", true);
-                            xhr.withCredentials = true;
-                            xhr.setRequestHeader("X-Requested-With", "XMLHttpRequest");
-                            xhr.setRequestHeader("Referer", "{BASE_URL}");
-                            xhr.onload = () => resolve(xhr.responseText);
-                            xhr.onerror = () => resolve("XHR error");
-                            xhr.send();
-                        }});
-                        res = xhrResp;
-                    }}
-                    return res;
-                }}
-            """)
+            status, resp = await h.fetch(action_url)
+            logger.info(f"📩 RESPONSE ← {status} {action_url}")
         except Exception as e:
             return {"success": False, "message": f"❌ Ошибка при запросе {action_name}: {e}"}
 
@@ -225,6 +195,7 @@ async def run_castle_machine(user_id: str, uid: str = None, context=None) -> dic
 
             return {
                 "success": True,
+                "daily_done": True,
                 "message": (
                     f"✅ <b>{username}</b> ({uid}) — акция <b>Создающая машина</b>\n\n"
                     f"{msg}{rewards_text}\n\n📅 Этапы: {stage_text}"
@@ -248,6 +219,7 @@ async def run_castle_machine(user_id: str, uid: str = None, context=None) -> dic
 
             return {
                 "success": True,
+                "daily_done": True,
                 "message": (
                     f"⚠️ <b>{username}</b> ({uid}) — вы пропустили первый сегмент события 🕒\n\n"
                     f"Теперь можно участвовать только во второй фазе (розыгрыше призов 🎁).\n"
@@ -275,4 +247,6 @@ async def run_castle_machine(user_id: str, uid: str = None, context=None) -> dic
             "message": f"⚠️ <b>{username}</b> ({uid}) — неизвестный ответ:\n<code>{snippet}</code>"
         }
 
-    return await run_event_with_browser(user_id, uid, BASE_URL, "Создающая машина", handler, context=context)
\ No newline at end of file
+    return await run_event_with_handoff(
+        user_id, uid, BASE_URL, "Создающая машина", handler, context=context, page_fn=read_page
+    )
\ No newline at end of file
@@ -0,0 +1,149 @@
+# tg_zov/services/checkpoint.py
+"""
+📍 Журнал завершённых аккаунтов для продолжения фарма
+
+Раньше puzzle2_auto сохранял позицию одним числом current_index в
+data/farm_state.json. При параллельных воркерах аккаунты завершаются
+не по порядку, поэтому продолжение с индекса либо повторяло чужую
+работу, либо пропускало незавершённые аккаунты. Новый new_data*.json
+сдвигал все индексы.
+
+CheckpointLedger — журнал одного прогона в формате JSON Lines:
+  • первая строка — заголовок {"run": id, "started": время};
+  • дальше по строке на каждый окончательно завершённый uid;
+  • строка дописывается сразу (переживает падение процесса), а fsync
+    делается пачкой — раз в FSYNC_EVERY записей или FSYNC_INTERVAL секунд
+    и при закрытии;
+  • при продолжении журнал перечитывается, оборванная последняя строка
+    пропускается; is_done(uid) — аккаунт в этом прогоне уже сделан.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from services import persist
+
+logger = logging.getLogger("checkpoint")
+
+FSYNC_EVERY = 50        # записей между fsync
+FSYNC_INTERVAL = 5.0    # сек. — не дольше этого запись живёт без fsync
+
+
+class CheckpointLedger:
+    def __init__(self, path: Path, *, fsync_every: int = FSYNC_EVERY,
+                 fsync_interval: float = FSYNC_INTERVAL):
+        self.path = Path(path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.run: Optional[str] = None
+        self.started: Optional[str] = None
+        self.done: Set[str] = set()
+        self.failed = 0
+        self._fh = None
+        self._torn = False
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    # ───── открытие ─────
+    def open(self, resume: bool = True) -> "CheckpointLedger":
+        """resume — продолжить журнал, если он есть; иначе начинается новый прогон."""
+        if resume and self.path.exists():
+            self._load()
+        if self.run is None:
+            self._start()
+        else:
+            self._fh = open(self.path, "a", encoding="utf-8")
+            if self._torn:
+                self._fh.write("\n")  # следующая запись не должна склеиться с оборванной
+            logger.info("[CKPT] ▶️ Продолжаем прогон %s от %s: уже сделано %s аккаунтов",
+                        self.run, self.started, len(self.done))
+        return self
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    self._torn = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # оборванная запись при падении
+                    if "run" in entry:
+                        self.run, self.started = entry["run"], entry.get("started")
+                    elif entry.get("uid"):
+                        self.done.add(str(entry["uid"]))
+                        if not entry.get("ok", True):
+                            self.failed += 1
+        except Exception as e:
+            logger.warning("[CKPT] ⚠️ Не удалось прочитать %s: %s — начинаем заново", self.path, e)
+            self.run, self.done, self.failed = None, set(), 0
+
+    def _start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.run = uuid.uuid4().hex[:12]
+        self.started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.done, self.failed = set(), 0
+        with persist.locked(self.path):
+            self._fh = open(self.path, "w", encoding="utf-8")
+            self._write({"run": self.run, "started": self.started})
+            self.sync()
+        logger.info("[CKPT] 🆕 Новый прогон %s", self.run)
+
+    # ───── записи ─────
+    def is_done(self, uid: Any) -> bool:
+        return str(uid) in self.done
+
+    def mark(self, uid: Any, ok: bool = True):
+        """Аккаунт завершён окончательно (успех или исчерпаны попытки)."""
+        uid = "" if uid is None else str(uid)
+        if not uid or uid in self.done or self._fh is None:
+            return
+        self.done.add(uid)
+        if not ok:
+            self.failed += 1
+        self._write({"uid": uid, "ok": ok})
+        self._unsynced += 1
+        if (self._unsynced >= self.fsync_every
+                or time.monotonic() - self._synced_at >= self.fsync_interval):
+            self.sync()
+
+    def _write(self, entry: Dict[str, Any]):
+        self._fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._fh.flush()
+
+    def sync(self):
+        if self._fh is None:
+            return
+        try:
+            os.fsync(self._fh.fileno())
+        except OSError as e:
+            logger.warning("[CKPT] ⚠️ fsync %s: %s", self.path, e)
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        if self._fh is not None:
+            self.sync()
+            self._fh.close()
+            self._fh = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"run": self.run, "done": len(self.done), "failed": self.failed}
+
+
+def reset(path: Path):
+    """Удаляет журнал — следующий прогон начнётся с нуля."""
+    try:
+        Path(path).unlink()
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("[CKPT] ⚠️ Не удалось удалить %s: %s", path, e)
@@ -0,0 +1,495 @@
+# tg_zov/services/claim_ledger.py
+"""
+🧾 Журнал выдачи пазлов: снимок puzzle_claim_log.json + append-журнал
+
+Раньше каждая операция (выдача кодов, проверка «уже получал?», claim у донора,
+сохранение id сообщения) читала и целиком перезаписывала puzzle_claim_log.json.
+Теперь:
+  • puzzle_claim_log.json — снимок в прежнем формате (верхний уровень
+    {tg_user_id: {...}} для ручной выдачи и users/users_meta для auto-claim);
+  • puzzle_claim_log.journal.jsonl — операции после снимка, одна строка на операцию.
+
+В памяти состояние = снимок + журнал, и поверх него индексы:
+  • ec_param, выданные пользователю — проверка повторной выдачи за O(1);
+  • счётчики пазлов по пользователю и по аккаунтам — страница статистики
+    строится из них, не читая сырые логи.
+
+Снимок переписывается раз в SNAPSHOT_EVERY операций и при выходе, журнал
+после этого обнуляется. В снимке хранится номер последней учтённой операции
+(_journal_seq), так что падение между записью снимка и обнулением журнала
+не приводит к повторному применению операций. Запись операций и снимка
+идёт под межпроцессной блокировкой services.persist; операции, дописанные
+другим процессом, подхватываются по изменению stat файлов.
+"""
+
+from __future__ import annotations
+
+import atexit
+import copy
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Tuple
+
+from services import persist
+from services.puzzle_files import PUZZLE_CLAIM_JOURNAL_FILE, PUZZLE_CLAIM_LOG_FILE
+
+logger = logging.getLogger("claim_ledger")
+
+ACCOUNT_LIMIT = 30
+# Переписывать снимок после стольких операций в журнале
+SNAPSHOT_EVERY = 200
+
+_SEQ_KEY = "_journal_seq"
+
+
+def _as_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _new_user_entry() -> Dict[str, Any]:
+    return {
+        "count": 0,
+        "claimed_puzzles": [],
+        "claimed_ec_params": [],
+        "history": [],
+        "tg_name": "",
+        "tg_tag": "",
+    }
+
+
+def _new_account_entry() -> Dict[str, Any]:
+    return {"donors": [], "count": 0, "claimed_puzzles": [], "last_messages": {}}
+
+
+class ClaimLedger:
+    def __init__(self, snapshot_path: Path = PUZZLE_CLAIM_LOG_FILE,
+                 journal_path: Path = PUZZLE_CLAIM_JOURNAL_FILE):
+        self.snapshot_path = Path(snapshot_path)
+        self.journal_path = Path(journal_path)
+        self._lock = threading.RLock()
+        self._data: Dict[str, Any] = {}
+        self._seq = 0
+        self._journal_lines = 0
+        self._journal_end = 0       # байт журнала разобрано (до последнего \n)
+        self._stat: Optional[Tuple] = None
+        self._codes: Dict[str, Set[str]] = {}
+        self._auto_totals: Dict[str, int] = {}
+        # растёт при любом изменении — по нему производные представления понимают, что устарели
+        self.version = 0
+        self._reset_version = 0
+        self._changed: Dict[str, int] = {}
+        self._load()
+
+    # ───── служебное ─────
+    def _file_stat(self) -> Tuple:
+        out = []
+        for path in (self.snapshot_path, self.journal_path):
+            try:
+                st = os.stat(path)
+                out.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    @contextmanager
+    def _txn(self):
+        """Эксклюзивный доступ к снимку и журналу (в т.ч. от других процессов)."""
+        with self._lock, persist.locked(self.snapshot_path):
+            self._check_external_change(locked=True)
+            yield
+
+    def _check_external_change(self, locked: bool = False):
+        """
+        Файлы изменил другой процесс или очистили снаружи (clear_puzzle_runtime_files и т.п.) — перечитываем.
+        locked — держим persist.locked: хвост журнала без \n точно мусор после падения, его можно отрезать.
+        Без блокировки это может быть чужая дозапись в процессе — файл не трогаем.
+        """
+        if self._file_stat() != self._stat:
+            self._load()
+        if locked:
+            try:
+                size = os.stat(self.journal_path).st_size
+            except OSError:
+                size = 0
+            if size > self._journal_end:
+                logger.warning(
+                    f"[CLAIM-LEDGER] ✂️ Отрезан повреждённый хвост {self.journal_path} ({size - self._journal_end} байт)"
+                )
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(self._journal_end)
+                self._stat = self._file_stat()
+
+    def _load(self):
+        # stat — до чтения: дозапись, попавшая между чтением и stat, не потеряется
+        stat = self._file_stat()
+        data: Dict[str, Any] = {}
+        if self.snapshot_path.exists():
+            try:
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                if isinstance(loaded, dict):
+                    data = loaded
+            except Exception as e:
+                logger.warning(f"[CLAIM-LEDGER] ⚠️ Не удалось прочитать {self.snapshot_path}: {e}")
+
+        self._seq = _as_int(data.pop(_SEQ_KEY, 0))
+        self._data = data
+        self._reindex()
+        self._journal_lines = 0
+        self._replay_journal()
+        self.version += 1
+        self._reset_version = self.version
+        self._changed = {}
+        self._stat = stat
+
+    def _replay_journal(self):
+        self._journal_end = 0
+        if not self.journal_path.exists():
+            return
+        with open(self.journal_path, "rb") as f:
+            raw = f.read()
+
+        good_end = 0
+        for line in raw.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # недописанный хвост
+            good_end += len(line)
+            try:
+                op = json.loads(line)
+            except Exception:
+                continue
+            if not isinstance(op, dict):
+                continue
+            self._journal_lines += 1
+            seq = _as_int(op.get("seq"))
+            if seq <= self._seq:
+                continue  # уже учтено в снимке
+            self._apply(op)
+            self._seq = seq
+        self._journal_end = good_end
+
+    def _reindex(self):
+        self._codes = {}
+        self._auto_totals = {}
+        for key, entry in self._data.items():
+            if str(key).isdigit() and isinstance(entry, dict):
+                codes = entry.get("claimed_ec_params")
+                if isinstance(codes, list):
+                    self._codes[str(key)] = {c for c in codes if isinstance(c, str)}
+
+        users = self._data.get("users")
+        if isinstance(users, dict):
+            for user, accounts in users.items():
+                if not isinstance(accounts, dict):
+                    continue
+                self._auto_totals[str(user)] = sum(
+                    _as_int(acc.get("count")) for acc in accounts.values() if isinstance(acc, dict)
+                )
+
+    def _user_entry(self, user: str) -> Dict[str, Any]:
+        entry = self._data.get(user)
+        if not isinstance(entry, dict):
+            entry = self._data[user] = _new_user_entry()
+        return entry
+
+    def _account_entry(self, user: str, iggid: str) -> Dict[str, Any]:
+        users = self._data.get("users")
+        if not isinstance(users, dict):
+            users = self._data["users"] = {}
+        accounts = users.get(user)
+        if not isinstance(accounts, dict):
+            accounts = users[user] = {}
+        entry = accounts.get(iggid)
+        if not isinstance(entry, dict):
+            entry = accounts[iggid] = _new_account_entry()
+        for key, default in _new_account_entry().items():
+            if not isinstance(entry.get(key), type(default)):
+                entry[key] = default
+        return entry
+
+    # ───── применение операций ─────
+    def _apply(self, op: Dict[str, Any]):
+        kind = op.get("op")
+        user = str(op.get("user", ""))
+
+        if kind in ("codes", "code"):
+            entry = self._user_entry(user)
+            if op.get("name"):
+                entry["tg_name"] = op["name"]
+            if op.get("tag"):
+                entry["tg_tag"] = op["tag"]
+            history = entry.setdefault("history", [])
+            if kind == "codes":
+                entry["count"] = _as_int(entry.get("count")) + _as_int(op.get("count"))
+                history.append({"ts": op.get("ts"), "action": "claim_30_codes", "count": op.get("count")})
+            else:
+                ec_param, puzzle_id = op.get("ec_param"), op.get("puzzle_id")
+                claimed = entry.setdefault("claimed_ec_params", [])
+                if ec_param not in claimed:
+                    claimed.append(ec_param)
+                self._codes.setdefault(user, set()).add(ec_param)
+                claimed_puzzles = entry.setdefault("claimed_puzzles", [])
+                if puzzle_id not in claimed_puzzles:
+                    claimed_puzzles.append(puzzle_id)
+                history.append({
+                    "ts": op.get("ts"),
+                    "action": "claim_specific_puzzle",
+                    "puzzle_id": puzzle_id,
+                    "ec_param": ec_param,
+                })
+
+        elif kind == "meta":
+            meta = self._data.get("users_meta")
+            if not isinstance(meta, dict):
+                meta = self._data["users_meta"] = {}
+            current = meta.get(user, {}) if isinstance(meta.get(user), dict) else {}
+            meta[user] = {
+                "name": op.get("name") or current.get("name", ""),
+                "tag": op.get("tag") or current.get("tag", ""),
+            }
+
+        elif kind in ("donor", "limit", "message"):
+            entry = self._account_entry(user, str(op.get("iggid")))
+            before = _as_int(entry.get("count"))
+            if kind == "donor":
+                donor = op.get("donor")
+                if donor not in entry["donors"]:
+                    entry["donors"].append(donor)
+                    if op.get("counted"):
+                        entry["count"] = before + 1
+                puzzle_id = op.get("puzzle_id")
+                if op.get("counted") and puzzle_id not in entry["claimed_puzzles"]:
+                    entry["claimed_puzzles"].append(puzzle_id)
+            elif kind == "limit":
+                entry["count"] = ACCOUNT_LIMIT
+            else:
+                entry["last_messages"][str(op.get("key"))] = op.get("message_id")
+            delta = _as_int(entry.get("count")) - before
+            if delta:
+                self._auto_totals[user] = self._auto_totals.get(user, 0) + delta
+
+        else:
+            logger.warning(f"[CLAIM-LEDGER] Неизвестная операция в журнале: {kind}")
+
+    def _record(self, op: Dict[str, Any]):
+        """Дописывает операцию в журнал и применяет её к состоянию в памяти."""
+        with self._txn():
+            op = {"seq": self._seq + 1, **op}
+            line = (json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_path, "ab") as f:
+                f.write(line)
+                f.flush()
+            self._journal_end += len(line)
+            self._seq += 1
+            self._journal_lines += 1
+            self._apply(op)
+            self.version += 1
+            self._changed[op["user"]] = self.version
+            self._stat = self._file_stat()
+            if self._journal_lines >= SNAPSHOT_EVERY:
+                self.snapshot()
+
+    # ───── снимок ─────
+    def snapshot(self):
+        """Переписывает puzzle_claim_log.json текущим состоянием и обнуляет журнал."""
+        with self._txn():
+            if not self._journal_lines:
+                return
+            persist.write_json(self.snapshot_path, {**self._data, _SEQ_KEY: self._seq})
+            if self.journal_path.exists():
+                with open(self.journal_path, "wb"):
+                    pass
+            self._journal_end = 0
+            logger.info(f"[CLAIM-LEDGER] 💾 Снимок записан ({self._journal_lines} операций из журнала)")
+            self._journal_lines = 0
+            self._stat = self._file_stat()
+
+    # ───── запись ─────
+    def record_codes(self, user_id, count: int, user_name: str | None = None, user_tag: str | None = None):
+        """Выдача пачки кодов (кнопка «Получить 30 пазлов»)."""
+        self._record({
+            "op": "codes",
+            "user": str(user_id),
+            "count": int(count),
+            "name": user_name or "",
+            "tag": (user_tag or "").lstrip("@"),
+            "ts": datetime.now().isoformat(timespec="seconds"),
+        })
+
+    def record_code(self, user_id, puzzle_id: int, ec_param: str,
+                    user_name: str | None = None, user_tag: str | None = None):
+        """Выдача конкретного пазла кодом ec_param."""
+        self._record({
+            "op": "code",
+            "user": str(user_id),
+            "puzzle_id": puzzle_id,
+            "ec_param": ec_param,
+            "name": user_name or "",
+            "tag": (user_tag or "").lstrip("@"),
+            "ts": datetime.now().isoformat(timespec="seconds"),
+        })
+
+    def set_user_meta(self, user_id, user_name: str | None = None, user_tag: str | None = None):
+        if not (user_name or user_tag):
+            return
+        user = str(user_id)
+        with self._txn():
+            current = self.user_meta(user)
+            if (user_name or current.get("name", "")) == current.get("name") and \
+                    (user_tag or current.get("tag", "")) == current.get("tag"):
+                return
+            self._record({"op": "meta", "user": user, "name": user_name or "", "tag": user_tag or ""})
+
+    def record_claim(self, user_id, iggid: str, donor_iggid: str, puzzle_id: int):
+        """Успешный claim пазла у донора для аккаунта iggid (+1 к счётчику аккаунта)."""
+        self._record({
+            "op": "donor",
+            "user": str(user_id),
+            "iggid": str(iggid),
+            "donor": donor_iggid,
+            "puzzle_id": puzzle_id,
+            "counted": True,
+        })
+
+    def add_used_donor(self, user_id, iggid: str, donor_iggid: str):
+        """Донор больше не подходит аккаунту (уже использован / ошибка) — без изменения счётчика."""
+        with self._txn():
+            if donor_iggid in self.account(user_id, iggid)["donors"]:
+                return
+            self._record({"op": "donor", "user": str(user_id), "iggid": str(iggid), "donor": donor_iggid})
+
+    def mark_limit(self, user_id, iggid: str):
+        """Сервер ответил, что аккаунт уже получил все ACCOUNT_LIMIT пазлов."""
+        with self._txn():
+            if self.account(user_id, iggid)["count"] == ACCOUNT_LIMIT:
+                return
+            self._record({"op": "limit", "user": str(user_id), "iggid": str(iggid)})
+
+    def set_message(self, user_id, iggid: str, key, message_id: int):
+        """Запоминает id сообщения бота (чтобы потом его редактировать)."""
+        self._record({
+            "op": "message",
+            "user": str(user_id),
+            "iggid": str(iggid),
+            "key": str(key),
+            "message_id": message_id,
+        })
+
+    # ───── чтение ─────
+    def has_claim(self, user_id, ec_param: str) -> bool:
+        """Получал ли уже пользователь конкретный ec_param (O(1))."""
+        with self._lock:
+            self._check_external_change()
+            return ec_param in self._codes.get(str(user_id), ())
+
+    def account(self, user_id, iggid: str) -> Dict[str, Any]:
+        """Копия записи аккаунта: {donors, count, claimed_puzzles, last_messages}."""
+        with self._lock:
+            self._check_external_change()
+            users = self._data.get("users")
+            accounts = users.get(str(user_id)) if isinstance(users, dict) else None
+            entry = accounts.get(str(iggid)) if isinstance(accounts, dict) else None
+            result = _new_account_entry()
+            if isinstance(entry, dict):
+                for key, default in result.items():
+                    if isinstance(entry.get(key), type(default)):
+                        result[key] = copy.deepcopy(entry[key])
+            return result
+
+    def account_counts(self, user_id) -> Dict[str, int]:
+        """{iggid: сколько пазлов получено} по аккаунтам пользователя."""
+        with self._lock:
+            self._check_external_change()
+            users = self._data.get("users")
+            accounts = users.get(str(user_id)) if isinstance(users, dict) else None
+            if not isinstance(accounts, dict):
+                return {}
+            return {
+                str(iggid): _as_int(entry.get("count"))
+                for iggid, entry in accounts.items()
+                if isinstance(entry, dict)
+            }
+
+    def user_total(self, user_id) -> int:
+        """
+        Всего пазлов пользователя: auto-claim по всем аккаунтам + ручная выдача
+        (но не меньше числа выданных ему кодов).
+        """
+        user = str(user_id)
+        with self._lock:
+            self._check_external_change()
+            total = self._auto_totals.get(user, 0)
+            entry = self._data.get(user)
+            if isinstance(entry, dict):
+                total += _as_int(entry.get("count"))
+            return max(total, len(self._codes.get(user, ())))
+
+    def user_names(self, user_id) -> Tuple[str, str]:
+        """(tg_name, tg_tag) из записей ручной выдачи."""
+        with self._lock:
+            self._check_external_change()
+            entry = self._data.get(str(user_id))
+            if not isinstance(entry, dict):
+                return "", ""
+            return entry.get("tg_name", "") or "", entry.get("tg_tag", "") or ""
+
+    def user_meta(self, user_id) -> Dict[str, str]:
+        """users_meta пользователя: {name, tag} (из auto-claim)."""
+        with self._lock:
+            self._check_external_change()
+            meta = self._data.get("users_meta")
+            entry = meta.get(str(user_id)) if isinstance(meta, dict) else None
+            return dict(entry) if isinstance(entry, dict) else {}
+
+    def changes_since(self, version: int) -> Tuple[int, Optional[Set[str]]]:
+        """
+        (текущая версия, пользователи, затронутые после version).
+        None вместо множества — журнал перечитывался целиком.
+        """
+        with self._lock:
+            self._check_external_change()
+            if version < self._reset_version:
+                return self.version, None
+            return self.version, {user for user, v in self._changed.items() if v > version}
+
+    def user_ids(self) -> Set[str]:
+        """Все пользователи, встречающиеся в журнале выдачи."""
+        with self._lock:
+            self._check_external_change()
+            ids = {str(k) for k, v in self._data.items() if str(k).isdigit() and isinstance(v, dict)}
+            for section in ("users", "users_meta"):
+                value = self._data.get(section)
+                if isinstance(value, dict):
+                    ids |= {str(k) for k in value.keys()}
+            return ids
+
+
+_ledger: Optional[ClaimLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def _snapshot_at_exit():
+    if _ledger is not None:
+        try:
+            _ledger.snapshot()
+        except Exception as e:
+            logger.warning(f"[CLAIM-LEDGER] ⚠️ Не удалось записать снимок при выходе: {e}")
+
+
+def get_ledger() -> ClaimLedger:
+    """Общий на процесс журнал выдачи пазлов."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = ClaimLedger()
+            atexit.register(_snapshot_at_exit)
+        return _ledger
@@ -0,0 +1,299 @@
+# tg_zov/services/concurrency.py
+"""
+📈 Адаптивный параллелизм (AIMD) для ферм и обновления cookies
+
+Раньше число одновременных аккаунтов было зашито константой в каждом
+модуле (puzzle2 — 5, puzzle3 — 4, login_and_refresh — 8,
+cookie_refresh_auto2 — 6), а 403 просто переигрывались батчем в конце.
+
+AdaptiveLimiter вместо asyncio.Semaphore:
+  • аддитивный рост: после «раунда» успешных аккаунтов (столько, каков
+    текущий лимит) лимит +1 — пока доля ошибок в окне мала, а задержка
+    не выросла относительно лучшей наблюдавшейся;
+  • мультипликативное снижение (×0.5): всплеск 403 в окне, таймаут,
+    нехватка памяти на хосте (/proc/meminfo);
+  • один всплеск режет лимит один раз: ошибки аккаунтов, начатых до
+    последнего снижения, уже учтены;
+  • limit, stats() и history (время, лимит, причина) — для логов и отчётов.
+
+Лимитеры живут на процесс (get_limiter): следующий прогон стартует
+с уже найденного значения.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger("concurrency")
+
+# Исходы обработки аккаунта
+OK = "ok"
+R403 = "403"
+TIMEOUT = "timeout"
+ERROR = "error"
+SKIP = "skip"         # аккаунт не обрабатывался (остановка, нет данных) — в статистику не идёт
+
+WINDOW = 20                 # последних исходов для оценки доли ошибок
+CUT_ON_403 = 3              # столько 403 в окне — «всплеск»
+HEALTHY_ERROR_RATE = 0.10   # выше — лимит не растёт
+LATENCY_TOLERANCE = 1.5     # рост, пока EMA задержки ≤ лучшей EMA × допуск
+LATENCY_ALPHA = 0.2
+DECREASE_FACTOR = 0.5
+MEMORY_LOW_RATIO = 0.10     # MemAvailable / MemTotal ниже — давление памяти
+MEMORY_CHECK_EVERY = 2.0    # сек. между чтениями /proc/meminfo
+MEMORY_CUT_COOLDOWN = 10.0  # не чаще одного снижения по памяти за это время
+HISTORY_LEN = 200
+
+
+def memory_available_ratio() -> Optional[float]:
+    """Доля доступной памяти хоста; None, если /proc/meminfo нет (не Linux)."""
+    try:
+        info = {}
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                info[key] = int(rest.split()[0])
+        return info["MemAvailable"] / info["MemTotal"]
+    except (OSError, KeyError, ValueError, IndexError, ZeroDivisionError):
+        return None
+
+
+def classify_exception(exc: BaseException) -> str:
+    """Исход по исключению: таймауты asyncio/aiohttp/Playwright и эскалация HTTP-движка (403)."""
+    if isinstance(exc, asyncio.TimeoutError) or type(exc).__name__ == "TimeoutError":
+        return TIMEOUT
+    if type(exc).__name__ == "EscalateToBrowser":
+        return R403
+    return ERROR
+
+
+class Slot:
+    """Занятое место в лимитере; исход по умолчанию — OK."""
+    __slots__ = ("outcome", "started")
+
+    def __init__(self):
+        self.outcome = OK
+        self.started = time.monotonic()
+
+    def fail(self, reason: Union[str, BaseException] = ERROR):
+        self.outcome = classify_exception(reason) if isinstance(reason, BaseException) else reason
+
+    def skip(self):
+        self.outcome = SKIP
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        *,
+        min_limit: int = 1,
+        max_limit: Optional[int] = None,
+        increase: int = 1,
+        decrease: float = DECREASE_FACTOR,
+        window: int = WINDOW,
+        cut_on_403: int = CUT_ON_403,
+        memory_low: float = MEMORY_LOW_RATIO,
+    ):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit if max_limit is not None else initial * 4)
+        self.increase = increase
+        self.decrease = decrease
+        self.cut_on_403 = cut_on_403
+        self.memory_low = memory_low
+        self._limit = min(max(initial, self.min_limit), self.max_limit)
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._window: Deque[str] = deque(maxlen=max(1, window))
+        self._round = 0                 # успехов с последнего изменения лимита
+        self._last_cut = 0.0            # monotonic последнего снижения
+        self._latency_ema: Optional[float] = None
+        self._latency_best: Optional[float] = None
+        self._mem_checked = 0.0
+        self._mem_low = False
+        self.completed = 0
+        self.outcomes: Dict[str, int] = {}
+        self.raises = 0
+        self.cuts = 0
+        self.peak = self._limit
+        self.history: Deque[Tuple[float, int, str]] = deque(maxlen=HISTORY_LEN)
+        self.history.append((time.time(), self._limit, "старт"))
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    # ───── слоты ─────
+    async def acquire(self) -> Slot:
+        self._check_memory()
+        while self.in_flight >= self._limit:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except BaseException:
+                # разбудили, но задача отменена — место достаётся следующему
+                if fut.done() and not fut.cancelled():
+                    self._wake()
+                raise
+            finally:
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+        self.in_flight += 1
+        return Slot()
+
+    def release(self, slot: Slot):
+        self.in_flight -= 1
+        self._record(slot)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        async with limiter.slot() as slot:
+            ok = await process(acc)
+            if not ok:
+                slot.fail(R403)
+        Исключение внутри блока классифицируется само (таймаут / ошибка).
+        """
+        slot = await self.acquire()
+        try:
+            yield slot
+        except asyncio.CancelledError:
+            slot.skip()
+            raise
+        except Exception as e:
+            if slot.outcome == OK:
+                slot.fail(e)
+            raise
+        finally:
+            self.release(slot)
+
+    def _wake(self):
+        free = self._limit - self.in_flight
+        for fut in self._waiters:
+            if free <= 0:
+                break
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    # ───── AIMD ─────
+    def _record(self, slot: Slot):
+        outcome = slot.outcome
+        if outcome == SKIP:
+            return
+        self.completed += 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self._window.append(outcome)
+
+        if outcome == OK:
+            latency = time.monotonic() - slot.started
+            if self._latency_ema is None:
+                self._latency_ema = latency
+            else:
+                self._latency_ema += LATENCY_ALPHA * (latency - self._latency_ema)
+            if len(self._window) >= self._window.maxlen // 2:
+                if self._latency_best is None or self._latency_ema < self._latency_best:
+                    self._latency_best = self._latency_ema
+            self._round += 1
+            if self._round >= self._limit and self._healthy() and self._limit < self.max_limit:
+                self.raises += 1
+                self._set(min(self.max_limit, self._limit + self.increase), "рост")
+            return
+
+        if outcome not in (R403, TIMEOUT) or slot.started < self._last_cut:
+            return
+        if outcome == TIMEOUT:
+            self._cut("таймаут")
+        elif sum(1 for o in self._window if o == R403) >= self.cut_on_403:
+            self._cut("всплеск 403")
+
+    def _healthy(self) -> bool:
+        if self._mem_low:
+            return False
+        if self._window:
+            errors = sum(1 for o in self._window if o != OK)
+            if errors / len(self._window) > HEALTHY_ERROR_RATE:
+                return False
+        if self._latency_best and self._latency_ema:
+            return self._latency_ema <= self._latency_best * LATENCY_TOLERANCE
+        return True
+
+    def _check_memory(self):
+        now = time.monotonic()
+        if now - self._mem_checked < MEMORY_CHECK_EVERY:
+            return
+        self._mem_checked = now
+        ratio = memory_available_ratio()
+        self._mem_low = ratio is not None and ratio < self.memory_low
+        if self._mem_low and now - self._last_cut >= MEMORY_CUT_COOLDOWN:
+            self._cut(f"память {ratio:.0%}")
+
+    def _cut(self, reason: str):
+        self._last_cut = time.monotonic()
+        new = max(self.min_limit, int(math.floor(self._limit * self.decrease)))
+        if new < self._limit:
+            self.cuts += 1
+            self._set(new, reason)
+        self._round = 0
+
+    def _set(self, value: int, reason: str):
+        old, self._limit = self._limit, value
+        self._round = 0
+        self.peak = max(self.peak, value)
+        self.history.append((time.time(), value, reason))
+        log = logger.info if value > old else logger.warning
+        log("[AIMD] %s: лимит %s → %s (%s)", self.name, old, value, reason)
+
+    # ───── отчёт ─────
+    def history_list(self) -> List[Dict[str, Any]]:
+        return [
+            {"time": time.strftime("%H:%M:%S", time.localtime(ts)), "limit": limit, "reason": reason}
+            for ts, limit, reason in self.history
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "limit": self._limit,
+            "min": self.min_limit,
+            "max": self.max_limit,
+            "peak": self.peak,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "outcomes": dict(self.outcomes),
+            "raises": self.raises,
+            "cuts": self.cuts,
+            "latency_ema": round(self._latency_ema, 2) if self._latency_ema is not None else None,
+            "latency_best": round(self._latency_best, 2) if self._latency_best is not None else None,
+        }
+
+
+# Лимитеры на процесс: найденное значение переживает прогон
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, initial: int, **kwargs) -> AdaptiveLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = AdaptiveLimiter(name, initial, **kwargs)
+        return limiter
+
+
+def limiters_stats() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        return {name: limiter.stats() for name, limiter in _limiters.items()}
@@ -3,22 +3,31 @@
 рандомными браузерными профилями и подробными логами.
 """
 import asyncio
-import json
 import logging
 import random
 import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List
 
 import aiohttp
 from aiohttp import ClientError
-from yarl import URL
 
 from services.browser_patches import get_random_browser_profile
+from services.concurrency import get_limiter
+from services.rate_limit import rate_stats, throttle
+from services.data_corpus import FLUSH_EVERY, get_corpus
+from services.event_http import (
+    EVENT_URL,
+    PUZZLE2_API as EVENT_API,
+    PUZZLE2_PAGE as EVENT_PAGE,
+    build_ajax_headers,
+    build_navigation_headers,
+    close_event_http,
+    cookies_from_jar,
+    get_event_http,
+    init_cookie_jar,
+)
 
-EVENT_PAGE = "https://event-eu-cc.igg.com/event/puzzle2/"
-EVENT_API = f"{EVENT_PAGE}ajax.req.php"
-EVENT_URL = URL("https://event-eu-cc.igg.com/")
 REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=45)
 
 DATA_DIR = Path("data/data_akk")
@@ -27,19 +36,20 @@ LOG_DIR.mkdir(parents=True, exist_ok=True)
 LOG_FILE = LOG_DIR / "cookie_refresh2.log"
 
 logger = logging.getLogger("cookie_refresh2")
-logger.setLevel(logging.INFO)
-handler = logging.FileHandler(LOG_FILE, encoding="utf-8", mode="w")
-handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", "%H:%M:%S"))
-logger.handlers.clear()
-logger.addHandler(handler)
 
-CONCURRENT = 6
-DELAY_BETWEEN_ACCOUNTS = 2.0
 
+def setup_file_logging() -> None:
+    """Лог перезаписывается при запуске обновления, а не при импорте модуля."""
+    if any(isinstance(h, logging.FileHandler) for h in logger.handlers):
+        return
+    logger.setLevel(logging.INFO)
+    handler = logging.FileHandler(LOG_FILE, encoding="utf-8", mode="w")
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", "%H:%M:%S"))
+    logger.handlers.clear()
+    logger.addHandler(handler)
 
-def jitter(base: float, variance: float = 0.35) -> float:
-    delta = random.uniform(-variance * base, variance * base)
-    return max(0.15, base + delta)
+CONCURRENT = 6  # на старте; дальше лимит подбирает services.concurrency
+MAX_CONCURRENT = 24
 
 
 async def human_delay(min_delay: float = 0.4, max_delay: float = 1.2) -> None:
@@ -53,17 +63,9 @@ def load_accounts() -> List[Dict[str, Any]]:
         logger.error("Папка с аккаунтами не найдена: %s", DATA_DIR)
         return accs
 
-    for file_path in sorted(DATA_DIR.glob("new_data*.json")):
-        try:
-            with open(file_path, "r", encoding="utf-8") as fh:
-                data = json.load(fh)
-        except Exception as e:
-            logger.warning("Не удалось прочитать %s: %s", file_path.name, e)
-            continue
-
-        if not isinstance(data, list):
-            continue
-        for entry in data:
+    corpus = get_corpus(DATA_DIR)
+    for file_path in corpus.files():
+        for entry in corpus.accounts(file_path):
             if not isinstance(entry, dict):
                 continue
             mail = entry.get("mail")
@@ -78,77 +80,24 @@ def load_accounts() -> List[Dict[str, Any]]:
     return accs
 
 
-def init_cookie_jar(cookies: Optional[Dict[str, str]]) -> aiohttp.CookieJar:
-    jar = aiohttp.CookieJar(unsafe=True)
-    if cookies:
-        jar.update_cookies(cookies, response_url=EVENT_URL)
-    return jar
-
-
-def cookies_from_jar(jar: aiohttp.CookieJar) -> Dict[str, str]:
-    filtered = jar.filter_cookies(EVENT_URL)
-    return {name: morsel.value for name, morsel in filtered.items()}
-
-
 def persist_account_cookies(uid: str, cookies: Dict[str, str]) -> None:
+    """Буферизует cookies в индексе корпуса; файлы пишутся пачками (см. flush в main)."""
     if not cookies:
         return
-    for file_path in sorted(DATA_DIR.glob("new_data*.json")):
-        try:
-            with open(file_path, "r", encoding="utf-8") as fh:
-                data = json.load(fh)
-        except Exception:
-            continue
-
-        modified = False
-        if isinstance(data, list):
-            for entry in data:
-                if isinstance(entry, dict) and entry.get(uid) is not None:
-                    entry[uid] = cookies
-                    modified = True
-                    break
-        if not modified:
-            continue
-
-        tmp = file_path.with_suffix(".tmp")
-        with open(tmp, "w", encoding="utf-8") as out:
-            json.dump(data, out, ensure_ascii=False, indent=2)
-        tmp.replace(file_path)
-        logger.info("[%s] 🍪 Cookies обновлены в %s", uid, file_path.name)
+    corpus = get_corpus(DATA_DIR)
+    file_path = corpus.set_cookies(uid, cookies)
+    if file_path is None:
+        return
+    if corpus.pending(file_path) >= FLUSH_EVERY:
+        corpus.flush_file_sync(file_path)
+    logger.info("[%s] 🍪 Cookies обновлены в %s", uid, file_path.name)
 
 
 # ===== HTTP вспомогательные =====
-def _accept_language(profile: Dict[str, Any]) -> str:
-    return profile.get("accept_language") or "en-US,en;q=0.9"
-
-
-def build_navigation_headers(profile: Dict[str, Any]) -> Dict[str, str]:
-    return {
-        "User-Agent": profile.get("user_agent", "Mozilla/5.0"),
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-        "Accept-Language": _accept_language(profile),
-        "Cache-Control": "no-cache",
-        "Pragma": "no-cache",
-        "Upgrade-Insecure-Requests": "1",
-        "Referer": EVENT_PAGE,
-    }
-
-
-def build_ajax_headers(profile: Dict[str, Any]) -> Dict[str, str]:
-    return {
-        "User-Agent": profile.get("user_agent", "Mozilla/5.0"),
-        "Accept": "application/json, text/javascript, */*; q=0.01",
-        "Accept-Language": _accept_language(profile),
-        "Referer": EVENT_PAGE,
-        "X-Requested-With": "XMLHttpRequest",
-        "Cache-Control": "no-cache",
-        "Pragma": "no-cache",
-    }
-
-
 async def warmup_event_page(session: aiohttp.ClientSession, profile: Dict[str, Any], uid: str) -> None:
     headers = build_navigation_headers(profile)
     try:
+        await throttle(EVENT_PAGE, "page")
         async with session.get(EVENT_PAGE, headers=headers, allow_redirects=True) as resp:
             await resp.text()
             logger.info("[%s] 🌐 Прогрев puzzle2: %s", uid, resp.status)
@@ -167,6 +116,7 @@ async def ping_ajax_action(
     params = {"action": action, "_": str(random.randint(10_000, 99_999))}
     headers = build_ajax_headers(profile)
     try:
+        await throttle(EVENT_API, action)
         if method.lower() == "post":
             async with session.post(EVENT_API, params=params, headers=headers) as resp:
                 await resp.text()
@@ -199,21 +149,19 @@ async def refresh_account(account: Dict[str, Any]) -> bool:
     jar = init_cookie_jar(cookies)
 
     logger.info("[%s] → обновляю cookies (mail=%s)", uid, mail)
-    connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=600)
     start = time.perf_counter()
 
-    async with aiohttp.ClientSession(cookie_jar=jar, timeout=REQUEST_TIMEOUT, connector=connector) as session:
+    # общий keep-alive коннектор services.event_http вместо нового TCPConnector на каждый аккаунт
+    async with aiohttp.ClientSession(cookie_jar=jar, timeout=REQUEST_TIMEOUT,
+                                     connector=get_event_http().connector, connector_owner=False) as session:
         try:
             await human_delay()
             await warmup_event_page(session, profile, uid)
             log_cookie_inventory(session.cookie_jar, uid, "после warmup")
-            await asyncio.sleep(jitter(1.5))
 
-            # небольшая серия ajax-запросов, чтобы активация Akamai прошла
+            # небольшая серия ajax-запросов, чтобы активация Akamai прошла (темп — services.rate_limit)
             await ping_ajax_action(session, profile, uid, "get_activity_time")
-            await asyncio.sleep(jitter(1.0))
             await ping_ajax_action(session, profile, uid, "lottery")
-            await asyncio.sleep(jitter(1.0))
             await ping_ajax_action(session, profile, uid, "get_resource", method="post")
 
             await human_delay(0.5, 1.5)
@@ -234,6 +182,8 @@ async def refresh_account(account: Dict[str, Any]) -> bool:
 
 
 async def main() -> None:
+    setup_file_logging()
+    get_corpus(DATA_DIR, rebuild=True)
     accounts = load_accounts()
     if not accounts:
         logger.error("Нет аккаунтов для обновления")
@@ -241,21 +191,27 @@ async def main() -> None:
 
     logger.info("Всего аккаунтов: %s", len(accounts))
     stats = {"total": len(accounts), "ok": 0, "fail": 0}
-    sem = asyncio.Semaphore(CONCURRENT)
+    limiter = get_limiter("cookie_refresh2", CONCURRENT, max_limit=MAX_CONCURRENT)
 
     async def worker(acc: Dict[str, Any]):
-        async with sem:
+        async with limiter.slot() as slot:
             ok = await refresh_account(acc)
             if ok:
                 stats["ok"] += 1
             else:
+                slot.fail()
                 stats["fail"] += 1
-            await asyncio.sleep(jitter(DELAY_BETWEEN_ACCOUNTS))
 
-    await asyncio.gather(*(worker(acc) for acc in accounts))
+    try:
+        await asyncio.gather(*(worker(acc) for acc in accounts))
+    finally:
+        await get_corpus(DATA_DIR).flush()
+        await close_event_http()
     logger.info("=== Итог ===")
     logger.info("Обновлено: %s", stats["ok"])
     logger.info("Ошибок: %s", stats["fail"])
+    logger.info("Параллелизм: %s", limiter.stats())
+    logger.info("Темп запросов: %s", rate_stats())
 
 
 if __name__ == "__main__":
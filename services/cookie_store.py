@@ -0,0 +1,261 @@
+# tg_zov/services/cookie_store.py
+"""
+🍪 Хранилище cookies на SQLite (вместо полной перезаписи cookies.json)
+
+Одна строка на пару (user_id, uid). Запись — точечный upsert, причём
+неизменившийся набор cookies (тот же хэш) не пишется вовсе.
+База работает в режиме WAL, поэтому чтения не блокируются записью.
+
+При первом обращении, если база пустая, а cookies.json существует,
+данные импортируются автоматически. Для обратной совместимости есть
+export_to_json() — выгружает базу в прежний формат {user_id: {uid: {name: value}}}.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from config import COOKIES_DB_FILE, COOKIES_FILE
+from services import persist
+
+logger = logging.getLogger("cookie_store")
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+# ───────────────────────── соединение ─────────────────────────
+def _connect() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+
+    os.makedirs(os.path.dirname(COOKIES_DB_FILE) or ".", exist_ok=True)
+    conn = sqlite3.connect(COOKIES_DB_FILE, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.conn = conn
+    _init_schema(conn)
+    return conn
+
+
+def _init_schema(conn: sqlite3.Connection):
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cookies (
+                user_id    TEXT NOT NULL,
+                uid        TEXT NOT NULL,
+                cookies    TEXT NOT NULL,
+                hash       TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (user_id, uid)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cookies_uid ON cookies(uid)")
+        _initialized = True
+
+        empty = conn.execute("SELECT 1 FROM cookies LIMIT 1").fetchone() is None
+        if empty and os.path.exists(COOKIES_FILE):
+            count = _import_json(conn, COOKIES_FILE)
+            logger.info(f"[COOKIES] 📥 Импортировано {count} аккаунтов из {COOKIES_FILE}")
+
+
+def _hash(cookies: Dict[str, str]) -> str:
+    raw = json.dumps(cookies, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _decode(raw: Optional[str]) -> Dict[str, str]:
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+# ───────────────────────── чтение ─────────────────────────
+def get_cookies(user_id: str, uid: str) -> Dict[str, str]:
+    """Cookies конкретного аккаунта (точечный запрос по первичному ключу)."""
+    row = _connect().execute(
+        "SELECT cookies FROM cookies WHERE user_id = ? AND uid = ?",
+        (str(user_id), str(uid)),
+    ).fetchone()
+    return _decode(row[0]) if row else {}
+
+
+def get_cookies_by_uid(uid: str) -> Dict[str, str]:
+    """Cookies аккаунта по UID без привязки к пользователю (последние обновлённые)."""
+    row = _connect().execute(
+        "SELECT cookies FROM cookies WHERE uid = ? ORDER BY updated_at DESC LIMIT 1",
+        (str(uid),),
+    ).fetchone()
+    return _decode(row[0]) if row else {}
+
+
+def get_user_cookies(user_id: str) -> Dict[str, Dict[str, str]]:
+    """Все аккаунты пользователя: {uid: cookies}, в порядке добавления."""
+    rows = _connect().execute(
+        "SELECT uid, cookies FROM cookies WHERE user_id = ? ORDER BY rowid",
+        (str(user_id),),
+    ).fetchall()
+    return {uid: _decode(raw) for uid, raw in rows}
+
+
+def first_account_cookies() -> Dict[str, str]:
+    """Cookies самого первого аккаунта в базе."""
+    row = _connect().execute("SELECT cookies FROM cookies ORDER BY rowid LIMIT 1").fetchone()
+    return _decode(row[0]) if row else {}
+
+
+def iter_accounts() -> Iterator[Tuple[str, str, Dict[str, str]]]:
+    """Итератор (user_id, uid, cookies) по всем аккаунтам."""
+    rows = _connect().execute("SELECT user_id, uid, cookies FROM cookies ORDER BY rowid").fetchall()
+    for user_id, uid, raw in rows:
+        yield user_id, uid, _decode(raw)
+
+
+def load_all() -> Dict[str, Dict[str, Dict[str, str]]]:
+    """Вся база в формате cookies.json: {user_id: {uid: cookies}}."""
+    data: Dict[str, Dict[str, Dict[str, str]]] = {}
+    for user_id, uid, cookies in iter_accounts():
+        data.setdefault(user_id, {})[uid] = cookies
+    return data
+
+
+# ───────────────────────── запись ─────────────────────────
+def put_cookies(user_id: str, uid: str, cookies: Dict[str, str], merge: bool = False) -> bool:
+    """
+    Сохраняет cookies аккаунта.
+    merge=True — дополняет уже сохранённый набор, иначе заменяет его.
+    Возвращает True, если что-то реально записано (набор изменился).
+    """
+    user_id, uid = str(user_id), str(uid)
+    conn = _connect()
+    if merge:
+        current = get_cookies(user_id, uid)
+        current.update(cookies or {})
+        cookies = current
+    cookies = dict(cookies or {})
+    digest = _hash(cookies)
+
+    row = conn.execute(
+        "SELECT hash FROM cookies WHERE user_id = ? AND uid = ?", (user_id, uid)
+    ).fetchone()
+    if row and row[0] == digest:
+        return False
+
+    conn.execute(
+        """
+        INSERT INTO cookies (user_id, uid, cookies, hash, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, uid) DO UPDATE SET
+            cookies = excluded.cookies,
+            hash = excluded.hash,
+            updated_at = excluded.updated_at
+        """,
+        (user_id, uid, json.dumps(cookies, ensure_ascii=False), digest, time.time()),
+    )
+    return True
+
+
+def put_many(data: Dict[str, Dict[str, Dict[str, str]]]) -> int:
+    """Пакетный upsert в формате cookies.json. Возвращает число изменённых аккаунтов."""
+    conn = _connect()
+    changed = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for user_id, accounts in (data or {}).items():
+            if not isinstance(accounts, dict):
+                continue
+            for uid, cookies in accounts.items():
+                if isinstance(cookies, dict) and put_cookies(user_id, uid, cookies):
+                    changed += 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return changed
+
+
+def delete_cookies(user_id: str, uid: str) -> bool:
+    cur = _connect().execute(
+        "DELETE FROM cookies WHERE user_id = ? AND uid = ?", (str(user_id), str(uid))
+    )
+    return cur.rowcount > 0
+
+
+# ───────────────────────── импорт / экспорт ─────────────────────────
+def _import_json(conn: sqlite3.Connection, path: str) -> int:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        logger.warning(f"[COOKIES] ⚠️ Не удалось прочитать {path}: {e}")
+        return 0
+    if not isinstance(data, dict):
+        return 0
+
+    now = time.time()
+    rows = []
+    for user_id, accounts in data.items():
+        if not isinstance(accounts, dict):
+            continue
+        for uid, cookies in accounts.items():
+            if not isinstance(cookies, dict):
+                continue
+            rows.append((
+                str(user_id), str(uid),
+                json.dumps(cookies, ensure_ascii=False), _hash(cookies), now,
+            ))
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany(
+        """
+        INSERT INTO cookies (user_id, uid, cookies, hash, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, uid) DO UPDATE SET
+            cookies = excluded.cookies,
+            hash = excluded.hash,
+            updated_at = excluded.updated_at
+        """,
+        rows,
+    )
+    conn.execute("COMMIT")
+    return len(rows)
+
+
+def import_from_json(path: str = COOKIES_FILE) -> int:
+    """Разовый импорт cookies.json в базу. Возвращает число аккаунтов."""
+    return _import_json(_connect(), path)
+
+
+def export_to_json(path: str = COOKIES_FILE) -> int:
+    """Выгружает базу в cookies.json (атомарно). Возвращает число аккаунтов."""
+    data = load_all()
+    persist.write_json(path, data)
+    return sum(len(v) for v in data.values())
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "import":
+        print(f"Импортировано: {import_from_json(*sys.argv[2:3])}")
+    elif cmd == "export":
+        print(f"Выгружено: {export_to_json(*sys.argv[2:3])}")
+    else:
+        print("Использование: python -m services.cookie_store import|export [path]")
@@ -1,19 +1,21 @@
-import json
-import os
-from config import COOKIES_FILE
+"""
+Совместимый слой над services.cookie_store.
+
+Раньше здесь читался/перезаписывался целиком cookies.json; теперь данные
+лежат в SQLite, а эти функции оставлены для старых вызовов.
+Для работы с одним аккаунтом используйте cookie_store.get_cookies/put_cookies.
+"""
+from services import cookie_store
+
 
 def load_all_cookies() -> dict:
-    """Загружает общий файл cookies.json"""
-    if not os.path.exists(COOKIES_FILE):
-        return {}
+    """Возвращает все cookies в формате {user_id: {uid: {name: value}}}"""
     try:
-        with open(COOKIES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return cookie_store.load_all()
     except Exception:
         return {}
 
+
 def save_all_cookies(data: dict):
-    """Сохраняет общий файл cookies.json"""
-    os.makedirs(os.path.dirname(COOKIES_FILE), exist_ok=True)
-    with open(COOKIES_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """Upsert всех переданных аккаунтов; неизменившиеся наборы не пишутся."""
+    cookie_store.put_many(data)
@@ -0,0 +1,203 @@
+# tg_zov/services/daily_ledger.py
+"""
+📅 Дневной журнал завершённых акций: (акция, uid, игровой день)
+
+Фермы и обработчики акций узнавали, что аккаунту сегодня делать нечего
+(шансы lottery закончились, награда «уже получена», «попытки закончились»),
+но нигде это не запоминали: повторный запуск в тот же день снова открывал
+сессию на каждый аккаунт, чтобы получить тот же ответ.
+
+DailyLedger:
+  • mark(event, uid) / record(event, uid, result) — отметка «на сегодня всё»;
+    record отмечает только результаты, где обработчик явно вернул
+    "daily_done": True (текст сообщения и success не разбираются: «событие
+    ещё не началось» тоже success, а ошибки бывают на любом языке);
+  • is_done(event, uid) — раннеры (цикл акций, puzzle2_auto) проверяют это
+    до постановки работы;
+  • игровой день — дата UTC со сдвигом RESET_HOUR_UTC для акций, которые
+    сбрасываются не в полночь; новый день начинается без отметок;
+  • отметки копятся в памяти и пишутся пачкой (FLUSH_EVERY / FLUSH_INTERVAL,
+    при выходе) транзакцией services.persist, так что процессы и воркеры
+    очереди не затирают друг друга; чужие отметки подхватываются по
+    изменению файла.
+
+@records_daily("gas") на обработчике акции — его окончательные результаты
+попадают в журнал, откуда бы он ни был вызван (цикл, кнопки, воркер).
+
+Формат data/event_done.json прежний: {день: {акция: [uid, …]}}.
+"""
+
+from __future__ import annotations
+
+import atexit
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Tuple
+
+from services import persist
+
+logger = logging.getLogger("daily_ledger")
+
+LEDGER_FILE = Path("data/event_done.json")
+KEEP_DAYS = 3               # столько последних игровых дней хранится в файле
+FLUSH_EVERY = 50            # отметок в памяти до записи
+FLUSH_INTERVAL = 5.0        # сек. — не дольше этого отметка живёт только в памяти
+REFRESH_INTERVAL = 2.0      # сек. между проверками, не дописал ли файл другой процесс
+
+# Акции со сбросом не в 00:00 UTC: час сброса по UTC
+RESET_HOUR_UTC: Dict[str, int] = {}
+
+
+def event_day(event_key: Optional[str] = None, now: Optional[datetime] = None) -> str:
+    """Игровой день акции (дата UTC с учётом часа сброса)."""
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(hours=RESET_HOUR_UTC.get(event_key or "", 0))).date().isoformat()
+
+
+def is_terminal(result: Dict[str, Any]) -> bool:
+    """Обработчик сообщил, что на этот игровой день акции больше нечего делать."""
+    return isinstance(result, dict) and result.get("daily_done") is True
+
+
+class DailyLedger:
+    def __init__(self, path: Path = LEDGER_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._done: Dict[Tuple[str, str], Set[str]] = {}      # (день, акция) -> uid
+        self._pending: Dict[Tuple[str, str], Set[str]] = {}
+        self._pending_count = 0
+        self._flushed_at = time.monotonic()
+        self._checked_at = 0.0
+        self._stat: Optional[Tuple[int, int]] = None
+        self._reload()
+
+    # ───── чтение ─────
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, data: Any):
+        done: Dict[Tuple[str, str], Set[str]] = {}
+        for day, events in (data or {}).items():
+            if not isinstance(events, dict):
+                continue
+            for event, uids in events.items():
+                done[(day, event)] = {str(u) for u in uids or ()}
+        for key, uids in self._pending.items():
+            done.setdefault(key, set()).update(uids)
+        self._done = done
+
+    def _reload(self):
+        self._stat = self._file_stat()
+        self._load(persist.read_json(self.path, {}))
+        self._checked_at = time.monotonic()
+
+    def _refresh(self):
+        if time.monotonic() - self._checked_at < REFRESH_INTERVAL:
+            return
+        self._checked_at = time.monotonic()
+        if self._file_stat() != self._stat:
+            self._reload()
+
+    def is_done(self, event_key: str, uid: Any) -> bool:
+        with self._lock:
+            self._refresh()
+            return str(uid) in self._done.get((event_day(event_key), event_key), ())
+
+    def done_count(self, event_key: str) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._done.get((event_day(event_key), event_key), ()))
+
+    # ───── отметки ─────
+    def mark(self, event_key: str, uid: Any):
+        uid = "" if uid is None else str(uid)
+        if not uid:
+            return
+        key = (event_day(event_key), event_key)
+        with self._lock:
+            if uid in self._done.get(key, ()):
+                return
+            self._done.setdefault(key, set()).add(uid)
+            self._pending.setdefault(key, set()).add(uid)
+            self._pending_count += 1
+            due = (self._pending_count >= FLUSH_EVERY
+                   or time.monotonic() - self._flushed_at >= FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def record(self, event_key: str, uid: Any, result: Dict[str, Any]) -> bool:
+        """Отмечает uid, если результат окончательный; True — отмечен."""
+        if uid is None or not is_terminal(result):
+            return False
+        self.mark(event_key, uid)
+        return True
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._pending_count = self._pending, {}, 0
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        try:
+            with persist.transaction(self.path, {}) as data:
+                for (day, event), uids in pending.items():
+                    stored = data.setdefault(day, {}).setdefault(event, [])
+                    known = set(stored)
+                    stored.extend(sorted(u for u in uids if u not in known))
+                for old in sorted(data)[:-KEEP_DAYS]:
+                    del data[old]
+                snapshot = data
+        except Exception as e:
+            logger.warning(f"[DAILY] ⚠️ Не удалось сохранить {sum(map(len, pending.values()))} отметок: {e}")
+            with self._lock:
+                for key, uids in pending.items():
+                    self._pending.setdefault(key, set()).update(uids)
+                    self._pending_count += len(uids)
+            return
+        with self._lock:
+            self._load(snapshot)
+            self._stat = self._file_stat()
+
+
+_ledger: Optional[DailyLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_daily_ledger() -> DailyLedger:
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = DailyLedger()
+            atexit.register(_ledger.flush)
+        return _ledger
+
+
+def records_daily(event_key: str):
+    """Декоратор обработчика акции (user_id, uid, …): окончательный результат — в журнал."""
+
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            result = await fn(*args, **kwargs)
+            try:
+                uid = signature.bind_partial(*args, **kwargs).arguments.get("uid")
+                get_daily_ledger().record(event_key, uid, result)
+            except Exception as e:
+                logger.warning(f"[DAILY] ⚠️ {event_key}: отметка не записана: {e}")
+            return result
+
+        return wrapper
+
+    return decorate
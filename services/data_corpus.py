@@ -0,0 +1,289 @@
+# tg_zov/services/data_corpus.py
+"""
+📚 Индекс корпуса аккаунтов data/data_akk/new_data*.json
+
+Раньше каждое обновление cookies одного uid заново читало (а то и
+глобило) все файлы new_data*.json. Здесь файлы читаются один раз за
+прогон, строится индекс uid -> (файл, позиция) и (mail, paswd) -> (файл, позиция),
+а изменения копятся в памяти и пишутся по одному разу на файл за пачку.
+Запись идёт транзакцией services.persist: файл перечитывается под
+межпроцессной блокировкой и накопленные cookies накладываются на свежую
+версию, так что параллельные lr1/lr2 не затирают изменения друг друга.
+
+Индекс живёт весь процесс бота: если uid не найден, сначала перечитываются
+новые и изменившиеся (mtime/size) файлы корпуса, и только потом — «не найден».
+
+Формат записи: {"mail": "...", "paswd": "...", "<UID>": {...cookies...}}
+Поддерживаются те же варианты корня файла, что и в login_and_refresh:
+список, {"accounts": [...]} или dict со списками внутри.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from services import persist
+
+logger = logging.getLogger("data_corpus")
+
+DATA_DIR = Path("data/data_akk")
+FILE_PATTERN = "new_data*.json"
+
+# Автосброс файла, когда в нём накопилось столько изменений
+FLUSH_EVERY = 50
+
+# Общие на процесс asyncio-блокировки по файлам (раньше жили внутри login_and_refresh)
+file_locks: Dict[str, asyncio.Lock] = {}
+
+
+def get_file_lock(file_path: Path) -> asyncio.Lock:
+    key = str(Path(file_path).resolve())
+    lock = file_locks.get(key)
+    if lock is None:
+        lock = file_locks[key] = asyncio.Lock()
+    return lock
+
+
+def _accounts_list(data: Any) -> List[Dict[str, Any]]:
+    """Список записей аккаунтов внутри файла (те же объекты, не копии)."""
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        if isinstance(data.get("accounts"), list):
+            return data["accounts"]
+        for v in data.values():
+            if isinstance(v, list):
+                return v
+    return []
+
+
+def _entry_uids(entry: Dict[str, Any]) -> List[str]:
+    return [str(k) for k, v in entry.items() if str(k).isdigit() and isinstance(v, dict)]
+
+
+def _file_stat(file_path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = file_path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class CorpusIndex:
+    def __init__(self, data_dir: Path = DATA_DIR):
+        self.data_dir = Path(data_dir)
+        self._files: Dict[Path, Any] = {}
+        self._stats: Dict[Path, Optional[Tuple[int, int]]] = {}   # (mtime_ns, size) на момент чтения
+        self._missed: set = set()                                  # о них уже предупредили
+        self._by_uid: Dict[str, Tuple[Path, int]] = {}
+        self._by_creds: Dict[Tuple[str, str], Tuple[Path, int]] = {}
+        # файл -> {uid: (cookies, mail, paswd)} — ещё не записанные изменения
+        self._pending: Dict[Path, Dict[str, Tuple[Dict[str, str], Optional[str], Optional[str]]]] = {}
+
+    # ───── построение ─────
+    def build(self) -> "CorpusIndex":
+        """Читает все файлы корпуса и строит индексы (один раз за прогон)."""
+        self._files.clear()
+        self._stats.clear()
+        self._by_uid.clear()
+        self._by_creds.clear()
+        self._pending.clear()
+        if not self.data_dir.exists():
+            logger.warning("[CORPUS] Папка не найдена: %s", self.data_dir)
+            return self
+
+        for file_path in sorted(self.data_dir.glob(FILE_PATTERN)):
+            data = self._read(file_path)
+            if data is not None:
+                self._index_file(file_path, data)
+
+        logger.info("[CORPUS] 📚 Файлов: %s, UID в индексе: %s", len(self._files), len(self._by_uid))
+        return self
+
+    def _read(self, file_path: Path) -> Any:
+        stat = _file_stat(file_path)
+        try:
+            with open(file_path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except Exception as e:
+            logger.warning("[CORPUS] Не удалось прочитать %s: %s", file_path.name, e)
+            return None
+        # stat — до чтения: изменение во время чтения заметит следующий refresh_changed()
+        self._stats[file_path] = stat
+        return data
+
+    def refresh_changed(self) -> int:
+        """Перечитывает новые и изменившиеся (mtime/size) файлы корпуса; возвращает их число."""
+        if not self.data_dir.exists():
+            return 0
+        current = set(self.data_dir.glob(FILE_PATTERN))
+        changed = 0
+        for file_path in sorted(current):
+            if file_path in self._files and _file_stat(file_path) == self._stats.get(file_path):
+                continue
+            data = self._read(file_path)
+            if data is None:
+                continue
+            self._apply_changes(data, self._pending.get(file_path, {}))  # ещё не записанные cookies
+            self._reindex_file(file_path, data)
+            changed += 1
+        for file_path in [fp for fp in self._files if fp not in current]:
+            self._reindex_file(file_path, None)
+            del self._files[file_path]
+            self._stats.pop(file_path, None)
+            self._pending.pop(file_path, None)
+            changed += 1
+        if changed:
+            logger.info("[CORPUS] 🔄 Перечитано файлов: %s, UID в индексе: %s", changed, len(self._by_uid))
+        return changed
+
+    def _index_file(self, file_path: Path, data: Any):
+        self._files[file_path] = data
+        for pos, entry in enumerate(_accounts_list(data)):
+            if not isinstance(entry, dict):
+                continue
+            for uid in _entry_uids(entry):
+                self._by_uid.setdefault(uid, (file_path, pos))
+            creds = (entry.get("mail"), entry.get("paswd"))
+            if creds[0] and creds[1]:
+                self._by_creds.setdefault(creds, (file_path, pos))
+
+    def _reindex_file(self, file_path: Path, data: Any):
+        """Файл перечитан (его могли поменять другие процессы) — обновляем его позиции в индексах."""
+        for index in (self._by_uid, self._by_creds):
+            for key in [k for k, (fp, _) in index.items() if fp == file_path]:
+                del index[key]
+        self._index_file(file_path, data)
+
+    # ───── поиск ─────
+    def files(self) -> List[Path]:
+        return list(self._files.keys())
+
+    def accounts(self, file_path: Path) -> List[Dict[str, Any]]:
+        return _accounts_list(self._files.get(file_path))
+
+    def locate(self, uid: Optional[str] = None, mail: Optional[str] = None,
+               paswd: Optional[str] = None) -> Optional[Tuple[Path, int]]:
+        where = self._lookup(uid, mail, paswd)
+        stale = where is not None and _file_stat(where[0]) != self._stats.get(where[0])
+        if (where is None or stale) and self.refresh_changed():
+            where = self._lookup(uid, mail, paswd)
+        key = str(uid) if uid is not None else str(mail)
+        if where is not None:
+            self._missed.discard(key)
+        elif key not in self._missed:
+            self._missed.add(key)
+            logger.warning("[CORPUS] ⚠️ %s не найден в %s/%s", key, self.data_dir, FILE_PATTERN)
+        return where
+
+    def _lookup(self, uid: Optional[str], mail: Optional[str], paswd: Optional[str]) -> Optional[Tuple[Path, int]]:
+        if uid is not None and str(uid) in self._by_uid:
+            return self._by_uid[str(uid)]
+        if mail and paswd:
+            return self._by_creds.get((mail, paswd))
+        return None
+
+    # ───── буферизованное обновление cookies ─────
+    def set_cookies(self, uid: str, cookies: Dict[str, str],
+                    original_acc: Optional[Dict[str, Any]] = None) -> Optional[Path]:
+        """
+        Меняет cookies uid в памяти (по UID-ключу или по mail+paswd).
+        Возвращает файл, который стал «грязным», или None, если запись не найдена.
+        """
+        uid = str(uid)
+        original_acc = original_acc or {}
+        where = self.locate(uid, original_acc.get("mail"), original_acc.get("paswd"))
+        if where is None:
+            return None
+        file_path, pos = where
+        entry = self.accounts(file_path)[pos]
+        entry[uid] = cookies
+        self._by_uid[uid] = where
+        self._pending.setdefault(file_path, {})[uid] = (cookies, entry.get("mail"), entry.get("paswd"))
+        return file_path
+
+    def pending(self, file_path: Path) -> int:
+        return len(self._pending.get(file_path, {}))
+
+    @staticmethod
+    def _apply_changes(data: Any, changes: Dict[str, Tuple[Dict[str, str], Optional[str], Optional[str]]]) -> int:
+        """Накладывает изменения cookies на (свежепрочитанное) содержимое файла."""
+        entries = [e for e in _accounts_list(data) if isinstance(e, dict)]
+        by_uid = {uid: e for e in entries for uid in _entry_uids(e)}
+        by_creds = {(e.get("mail"), e.get("paswd")): e for e in entries if e.get("mail") and e.get("paswd")}
+        applied = 0
+        for uid, (cookies, mail, paswd) in changes.items():
+            entry = by_uid.get(uid) or by_creds.get((mail, paswd))
+            if entry is not None:
+                entry[uid] = cookies
+                applied += 1
+        return applied
+
+    def _write(self, file_path: Path) -> bool:
+        changes = self._pending.pop(file_path, None)
+        if not changes:
+            return True
+        try:
+            with persist.transaction(file_path, self._files.get(file_path)) as data:
+                applied = self._apply_changes(data, changes)
+            self._stats[file_path] = _file_stat(file_path)
+            self._reindex_file(file_path, data)
+            logger.info("[CORPUS] 💾 %s: записано изменений %s", file_path.name, applied)
+            return True
+        except Exception as e:
+            pending = self._pending.setdefault(file_path, {})
+            for uid, change in changes.items():
+                pending.setdefault(uid, change)
+            logger.exception("[CORPUS] Ошибка перезаписи %s: %s", file_path.name, e)
+            return False
+
+    def flush_file_sync(self, file_path: Path) -> bool:
+        return self._write(file_path)
+
+    def flush_sync(self) -> int:
+        return sum(1 for fp in list(self._pending) if self._write(fp))
+
+    async def flush_file(self, file_path: Path) -> bool:
+        async with get_file_lock(file_path):
+            return self._write(file_path)
+
+    async def flush(self) -> int:
+        """Сбрасывает все «грязные» файлы, по одной записи на файл."""
+        written = 0
+        for file_path in list(self._pending):
+            if await self.flush_file(file_path):
+                written += 1
+        return written
+
+    async def update_cookies(self, uid: str, cookies: Dict[str, str],
+                             original_acc: Optional[Dict[str, Any]] = None,
+                             flush_every: int = FLUSH_EVERY) -> bool:
+        """Буферизует обновление и сбрасывает файл, когда набралась пачка изменений."""
+        file_path = self.set_cookies(uid, cookies, original_acc)
+        if file_path is None:
+            return False
+        if self.pending(file_path) >= flush_every:
+            await self.flush_file(file_path)
+        return True
+
+
+_corpora: Dict[Path, CorpusIndex] = {}
+
+
+def get_corpus(data_dir: Path = DATA_DIR, rebuild: bool = False) -> CorpusIndex:
+    """
+    Общий на процесс индекс корпуса. rebuild=True — перечитать файлы
+    (вызывается в начале прогона; несброшенные изменения предварительно пишутся).
+    """
+    key = Path(data_dir).resolve()
+    corpus = _corpora.get(key)
+    if corpus is None:
+        corpus = _corpora[key] = CorpusIndex(Path(data_dir)).build()
+    elif rebuild:
+        corpus.flush_sync()
+        corpus.build()
+    return corpus
@@ -0,0 +1,220 @@
+# tg_zov/services/donor_index.py
+"""
+🎯 Индекс доноров пазлов (1–9) поверх puzzle_log
+
+Для каждого номера пазла держится «корзина» доноров в порядке файла
+и их остатки. Поиск донора больше не парсит puzzle_data целиком:
+  • исключения (уже использованные доноры) проходятся через курсор
+    владельца — для одного (tg_user, аккаунт) набор исключений только растёт,
+    поэтому пропущенных доноров повторно не смотрим;
+  • доноры с нулевым остатком пропускаются лениво.
+
+Списание (claim) идёт через PuzzleLog.decrement, то есть сразу
+сохраняется на диск. Если лог изменился в обход индекса (ферма дописала
+доноров, другой процесс списал пазл) — обновляются только изменённые записи
+(PuzzleLog.changes_since); курсоры, ушедшие дальше донора с новым остатком,
+откатываются к нему. Полная перестройка — только если лог заменён целиком
+(очистка файлов, replace_all).
+
+Курсоры сбрасываются, когда исключения перестали только расти: журнал выдачи
+(services.claim_ledger) перечитан целиком (очистили/заменили снаружи) или
+владелец передал исключений меньше, чем в прошлый раз.
+"""
+
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from services.claim_ledger import ClaimLedger, get_ledger
+from services.puzzle_files import PUZZLE_DATA_FILE
+from services.puzzle_log import PuzzleLog, get_log
+
+PUZZLE_IDS = tuple(str(i) for i in range(1, 10))
+
+
+def _puzzle_counts(rec: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """{pid: остаток > 0} записи донора (None — донор удалён)."""
+    puzzles = rec.get("puzzle") if rec else None
+    if not isinstance(puzzles, dict):
+        return {}
+    out: Dict[str, int] = {}
+    for pid, cnt in puzzles.items():
+        try:
+            cnt = int(cnt)
+        except (TypeError, ValueError):
+            continue
+        if str(pid) in PUZZLE_IDS and cnt > 0:
+            out[str(pid)] = cnt
+    return out
+
+
+class DonorIndex:
+    def __init__(self, log: PuzzleLog, claims: Optional[ClaimLedger] = None):
+        self.log = log
+        self.claims = claims
+        self._lock = threading.RLock()
+        self._version = -1
+        self._claims_version = 0
+        self._buckets: Dict[str, List[str]] = {}
+        self._positions: Dict[str, Dict[str, int]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._ec_params: Dict[str, str] = {}
+        self._cursors: Dict[Tuple[str, str], int] = {}
+        self._cursor_excluded: Dict[Tuple[str, str], int] = {}   # размер exclude при сохранении курсора
+
+    # ───── построение ─────
+    def _rebuild(self):
+        self._version = self.log.refresh()
+        self._buckets = {pid: [] for pid in PUZZLE_IDS}
+        self._positions = {pid: {} for pid in PUZZLE_IDS}
+        self._counts = {pid: {} for pid in PUZZLE_IDS}
+        self._ec_params = {}
+        self._reset_cursors()
+        for rec in self.log.records():
+            iggid = str(rec.get("iggid") or "")
+            if iggid:
+                self._apply_record(iggid, rec)
+
+    def _apply_record(self, iggid: str, rec: Optional[Dict[str, Any]]):
+        """Переносит в индекс текущее состояние одного донора."""
+        if rec is not None and isinstance(rec.get("ec_param"), str):
+            self._ec_params[iggid] = rec["ec_param"]
+        else:
+            self._ec_params.pop(iggid, None)
+        new_counts = _puzzle_counts(rec)
+        for pid in PUZZLE_IDS:
+            counts = self._counts[pid]
+            cnt = new_counts.get(pid, 0)
+            if cnt <= counts.get(iggid, 0):
+                if cnt:
+                    counts[iggid] = cnt
+                else:
+                    counts.pop(iggid, None)
+                continue
+            counts[iggid] = cnt
+            positions = self._positions[pid]
+            pos = positions.get(iggid)
+            if pos is None:
+                pos = positions[iggid] = len(self._buckets[pid])
+                self._buckets[pid].append(iggid)
+            # у донора появился остаток — курсоры, ушедшие дальше, должны его снова увидеть
+            for key, cursor in self._cursors.items():
+                if key[1] == pid and cursor > pos:
+                    self._cursors[key] = pos
+
+    def _reset_cursors(self):
+        self._cursors.clear()
+        self._cursor_excluded.clear()
+
+    def _ensure_fresh(self):
+        version, changed = self.log.changes_since(self._version)
+        if version == self._version:
+            return
+        if changed is None or self._version < 0:
+            self._rebuild()
+            return
+        self._version = version
+        for iggid in changed:
+            self._apply_record(iggid, self.log.get(iggid))
+
+    def _sync_claims(self):
+        """Журнал выдачи перечитан целиком — исключения владельцев могли уменьшиться."""
+        if self.claims is None:
+            return
+        version, users = self.claims.changes_since(self._claims_version)
+        if users is None:
+            self._reset_cursors()
+        self._claims_version = version
+
+    # ───── чтение ─────
+    def find(
+        self,
+        puzzle_id,
+        exclude: Optional[Set[str]] = None,
+        owner: Optional[str] = None,
+        skip: Optional[Callable[[str, Optional[str]], bool]] = None,
+    ) -> Optional[Tuple[Dict[str, Any], int]]:
+        """
+        Первый донор с остатком по пазлу puzzle_id.
+        exclude — iggid, которые пропускаем; skip(iggid, ec_param) — доп. фильтр.
+        owner — ключ курсора: передавайте, только если исключения для него
+        со временем только растут (иначе поиск идёт с начала корзины).
+        Возвращает (запись донора, позиция в корзине) или None.
+        """
+        pid = str(puzzle_id)
+        exclude = exclude or set()
+        with self._lock:
+            self._ensure_fresh()
+            bucket = self._buckets.get(pid, [])
+            counts = self._counts.get(pid, {})
+            key = (owner, pid) if owner is not None else None
+            pos = 0
+            if key:
+                self._sync_claims()
+                if len(exclude) >= self._cursor_excluded.get(key, 0):
+                    pos = self._cursors.get(key, 0)
+                self._cursor_excluded[key] = len(exclude)
+
+            while pos < len(bucket):
+                iggid = bucket[pos]
+                if counts.get(iggid, 0) <= 0 or iggid in exclude or (
+                    skip is not None and skip(iggid, self._ec_params.get(iggid))
+                ):
+                    pos += 1
+                    continue
+                if key:
+                    self._cursors[key] = pos
+                rec = self.log.get(iggid)
+                if rec is None:
+                    # запись пропала из лога — индекс по этому донору устарел
+                    self._apply_record(iggid, None)
+                    return self.find(puzzle_id, exclude, owner, skip)
+                return rec, pos
+
+            if key:
+                self._cursors[key] = pos
+            return None
+
+    def available(self, puzzle_id) -> int:
+        """Сколько штук пазла puzzle_id осталось у всех доноров."""
+        with self._lock:
+            self._ensure_fresh()
+            return sum(self._counts.get(str(puzzle_id), {}).values())
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            self._ensure_fresh()
+            return {pid: sum(c.values()) for pid, c in self._counts.items()}
+
+    # ───── списание ─────
+    def claim(self, iggid: str, puzzle_id) -> Optional[Dict[str, Any]]:
+        """Списывает один пазл у донора (с записью в лог). Возвращает запись до списания."""
+        pid = str(puzzle_id)
+        iggid = str(iggid)
+        with self._lock:
+            self._ensure_fresh()
+            before = self.log.version
+            rec = self.log.decrement(iggid, pid)
+            if rec is None:
+                return None
+            if self.log.version == before + 1:
+                counts = self._counts.setdefault(pid, {})
+                counts[iggid] = max(0, counts.get(iggid, 0) - 1)
+                self._version = self.log.version
+            return rec
+
+
+_indexes: Dict[Path, DonorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_donor_index(path: Path = PUZZLE_DATA_FILE) -> DonorIndex:
+    """Общий на процесс индекс доноров для файла puzzle_data."""
+    key = Path(path).resolve()
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DonorIndex(get_log(path), get_ledger())
+        return index
@@ -2,9 +2,10 @@
 import json
 import logging
 
-from services.browser_patches import run_event_with_browser
+from services.browser_patches import run_event_with_handoff
 from services.accounts_manager import get_all_accounts
 from services.castle_api import load_cookies_for_account
+from services.daily_ledger import records_daily
 
 BASE_URL = "https://event-eu-cc.igg.com/event/dragon_quest/"
 ATTACK_URL = f"{BASE_URL}ajax.req.php?action=attack"
@@ -57,6 +58,7 @@ def format_rewards(data: dict) -> str:
     return "\n🎁 " + "\n🎁 ".join(lines)
 
 
+@records_daily("dragon_quest")
 async def run_dragon_quest(user_id: str, uid: str = None, context=None) -> dict:
     """
     ⚔️ Событие 'Рыцари Драконы'
@@ -78,7 +80,7 @@ async def run_dragon_quest(user_id: str, uid: str = None, context=None) -> dict:
 
     logger.info(f"[DRAGON_QUEST] 🍪 Cookies загружены для {username} ({uid}) — {len(cookies_dict)} шт.")
 
-    async def handler(page):
+    async def handler(h):
 
         # --- Проверка активности через event_checker ---
         try:
@@ -98,18 +100,7 @@ async def run_dragon_quest(user_id: str, uid: str = None, context=None) -> dict:
         logger.info(f"[DRAGON_QUEST] ⚔️ Отправляю запрос attack для {uid}")
 
         try:
-            resp = await page.evaluate(
-                f"""
-                async () => {{
-                    const res = await fetch("{ATTACK_URL}", {{
-                        method: "GET",
-                        credentials: "include",
-                        headers: {{ "X-Requested-With": "XMLHttpRequest" }}
-                    }});
-                    return await res.text();
-                }}
-                """
-            )
+            _, resp = await h.fetch(ATTACK_URL)
         except Exception as e:
             return {"success": False, "status": "error", "message": f"❌ Ошибка при запросе attack: {e}"}
 
@@ -131,6 +122,7 @@ async def run_dragon_quest(user_id: str, uid: str = None, context=None) -> dict:
             return {
                 "success": False,
                 "status": "ended",
+                "daily_done": True,
                 "message": f"⚙️ <b>{username}</b> ({uid}) — попытки закончились."
             }
 
@@ -159,4 +151,4 @@ async def run_dragon_quest(user_id: str, uid: str = None, context=None) -> dict:
             "message": f"⚠️ <b>{username}</b> ({uid}) — неизвестный ответ:\n<code>{snippet}</code>"
         }
 
-    return await run_event_with_browser(user_id, uid, BASE_URL, "Рыцари Драконы", handler, context=context)
\ No newline at end of file
+    return await run_event_with_handoff(user_id, uid, BASE_URL, "Рыцари Драконы", handler, context=context)
\ No newline at end of file
@@ -9,16 +9,17 @@ from typing import Dict, Any
 
 from playwright.async_api import async_playwright, Page, BrowserContext, Response
 
+from services import cookie_store
 from services.browser_patches import (
-    BROWSER_PATH,
+    get_browser_path,
     get_random_browser_profile,
     launch_masked_persistent_context,
 )
+from services.profile_manager import get_profile_manager
 
 # ────────────────────────────────────────────────
 # Настройки и директории
 # ────────────────────────────────────────────────
-COOKIES_FILE = Path("data/cookies.json")
 PROFILE_DIR = Path("data/chrome_profiles")
 PROFILE_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -47,24 +48,14 @@ UTC = timezone.utc
 LOCAL_OFFSET = timedelta(hours=10)
 IGG_ID = "952522571"
 
-BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "websocket"}
-BLOCKED_URL_KEYWORDS = (
-    "analytics", "google-analytics", "googletagmanager", "doubleclick",
-    "facebook", "fbcdn", "hotjar", "clarity", "yandex", "metrika", "ads", "tracking"
-)
+# Политика перехвата запросов (services.net_policy): без картинок, медиа, шрифтов, websocket и трекеров
+NET_POLICY = "render-light"
 
 # ────────────────────────────────────────────────
 # Helpers
 # ────────────────────────────────────────────────
 def get_cookies_for_igg(igg_id: str) -> list[dict]:
-    if not COOKIES_FILE.exists():
-        raise RuntimeError("Файл cookies.json не найден")
-    with open(COOKIES_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    outer_key = next(iter(data), None)
-    if not outer_key:
-        raise RuntimeError("Нет данных в cookies.json")
-    igg_cookies_raw = data[outer_key].get(igg_id)
+    igg_cookies_raw = cookie_store.get_cookies_by_uid(igg_id)
     if not igg_cookies_raw:
         raise RuntimeError(f"Нет cookies для IGG ID {igg_id}")
     return [
@@ -76,13 +67,6 @@ def _inactive_reason(text: str) -> bool:
     low = (text or "").lower()
     return any(p in low for p in INACTIVE_MARKERS)
 
-async def route_handler(route, request):
-    url = request.url.lower()
-    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(k in url for k in BLOCKED_URL_KEYWORDS):
-        await route.abort()
-    else:
-        await route.continue_()
-
 async def _read_body_text(page: Page) -> str:
     try:
         return (await page.evaluate("document.body?.innerText || document.body?.textContent || ''")).strip()
@@ -261,18 +245,18 @@ async def check_event_active(event_name: str) -> bool | int:
         logger.warning("[check_event_active] неизвестное событие: %s", event_name)
         return False
 
-    async with async_playwright() as p:
+    async with async_playwright() as p, get_profile_manager().profile(f"{IGG_ID}_single_check", p) as user_data_dir:
         ctx_data = await launch_masked_persistent_context(
             p,
-            user_data_dir=str(PROFILE_DIR / f"{IGG_ID}_single_check"),
-            browser_path=BROWSER_PATH,
+            user_data_dir=user_data_dir,
+            browser_path=get_browser_path(),
             headless=True,
             slow_mo=20,
             profile=get_random_browser_profile(),
+            policy=NET_POLICY,
         )
         context: BrowserContext = ctx_data["context"]
         page: Page = ctx_data["page"]
-        await page.route("**/*", route_handler)
 
         try:
             cookies_list = get_cookies_for_igg(IGG_ID)
@@ -291,20 +275,19 @@ async def check_event_active(event_name: str) -> bool | int:
 # ────────────────────────────────────────────────
 async def check_all_events(bot=None, admin_id=None) -> Dict[str, Any]:
     results: Dict[str, Any] = {}
-    async with async_playwright() as p:
+    async with async_playwright() as p, get_profile_manager().profile(f"{IGG_ID}_events", p) as user_data_dir:
         ctx_data = await launch_masked_persistent_context(
             p,
-            user_data_dir=str(PROFILE_DIR / f"{IGG_ID}_events"),
-            browser_path=BROWSER_PATH,
+            user_data_dir=user_data_dir,
+            browser_path=get_browser_path(),
             headless=True,
             slow_mo=25,
             profile=get_random_browser_profile(),
+            policy=NET_POLICY,
         )
         context: BrowserContext = ctx_data["context"]
         page: Page = ctx_data["page"]
 
-        await page.route("**/*", route_handler)
-
         try:
             cookies_list = get_cookies_for_igg(IGG_ID)
             await context.add_cookies(cookies_list)
@@ -0,0 +1,283 @@
+# tg_zov/services/event_http.py
+"""
+🌐 HTTP-движок для ajax-эндпоинтов событий IGG (без браузера)
+
+Фермы puzzle2/puzzle3 поднимали замаскированный Chromium только ради
+page.evaluate(fetch('ajax.req.php?action=...')). cookie_refresh_auto2 уже
+показал, что те же эндпоинты отвечают обычному aiohttp с CookieJar и
+«браузерными» заголовками — здесь этот код собран в общий движок:
+
+  • один TCPConnector на event loop (keep-alive, DNS-кэш) для всех аккаунтов;
+  • у каждого аккаунта своя CookieJar и свой профиль заголовков (EventSession);
+  • ответ 403 или страница Akamai вместо JSON — EscalateToBrowser:
+    вызывающий код переключается на Playwright-путь;
+  • jar_from_playwright()/jar_to_playwright() — перенос cookies между
+    контекстом браузера и CookieJar (см. browser_patches.browser_handoff);
+  • каждый запрос проходит через services.rate_limit.throttle (хост + action).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from http.cookies import Morsel
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+from yarl import URL
+
+from services.rate_limit import throttle
+
+logger = logging.getLogger("event_http")
+
+EVENT_URL = URL("https://event-eu-cc.igg.com/")
+PUZZLE2_PAGE = "https://event-eu-cc.igg.com/event/puzzle2/"
+PUZZLE2_API = f"{PUZZLE2_PAGE}ajax.req.php"
+
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=45)
+CONNECTOR_LIMIT = 64           # всего соединений на движок
+CONNECTOR_LIMIT_PER_HOST = 32
+DNS_TTL = 600
+
+# Признаки страницы-проверки Akamai / WAF вместо ответа эндпоинта
+CHALLENGE_MARKERS = ("access denied", "_abck", "bm-verify", "sec-if-cpt", "akamai", "errors.edgesuite.net")
+
+
+class EscalateToBrowser(Exception):
+    """HTTP-путь упёрся в 403 / проверку Akamai — нужен настоящий браузер."""
+
+
+# ───── cookies и заголовки ─────
+def _morsel(name: str, value: str, domain: str = "", path: str = "/") -> Morsel:
+    # значение как есть: SimpleCookie взял бы в кавычки значения с "/" и "=" (ak_bmsc, _abck)
+    morsel = Morsel()
+    morsel.set(name, value, value)
+    if domain:
+        morsel["domain"] = domain
+    morsel["path"] = path or "/"
+    return morsel
+
+
+def init_cookie_jar(cookies: Optional[Dict[str, str]]) -> aiohttp.CookieJar:
+    jar = aiohttp.CookieJar(unsafe=True)
+    if cookies:
+        jar.update_cookies({k: _morsel(str(k), str(v)) for k, v in cookies.items()}, response_url=EVENT_URL)
+    return jar
+
+
+def cookies_from_jar(jar: aiohttp.CookieJar, url: Any = EVENT_URL) -> Dict[str, str]:
+    filtered = jar.filter_cookies(URL(str(url)))
+    return {name: morsel.value for name, morsel in filtered.items()}
+
+
+def jar_from_playwright(cookies: Iterable[Dict[str, Any]]) -> aiohttp.CookieJar:
+    """CookieJar из context.cookies() Playwright — с доменами и путями (cookies разных хостов IGG)."""
+    jar = aiohttp.CookieJar(unsafe=True)
+    for c in cookies:
+        name, value = c.get("name"), c.get("value")
+        if not name or value is None:
+            continue
+        domain = c.get("domain") or EVENT_URL.host
+        jar.update_cookies(
+            {name: _morsel(name, value, domain, c.get("path") or "/")},
+            response_url=URL(f"https://{domain.lstrip('.')}/"),
+        )
+    return jar
+
+
+def jar_to_playwright(jar: aiohttp.CookieJar) -> List[Dict[str, Any]]:
+    """Обратное преобразование: cookies из CookieJar в формат context.add_cookies()."""
+    out = []
+    for morsel in jar:
+        if morsel["domain"]:
+            out.append({"name": morsel.key, "value": morsel.value,
+                        "domain": morsel["domain"], "path": morsel["path"] or "/"})
+    return out
+
+
+def _accept_language(profile: Dict[str, Any]) -> str:
+    return profile.get("accept_language") or "en-US,en;q=0.9"
+
+
+def _client_hints(profile: Dict[str, Any]) -> Dict[str, str]:
+    if not profile.get("sec_ch_ua"):
+        return {}
+    return {
+        "sec-ch-ua": profile["sec_ch_ua"],
+        "sec-ch-ua-mobile": profile.get("sec_ch_ua_mobile", "?0"),
+        "sec-ch-ua-platform": profile.get("sec_ch_ua_platform", '"Windows"'),
+    }
+
+
+def build_navigation_headers(profile: Dict[str, Any], referer: str = PUZZLE2_PAGE) -> Dict[str, str]:
+    return {
+        "User-Agent": profile.get("user_agent", "Mozilla/5.0"),
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+        "Accept-Language": _accept_language(profile),
+        "Cache-Control": "no-cache",
+        "Pragma": "no-cache",
+        "Upgrade-Insecure-Requests": "1",
+        "Referer": referer,
+        **_client_hints(profile),
+    }
+
+
+def build_ajax_headers(profile: Dict[str, Any], referer: str = PUZZLE2_PAGE) -> Dict[str, str]:
+    return {
+        "User-Agent": profile.get("user_agent", "Mozilla/5.0"),
+        "Accept": "application/json, text/javascript, */*; q=0.01",
+        "Accept-Language": _accept_language(profile),
+        "Referer": referer,
+        "X-Requested-With": "XMLHttpRequest",
+        "Cache-Control": "no-cache",
+        "Pragma": "no-cache",
+        **_client_hints(profile),
+    }
+
+
+def is_challenge(status: int, text: str) -> bool:
+    """403 или HTML-страница проверки вместо ответа эндпоинта."""
+    if status == 403:
+        return True
+    if not text:
+        return False
+    head = text[:4096].lower()
+    if "403 forbidden" in head:
+        return True
+    return head.lstrip().startswith("<") and any(m in head for m in CHALLENGE_MARKERS)
+
+
+# ───── сессия аккаунта ─────
+class EventSession:
+    """«Вкладка» одного аккаунта поверх общего коннектора: своя CookieJar и профиль заголовков."""
+
+    def __init__(self, engine: "EventHttp", session: aiohttp.ClientSession, profile: Dict[str, Any],
+                 uid: str = "", page_url: str = PUZZLE2_PAGE, api_url: str = PUZZLE2_API):
+        self.engine = engine
+        self.session = session
+        self.profile = profile
+        self.uid = uid
+        self.page_url = page_url
+        self.api_url = api_url
+
+    async def _request(self, method: str, url: str, headers: Dict[str, str], what: str,
+                       action: Optional[str] = None, **kwargs) -> Tuple[int, str]:
+        await throttle(url, action)
+        async with self.session.request(method, url, headers=headers, allow_redirects=True, **kwargs) as resp:
+            text = await resp.text(errors="replace")
+            status = resp.status
+        self.engine.requests += 1
+        if is_challenge(status, text):
+            self.engine.challenges += 1
+            raise EscalateToBrowser(f"{what}: HTTP {status}")
+        return status, text
+
+    async def open_page(self) -> int:
+        """Заход на страницу события — как у браузера: Akamai выставляет ak_bmsc/bm_sz."""
+        status, _ = await self._request(
+            "GET", self.page_url, build_navigation_headers(self.profile, self.page_url), "page", "page",
+        )
+        return status
+
+    async def ajax(self, action: str, *, method: str = "GET", data: Any = None,
+                   params: Optional[Dict[str, str]] = None) -> Tuple[int, str]:
+        return await self.fetch(self.api_url, method=method, data=data, params={"action": action, **(params or {})})
+
+    async def fetch(self, url: str, *, method: str = "GET", data: Any = None,
+                    params: Optional[Dict[str, str]] = None) -> Tuple[int, str]:
+        """Любой ajax-URL события (action может быть уже в query-строке) — с теми же заголовками."""
+        action = (params or {}).get("action") or URL(url).query.get("action")
+        return await self._request(
+            method.upper(), url, build_ajax_headers(self.profile, self.page_url), action or url, action,
+            params=params, data=data,
+        )
+
+    async def ajax_json(self, action: str, **kwargs) -> Dict[str, Any]:
+        """ajax() + разбор JSON; не-JSON ответ — ValueError."""
+        _, text = await self.ajax(action, **kwargs)
+        return json.loads(text)
+
+    def cookies(self) -> Dict[str, str]:
+        return cookies_from_jar(self.session.cookie_jar, self.page_url)
+
+
+# ───── движок ─────
+class EventHttp:
+    def __init__(self, *, limit: int = CONNECTOR_LIMIT, limit_per_host: int = CONNECTOR_LIMIT_PER_HOST,
+                 timeout: aiohttp.ClientTimeout = REQUEST_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self.closed = False
+        self.sessions = 0
+        self.requests = 0
+        self.challenges = 0
+
+    @property
+    def connector(self) -> aiohttp.TCPConnector:
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=DNS_TTL,
+            )
+        return self._connector
+
+    @asynccontextmanager
+    async def session(self, cookies: Optional[Dict[str, str]] = None, profile: Optional[Dict[str, Any]] = None,
+                      *, uid: str = "", page_url: str = PUZZLE2_PAGE, api_url: str = PUZZLE2_API,
+                      jar: Optional[aiohttp.CookieJar] = None):
+        """
+        async with engine.session(cookies, profile, uid=uid) as s:
+            await s.open_page()
+            data = await s.ajax_json("get_resource", method="POST")
+        """
+        if self.closed:
+            raise RuntimeError("EventHttp закрыт")
+        if profile is None:
+            from services.browser_patches import get_random_browser_profile
+            profile = get_random_browser_profile()
+        client = aiohttp.ClientSession(
+            connector=self.connector, connector_owner=False,
+            cookie_jar=jar if jar is not None else init_cookie_jar(cookies),
+            timeout=self.timeout,
+        )
+        self.sessions += 1
+        try:
+            yield EventSession(self, client, profile, uid, page_url, api_url)
+        finally:
+            await client.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": self.sessions,
+            "requests": self.requests,
+            "challenges": self.challenges,
+        }
+
+    async def close(self):
+        self.closed = True
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+
+
+# Общий движок на event loop (коннектор aiohttp привязан к циклу)
+_engines: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, EventHttp]" = weakref.WeakKeyDictionary()
+
+
+def get_event_http() -> EventHttp:
+    loop = asyncio.get_running_loop()
+    engine = _engines.get(loop)
+    if engine is None or engine.closed:
+        engine = _engines[loop] = EventHttp()
+    return engine
+
+
+async def close_event_http():
+    loop = asyncio.get_running_loop()
+    engine = _engines.pop(loop, None)
+    if engine is not None:
+        await engine.close()
@@ -1,9 +1,17 @@
 # tg_zov/services/event_manager.py
 import asyncio
+import html
+import inspect
 import json
 import logging
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
 
 from config import ADMIN_IDS
 from services.accounts_manager import load_all_users
@@ -16,14 +24,14 @@ from services.thanksgiving_event import run_thanksgiving_event
 from services.castle_machine import run_castle_machine
 from services.lucky_wheel_auto import run_lucky_wheel
 from services.dragon_quest import run_dragon_quest
-from services.browser_patches import (
-    launch_masked_persistent_context,
-    get_random_browser_profile,
-    cookies_to_playwright,
-    BROWSER_PATH,
-)
-from services.cookies_io import load_all_cookies, save_all_cookies
-from playwright.async_api import async_playwright
+from services.browser_patches import close_browser_pool, get_browser_pool
+from services.job_queue import run_batch
+from services.rate_limit import throttle
+from services.retry_queue import RetryPolicy, RetryQueue, drain
+from services.concurrency import ERROR
+from services.daily_ledger import get_daily_ledger
+from services.event_planner import AccountPlan, build_plan, record_cost
+from services import cookie_store
 
 logger = logging.getLogger("event_manager")
 
@@ -40,6 +48,173 @@ PROMO_INBOX_TXT = Path("data/new_promo.txt")
 PROMO_INBOX_JSON = Path("data/new_promo.json")
 STATUS_FILE = Path("data/event_status.json")
 
+EVENT_WORKERS = 4               # аккаунтов одновременно (по контексту из общего BrowserPool на каждый)
+EVENT_POLICY = "render-light"   # политика перехвата запросов для контекстов цикла
+TELEGRAM_API = "https://api.telegram.org"
+CHAT_INTERVAL = 1.0             # сек. между сообщениями в один чат (лимит Telegram)
+MESSAGE_LIMIT = 3800
+JOB_QUEUE = False               # True — аккаунты цикла ставятся заданиями в services.job_queue (python -m services.job_worker)
+
+
+# ────────────────────────────────────────────────
+# 📊 Итоги цикла и доставка результатов в Telegram
+# ────────────────────────────────────────────────
+class CycleSummary:
+    """Счётчики и строки итога; результаты приходят от воркеров по мере готовности."""
+
+    def __init__(self):
+        self.success = 0
+        self.errors = 0
+        self.attempts_over = 0
+        self.lines: List[str] = []
+
+    def add(self, event_key: str, username: str, result: dict) -> str:
+        """Учитывает результат события и возвращает его префикс (✅ / ⚙️ / ⚠️)."""
+        msg = result.get("message", "❓ Нет ответа")
+        msg_text = str(result.get("message", "")).lower()
+        if "попытки" in msg_text and "закончились" in msg_text:
+            prefix = "⚙️"
+            self.attempts_over += 1
+        elif result.get("success", False):
+            prefix = "✅"
+            self.success += 1
+        else:
+            prefix = "⚠️"
+            self.errors += 1
+        self.lines.append(f"{prefix} <b>{username}</b> — {event_key}: {msg}")
+        return prefix
+
+    def add_error(self, line: str):
+        self.errors += 1
+        self.lines.append(line)
+
+    @property
+    def total(self) -> int:
+        return self.success + self.errors + self.attempts_over
+
+
+class TelegramOutbox:
+    """
+    Очередь сообщений по чатам: воркеры не ждут Telegram.
+    На каждый чат — своя задача: всё, что накопилось, склеивается в одно
+    сообщение (до MESSAGE_LIMIT), между сообщениями в чат — CHAT_INTERVAL,
+    общий темп бота — правило api.telegram.org в rate_limit.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._queues: Dict[Any, Deque[str]] = {}
+        self._tasks: Dict[Any, asyncio.Task] = {}
+        self.sent = 0
+
+    def send(self, chat_id, text: str):
+        if self.bot is None or chat_id is None:
+            return
+        self._queues.setdefault(chat_id, deque()).append(text[:MESSAGE_LIMIT])
+        task = self._tasks.get(chat_id)
+        if task is None or task.done():
+            self._tasks[chat_id] = asyncio.ensure_future(self._drain_chat(chat_id))
+
+    async def _drain_chat(self, chat_id):
+        queue = self._queues[chat_id]
+        while queue:
+            parts = [queue.popleft()]
+            size = len(parts[0])
+            while queue and size + len(queue[0]) + 1 <= MESSAGE_LIMIT:
+                parts.append(queue.popleft())
+                size += len(parts[-1]) + 1
+            text = "\n".join(parts)
+            await throttle(TELEGRAM_API, "sendMessage")
+            try:
+                await self.bot.send_message(chat_id, text, parse_mode="HTML")
+            except Exception as e:
+                logger.warning(f"[Telegram send] Ошибка отправки в {chat_id}: {e}")
+                try:
+                    await self.bot.send_message(chat_id, re.sub(r"<[^>]+>", "", html.unescape(text)), parse_mode=None)
+                except Exception as inner:
+                    logger.error(f"[Telegram send] Повторная ошибка ({chat_id}): {inner}")
+                    continue
+            self.sent += 1
+            if queue:
+                await asyncio.sleep(CHAT_INTERVAL)
+
+    async def flush(self):
+        tasks = [t for t in self._tasks.values() if not t.done()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _accepts_context(handler) -> bool:
+    try:
+        return "context" in inspect.signature(handler).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+# ────────────────────────────────────────────────
+# 👤 Все акции одного аккаунта в одной сессии
+# ────────────────────────────────────────────────
+async def run_account_events(user_id: str, uid: str, username: str, events: List[str], on_result):
+    """
+    Открывает контекст аккаунта из общего BrowserPool и прогоняет в нём events по порядку.
+    on_result(event_key, result, seconds) — после каждой акции; ошибка сессии пробрасывается.
+    """
+    async with get_browser_pool().session(
+        cookies=cookie_store.get_cookies(user_id, uid) or None,
+        policy=EVENT_POLICY,
+        label=f"{uid}_events",
+    ) as ctx:
+        context = ctx["context"]
+        try:
+            for event_key in events:
+                handler = EVENT_HANDLERS[event_key]
+                logger.info(f"▶️ {event_key}: {username} ({uid})")
+                t_event = time.monotonic()
+                try:
+                    if _accepts_context(handler):
+                        result = await handler(user_id, uid, context=context)
+                    else:
+                        result = await handler(user_id, uid)
+                except Exception as e:
+                    logger.exception(f"❌ [{event_key}] {username} ({uid}): {e}")
+                    result = {"success": False, "message": str(e)}
+                on_result(event_key, result or {}, time.monotonic() - t_event)
+        finally:
+            try:
+                fresh = await context.cookies()
+                fresh_map = {c["name"]: c["value"] for c in fresh if "name" in c}
+                if fresh_map:
+                    # merge: cookies, сохранённые HTTP-фазой обработчиков, не затираются целиком
+                    cookie_store.put_cookies(user_id, uid, fresh_map, merge=True)
+            except Exception:
+                pass
+
+
+@asynccontextmanager
+async def job_runner():
+    """
+    Ресурсы воркера очереди заданий (services.job_worker): run(AccountPlan как dict) -> (reason, result),
+    result — {"results": [[акция, результат, сек], …]} (при ошибке сессии — ещё и "error").
+    """
+
+    async def run(payload):
+        results = []
+        try:
+            await run_account_events(
+                payload["user_id"], payload["uid"], payload["username"], payload["events"],
+                lambda event_key, result, seconds: results.append([event_key, result, seconds]),
+            )
+        except Exception as e:
+            logger.exception(f"❌ [session] {payload.get('username')} ({payload.get('uid')}): {e}")
+            return ERROR, {"results": results, "error": str(e)}
+        return None, {"results": results}
+
+    try:
+        yield run
+    finally:
+        get_daily_ledger().flush()
+        await close_browser_pool()
+
 
 # ────────────────────────────────────────────────
 # 🔔 Проверка и активация новых промокодов
@@ -101,7 +276,7 @@ async def check_and_apply_new_promo(bot=None) -> str | None:
 # ────────────────────────────────────────────────
 # 🔄 Полный цикл: проверка акций → сбор активных
 # ────────────────────────────────────────────────
-async def run_full_event_cycle(bot=None, manual=False):
+async def run_full_event_cycle(bot=None, manual=False, workers: Optional[int] = None):
     logger.info("🚀 Запуск полного цикла проверки и сбора акций…")
 
     # 1️⃣ Проверяем свежесть event_status.json (не старше 10 минут)
@@ -148,158 +323,101 @@ async def run_full_event_cycle(bot=None, manual=False):
     except Exception as e:
         logger.warning(f"[PROMO] Ошибка при проверке промокодов: {e}")
 
-    # 6️⃣ Запускаем фарм активных акций
-    all_users = load_all_users()
-    total_success = total_errors = total_attempts_over = 0
-    summary_lines = []
     # ❌ Пропускаем puzzle2, если она фактически не активна
     if "puzzle2" in active_events and not event_status.get("puzzle2", False):
         logger.info("⏸ Puzzle2 указана, но фактически не активна — пропускаем фарм.")
         active_events.remove("puzzle2")
 
-    async def _send_result(event_key: str, user_id: str, uid: str, username: str, result: dict):
-        nonlocal total_success, total_errors, total_attempts_over, summary_lines
-        msg = result.get("message", "❓ Нет ответа")
-        success = result.get("success", False)
-        msg_text = result.get("message", "").lower()
-
-        if "попытки" in msg_text and "закончились" in msg_text:
-            prefix = "⚙️"
-            total_attempts_over += 1
-        elif success:
-            prefix = "✅"
-            total_success += 1
+    handlers = []
+    for event_key in active_events:
+        if event_key not in EVENT_HANDLERS:
+            logger.warning(f"[{event_key}] ⚠️ Нет обработчика — пропуск.")
+            continue
+        handlers.append(event_key)
+
+    # 6️⃣ План: сессия на аккаунт, сделанное сегодня — мимо; пул воркеров по плану
+    done = get_daily_ledger()
+    plan = build_plan(handlers, load_all_users(), done=done)
+    workers = max(1, min(workers or EVENT_WORKERS, plan.sessions or 1))
+    plan.log_estimate(workers)
+    busy = 0.0
+    summary = CycleSummary()
+    outbox = TelegramOutbox(bot)
+    admin_id = ADMIN_IDS[0] if ADMIN_IDS else None
+
+    def _deliver(event_key: str, user_id: str, uid: str, username: str, result: dict):
+        prefix = summary.add(event_key, username, result)
+        safe_msg = html.escape(re.sub(r"<[^>]+>", "", str(result.get("message", "❓ Нет ответа"))))
+        if prefix == "✅":
+            outbox.send(user_id, f"✅ {event_key}: {safe_msg}")
         else:
-            prefix = "⚠️"
-            total_errors += 1
-
-        summary_lines.append(f"{prefix} <b>{username}</b> — {event_key}: {msg}")
-
-        import re
-        import html
-
-        if bot:
-            try:
-                clean_msg = re.sub(r"<[^>]+>", "", str(msg))
-                safe_msg = html.escape(clean_msg)
-
-                if success:
-                    await bot.send_message(
-                        user_id,
-                        f"✅ {event_key}: {safe_msg[:3800]}",
-                        parse_mode="HTML"
-                    )
-                else:
-                    await bot.send_message(
-                        ADMIN_IDS[0],
-                        f"❌ [{event_key}] {username} ({uid}): {safe_msg[:3800]}",
-                        parse_mode="HTML"
-                    )
-            except Exception as e:
-                logger.warning(f"[Telegram send] Ошибка отправки ({event_key}): {e}")
-                try:
-                    await bot.send_message(
-                        user_id if success else ADMIN_IDS[0],
-                        f"{'✅' if success else '❌'} [{event_key}] {msg[:3800]}",
-                        parse_mode=None
-                    )
-                except Exception as inner:
-                    logger.error(f"[Telegram send] Повторная ошибка ({event_key}): {inner}")
-
-        await asyncio.sleep(1)
-
-    async def run_with_single_session(event_keys: list[str]):
-        nonlocal total_errors
-        cookies_db = load_all_cookies()
-        for user_id, accounts in all_users.items():
-            for acc in accounts:
-                uid = str(acc.get("uid"))
-                username = acc.get("username", "Игрок")
-                if not uid:
-                    continue
-
-                async with async_playwright() as p:
-                    profile = get_random_browser_profile()
-                    ctx = await launch_masked_persistent_context(
-                        p,
-                        user_data_dir=f"data/chrome_profiles/{uid}_events",
-                        browser_path=BROWSER_PATH,
-                        headless=True,
-                        slow_mo=30,
-                        profile=profile,
-                    )
-                    context = ctx["context"]
-                    page = ctx["page"]
-
-                    try:
-                        acc_cookies = cookies_db.get(str(user_id), {}).get(str(uid), {})
-                        if acc_cookies:
-                            await context.add_cookies(cookies_to_playwright(acc_cookies))
-
-                        for event_key in event_keys:
-                            handler = EVENT_HANDLERS.get(event_key)
-                            if not handler:
-                                logger.warning(f"[{event_key}] ⚠️ Нет обработчика — пропуск.")
-                                continue
-
-                            logger.info(f"▶️ Запуск обработки события: {event_key}")
-                            try:
-                                result = await handler(user_id, uid, context=context)
-                            except TypeError:
-                                result = await handler(user_id, uid)
-
-                            await _send_result(event_key, user_id, uid, username, result)
-
-                    except Exception as e:
-                        err = f"❌ [session] {username} ({uid}): {e}"
-                        logger.exception(err)
-                        total_errors += 1
-                        summary_lines.append(err)
-                    finally:
-                        try:
-                            if page:
-                                await page.close()
-                            if context:
-                                fresh = await context.cookies()
-                                fresh_map = {c["name"]: c["value"] for c in fresh if "name" in c}
-                                if fresh_map:
-                                    cookies_db.setdefault(str(user_id), {})[str(uid)] = fresh_map
-                                    save_all_cookies(cookies_db)
-                                await context.close()
-                        except Exception:
-                            pass
-
-    if manual:
-        await run_with_single_session(active_events)
-    else:
-        for event_key in active_events:
-            handler = EVENT_HANDLERS.get(event_key)
-            if not handler:
-                logger.warning(f"[{event_key}] ⚠️ Нет обработчика — пропуск.")
-                continue
-
-            logger.info(f"▶️ Запуск обработки события: {event_key}")
-            for user_id, accounts in all_users.items():
-                for acc in accounts:
-                    uid = str(acc.get("uid"))
-                    username = acc.get("username", "Игрок")
-                    try:
-                        result = await handler(user_id, uid)
-                        await _send_result(event_key, user_id, uid, username, result)
+            outbox.send(admin_id, f"❌ [{event_key}] {html.escape(username)} ({uid}): {safe_msg}")
+
+    def on_result(item: AccountPlan, event_key: str, result: dict, seconds: float):
+        record_cost(event_key, seconds)
+        done.record(event_key, item.uid, result)  # обработчик отмечает и сам; здесь — и для результатов из очереди
+        _deliver(event_key, item.user_id, item.uid, item.username, result)
+
+    def session_error(item: AccountPlan, error):
+        err = f"❌ [session] {item.username} ({item.uid}): {error}"
+        summary.add_error(err)
+        return err
+
+    async def handle(job) -> Optional[str]:
+        nonlocal busy
+        item = job.item
+        t_session = time.monotonic()
+        try:
+            await run_account_events(
+                item.user_id, item.uid, item.username, item.events,
+                lambda event_key, result, seconds: on_result(item, event_key, result, seconds),
+            )
+        except Exception as e:
+            logger.exception(session_error(item, e))
+            return ERROR
+        finally:
+            busy += time.monotonic() - t_session
+        return None
 
-                    except Exception as e:
-                        total_errors += 1
-                        err = f"❌ [{event_key}] {username} ({uid}): {e}"
-                        logger.exception(err)
-                        summary_lines.append(err)
+    def on_job(job):
+        # результат задания из очереди: те же on_result, что и в своём пуле
+        nonlocal busy
+        item = by_key[job["key"]]
+        data = job["result"] or {}
+        for event_key, result, seconds in data.get("results", []):
+            busy += seconds
+            on_result(item, event_key, result, seconds)
+        if job["status"] != "done":
+            logger.warning(session_error(item, data.get("error") or job["error"] or job["status"]))
+
+    started = time.monotonic()
+    if plan.accounts and JOB_QUEUE:
+        # ключ — (владелец, uid): один uid может быть у нескольких пользователей
+        by_key = {f"{a.user_id}:{a.uid}": a for a in plan.accounts}
+        await run_batch("event_account", [(key, asdict(a)) for key, a in by_key.items()],
+                        max_attempts=1, on_done=on_job)
+    elif plan.accounts:
+        queue = RetryQueue(plan.accounts, RetryPolicy(max_attempts=1), key=lambda a: a.uid, name="event_cycle")
+        await drain(queue, handle, workers=workers)
+    await outbox.flush()
+    done.flush()
+    elapsed = time.monotonic() - started
+    plan.log_actual(workers, elapsed, busy)
+    logger.info(
+        f"[CYCLE] ⏱ {plan.sessions} акк. за {elapsed:.0f} с "
+        f"({plan.sessions / elapsed if elapsed else 0:.2f} акк/с), сообщений: {outbox.sent}, "
+        f"pool: {get_browser_pool().stats()}"
+    )
 
     # 7️⃣ Итог
     summary = (
         f"{'🔄 Ручной' if manual else '🕛 Ежедневный'} цикл завершён\n"
         f"Активные акции: {', '.join(active_events)}\n"
-        f"✅ Успешно: {total_success}\n"
-        f"⚙️ Попытки закончились: {total_attempts_over}\n"
-        f"⚠️ Ошибок: {total_errors}\n"
+        f"👥 Аккаунтов: {plan.sessions} (воркеров: {workers}, {elapsed / 60:.1f} мин)\n"
+        f"⏭ Уже сделано сегодня: {plan.skipped}\n"
+        f"✅ Успешно: {summary.success}\n"
+        f"⚙️ Попытки закончились: {summary.attempts_over}\n"
+        f"⚠️ Ошибок: {summary.errors}\n"
         f"🕒 {datetime.now():%Y-%m-%d %H:%M:%S}"
     )
 
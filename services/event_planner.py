@@ -0,0 +1,137 @@
+# tg_zov/services/event_planner.py
+"""
+🗺 План цикла акций: какие аккаунты, какие акции, в каком порядке
+
+Ежедневный run_full_event_cycle шёл «акция → аккаунт», и каждый обработчик
+(run_gas_event, run_dragon_quest, run_castle_machine, …) без context
+поднимал свой браузер: сессий было столько, сколько пар (акция, аккаунт),
+даже если аккаунту сегодня уже нечего было забирать.
+
+build_plan(active_events, all_users) строит план:
+  • одна сессия (контекст) на аккаунт — в ней все его акции;
+  • пары (акция, uid), завершённые сегодня (награда получена, попытки
+    закончились — services.daily_ledger), выпадают из плана; аккаунт
+    без акций — без сессии;
+  • внутри аккаунта акции идут от дешёвых к дорогим: если сессия упадёт
+    на середине, больше акций успеет завершиться;
+  • аккаунты — от дорогих к дешёвым (LPT): пул воркеров меньше простаивает
+    в хвосте цикла;
+  • стоимость акции — EVENT_COST_S, а после первых прогонов — средняя
+    измеренная (EMA); оценка и факт пишутся в лог ([PLAN]).
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from services.daily_ledger import DailyLedger
+
+logger = logging.getLogger("event_planner")
+
+SESSION_COST_S = 4.0          # открыть контекст, подставить cookies, сохранить их обратно
+DEFAULT_EVENT_COST_S = 10.0
+COST_ALPHA = 0.3              # вес нового замера в EMA стоимости акции
+
+# Начальные оценки (сек. на аккаунт), пока нет своих замеров
+EVENT_COST_S: Dict[str, float] = {
+    "gas": 6.0,
+    "dragon_quest": 8.0,
+    "thanksgiving_event": 10.0,
+    "castle_machine": 12.0,
+    "lucky_wheel": 15.0,
+    "flop_pair": 25.0,
+}
+
+
+# ───── стоимость акций ─────
+_costs: Dict[str, float] = {}
+_costs_lock = threading.Lock()
+
+
+def event_cost(event_key: str) -> float:
+    with _costs_lock:
+        measured = _costs.get(event_key)
+    if measured is not None:
+        return measured
+    return EVENT_COST_S.get(event_key, DEFAULT_EVENT_COST_S)
+
+
+def record_cost(event_key: str, seconds: float):
+    """Замер одной акции на одном аккаунте — уточняет оценку для следующих планов."""
+    with _costs_lock:
+        old = _costs.get(event_key)
+        _costs[event_key] = seconds if old is None else old + COST_ALPHA * (seconds - old)
+
+
+# ───── план ─────
+@dataclass
+class AccountPlan:
+    user_id: str
+    uid: str
+    username: str
+    events: List[str]
+    cost: float
+
+
+@dataclass
+class ExecutionPlan:
+    accounts: List[AccountPlan] = field(default_factory=list)
+    skipped: int = 0            # пар (акция, uid), уже завершённых сегодня
+    pairs: int = 0              # пар в плане
+
+    @property
+    def sessions(self) -> int:
+        return len(self.accounts)
+
+    @property
+    def cost(self) -> float:
+        return sum(a.cost for a in self.accounts)
+
+    def estimated_wall(self, workers: int) -> float:
+        """Нижняя оценка времени цикла на workers воркерах."""
+        if not self.accounts:
+            return 0.0
+        workers = max(1, workers)
+        return max(self.cost / workers, self.accounts[0].cost,
+                   math.ceil(len(self.accounts) / workers) * SESSION_COST_S)
+
+    def log_estimate(self, workers: int):
+        logger.info(
+            f"[PLAN] 🗺 Сессий: {self.sessions}, пар акция×аккаунт: {self.pairs}, "
+            f"пропущено (сделано сегодня): {self.skipped}; оценка: {self.cost:.0f} с работы, "
+            f"~{self.estimated_wall(workers):.0f} с на {workers} воркерах"
+        )
+
+    def log_actual(self, workers: int, elapsed: float, busy: float):
+        estimate = self.estimated_wall(workers)
+        logger.info(
+            f"[PLAN] ⏱ Факт: {elapsed:.0f} с (оценка {estimate:.0f} с), "
+            f"работы {busy:.0f} с (оценка {self.cost:.0f} с)"
+        )
+
+
+def build_plan(active_events: Iterable[str], all_users: Dict[str, List[Dict]], *,
+               done: Optional[DailyLedger] = None) -> ExecutionPlan:
+    events = sorted(dict.fromkeys(active_events), key=event_cost)
+    plan = ExecutionPlan()
+    seen = set()
+    for user_id, accounts in all_users.items():
+        for acc in accounts or []:
+            uid = str(acc.get("uid") or "")
+            # один uid у двух пользователей Telegram — прогон и сообщение каждому владельцу
+            if not uid or (str(user_id), uid) in seen:
+                continue
+            seen.add((str(user_id), uid))
+            todo = [e for e in events if done is None or not done.is_done(e, uid)]
+            plan.skipped += len(events) - len(todo)
+            if not todo:
+                continue
+            plan.pairs += len(todo)
+            cost = SESSION_COST_S + sum(event_cost(e) for e in todo)
+            plan.accounts.append(AccountPlan(str(user_id), uid, acc.get("username", "Игрок"), todo, cost))
+    plan.accounts.sort(key=lambda a: -a.cost)
+    return plan
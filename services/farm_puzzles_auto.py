@@ -73,7 +73,7 @@ def is_farm_running() -> bool:
 
 def has_saved_state() -> bool:
     """Проверяет, есть ли сохранённое состояние для продолжения фарма."""
-    return puzzle2_auto.FARM_STATE_FILE.exists()
+    return puzzle2_auto.has_farm_state()
 
 
 async def start_farm(bot: Bot, resume: bool = False) -> bool:
@@ -10,6 +10,7 @@ import aiohttp
 from services.browser_patches import run_event_with_browser
 from services.accounts_manager import get_all_accounts
 from services.castle_api import load_cookies_for_account
+from services.daily_ledger import records_daily
 
 logger = logging.getLogger("flop_pair")
 
@@ -541,6 +542,7 @@ async def find_flop_pairs(user_id: str, uid: str = None, context=None):
     return await run_event_with_browser(user_id, uid, BASE_URL, "Найди пару (сканирование)", handler, context=context)
 
 # === Этап 2: открытие ===
+@records_daily("flop_pair")
 async def run_flop_pair(user_id: str, uid: str = None, context=None):
     """
     Ежедневное открытие пар. Пропускает уже открытые пары.
@@ -638,7 +640,7 @@ async def run_flop_pair(user_id: str, uid: str = None, context=None):
             pass
 
         if attempts <= 0:
-            return {"success": False, "message": "⚠️ Попыток не осталось."}
+            return {"success": False, "daily_done": True, "message": "⚠️ Попыток не осталось."}
 
         opened = 0
         marked_as_open = 0
@@ -755,6 +757,7 @@ async def run_flop_pair(user_id: str, uid: str = None, context=None):
         summary.append("")
         summary.extend(rewards)
         summary.append("✅ Ежедневное открытие завершено!")
-        return {"success": True, "message": "\n".join(summary)}
+        # на пару нужно 2 попытки: с меньшим остатком до сброса открывать нечем
+        return {"success": True, "daily_done": attempts < 2, "message": "\n".join(summary)}
 
     return await run_event_with_browser(user_id, uid, BASE_URL, "Найди пару", handler, context=context)
@@ -2,9 +2,10 @@
 import json
 import logging
 import html
-from services.browser_patches import run_event_with_browser
+from services.browser_patches import run_event_with_handoff
 from services.accounts_manager import get_all_accounts
 from services.castle_api import load_cookies_for_account
+from services.daily_ledger import records_daily
 
 logger = logging.getLogger("gas_event")
 
@@ -12,6 +13,7 @@ BASE_URL = "https://event-cc.igg.com/event/gas/"
 API_URL = f"{BASE_URL}ajax.req.php?action=battlepower"
 
 
+@records_daily("gas")
 async def run_gas_event(user_id: str, uid: str = None, context=None) -> dict:
     """
     🧩 Акция 'Маленькая помощь (gas)'
@@ -30,9 +32,16 @@ async def run_gas_event(user_id: str, uid: str = None, context=None) -> dict:
     if not cookies_dict:
         return {"success": False, "message": f"⚠️ Cookies не найдены ({username})."}
 
-    async def handler(page):
+    async def read_page(page):
+        # кнопки наград — пока страница открыта (дальше работаем по HTTP)
+        try:
+            return await page.locator(".gifts-get-btn.disable a").all_inner_texts()
+        except Exception:
+            return []
+
+    async def handler(h):
         # 🧠 Проверяем статус события
-        html_text = (await page.content()).lower()
+        html_text = h.html.lower()
         if any(x in html_text for x in ["событие еще не началось", "уже завершилось"]):
             return {
                 "success": True,
@@ -40,33 +49,18 @@ async def run_gas_event(user_id: str, uid: str = None, context=None) -> dict:
             }
 
         # 🟢 Проверяем кнопку "Получено"
-        try:
-            disable_btns = await page.locator(".gifts-get-btn.disable a").all_inner_texts()
-            if any("Получено" in t for t in disable_btns):
-                return {
-                    "success": True,
-                    "message": f"🟢 {username} ({uid}) — награда уже была получена сегодня ✅"
-                }
-        except Exception:
-            pass
+        disable_btns = h.page_data or []
+        if any("Получено" in t for t in disable_btns):
+            return {
+                "success": True,
+                "daily_done": True,
+                "message": f"🟢 {username} ({uid}) — награда уже была получена сегодня ✅"
+            }
 
         # 📡 Делаем запрос на получение награды
         logger.info(f"[GAS] 🚀 Отправляем запрос на получение награды для {username} ({uid})")
         try:
-            resp = await page.evaluate(
-                f"""
-                async () => {{
-                    const res = await fetch("{API_URL}", {{
-                        method: "GET",
-                        credentials: "include",
-                        headers: {{
-                            "X-Requested-With": "XMLHttpRequest"
-                        }}
-                    }});
-                    return await res.text();
-                }}
-                """
-            )
+            _, resp = await h.fetch(API_URL)
         except Exception as e:
             return {"success": False, "message": f"❌ Ошибка при отправке запроса: {e}"}
 
@@ -95,6 +89,7 @@ async def run_gas_event(user_id: str, uid: str = None, context=None) -> dict:
                 reward_text = html.escape(reward_text)
                 return {
                     "success": True,
+                    "daily_done": True,
                     "message": f"🎉 <b>{username}</b> ({uid})\n🏆 Награда: {reward_text}"
                 }
 
@@ -102,6 +97,7 @@ async def run_gas_event(user_id: str, uid: str = None, context=None) -> dict:
             if any(word in msg.lower() for word in ["уже получ", "повтор", "already", "получена"]):
                 return {
                     "success": True,
+                    "daily_done": True,
                     "message": f"🟢 <b>{username}</b> ({uid}) — награда уже получена ✅"
                 }
 
@@ -119,6 +115,7 @@ async def run_gas_event(user_id: str, uid: str = None, context=None) -> dict:
             snippet = html.escape(text.strip().replace("\n", " ")[:150])
             return {
                 "success": True,
+                "daily_done": True,
                 "message": f"🎉 <b>{username}</b> ({uid})\n🏆 Награда: {snippet}"
             }
 
@@ -130,4 +127,6 @@ async def run_gas_event(user_id: str, uid: str = None, context=None) -> dict:
 
         return {"success": False, "message": f"⚠️ Неизвестный ответ от сервера ({username})."}
 
-    return await run_event_with_browser(user_id, uid, BASE_URL, "Маленькая помощь", handler, context=context)
\ No newline at end of file
+    return await run_event_with_handoff(
+        user_id, uid, BASE_URL, "Маленькая помощь", handler, context=context, page_fn=read_page
+    )
\ No newline at end of file
@@ -0,0 +1,375 @@
+# tg_zov/services/job_queue.py
+"""
+📮 Очередь заданий на аккаунт для работы на нескольких машинах (SQLite)
+
+Один хост упирается в число Chromium, которое он тянет. Здесь фермы
+(puzzle2 — лотерея, puzzle3 — скан дубликатов, обновление cookies, цикл акций)
+раскладываются на задания «один аккаунт» в общей базе data/jobs.sqlite3:
+
+  • бот только ставит задания (enqueue / run_batch) и следит за прогрессом;
+  • воркеры (python -m services.job_worker) на любой машине с доступом к базе
+    берут задания в аренду (lease), продлевают её (heartbeat) и пишут
+    результат (complete / fail);
+  • аренда, которую никто не продлил (воркер упал), истекает — задание
+    снова выдаётся; неудача с 403 / таймаутом откладывается с задержкой
+    RetryPolicy фермы, после max_attempts — failed;
+  • остановка фермы = cancel(batch): невыданные задания снимаются, воркеры
+    видят отмену при heartbeat;
+  • воркеры отмечаются в таблице workers — run_batch предупреждает,
+    если живых воркеров нет.
+
+Новая машина = ещё один запущенный job_worker, без правок кода.
+SQLite в режиме WAL — замена на время; при переезде на сервер очередей
+меняется только этот модуль.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("job_queue")
+
+DB_FILE = Path("data/jobs.sqlite3")
+LEASE_S = 90.0          # аренда задания; продлевается heartbeat воркера
+WORKER_ALIVE_S = 60.0   # воркер «жив», если отмечался не раньше
+WATCH_POLL = 2.0        # сек. между опросами прогресса в run_batch
+KEEP_BATCHES_S = 3 * 24 * 3600
+
+QUEUED, LEASED, DONE, FAILED, CANCELLED = "queued", "leased", "done", "failed", "cancelled"
+TERMINAL = (DONE, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created REAL NOT NULL,
+    cancelled INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (kind, status, not_before);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, status);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    kinds TEXT NOT NULL,
+    in_flight INTEGER NOT NULL DEFAULT 0,
+    last_seen REAL NOT NULL
+);
+"""
+
+# Номер изменения: растёт с каждой сменой статуса. Записи идут под BEGIN IMMEDIATE,
+# поэтому порядок seq совпадает с порядком коммитов — в отличие от updated (часы
+# воркеров на разных машинах расходятся, а time() снимается до блокировки).
+_NEXT_SEQ = "(SELECT IFNULL(MAX(seq), 0) + 1 FROM jobs)"
+
+
+@dataclass
+class LeasedJob:
+    id: int
+    batch: str
+    kind: str
+    key: str
+    payload: Any
+    attempts: int
+    max_attempts: int
+
+
+class JobQueue:
+    def __init__(self, path: Path = DB_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(_SCHEMA)
+        if "seq" not in {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}:
+            db.execute("ALTER TABLE jobs ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")  # база старой версии
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_seq ON jobs (seq)")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_batch_seq ON jobs (batch, seq)")
+
+    # ───── соединение ─────
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _tx(self):
+        queue = self
+
+        class _Tx:
+            def __enter__(self):
+                self.db = queue._db()
+                self.db.execute("BEGIN IMMEDIATE")
+                return self.db
+
+            def __exit__(self, exc_type, exc, tb):
+                self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+                return False
+
+        return _Tx()
+
+    # ───── постановка ─────
+    def enqueue(self, kind: str, items: Iterable[Tuple[str, Any]], *, max_attempts: int = 3) -> str:
+        """items — пары (ключ, payload); payload должен сериализоваться в JSON. Возвращает id пачки."""
+        batch = uuid.uuid4().hex[:12]
+        now = time.time()
+        rows = [(batch, kind, str(key or ""), json.dumps(payload, ensure_ascii=False, default=str),
+                 QUEUED, max_attempts, now) for key, payload in items]
+        with self._tx() as db:
+            db.execute("INSERT INTO batches (id, kind, created) VALUES (?, ?, ?)", (batch, kind, now))
+            db.executemany(
+                "INSERT INTO jobs (batch, kind, key, payload, status, max_attempts, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+            old = now - KEEP_BATCHES_S
+            db.execute("DELETE FROM jobs WHERE batch IN (SELECT id FROM batches WHERE created < ?)", (old,))
+            db.execute("DELETE FROM batches WHERE created < ?", (old,))
+        logger.info("[JOBS] 📮 %s: поставлено %s заданий (пачка %s)", kind, len(rows), batch)
+        return batch
+
+    def cancel(self, batch: str) -> int:
+        """Снимает невыданные задания пачки; выданные доделываются, воркеры видят отмену."""
+        with self._tx() as db:
+            db.execute("UPDATE batches SET cancelled = 1 WHERE id = ?", (batch,))
+            cur = db.execute(
+                f"UPDATE jobs SET status = ?, updated = ?, seq = {_NEXT_SEQ} WHERE batch = ? AND status = ?",
+                (CANCELLED, time.time(), batch, QUEUED),
+            )
+            return cur.rowcount
+
+    # ───── воркеры ─────
+    def lease(self, worker: str, kind: str, limit: int = 1, lease_s: float = LEASE_S) -> List[LeasedJob]:
+        """Берёт до limit готовых заданий (свежие, созревшие повторы, просроченные аренды)."""
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self._tx() as db:
+            # аренда истекла, а попытки кончились — воркер падал на этом задании
+            db.execute(
+                f"UPDATE jobs SET status = ?, error = 'lease expired', lease_owner = NULL, updated = ?, "
+                f"seq = {_NEXT_SEQ} WHERE kind = ? AND status = ? AND lease_until < ? AND attempts >= max_attempts",
+                (FAILED, now, kind, LEASED, now),
+            )
+            rows = db.execute(
+                "SELECT id, batch, kind, key, payload, attempts, max_attempts FROM jobs "
+                "WHERE kind = ? AND ((status = ? AND not_before <= ?) OR (status = ? AND lease_until < ?)) "
+                "ORDER BY id LIMIT ?",
+                (kind, QUEUED, now, LEASED, now, limit),
+            ).fetchall()
+            if not rows:
+                return []
+            db.executemany(
+                f"UPDATE jobs SET status = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1, "
+                f"updated = ?, seq = {_NEXT_SEQ} WHERE id = ?",
+                [(LEASED, worker, now + lease_s, now, row["id"]) for row in rows],
+            )
+        return [
+            LeasedJob(row["id"], row["batch"], row["kind"], row["key"], json.loads(row["payload"]),
+                      row["attempts"] + 1, row["max_attempts"])
+            for row in rows
+        ]
+
+    def heartbeat(self, worker: str, job_ids: List[int], *, kinds: Iterable[str] = (),
+                  lease_s: float = LEASE_S) -> List[str]:
+        """Продлевает аренду заданий и отметку воркера; возвращает отменённые пачки среди них."""
+        now = time.time()
+        with self._tx() as db:
+            if job_ids:
+                marks = ",".join("?" * len(job_ids))
+                db.execute(
+                    f"UPDATE jobs SET lease_until = ? WHERE lease_owner = ? AND status = ? AND id IN ({marks})",
+                    (now + lease_s, worker, LEASED, *job_ids),
+                )
+            db.execute(
+                "INSERT INTO workers (id, host, pid, kinds, in_flight, last_seen) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET in_flight = excluded.in_flight, last_seen = excluded.last_seen",
+                (worker, socket.gethostname(), os.getpid(), ",".join(kinds), len(job_ids), now),
+            )
+            if not job_ids:
+                return []
+            marks = ",".join("?" * len(job_ids))
+            rows = db.execute(
+                f"SELECT DISTINCT b.id FROM jobs j JOIN batches b ON b.id = j.batch "
+                f"WHERE b.cancelled = 1 AND j.id IN ({marks})", job_ids,
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def complete(self, job: LeasedJob, worker: str, result: Any = None):
+        with self._tx() as db:
+            db.execute(
+                f"UPDATE jobs SET status = ?, result = ?, error = NULL, lease_owner = NULL, updated = ?, "
+                f"seq = {_NEXT_SEQ} WHERE id = ? AND lease_owner = ?",
+                (DONE, json.dumps(result, ensure_ascii=False, default=str), time.time(), job.id, worker),
+            )
+
+    def fail(self, job: LeasedJob, worker: str, error: str, *, retry_in: Optional[float] = None,
+             result: Any = None) -> bool:
+        """retry_in — отложить повтор (если попытки остались). True — задание ещё будет выполняться."""
+        now = time.time()
+        retry = retry_in is not None and job.attempts < job.max_attempts
+        with self._tx() as db:
+            db.execute(
+                f"UPDATE jobs SET status = ?, not_before = ?, error = ?, result = ?, lease_owner = NULL, "
+                f"updated = ?, seq = {_NEXT_SEQ} WHERE id = ? AND lease_owner = ?",
+                (QUEUED if retry else FAILED, now + (retry_in or 0), error,
+                 json.dumps(result, ensure_ascii=False, default=str), now, job.id, worker),
+            )
+        return retry
+
+    def release(self, job: LeasedJob, worker: str):
+        """Задание не выполнялось (остановка воркера) — вернуть в очередь без расхода попытки."""
+        with self._tx() as db:
+            db.execute(
+                f"UPDATE jobs SET status = ?, attempts = attempts - 1, lease_owner = NULL, updated = ?, "
+                f"seq = {_NEXT_SEQ} WHERE id = ? AND lease_owner = ?",
+                (QUEUED, time.time(), job.id, worker),
+            )
+
+    def unregister(self, worker: str):
+        with self._tx() as db:
+            db.execute("DELETE FROM workers WHERE id = ?", (worker,))
+
+    # ───── наблюдение ─────
+    def progress(self, batch: str) -> Dict[str, int]:
+        rows = self._db().execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE batch = ? GROUP BY status", (batch,)
+        ).fetchall()
+        counts = {QUEUED: 0, LEASED: 0, DONE: 0, FAILED: 0, CANCELLED: 0}
+        counts.update({row[0]: row[1] for row in rows})
+        counts["total"] = sum(row[1] for row in rows)
+        return counts
+
+    def finished_since(self, batch: str, after_seq: int) -> List[Dict[str, Any]]:
+        """Задания пачки, ставшие окончательными после изменения номер after_seq (по seq)."""
+        rows = self._db().execute(
+            "SELECT id, key, status, result, error, updated, seq FROM jobs "
+            "WHERE batch = ? AND seq > ? AND status IN (?, ?, ?) ORDER BY seq, id",
+            (batch, after_seq, *TERMINAL),
+        ).fetchall()
+        return [
+            {"id": row["id"], "key": row["key"], "status": row["status"],
+             "result": json.loads(row["result"]) if row["result"] else None,
+             "error": row["error"], "updated": row["updated"], "seq": row["seq"]}
+            for row in rows
+        ]
+
+    def workers(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        alive_after = time.time() - WORKER_ALIVE_S
+        rows = self._db().execute(
+            "SELECT id, host, pid, kinds, in_flight, last_seen FROM workers WHERE last_seen >= ?",
+            (alive_after,),
+        ).fetchall()
+        out = [dict(row) for row in rows]
+        if kind is not None:
+            out = [w for w in out if kind in w["kinds"].split(",")]
+        return out
+
+
+_queues: Dict[str, JobQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(path: Path = DB_FILE) -> JobQueue:
+    """Общая на процесс очередь (соединения SQLite — свои у каждого потока)."""
+    key = str(Path(path).resolve())
+    with _queues_lock:
+        queue = _queues.get(key)
+        if queue is None:
+            queue = _queues[key] = JobQueue(path)
+        return queue
+
+
+async def run_batch(
+    kind: str,
+    items: Iterable[Tuple[str, Any]],
+    *,
+    max_attempts: int = 3,
+    stop: Optional[Callable[[], bool]] = None,
+    on_done: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    poll: float = WATCH_POLL,
+) -> Dict[str, int]:
+    """
+    Ставит пачку заданий и ждёт, пока все станут окончательными.
+    on_done(job) — для каждого завершённого задания ({key, status, result, error});
+    stop() — отмена пачки. Возвращает итоговые счётчики по статусам.
+    """
+    queue = get_job_queue()
+    batch = await asyncio.to_thread(queue.enqueue, kind, list(items), max_attempts=max_attempts)
+    seen = 0
+    delivered = set()
+    warned = False
+    cancelled = False
+
+    async def _deliver_finished():
+        nonlocal seen
+        for job in await asyncio.to_thread(queue.finished_since, batch, seen):
+            seen = max(seen, job["seq"])
+            if job["id"] in delivered:
+                continue
+            delivered.add(job["id"])
+            if on_done is not None:
+                try:
+                    result = on_done(job)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.warning("[JOBS] ⚠️ Ошибка обработки результата %s: %s", job["key"], e)
+
+    try:
+        while True:
+            if stop is not None and stop() and not cancelled:
+                cancelled = True
+                dropped = await asyncio.to_thread(queue.cancel, batch)
+                logger.info("[JOBS] ⏹ %s: пачка %s отменена, снято %s заданий", kind, batch, dropped)
+            await _deliver_finished()
+            counts = await asyncio.to_thread(queue.progress, batch)
+            if counts[QUEUED] == 0 and counts[LEASED] == 0:
+                break
+            if not await asyncio.to_thread(queue.workers, kind):
+                if not warned:
+                    warned = True
+                    logger.warning("[JOBS] ⚠️ %s: нет живых воркеров — запусти python -m services.job_worker", kind)
+            else:
+                warned = False
+            await asyncio.sleep(poll)
+    except asyncio.CancelledError:
+        await asyncio.to_thread(queue.cancel, batch)
+        raise
+    # последние результаты, ставшие окончательными между опросами
+    await _deliver_finished()
+    counts = await asyncio.to_thread(queue.progress, batch)
+    logger.info("[JOBS] ✅ %s: пачка %s завершена: %s", kind, batch, counts)
+    return counts
@@ -0,0 +1,168 @@
+# tg_zov/services/job_worker.py
+"""
+🛠 Воркер очереди заданий (services.job_queue) — запускается на любой машине
+
+    python -m services.job_worker --kinds puzzle2,cookie_refresh --slots puzzle2=40
+
+Для каждого вида заданий модуль фермы отдаёт job_runner() — асинхронный
+контекст, внутри которого живут общие ресурсы (Playwright, BrowserPool,
+HTTP-движок), и функцию run(payload) -> (reason, result): reason None —
+успех, R403 / TIMEOUT — повтор позже по RETRY_POLICY модуля, SKIP — вернуть
+задание в очередь, прочее — окончательная ошибка.
+
+Воркер держит не больше slots заданий каждого вида одновременно, раз в
+HEARTBEAT_S продлевает аренду и отмечается в таблице workers.
+SIGINT/SIGTERM — новые задания не берутся, начатые доделываются.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import uuid
+from contextlib import AsyncExitStack
+from typing import Dict, Iterable, Optional, Set
+
+from services.concurrency import SKIP, classify_exception
+from services.job_queue import LEASE_S, LeasedJob, get_job_queue
+from services.registry import load
+from services.retry_queue import RETRYABLE, RetryPolicy
+
+logger = logging.getLogger("job_worker")
+
+# вид задания → модуль с job_runner() и RETRY_POLICY
+RUNNERS = {
+    "puzzle2": "services.puzzle2_auto",
+    "puzzle3": "services.puzzle3_auto",
+    "cookie_refresh": "services.login_and_refresh",
+    "event_account": "services.event_manager",
+}
+SLOTS = {"puzzle2": 30, "puzzle3": 30, "cookie_refresh": 8, "event_account": 4}
+HEARTBEAT_S = LEASE_S / 3
+IDLE_POLL = 2.0         # сек. между попытками взять задание, когда очередь пуста
+
+
+class JobWorker:
+    def __init__(self, kinds: Iterable[str], slots: Optional[Dict[str, int]] = None,
+                 worker_id: Optional[str] = None):
+        self.kinds = [k for k in kinds if k in RUNNERS]
+        self.slots = {k: (slots or {}).get(k, SLOTS.get(k, 4)) for k in self.kinds}
+        self.id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:4]}"
+        self.queue = get_job_queue()
+        self.in_flight: Dict[int, LeasedJob] = {}
+        self.stats = {"done": 0, "retried": 0, "failed": 0, "released": 0}
+        self._stopping = asyncio.Event()
+        self._running: Set[asyncio.Task] = set()
+
+    def stop(self):
+        if not self._stopping.is_set():
+            logger.info("[WORKER] ⏹ %s: остановка — доделываю %s заданий", self.id, len(self.in_flight))
+            self._stopping.set()
+
+    async def run(self):
+        logger.info("[WORKER] ▶️ %s: виды %s", self.id, self.slots)
+        async with AsyncExitStack() as stack:
+            runners = {}
+            for kind in self.kinds:
+                module = load(RUNNERS[kind])
+                runners[kind] = (await stack.enter_async_context(module.job_runner()),
+                                 getattr(module, "RETRY_POLICY", RetryPolicy()))
+            heartbeat = asyncio.ensure_future(self._heartbeat())
+            try:
+                await asyncio.gather(*(self._kind_loop(kind, *runners[kind]) for kind in self.kinds))
+                if self._running:
+                    await asyncio.gather(*self._running, return_exceptions=True)
+            finally:
+                heartbeat.cancel()
+                await asyncio.to_thread(self.queue.unregister, self.id)
+        logger.info("[WORKER] ✅ %s: итог %s", self.id, self.stats)
+
+    async def _kind_loop(self, kind: str, run, policy: RetryPolicy):
+        slots = self.slots[kind]
+        mine: Set[asyncio.Task] = set()
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        while not self._stopping.is_set():
+            free = slots - len(mine)
+            jobs = await asyncio.to_thread(self.queue.lease, self.id, kind, free) if free > 0 else []
+            for job in jobs:
+                self.in_flight[job.id] = job
+                task = asyncio.ensure_future(self._execute(job, run, policy))
+                mine.add(task)
+                self._running.add(task)
+                task.add_done_callback(mine.discard)
+                task.add_done_callback(self._running.discard)
+            if jobs and len(jobs) == free:
+                # все слоты заняты — ждём, пока освободится хотя бы один
+                await asyncio.wait(mine | {stopping}, return_when=asyncio.FIRST_COMPLETED)
+            elif not jobs:
+                await asyncio.wait({stopping}, timeout=IDLE_POLL)
+        stopping.cancel()
+
+    async def _execute(self, job: LeasedJob, run, policy: RetryPolicy):
+        result = None
+        try:
+            reason, result = await run(job.payload)
+        except Exception as e:
+            reason = classify_exception(e)
+            result = {"error": str(e)}
+            logger.error("[WORKER] ❌ %s/%s: %s", job.kind, job.key, e)
+        try:
+            if reason is None:
+                await asyncio.to_thread(self.queue.complete, job, self.id, result)
+                self.stats["done"] += 1
+            elif reason == SKIP:
+                await asyncio.to_thread(self.queue.release, job, self.id)
+                self.stats["released"] += 1
+            else:
+                retry_in = policy.delay(job.attempts) if reason in RETRYABLE else None
+                retried = await asyncio.to_thread(self.queue.fail, job, self.id, str(reason),
+                                                  retry_in=retry_in, result=result)
+                self.stats["retried" if retried else "failed"] += 1
+        finally:
+            self.in_flight.pop(job.id, None)
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                cancelled = await asyncio.to_thread(
+                    self.queue.heartbeat, self.id, list(self.in_flight), kinds=self.kinds,
+                )
+                if cancelled:
+                    logger.info("[WORKER] ⏹ Пачки отменены: %s — начатые задания доделываются", cancelled)
+            except Exception as e:
+                logger.warning("[WORKER] ⚠️ heartbeat: %s", e)
+            await asyncio.sleep(HEARTBEAT_S)
+
+
+def _parse_slots(values) -> Dict[str, int]:
+    out = {}
+    for item in values or []:
+        kind, _, n = item.partition("=")
+        if n.isdigit():
+            out[kind] = int(n)
+    return out
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Воркер очереди заданий tg_zov")
+    parser.add_argument("--kinds", default=",".join(RUNNERS), help="виды заданий через запятую")
+    parser.add_argument("--slots", nargs="*", help="вид=число одновременных заданий")
+    args = parser.parse_args(argv)
+
+    worker = JobWorker(args.kinds.split(","), _parse_slots(args.slots))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except (NotImplementedError, RuntimeError):  # Windows
+            pass
+    await worker.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+    asyncio.run(main())
@@ -1,17 +1,24 @@
 import asyncio
 import json
-import os
 import time
 import base64
 import itertools
 import sys
 import logging
 import inspect
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, Any, List, Optional, Callable, Set
+from typing import Dict, Any, List, Optional, Callable
 from colorama import init
 from playwright.async_api import async_playwright, Error as PWError
 
+from services import persist
+from services.concurrency import ERROR, R403, SKIP, get_limiter
+from services.data_corpus import get_corpus
+from services.job_queue import run_batch
+from services.process_pool import run_sharded
+from services.retry_queue import RetryPolicy, RetryQueue, drain
+
 init(autoreset=True)
 
 # === Настройки ===
@@ -23,9 +30,14 @@ for path in (DATA_DIR, PROFILE_DIR, LOGS_DIR):
     path.mkdir(parents=True, exist_ok=True)
 
 LOG_FILE = LOGS_DIR / "login_refresh.log"
-WORKER_ID = 1
 
-CONCURRENT = 8 #Сколько аккаунтов обрабатывается одновременно
+WORKERS = 2 #Сколько воркеров разбирают общую очередь аккаунтов (у каждого свой адаптивный лимит)
+CONCURRENT = 8 #Сколько аккаунтов обрабатывается одновременно на старте одним воркером (дальше — services.concurrency)
+MAX_CONCURRENT = 16 #Потолок адаптивного лимита воркера
+PROCESSES = 1 #Дочерних процессов (services.process_pool, до DEFAULT_PROCESSES), воркеры делятся между ними; у каждого свой адаптивный лимит
+JOB_QUEUE = False #True — аккаунты ставятся заданиями в services.job_queue (воркеры: python -m services.job_worker)
+CORPUS_TTL = 600 #Воркер очереди перечитывает корпус new_data*.json не реже, чем раз в столько секунд
+RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=60.0, factor=2.0, max_delay=900.0) #Повторы аккаунтов с 403
 DELAY_AFTER_SUCCESS = 1 #Задержка (в секундах) после успешного логина
 NAV_TIMEOUT = 30000 #Таймаут загрузки страницы
 WAIT_AFTER_LOGIN = 5 #Время ожидания после нажатия кнопки «Войти»
@@ -43,8 +55,6 @@ file_handler.setFormatter(formatter)
 logger.addHandler(file_handler)
 logger.propagate = False
 
-file_locks: Dict[str, asyncio.Lock] = {}
-
 _stop_requested = False
 
 def request_stop():
@@ -61,10 +71,7 @@ def is_stop_requested() -> bool:
 
 # === JSON helpers ===
 def atomic_write_json(path: Path, data):
-    tmp = path.with_suffix(path.suffix + ".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    os.replace(str(tmp), str(path))
+    persist.write_json(path, data)
 
 def load_json_safe(path: Path):
     try:
@@ -126,86 +133,19 @@ async def update_account_in_newdata(file_path: Path, original_acc: Dict[str, Any
     Ищет в файле запись аккаунта (по mail+paswd или по UID-ключу) и обновляет
     значение по ключу UID на новый словарь cookies.
     Формат записи в new_dataX.json: {"mail": "...", "paswd": "...", "<UID>": { ...cookies... } }
+    Изменение копится в индексе корпуса (services.data_corpus) и пишется
+    в файл пачкой — под общей per-file блокировкой.
     """
-    key = str(file_path.resolve())
-    lock = file_locks.get(key)
-    if lock is None:
-        lock = asyncio.Lock()
-        file_locks[key] = lock
-
-    async with lock:
-        data = load_json_safe(file_path)
-        if data is None:
-            logger.warning(f"[UPDATE] Не удалось прочитать {file_path.name}")
-            return False
-
-        changed = False
-        if isinstance(data, list):
-            for entry in data:
-                if not isinstance(entry, dict):
-                    continue
-
-                has_uid_key = entry.get(uid) is not None
-                same_creds = (
-                    entry.get("mail") == original_acc.get("mail") and
-                    entry.get("paswd") == original_acc.get("paswd")
-                )
-
-                if has_uid_key or same_creds:
-                    entry[uid] = new_cookies
-                    changed = True
-                    break
-
-        elif isinstance(data, dict) and "accounts" in data and isinstance(data["accounts"], list):
-            for entry in data["accounts"]:
-                if not isinstance(entry, dict):
-                    continue
-                has_uid_key = entry.get(uid) is not None
-                same_creds = (
-                    entry.get("mail") == original_acc.get("mail") and
-                    entry.get("paswd") == original_acc.get("paswd")
-                )
-                if has_uid_key or same_creds:
-                    entry[uid] = new_cookies
-                    changed = True
-                    break
-
-        else:
-            # возможные нетиповые структуры: попробуем найти список
-            found_list = None
-            if isinstance(data, dict):
-                for v in data.values():
-                    if isinstance(v, list):
-                        found_list = v
-                        break
-            if isinstance(found_list, list):
-                for entry in found_list:
-                    if not isinstance(entry, dict):
-                        continue
-                    has_uid_key = entry.get(uid) is not None
-                    same_creds = (
-                        entry.get("mail") == original_acc.get("mail") and
-                        entry.get("paswd") == original_acc.get("paswd")
-                    )
-                    if has_uid_key or same_creds:
-                        entry[uid] = new_cookies
-                        changed = True
-                        break
-
-        if not changed:
-            logger.warning(f"[UPDATE] В {file_path.name} не нашли запись для обновления (uid={uid}, mail={original_acc.get('mail')})")
-            return False
-
-        try:
-            atomic_write_json(file_path, data)
-            logger.info(f"[UPDATE] 🔄 Cookies обновлены в {file_path.name} для UID={uid}")
-            return True
-        except Exception as e:
-            logger.exception(f"[UPDATE] Ошибка перезаписи {file_path.name}: {e}")
-            return False
+    corpus = get_corpus(DATA_DIR)
+    ok = await corpus.update_cookies(uid, new_cookies, original_acc)
+    if not ok:
+        logger.warning(f"[UPDATE] В {file_path.name} не нашли запись для обновления (uid={uid}, mail={original_acc.get('mail')})")
+        return False
+    logger.info(f"[UPDATE] 🔄 Cookies обновлены в {file_path.name} для UID={uid}")
+    return True
 
 # === Логин одного аккаунта ===
-async def process_single_account(playwright, sem, file_path: Path, account: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+async def process_single_account(playwright, limiter, file_path: Path, account: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     mail = account.get("mail") or account.get("email") or account.get("user")
     passwd = account.get("paswd") or account.get("password") or account.get("pass")
 
@@ -213,8 +153,9 @@ async def process_single_account(playwright, sem, file_path: Path, account: Dict
         logger.info(f"[STOP] Пропускаем аккаунт {mail} из-за активного запроса остановки")
         return None
 
-    async with sem:
+    async with limiter.slot() as slot:
         if is_stop_requested():
+            slot.skip()
             logger.info(f"[STOP] Запрос остановки получен перед запуском браузера ({mail})")
             return None
 
@@ -222,6 +163,7 @@ async def process_single_account(playwright, sem, file_path: Path, account: Dict
         passwd = passwd or account.get("paswd") or account.get("password") or account.get("pass")
 
         if not mail or not passwd:
+            slot.skip()
             logger.info(f"[SKIP] в аккаунте нет mail/paswd, пропускаем: {file_path.name} / {mail}")
             return None
 
@@ -366,6 +308,7 @@ async def process_single_account(playwright, sem, file_path: Path, account: Dict
                     pass
 
             if not uid:
+                slot.fail()
                 logger.info(f"[FAIL] {mail} — не найден uid / token, пропускаем.")
                 return None
 
@@ -375,14 +318,17 @@ async def process_single_account(playwright, sem, file_path: Path, account: Dict
                 logger.info(f"[OK] {mail} uid={uid} — куки обновлены в {file_path.name}")
             await asyncio.sleep(DELAY_AFTER_SUCCESS)
             if had_403:
+                slot.fail("403")
                 logger.warning(f"[403] {mail} uid={uid} — требуется повторная попытка")
                 return {"uid": str(uid), "cookies": cookies_flat, "retry_403": True}
             return {"uid": str(uid), "cookies": cookies_flat, "retry_403": False}
 
         except PWError as e:
+            slot.fail(e)
             logger.exception(f"[ERROR] {mail} — playwright error: {e}")
             return None
         except Exception as e:
+            slot.fail(e)
             logger.exception(f"[ERROR] {mail} — {e}")
             return None
         finally:
@@ -394,143 +340,192 @@ async def process_single_account(playwright, sem, file_path: Path, account: Dict
             except Exception:
                 pass
 
+async def _refresh(jobs, worker_ids: List[int], *, stop, on_final):
+    """
+    Воркеры worker_ids в текущем процессе разбирают общую очередь jobs.
+    on_final(worker_id) — аккаунт завершён окончательно.
+    """
+    queue = RetryQueue(
+        jobs, RETRY_POLICY,
+        key=lambda job: job[1].get("mail") or job[1].get("email") or "", name="login_refresh",
+    )
+
+    async with async_playwright() as pw:
+        limiters = {
+            wid: get_limiter(f"login_refresh_{wid}", CONCURRENT, max_limit=MAX_CONCURRENT)
+            for wid in worker_ids
+        }
+
+        def make_worker(wid: int):
+            limiter = limiters[wid]
+
+            async def handle(job):
+                file_path, account = job.item
+                result = await process_single_account(pw, limiter, file_path, account)
+                if result and result.get("retry_403"):
+                    return R403
+                if result is None and stop():
+                    return SKIP
+                return None
+
+            # повторы 403 откладываются с нарастающей задержкой и идут вперемешку со свежими аккаунтами
+            return drain(queue, handle, workers=limiter.max_limit, stop=stop,
+                         on_final=lambda job, reason: on_final(wid))
+
+        await asyncio.gather(*(make_worker(wid) for wid in worker_ids))
+        if stop():
+            logger.info("[REFRESH] Получен запрос остановки. Текущие задачи завершены.")
+        logger.info("[REFRESH] Повторы: %s", queue.stats())
+
+    await get_corpus(DATA_DIR).flush()
+    for wid in worker_ids:
+        logger.info("[WORKER %s] Параллелизм: %s", wid, limiters[wid].stats())
+
+
+async def refresh_shard(items, ctx, worker_ids: List[int]):
+    """Точка входа дочернего процесса (services.process_pool)."""
+    get_corpus(DATA_DIR, rebuild=True)
+    await _refresh(items, worker_ids, stop=ctx.stop_requested,
+                   on_final=lambda wid: ctx.progress(worker=wid))
+
+
+@asynccontextmanager
+async def job_runner():
+    """
+    Ресурсы воркера очереди заданий (services.job_worker): run({"file", "account"}) -> (reason, result).
+    Корпус перечитывается раз в CORPUS_TTL — файлы могли обновить другие узлы.
+    """
+    limiter = get_limiter("login_refresh_jobs", CONCURRENT, max_limit=MAX_CONCURRENT)
+    corpus_at = time.monotonic()
+    get_corpus(DATA_DIR, rebuild=True)
+
+    async with async_playwright() as pw:
+
+        async def run(payload):
+            nonlocal corpus_at
+            if time.monotonic() - corpus_at > CORPUS_TTL:
+                corpus_at = time.monotonic()
+                await get_corpus(DATA_DIR).flush()
+                get_corpus(DATA_DIR, rebuild=True)
+            result = await process_single_account(pw, limiter, Path(payload["file"]), payload["account"])
+            if result is None:
+                return ERROR, None
+            # cookies остаются в корпусе, в очередь — только uid
+            return (R403 if result.get("retry_403") else None), {"uid": result.get("uid")}
+
+        try:
+            yield run
+        finally:
+            await get_corpus(DATA_DIR).flush()
+            logger.info("[REFRESH] Параллелизм воркера очереди: %s", limiter.stats())
+
+
 async def process_all_files(
     progress_callback: Optional[Callable[[int, float, int, int], None]] = None,
+    workers: int = WORKERS,
+    processes: int = PROCESSES,
 ):
+    """
+    Обновляет cookies всех аккаунтов из new_data*.json.
+    workers воркеров берут аккаунты из одной общей очереди (никакого деления
+    файлов пополам): кто освободился — тот и берёт следующий. У каждого воркера
+    свой адаптивный лимит, так что общий параллелизм растёт с числом воркеров.
+    При processes > 1 воркеры разносятся по дочерним процессам
+    (services.process_pool), очередь остаётся общей.
+    progress_callback(worker_id, percent, done, total) вызывается для каждого
+    воркера; total воркера = сделанное им + его доля оставшегося, поэтому
+    сумма total по воркерам равна числу аккаунтов.
+    """
     if not DATA_DIR.exists():
         logger.error(f"Папка не найдена: {DATA_DIR}")
         return 0
 
-    all_files = sorted(DATA_DIR.glob("new_data*.json"))
-    if not all_files:
+    files = sorted(DATA_DIR.glob("new_data*.json"))
+    if not files:
         logger.error("Нет JSON-файлов вида new_data*.json для обработки.")
         return 0
 
-    midpoint = (len(all_files) + 1) // 2
-    files = all_files[:midpoint]
-
-    if not files:
-        logger.info("[WORKER %s] Нет файлов для обработки в первой половине списка.", WORKER_ID)
-        return 0
+    # корпус читается один раз за прогон: из него же берём аккаунты и в него пишем cookies
+    corpus = get_corpus(DATA_DIR, rebuild=True)
 
-    total_accounts = 0
-    file_to_accounts: Dict[Path, List[Dict[str, Any]]] = {}
+    pending_jobs = []
     for file_path in files:
-        data = load_json_safe(file_path)
-        if data is None:
-            continue
-
-        if isinstance(data, list):
-            accounts = data
-        elif isinstance(data, dict) and "accounts" in data:
-            accounts = data["accounts"]
-        elif isinstance(data, dict):
-            accounts = []
-            for v in data.values():
-                if isinstance(v, list):
-                    accounts.extend(v)
-        else:
-            continue
-
-        if accounts:
-            file_to_accounts[file_path] = accounts
-            total_accounts += len(accounts)
+        for acc in corpus.accounts(file_path):
+            if isinstance(acc, dict):
+                pending_jobs.append((file_path, dict(acc)))
 
+    total_accounts = len(pending_jobs)
     if total_accounts == 0:
         logger.error("Нет аккаунтов для обработки.")
         return 0
 
+    workers = max(1, min(workers, total_accounts))
+    processes = max(1, min(processes, workers))
+    worker_ids = list(range(1, workers + 1))
+    done_by_worker = {wid: 0 for wid in worker_ids}
     completed = 0
     start_time = time.time()
     spinner = itertools.cycle(["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"])
+    logger.info("[REFRESH] Аккаунтов: %s, файлов: %s, воркеров: %s, процессов: %s",
+                total_accounts, len(files), workers, processes)
 
-    async def _maybe_call_progress(percent_value: float, done_value: int, total_value: int):
+    async def _report_progress():
         if not progress_callback:
             return
-        try:
-            result = progress_callback(WORKER_ID, percent_value, done_value, total_value)
-            if inspect.isawaitable(result):
-                await result
-        except Exception:
-            pass
-
-    pending_jobs = []
-    for file_path, accounts in file_to_accounts.items():
-        for acc in accounts:
-            pending_jobs.append((file_path, acc))
-
-    async with async_playwright() as pw:
-        sem = asyncio.Semaphore(CONCURRENT)
-
-        async def process_jobs(jobs, allow_retry: bool):
-            nonlocal completed
-            retry_jobs = []
-            job_iter = iter(jobs)
-            running_tasks: Dict[asyncio.Task, tuple[Path, Dict[str, Any]]] = {}
-            submissions_finished = False
-            stop_announced = False
-
-            while True:
-                if not stop_announced and is_stop_requested():
-                    stop_announced = True
-                    logger.info("[WORKER %s] Получен запрос остановки. Дожидаемся текущие задачи.", WORKER_ID)
-
-                while not stop_announced and len(running_tasks) < CONCURRENT and not submissions_finished:
-                    try:
-                        file_path, account = next(job_iter)
-                    except StopIteration:
-                        submissions_finished = True
-                        break
-                    task = asyncio.create_task(process_single_account(pw, sem, file_path, account))
-                    running_tasks[task] = (file_path, account)
-
-                if not running_tasks:
-                    if submissions_finished or stop_announced:
-                        break
-                    await asyncio.sleep(0.1)
-                    continue
-
-                done, pending = await asyncio.wait(running_tasks.keys(), return_when=asyncio.FIRST_COMPLETED)
-
-                for finished in done:
-                    file_path, account = running_tasks.pop(finished, (None, None))
-                    try:
-                        result = finished.result()
-                        if result and result.get("retry_403") and allow_retry and file_path and account:
-                            retry_jobs.append((file_path, account))
-                    except Exception:
-                        pass
-
-                    completed += 1
-                    percent = completed / total_accounts if total_accounts else 0
-                    filled = int(percent * 20)
-                    bar = "█" * filled + "-" * (20 - filled)
-
-                    elapsed = time.time() - start_time
-                    est_total = elapsed / completed * total_accounts if completed else 0
-                    remaining = max(est_total - elapsed, 0)
-                    spinner_icon = next(spinner)
-
-                    sys.stdout.write(
-                        f"\r{spinner_icon} [{bar}] {percent * 100:5.1f}% | {completed:3d}/{total_accounts} | Осталось ~{remaining:5.1f} сек"
-                    )
-                    sys.stdout.flush()
+        remaining = total_accounts - completed
+        share, extra = divmod(remaining, workers)
+        for idx, wid in enumerate(worker_ids):
+            done = done_by_worker[wid]
+            total = done + share + (1 if idx < extra else 0)
+            try:
+                result = progress_callback(wid, done / total if total else 1.0, done, total)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                pass
 
-                    await _maybe_call_progress(percent, completed, total_accounts)
+    async def on_final(wid: int):
+        nonlocal completed
+        completed += 1
+        done_by_worker[wid] += 1
+        percent = completed / total_accounts
+        filled = int(percent * 20)
+        bar = "█" * filled + "-" * (20 - filled)
 
-                if submissions_finished and not running_tasks:
-                    break
+        elapsed = time.time() - start_time
+        est_total = elapsed / completed * total_accounts
+        remaining = max(est_total - elapsed, 0)
+        spinner_icon = next(spinner)
 
-            return retry_jobs
+        sys.stdout.write(
+            f"\r{spinner_icon} [{bar}] {percent * 100:5.1f}% | {completed:3d}/{total_accounts} | Осталось ~{remaining:5.1f} сек"
+        )
+        sys.stdout.flush()
+
+        await _report_progress()
+
+    if JOB_QUEUE:
+        # аккаунты разбирают воркеры очереди (на любых узлах); прогресс — одной строкой
+        workers, worker_ids, done_by_worker = 1, [1], {1: 0}
+        await run_batch(
+            "cookie_refresh",
+            [(account.get("mail") or account.get("email") or "", {"file": str(file_path), "account": account})
+             for file_path, account in pending_jobs],
+            max_attempts=RETRY_POLICY.max_attempts, stop=is_stop_requested,
+            on_done=lambda job: job["status"] != "cancelled" and on_final(1),
+        )
+    elif processes > 1:
+        # воркеры поровну по процессам; аккаунты — из общей очереди пачками
+        await run_sharded(
+            "services.login_and_refresh:refresh_shard", pending_jobs, processes=processes,
+            stop=is_stop_requested, on_progress=lambda _child, msg: on_final(msg["worker"]),
+            kwargs_for=lambda child, count: {"worker_ids": worker_ids[child - 1::count]},
+        )
+    else:
+        await _refresh(pending_jobs, worker_ids, stop=is_stop_requested, on_final=on_final)
 
-        batch_size = 100
-        for batch_start in range(0, len(pending_jobs), batch_size):
-            if is_stop_requested():
-                break
-            batch = pending_jobs[batch_start:batch_start + batch_size]
-            retry_jobs = await process_jobs(batch, allow_retry=True)
-            if retry_jobs and not is_stop_requested():
-                await process_jobs(retry_jobs, allow_retry=False)
+    for wid in worker_ids:
+        logger.info("[WORKER %s] Аккаунтов: %s", wid, done_by_worker[wid])
 
     total_time = time.time() - start_time
     if completed >= total_accounts:
@@ -543,7 +538,7 @@ async def process_all_files(
         )
     sys.stdout.flush()
 
-    await _maybe_call_progress(min(completed / total_accounts if total_accounts else 0, 1.0), completed, total_accounts)
+    await _report_progress()
 
     return completed
 
@@ -1,17 +1,18 @@
 import asyncio
 import json
 import logging
-import random
 from pathlib import Path
 from typing import Optional, Callable
 from playwright.async_api import async_playwright
 from services.browser_patches import (
-    BROWSER_PATH,
-    get_random_browser_profile,
-    launch_masked_persistent_context,
+    BrowserPool,
+    get_browser_pool,
     cookies_to_playwright,
 )
-from services.cookies_io import load_all_cookies, save_all_cookies
+from services.cookies_io import load_all_cookies
+from services.rate_limit import throttle
+from services import cookie_store
+from services.daily_ledger import records_daily
 
 # === Настройки ===
 FAIL_DIR = Path("data/fails/lucky_wheel")
@@ -21,7 +22,6 @@ URL = "https://event-eu-cc.igg.com/event/lucky_wheel/"
 API = "https://event-eu-cc.igg.com/event/lucky_wheel/ajax.req.php?action=lottery&times=1"
 
 CONCURRENT = 3
-DELAY_BETWEEN_ACCOUNTS = 3
 REQUEST_TIMEOUT = 35000
 
 logger = logging.getLogger("lucky_wheel_auto")
@@ -53,24 +53,21 @@ async def save_response(uid: str, data: dict):
 
 
 # ───────────────────────── core ─────────────────────────
-async def process_account(p, user_id: str, uid: str, cookies: dict, send_callback: Optional[Callable] = None):
+async def process_account(pool: BrowserPool, user_id: str, uid: str, cookies: dict, send_callback: Optional[Callable] = None) -> bool:
+    """True — попытки вращения на сегодня закончились."""
     context = page = None
+    exhausted = False
     try:
         logger.info(f"[{uid}] 🎡 Начинаю вращение колеса фортуны")
 
-        ctx = await launch_masked_persistent_context(
-            p,
-            user_data_dir=f"data/chrome_profiles/{uid}_wheel",
-            browser_path=BROWSER_PATH,
-            headless=True,
-            slow_mo=30,
-            profile=get_random_browser_profile(),
-        )
+        ctx = await pool.new_session(policy="api-only", label=uid)
         context, page = ctx["context"], ctx["page"]
 
         await context.add_cookies(cookies_to_playwright(cookies))
+        # темп заходов и lottery — services.rate_limit (вместо фиксированных пауз)
+        await throttle(URL, "page")
         await page.goto(URL, wait_until="domcontentloaded", timeout=REQUEST_TIMEOUT)
-        await asyncio.sleep(random.uniform(1.5, 3.0))
+        await throttle(API)
 
         # 🌀 Отправляем запрос lottery
         js = f"""
@@ -100,6 +97,7 @@ async def process_account(p, user_id: str, uid: str, cookies: dict, send_callbac
             # 🎯 Нет попыток
             if err == 10 or (status == 0 and data == []):
                 reward_text = "🚫 Попытки вращения закончились."
+                exhausted = True
             # 🎁 Есть награда
             elif isinstance(data, dict) and "rewards" in data:
                 rewards = data.get("rewards", [])
@@ -122,9 +120,7 @@ async def process_account(p, user_id: str, uid: str, cookies: dict, send_callbac
         fresh = await context.cookies()
         fresh_map = {c["name"]: c["value"] for c in fresh if "name" in c and "value" in c}
         if fresh_map:
-            cookies_db = load_all_cookies()
-            cookies_db.setdefault(str(user_id), {}).setdefault(str(uid), {}).update(fresh_map)
-            save_all_cookies(cookies_db)
+            cookie_store.put_cookies(user_id, uid, fresh_map, merge=True)
             logger.info(f"[{uid}] 🔄 Cookies обновлены")
 
     except Exception as e:
@@ -141,20 +137,24 @@ async def process_account(p, user_id: str, uid: str, cookies: dict, send_callbac
                 await context.close()
         except Exception:
             pass
-        await asyncio.sleep(DELAY_BETWEEN_ACCOUNTS)
+    return exhausted
 
 
 # ───────────────────────── core (existing context) ─────────────────────────
-async def process_account_in_context(context, user_id: str, uid: str, cookies: dict, send_callback: Optional[Callable] = None):
+async def process_account_in_context(context, user_id: str, uid: str, cookies: dict, send_callback: Optional[Callable] = None) -> bool:
+    """True — попытки вращения на сегодня закончились."""
     page = None
+    exhausted = False
     try:
         logger.info(f"[{uid}] 🎡 Начинаю вращение колеса фортуны (reuse context)")
         page = await context.new_page()
 
         if cookies:
             await context.add_cookies(cookies_to_playwright(cookies))
+        # темп заходов и lottery — services.rate_limit (вместо фиксированных пауз)
+        await throttle(URL, "page")
         await page.goto(URL, wait_until="domcontentloaded", timeout=REQUEST_TIMEOUT)
-        await asyncio.sleep(random.uniform(1.5, 3.0))
+        await throttle(API)
 
         js = f"""
             async () => {{
@@ -181,6 +181,7 @@ async def process_account_in_context(context, user_id: str, uid: str, cookies: d
 
             if err == 10 or (status == 0 and data == []):
                 reward_text = "🚫 Попытки вращения закончились."
+                exhausted = True
             elif isinstance(data, dict) and "rewards" in data:
                 rewards = data.get("rewards", [])
                 if rewards and isinstance(rewards[0], dict):
@@ -206,10 +207,11 @@ async def process_account_in_context(context, user_id: str, uid: str, cookies: d
                 await page.close()
         except Exception:
             pass
-        await asyncio.sleep(DELAY_BETWEEN_ACCOUNTS)
+    return exhausted
 
 
 # ───────────────────────── main ─────────────────────────
+@records_daily("lucky_wheel")
 async def run_lucky_wheel(
     user_id: Optional[str] = None,
     uid: Optional[str] = None,
@@ -221,11 +223,9 @@ async def run_lucky_wheel(
     - если переданы user_id и uid → обрабатывается только один аккаунт (для event_manager)
     - если не переданы → обрабатываются все аккаунты (для кнопки вручную)
     """
-    cookies_db = load_all_cookies()
-
     # 🔹 режим одиночного аккаунта
     if user_id and uid:
-        cookies = cookies_db.get(str(user_id), {}).get(str(uid))
+        cookies = cookie_store.get_cookies(user_id, uid)
         if not cookies:
             msg = f"⚠️ Не найдены cookies для {uid}"
             logger.warning(msg)
@@ -233,13 +233,12 @@ async def run_lucky_wheel(
                 await send_callback(uid, msg)
             return {"success": False, "message": msg}
         if context:
-            await process_account_in_context(context, user_id, uid, cookies, send_callback)
+            exhausted = await process_account_in_context(context, user_id, uid, cookies, send_callback)
         else:
-            async with async_playwright() as p:
-                await process_account(p, user_id, uid, cookies, send_callback)
+            exhausted = await process_account(get_browser_pool(), user_id, uid, cookies, send_callback)
         if send_callback:
             await send_callback(uid, "✅ Колесо фортуны завершено.")
-        return {"success": True, "message": "✅ Колесо фортуны завершено."}
+        return {"success": True, "daily_done": exhausted, "message": "✅ Колесо фортуны завершено."}
 
     # 🔹 режим массового автозапуска (без параметров)
     accounts = pick_all_accounts_from_cookies()
@@ -253,12 +252,15 @@ async def run_lucky_wheel(
 
     sem = asyncio.Semaphore(CONCURRENT)
     async with async_playwright() as p:
+        pool = BrowserPool(p, max_contexts=CONCURRENT, slow_mo=30)
+
         async def worker(user_id, uid, cookies):
             async with sem:
-                await process_account(p, user_id, uid, cookies, send_callback)
+                await process_account(pool, user_id, uid, cookies, send_callback)
 
         tasks = [asyncio.create_task(worker(*acc)) for acc in accounts]
         await asyncio.gather(*tasks)
+        await pool.close()
 
     logger.info("✅ Колесо фортуны завершено для всех аккаунтов.")
     if send_callback:
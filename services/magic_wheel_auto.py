@@ -1,19 +1,18 @@
 import asyncio
 import json
 import logging
-import random
 from pathlib import Path
 from typing import Optional, Callable
 
 from playwright.async_api import async_playwright
 
 from services.browser_patches import (
-    BROWSER_PATH,
-    get_random_browser_profile,
-    launch_masked_persistent_context,
+    BrowserPool,
     cookies_to_playwright,
 )
-from services.cookies_io import load_all_cookies, save_all_cookies
+from services.cookies_io import load_all_cookies
+from services.rate_limit import throttle
+from services import cookie_store
 
 FAIL_DIR = Path("data/fails/magic_wheel")
 FAIL_DIR.mkdir(parents=True, exist_ok=True)
@@ -22,7 +21,6 @@ URL = "https://event-eu-cc.igg.com/event/double_turntable/"
 API = "https://event-eu-cc.igg.com/event/double_turntable/ajax.req.php?action=lottery&times=1"
 
 CONCURRENT = 3
-DELAY_BETWEEN_ACCOUNTS = 3
 REQUEST_TIMEOUT = 35000
 
 logger = logging.getLogger("magic_wheel_auto")
@@ -75,23 +73,18 @@ def _parse_reward_text(response: dict) -> str:
     return f"⚠️ Неизвестный ответ: {response}"
 
 
-async def process_account(p, user_id: str, uid: str, cookies: dict, send_callback: Optional[Callable] = None):
+async def process_account(pool: BrowserPool, user_id: str, uid: str, cookies: dict, send_callback: Optional[Callable] = None):
     context = page = None
     try:
         logger.info(f"[{uid}] 🎡 Запуск 'Магического колеса'")
-        ctx = await launch_masked_persistent_context(
-            p,
-            user_data_dir=f"data/chrome_profiles/{uid}_magic_wheel",
-            browser_path=BROWSER_PATH,
-            headless=True,
-            slow_mo=30,
-            profile=get_random_browser_profile(),
-        )
+        ctx = await pool.new_session(policy="api-only", label=uid)
         context, page = ctx["context"], ctx["page"]
 
         await context.add_cookies(cookies_to_playwright(cookies))
+        # темп заходов и lottery — services.rate_limit (вместо фиксированных пауз)
+        await throttle(URL, "page")
         await page.goto(URL, wait_until="domcontentloaded", timeout=REQUEST_TIMEOUT)
-        await asyncio.sleep(random.uniform(1.5, 3.0))
+        await throttle(API)
 
         js = f"""
             async () => {{
@@ -119,9 +112,7 @@ async def process_account(p, user_id: str, uid: str, cookies: dict, send_callbac
         fresh = await context.cookies()
         fresh_map = {c["name"]: c["value"] for c in fresh if "name" in c and "value" in c}
         if fresh_map:
-            cookies_db = load_all_cookies()
-            cookies_db.setdefault(str(user_id), {}).setdefault(str(uid), {}).update(fresh_map)
-            save_all_cookies(cookies_db)
+            cookie_store.put_cookies(user_id, uid, fresh_map, merge=True)
             logger.info(f"[{uid}] 🔄 Cookies обновлены")
 
     except Exception as e:
@@ -136,7 +127,6 @@ async def process_account(p, user_id: str, uid: str, cookies: dict, send_callbac
                 await context.close()
         except Exception:
             pass
-        await asyncio.sleep(DELAY_BETWEEN_ACCOUNTS)
 
 
 async def run_magic_wheel(
@@ -158,12 +148,15 @@ async def run_magic_wheel(
 
     sem = asyncio.Semaphore(CONCURRENT)
     async with async_playwright() as p:
+        pool = BrowserPool(p, max_contexts=CONCURRENT, slow_mo=30)
+
         async def worker(owner_id: str, uid: str, cookies: dict):
             async with sem:
-                await process_account(p, owner_id, uid, cookies, send_callback)
+                await process_account(pool, owner_id, uid, cookies, send_callback)
 
         tasks = [asyncio.create_task(worker(*acc)) for acc in accounts]
         await asyncio.gather(*tasks)
+        await pool.close()
 
     done_msg = "✅ Магическое колесо завершено."
     if send_callback:
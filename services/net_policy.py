@@ -0,0 +1,232 @@
+# tg_zov/services/net_policy.py
+"""
+🚦 Единые политики перехвата сетевых запросов + учёт сэкономленного
+
+Раньше блокировка ресурсов была у каждого своя: event_checker резал
+image/media/font/websocket и аналитику, фермы пазлов — только image/media/font,
+а run_event_with_browser не резал ничего. Сколько это экономит — не знал никто.
+
+Политики (применяются к контексту целиком — context.route, все страницы):
+  • "full"         — ничего не блокируется (только учёт);
+  • "render-light" — без картинок, видео, шрифтов, websocket и трекеров;
+    вёрстка и скрипты грузятся, клики по элементам работают;
+  • "api-only"     — только документ, скрипты и XHR/fetch: для сценариев,
+    где страница нужна лишь как источник cookies/origin для fetch().
+
+Трекеры узнаются по хосту: ключевое слово должно совпасть с меткой домена
+или словом в ней ("ads" режет ads.example.com, но не /uploads/ или
+downloads.igg.com). XHR/fetch к origin страницы акции (origin документа
+главного фрейма, плюс origins из apply_policy) по ключевым словам не режутся
+никогда — это API самой акции.
+
+Каждый «прогон» (контекст от применения политики до закрытия) считает
+разрешённые запросы и байты (по Content-Length) и заблокированные запросы
+по типам; итоги копятся по политикам — policy_stats().
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("net_policy")
+
+TRACKER_KEYWORDS: Tuple[str, ...] = (
+    "analytics", "google-analytics", "googletagmanager", "doubleclick",
+    "facebook", "fbcdn", "hotjar", "clarity", "yandex", "metrika", "ads", "tracking",
+)
+
+API_TYPES = frozenset({"xhr", "fetch"})
+
+_HOST_WORD_SPLIT = re.compile(r"[.\-]")
+
+
+def url_origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def is_tracker_host(host: str, keywords: Iterable[str] = TRACKER_KEYWORDS) -> bool:
+    """Ключевое слово совпадает с меткой хоста (google-analytics.com) или словом в ней (ads-eu.x.com)."""
+    host = (host or "").lower()
+    tokens = set(host.split(".")) | set(_HOST_WORD_SPLIT.split(host))
+    return any(k in tokens for k in keywords)
+
+
+@dataclass(frozen=True)
+class InterceptionPolicy:
+    name: str
+    block_types: FrozenSet[str] = frozenset()
+    allow_types: Optional[FrozenSet[str]] = None   # если задано — всё остальное блокируется
+    block_keywords: Tuple[str, ...] = ()
+
+    def blocks(self, resource_type: str, url: str, first_party: bool = False) -> bool:
+        """first_party — запрос идёт на origin страницы акции."""
+        if self.allow_types is not None and resource_type not in self.allow_types:
+            return True
+        if resource_type in self.block_types:
+            return True
+        if first_party and resource_type in API_TYPES:
+            return False
+        if self.block_keywords and resource_type != "document":
+            return is_tracker_host(urlsplit(url).hostname or "", self.block_keywords)
+        return False
+
+
+POLICIES: Dict[str, InterceptionPolicy] = {
+    "full": InterceptionPolicy("full"),
+    "render-light": InterceptionPolicy(
+        "render-light",
+        block_types=frozenset({"image", "media", "font", "websocket"}),
+        block_keywords=TRACKER_KEYWORDS,
+    ),
+    "api-only": InterceptionPolicy(
+        "api-only",
+        allow_types=frozenset({"document", "script", "xhr", "fetch"}),
+        block_keywords=TRACKER_KEYWORDS,
+    ),
+}
+
+DEFAULT_POLICY = "render-light"
+
+
+def get_policy(policy: Union[str, InterceptionPolicy, None]) -> InterceptionPolicy:
+    if isinstance(policy, InterceptionPolicy):
+        return policy
+    try:
+        return POLICIES[policy or DEFAULT_POLICY]
+    except KeyError:
+        raise ValueError(f"Неизвестная политика перехвата: {policy!r}") from None
+
+
+@dataclass
+class NetStats:
+    """Учёт одного прогона (одного контекста)."""
+    policy: str
+    label: str = ""
+    started: float = field(default_factory=time.perf_counter)
+    finished: Optional[float] = None
+    allowed: int = 0
+    allowed_bytes: int = 0
+    blocked: int = 0
+    blocked_by_type: Dict[str, int] = field(default_factory=dict)
+    bytes_by_type: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "label": self.label,
+            "seconds": round(self.seconds, 2),
+            "allowed": self.allowed,
+            "allowed_kb": round(self.allowed_bytes / 1024, 1),
+            "blocked": self.blocked,
+            "blocked_by_type": dict(self.blocked_by_type),
+        }
+
+
+# ───── итоги по политикам (на процесс) ─────
+_totals: Dict[str, Dict[str, Any]] = {}
+_totals_lock = threading.Lock()
+
+
+def _account(stats: NetStats):
+    with _totals_lock:
+        t = _totals.setdefault(stats.policy, {
+            "runs": 0, "seconds": 0.0, "allowed": 0, "allowed_bytes": 0,
+            "blocked": 0, "blocked_by_type": {},
+        })
+        t["runs"] += 1
+        t["seconds"] += stats.seconds
+        t["allowed"] += stats.allowed
+        t["allowed_bytes"] += stats.allowed_bytes
+        t["blocked"] += stats.blocked
+        for rtype, n in stats.blocked_by_type.items():
+            t["blocked_by_type"][rtype] = t["blocked_by_type"].get(rtype, 0) + n
+
+
+def policy_stats() -> Dict[str, Dict[str, Any]]:
+    """Сводка по политикам: сколько прогонов, среднее время, средний объём, что блокировалось."""
+    with _totals_lock:
+        out = {}
+        for name, t in _totals.items():
+            runs = max(t["runs"], 1)
+            out[name] = {
+                "runs": t["runs"],
+                "avg_seconds": round(t["seconds"] / runs, 2),
+                "avg_kb": round(t["allowed_bytes"] / runs / 1024, 1),
+                "avg_requests": round(t["allowed"] / runs, 1),
+                "avg_blocked": round(t["blocked"] / runs, 1),
+                "blocked_by_type": dict(t["blocked_by_type"]),
+            }
+        return out
+
+
+def reset_policy_stats():
+    with _totals_lock:
+        _totals.clear()
+
+
+# ───── применение ─────
+async def apply_policy(context, policy: Union[str, InterceptionPolicy, None] = None,
+                       label: str = "", origins: Iterable[str] = ()) -> NetStats:
+    """
+    Вешает политику на весь контекст и начинает учёт.
+    origins — заранее известные origin страниц акций; к ним добавляются
+    origin документов главного фрейма по мере навигации.
+    Итоги прогона попадают в policy_stats() при закрытии контекста.
+    """
+    pol = get_policy(policy)
+    stats = NetStats(pol.name, label)
+    first_party: Set[str] = {url_origin(o) for o in origins}
+
+    async def _route(route):
+        request = route.request
+        rtype = request.resource_type
+        try:
+            origin = url_origin(request.url)
+            if rtype == "document" and request.frame.parent_frame is None:
+                first_party.add(origin)
+            if pol.blocks(rtype, request.url, first_party=origin in first_party):
+                stats.blocked += 1
+                stats.blocked_by_type[rtype] = stats.blocked_by_type.get(rtype, 0) + 1
+                await route.abort()
+            else:
+                await route.continue_()
+        except Exception:
+            pass  # страница/контекст уже закрыты
+
+    def _on_response(response):
+        try:
+            size = int(response.headers.get("content-length") or 0)
+            rtype = response.request.resource_type
+        except Exception:
+            size, rtype = 0, "other"
+        stats.allowed += 1
+        stats.allowed_bytes += size
+        stats.bytes_by_type[rtype] = stats.bytes_by_type.get(rtype, 0) + size
+
+    def _on_close(_context):
+        if stats.finished is not None:
+            return
+        stats.finished = time.perf_counter()
+        _account(stats)
+        logger.debug(
+            "[NET] %s %s: разрешено %s (%.1f КБ), заблокировано %s %s за %.2f с",
+            pol.name, label, stats.allowed, stats.allowed_bytes / 1024,
+            stats.blocked, stats.blocked_by_type, stats.seconds,
+        )
+
+    if pol.name != "full":
+        await context.route("**/*", _route)
+    context.on("response", _on_response)
+    context.on("close", _on_close)
+    return stats
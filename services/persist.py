@@ -0,0 +1,215 @@
+# tg_zov/services/persist.py
+"""
+💾 Общий слой сохранения JSON-файлов, безопасный между процессами
+
+Одни и те же файлы (new_data*.json, puzzle_claim_log.json, puzzle_summary.json,
+user_accounts.json, cookies.json) пишут бот, lr1/lr2 и фермы пазлов — раньше
+каждый модуль делал это сам через open(..., "w") или свой os.replace,
+а блокировки (file_locks) действовали только внутри одного модуля.
+
+Здесь:
+  • locked(path) — advisory-блокировка fcntl.flock на соседнем файле <path>.lock
+    (сам файл подменяется через os.replace, поэтому блокировать его нельзя);
+    повторный захват тем же потоком не блокирует;
+  • write_json(path, data) — запись во временный файл, fsync, os.replace;
+  • transaction(path, default) — чтение → правка → запись под одной блокировкой:
+    параллельные read-modify-write больше не теряют чужие изменения;
+  • fsync_batch() — внутри блока fsync откладывается и делается один раз
+    на каждый файл/папку при выходе (для пачек записей).
+
+Где fcntl недоступен (Windows), блокировка работает только внутри процесса.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Set, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger("persist")
+
+PathLike = Union[str, Path]
+
+_thread_locks: Dict[str, threading.RLock] = {}
+_thread_locks_guard = threading.Lock()
+_local = threading.local()
+
+
+def _key(path: PathLike) -> str:
+    return os.path.abspath(str(path))
+
+
+def _thread_lock(key: str) -> threading.RLock:
+    with _thread_locks_guard:
+        lock = _thread_locks.get(key)
+        if lock is None:
+            lock = _thread_locks[key] = threading.RLock()
+        return lock
+
+
+def _held() -> Dict[str, int]:
+    held = getattr(_local, "held", None)
+    if held is None:
+        held = _local.held = {}
+    return held
+
+
+# ───────────────────────── блокировки ─────────────────────────
+@contextmanager
+def locked(path: PathLike, shared: bool = False) -> Iterator[None]:
+    """
+    Блокировка файла между процессами (и потоками этого процесса).
+    shared=True — разделяемая блокировка для чтения.
+    """
+    key = _key(path)
+    held = _held()
+    if held.get(key):
+        # уже держим в этом потоке — вложенный захват
+        held[key] += 1
+        try:
+            yield
+        finally:
+            held[key] -= 1
+        return
+
+    tlock = _thread_lock(key)
+    with tlock:
+        fd = None
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(key) or ".", exist_ok=True)
+            fd = os.open(key + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        held[key] = 1
+        try:
+            yield
+        finally:
+            held.pop(key, None)
+            if fd is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                finally:
+                    os.close(fd)
+
+
+# ───────────────────────── fsync ─────────────────────────
+def _batch() -> Set[str]:
+    return getattr(_local, "batch", None)
+
+
+def _fsync_path(path: str):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # каталоги на некоторых ФС/ОС fsync не поддерживают
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def fsync_batch() -> Iterator[None]:
+    """Откладывает fsync всех write_json внутри блока до выхода из него."""
+    if _batch() is not None:
+        yield
+        return
+    _local.batch = set()
+    try:
+        yield
+    finally:
+        paths, _local.batch = _local.batch, None
+        dirs = {os.path.dirname(p) or "." for p in paths}
+        for p in paths:
+            _fsync_path(p)
+        for d in dirs:
+            _fsync_path(d)
+        if paths:
+            logger.debug("[PERSIST] fsync пачки: файлов %s", len(paths))
+
+
+# ───────────────────────── чтение / запись ─────────────────────────
+def read_json(path: PathLike, default: Any = None) -> Any:
+    """Читает JSON под разделяемой блокировкой. При ошибке — default."""
+    path = Path(path)
+    if not path.exists():
+        return default
+    try:
+        with locked(path, shared=True):
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        logger.warning(f"[PERSIST] ⚠️ Не удалось прочитать {path}: {e}")
+        return default
+
+
+def _write_locked(path: Path, data: Any, indent: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # имя временного файла уникально для процесса/потока — параллельные писатели не мешают друг другу
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    batch = _batch()
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            if batch is None:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if batch is None:
+        _fsync_path(str(path.parent))
+    else:
+        batch.add(str(path))
+
+
+def write_json(path: PathLike, data: Any, indent: int = 2):
+    """Атомарная запись JSON (tmp + fsync + os.replace) под эксклюзивной блокировкой."""
+    path = Path(path)
+    with locked(path):
+        _write_locked(path, data, indent)
+
+
+@contextmanager
+def transaction(path: PathLike, default: Any = None, indent: int = 2) -> Iterator[Any]:
+    """
+    Read-modify-write под одной эксклюзивной блокировкой:
+
+        with transaction(path, {}) as data:
+            data["x"] = 1
+
+    Правки вносятся в выданный объект на месте; при выходе без исключения
+    файл перезаписывается (если содержимое изменилось).
+    """
+    path = Path(path)
+    with locked(path):
+        data = default
+        raw = None
+        if path.exists():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    raw = f.read()
+                data = json.loads(raw) if raw.strip() else default
+            except Exception as e:
+                logger.warning(f"[PERSIST] ⚠️ {path} повреждён, начинаем с пустого: {e}")
+                data = default
+        if data is None:
+            data = {}
+        before = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        yield data
+        if raw is None or json.dumps(data, ensure_ascii=False, sort_keys=True) != before:
+            _write_locked(path, data, indent)
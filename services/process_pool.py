@@ -0,0 +1,216 @@
+# tg_zov/services/process_pool.py
+"""
+🧵 Многопроцессный бэкенд для ферм с браузером
+
+Вся работа Playwright (puzzle2_auto, puzzle3_auto, login_and_refresh) шла
+в одном процессе и одном event loop вместе с ботом. После десятка-другого
+контекстов упор — одно ядро: разбор CDP-сообщений, JSON, логирование.
+
+run_sharded("services.x:shard_fn", items, processes=N):
+  • N дочерних процессов (spawn — у каждого свой драйвер Playwright и свой loop);
+  • аккаунты раздаются пачками (CHUNK) из общей очереди задач: процесс,
+    который освободился, берёт следующую пачку — медленный процесс не держит
+    остальных;
+  • shard_fn(items, ctx) в дочернем процессе — корутина; items — асинхронный
+    итератор по аккаунтам (следующая пачка ждётся в потоке, event loop
+    процесса не блокируется; RetryQueue принимает его как обычный список), ctx.progress(...) / ctx.result(...) отправляют сообщения
+    родителю, ctx.stop_requested() — общий флаг остановки;
+  • родитель читает очередь сообщений, вызывает on_progress / on_result и
+    переводит свой stop() (STOP_EVENT фермы) в multiprocessing.Event —
+    остановка доходит до каждого процесса;
+  • темп запросов (services.rate_limit) в каждом процессе делится на N:
+    суммарная частота к хосту остаётся прежней.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib
+import inspect
+import logging
+import multiprocessing as mp
+import os
+import queue as queue_mod
+import time
+import traceback
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("process_pool")
+
+DEFAULT_PROCESSES = max(1, min(4, os.cpu_count() or 1))
+CHUNK = 20              # аккаунтов в одной пачке из очереди задач
+POLL = 0.5              # сек. ожидания сообщения (и между проверками stop())
+STOP_GRACE = 60.0       # сек. на мягкую остановку при отмене, потом terminate()
+
+_MP = mp.get_context("spawn")
+
+
+class ChildContext:
+    """Связь дочернего процесса с родителем."""
+
+    def __init__(self, child_id: int, processes: int, tasks, messages, stop_event):
+        self.child_id = child_id
+        self.processes = processes
+        self._tasks = tasks
+        self._messages = messages
+        self._stop = stop_event
+
+    async def items(self) -> AsyncIterator[Any]:
+        """Аккаунты из общей очереди, пачка за пачкой, до метки конца или остановки."""
+        while not self._stop.is_set():
+            # get() блокирующий: в потоке, чтобы аккаунты в работе не стояли, пока родитель отдаёт пачку
+            chunk = await asyncio.to_thread(self._tasks.get)
+            if chunk is None:
+                return
+            for item in chunk:
+                yield item
+
+    def stop_requested(self) -> bool:
+        return self._stop.is_set()
+
+    def progress(self, **payload):
+        self._messages.put(("progress", self.child_id, payload))
+
+    def result(self, payload: Any):
+        self._messages.put(("result", self.child_id, payload))
+
+
+def _resolve(target: str) -> Callable:
+    module, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def _child_main(target: str, child_id: int, processes: int, tasks, messages, stop_event,
+                kwargs: Dict[str, Any]):
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s [P{child_id}] %(name)s %(levelname)s: %(message)s",
+    )
+    ctx = ChildContext(child_id, processes, tasks, messages, stop_event)
+    try:
+        from services.rate_limit import get_rate_limiter
+        get_rate_limiter().scale(1.0 / processes)
+
+        fn = _resolve(target)
+        value = asyncio.run(fn(ctx.items(), ctx, **kwargs))
+        messages.put(("done", child_id, value))
+    except BaseException as e:
+        messages.put(("error", child_id, f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+
+
+def _get(messages, timeout: float):
+    try:
+        return messages.get(timeout=timeout)
+    except queue_mod.Empty:
+        return None
+
+
+async def _call(callback, *args):
+    if callback is None:
+        return
+    try:
+        result = callback(*args)
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logger.warning("[PROC] ⚠️ Ошибка обработчика сообщения: %s", e)
+
+
+async def run_sharded(
+    target: str,
+    items: Iterable[Any],
+    *,
+    processes: int = DEFAULT_PROCESSES,
+    chunk: int = CHUNK,
+    stop: Optional[Callable[[], bool]] = None,
+    on_progress: Optional[Callable[[int, Dict[str, Any]], Any]] = None,
+    on_result: Optional[Callable[[int, Any], Any]] = None,
+    kwargs: Optional[Dict[str, Any]] = None,
+    kwargs_for: Optional[Callable[[int, int], Dict[str, Any]]] = None,
+) -> List[Any]:
+    """
+    Раздаёт items processes дочерним процессам и ждёт их завершения.
+    kwargs — доп. аргументы shard_fn; kwargs_for(child_id, processes) — свои для каждого процесса.
+    Возвращает значения shard_fn по процессам (для упавшего процесса — RuntimeError).
+    """
+    items = list(items)
+    processes = max(1, min(processes, (len(items) + chunk - 1) // chunk or 1))
+    tasks, messages, stop_event = _MP.Queue(), _MP.Queue(), _MP.Event()
+    for i in range(0, len(items), chunk):
+        tasks.put(items[i:i + chunk])
+    for _ in range(processes):
+        tasks.put(None)
+
+    procs = {
+        cid: _MP.Process(
+            target=_child_main,
+            args=(target, cid, processes, tasks, messages, stop_event,
+                  {**(kwargs or {}), **(kwargs_for(cid, processes) if kwargs_for else {})}),
+            name=f"{target.rsplit(':', 1)[-1]}-{cid}",
+            daemon=True,
+        )
+        for cid in range(1, processes + 1)
+    }
+    for proc in procs.values():
+        proc.start()
+    logger.info("[PROC] 🧵 %s: %s аккаунтов на %s процессов", target, len(items), processes)
+
+    loop = asyncio.get_running_loop()
+    results: Dict[int, Any] = {}
+
+    def _handle(msg) -> Optional[asyncio.Future]:
+        kind, cid, payload = msg
+        if kind == "progress":
+            return _call(on_progress, cid, payload)
+        if kind == "result":
+            return _call(on_result, cid, payload)
+        if kind == "done":
+            results[cid] = payload
+        elif kind == "error":
+            logger.error("[PROC] ❌ Процесс %s упал: %s", cid, payload)
+            results[cid] = RuntimeError(payload.splitlines()[0] if payload else "error")
+        return None
+
+    try:
+        while len(results) < len(procs):
+            msg = await loop.run_in_executor(None, _get, messages, POLL)
+            if msg is not None:
+                coro = _handle(msg)
+                if coro is not None:
+                    await coro
+            if stop is not None and stop() and not stop_event.is_set():
+                logger.info("[PROC] ⏹ Остановка передана %s процессам", len(procs))
+                stop_event.set()
+            for cid, proc in procs.items():
+                if cid not in results and not proc.is_alive() and proc.exitcode not in (None, 0):
+                    # процесс умер, не успев отчитаться (OOM killer, сегфолт драйвера)
+                    while (msg := _get(messages, 0)) is not None:
+                        coro = _handle(msg)
+                        if coro is not None:
+                            await coro
+                    if cid not in results:
+                        logger.error("[PROC] ❌ Процесс %s завершился с кодом %s", cid, proc.exitcode)
+                        results[cid] = RuntimeError(f"exit code {proc.exitcode}")
+    except asyncio.CancelledError:
+        stop_event.set()
+        await loop.run_in_executor(None, _join_all, list(procs.values()), STOP_GRACE)
+        raise
+    finally:
+        stop_event.set()
+        await loop.run_in_executor(None, _join_all, list(procs.values()), 5.0)
+        # неразобранные пачки (остановка) не должны держать выход процесса бота
+        tasks.cancel_join_thread()
+        messages.cancel_join_thread()
+
+    return [results.get(cid) for cid in sorted(procs)]
+
+
+def _join_all(procs: List[Any], timeout: float):
+    deadline = time.monotonic() + timeout
+    for proc in procs:
+        proc.join(max(0.0, deadline - time.monotonic()))
+    for proc in procs:
+        if proc.is_alive():
+            logger.warning("[PROC] ⚠️ %s не завершился — terminate()", proc.name)
+            proc.terminate()
+            proc.join(5.0)
@@ -0,0 +1,253 @@
+# tg_zov/services/profile_manager.py
+"""
+🗂 Одноразовые профили Chromium из заранее подготовленного шаблона
+
+Раньше каждый запуск launch_persistent_context получал «чистую» папку
+профиля: Chromium при старте заново создавал базы, Preferences и кэши,
+а потом папку удаляли shutil.rmtree прямо в event loop (или не удаляли
+вовсе, и data/chrome_profiles разрастался).
+
+Здесь:
+  • шаблон профиля создаётся один раз (Chromium запускается и закрывается
+    на пустой папке) и лежит рядом с клонами;
+  • клон — копия шаблона: reflink (copy-on-write на btrfs/xfs), иначе
+    обычное копирование; стратегия "hardlink" — жёсткие ссылки
+    (шаблон сверяется по отпечатку и пересоздаётся, если Chromium
+    изменил общий файл на месте);
+  • клоны по возможности живут в tmpfs (/dev/shm);
+  • удаление клона уходит в фоновый пул потоков и не блокирует цикл;
+  • время подготовки профиля на аккаунт пишется в лог и в stats().
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from services.browser_patches import chromium_launch_args, get_browser_path
+
+logger = logging.getLogger("profile_manager")
+
+PROFILE_ROOT = Path("data/chrome_profiles")
+TMPFS_ROOT = Path("/dev/shm")
+USE_TMPFS = True
+CLONE_STRATEGY = "auto"      # "auto" (reflink → copy) | "hardlink" | "copy"
+DELETE_WORKERS = 2
+STALE_CLONE_AGE = 6 * 3600   # клоны старше — остатки упавших процессов, удаляются при старте
+
+_FICLONE = 0x40049409        # ioctl(FICLONE) — reflink одного файла (Linux)
+
+
+def _default_root() -> Path:
+    if USE_TMPFS and TMPFS_ROOT.is_dir() and os.access(TMPFS_ROOT, os.W_OK):
+        return TMPFS_ROOT / "tg_zov_profiles"
+    return PROFILE_ROOT / "_clones"
+
+
+def _reflink(src: str, dst: str):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def _fingerprint(path: Path) -> Tuple[int, int]:
+    count = total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            count += 1
+            total += st.st_size ^ st.st_mtime_ns
+    return count, total
+
+
+class ProfileManager:
+    def __init__(self, root: Optional[Path] = None, strategy: str = CLONE_STRATEGY,
+                 delete_workers: int = DELETE_WORKERS):
+        self.root = Path(root) if root is not None else _default_root()
+        self.template_dir = self.root / "_template"
+        self.strategy = strategy
+        self._reflink_ok = fcntl is not None and strategy == "auto"
+        self._template_fp: Optional[Tuple[int, int]] = None
+        self._build_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+        self._deleter = ThreadPoolExecutor(max_workers=max(1, delete_workers), thread_name_prefix="profile-rm")
+        self._stats_lock = threading.Lock()
+        self._pending_deletes = 0
+        self.clones = 0
+        self.template_builds = 0
+        self.last_setup_ms = 0.0
+        self.total_setup_ms = 0.0
+        self._sweep_stale()
+
+    def _sweep_stale(self):
+        if not self.root.is_dir():
+            return
+        now = time.time()
+        for entry in self.root.iterdir():
+            if entry == self.template_dir:
+                continue
+            try:
+                if now - entry.stat().st_mtime > STALE_CLONE_AGE:
+                    self.release(str(entry))
+            except OSError:
+                pass
+
+    # ───── шаблон ─────
+    def _template_ready(self) -> bool:
+        if not (self.template_dir / "Default").is_dir():
+            return False
+        if self.strategy == "hardlink" and self._template_fp is not None:
+            if _fingerprint(self.template_dir) != self._template_fp:
+                logger.warning("[PROFILES] ⚠️ Шаблон изменён через жёсткую ссылку — пересоздаю")
+                shutil.rmtree(self.template_dir, ignore_errors=True)
+                return False
+        return True
+
+    async def _build_template(self, playwright=None):
+        loop = asyncio.get_running_loop()
+        lock = self._build_locks.get(loop)
+        if lock is None:
+            lock = self._build_locks[loop] = asyncio.Lock()
+        async with lock:
+            if await asyncio.to_thread(self._template_ready):
+                return
+            t0 = time.perf_counter()
+            tmp = self.root / f"_template.{uuid.uuid4().hex}"
+            tmp.mkdir(parents=True, exist_ok=True)
+
+            own = playwright is None
+            if own:
+                from playwright.async_api import async_playwright
+                playwright = await async_playwright().start()
+            try:
+                kwargs = dict(headless=True, args=chromium_launch_args())
+                browser_path = get_browser_path()
+                if browser_path:
+                    kwargs["executable_path"] = browser_path
+                context = await playwright.chromium.launch_persistent_context(str(tmp), **kwargs)
+                try:
+                    page = await context.new_page()
+                    await page.goto("about:blank")
+                finally:
+                    await context.close()
+            finally:
+                if own:
+                    await playwright.stop()
+
+            def _install():
+                # процесс-«одиночка» больше не держит файлы: убираем блокировки профиля
+                for name in ("SingletonLock", "SingletonCookie", "SingletonSocket"):
+                    try:
+                        os.unlink(tmp / name)
+                    except OSError:
+                        pass
+                shutil.rmtree(self.template_dir, ignore_errors=True)
+                os.replace(tmp, self.template_dir)
+                return _fingerprint(self.template_dir)
+
+            self._template_fp = await asyncio.to_thread(_install)
+            self.template_builds += 1
+            logger.info("[PROFILES] 🧱 Шаблон профиля готов за %.0f мс: %s",
+                        (time.perf_counter() - t0) * 1000, self.template_dir)
+
+    # ───── клоны ─────
+    def _copy_file(self, src: str, dst: str):
+        if self.strategy == "hardlink":
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+        if self._reflink_ok:
+            try:
+                _reflink(src, dst)
+                return
+            except OSError:
+                self._reflink_ok = False  # ФС не умеет reflink — дальше просто копируем
+        shutil.copy2(src, dst)
+
+    def _clone(self, label: str) -> str:
+        safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in label) or "profile"
+        dst = self.root / f"{safe}.{uuid.uuid4().hex[:8]}"
+        shutil.copytree(self.template_dir, dst, copy_function=self._copy_file)
+        return str(dst)
+
+    async def acquire(self, label: str, playwright=None) -> str:
+        """Путь к новому профилю-клону для launch_persistent_context."""
+        t0 = time.perf_counter()
+        if not await asyncio.to_thread(self._template_ready):
+            await self._build_template(playwright)
+        path = await asyncio.to_thread(self._clone, label)
+        ms = (time.perf_counter() - t0) * 1000
+        with self._stats_lock:
+            self.clones += 1
+            self.last_setup_ms = ms
+            self.total_setup_ms += ms
+        logger.info("[PROFILES] 📁 Профиль %s подготовлен за %.1f мс", label, ms)
+        return path
+
+    def release(self, path: Optional[str]):
+        """Удаляет клон в фоновом потоке (не блокирует event loop)."""
+        if not path:
+            return
+        with self._stats_lock:
+            self._pending_deletes += 1
+
+        def _rm():
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                with self._stats_lock:
+                    self._pending_deletes -= 1
+
+        self._deleter.submit(_rm)
+
+    @asynccontextmanager
+    async def profile(self, label: str, playwright=None):
+        """async with manager.profile("uid_events", p) as user_data_dir: ..."""
+        path = await self.acquire(label, playwright)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "root": str(self.root),
+                "clones": self.clones,
+                "template_builds": self.template_builds,
+                "last_setup_ms": round(self.last_setup_ms, 1),
+                "avg_setup_ms": round(self.total_setup_ms / self.clones, 1) if self.clones else 0.0,
+                "pending_deletes": self._pending_deletes,
+            }
+
+
+_manager: Optional[ProfileManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_profile_manager() -> ProfileManager:
+    """Общий на процесс менеджер профилей."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ProfileManager()
+        return _manager
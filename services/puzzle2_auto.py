@@ -3,14 +3,22 @@ import asyncio
 import inspect
 import json
 import logging
-import os
 import random
-import shutil
-import tempfile
 import time
 import warnings
-
-from services.browser_patches import BROWSER_PATH
+from contextlib import asynccontextmanager
+
+from services import checkpoint
+from services.browser_patches import BrowserPool
+from services.concurrency import R403, SKIP, classify_exception, get_limiter
+from services.daily_ledger import get_daily_ledger
+from services.event_http import EscalateToBrowser, EventHttp
+from services.net_policy import policy_stats
+from services.job_queue import run_batch
+from services.process_pool import run_sharded
+from services.rate_limit import rate_stats, throttle
+from services.retry_queue import RetryPolicy, RetryQueue, drain
+from services.puzzle_log import get_log as get_puzzle_log
 
 # === Настройка тишины для asyncio и Playwright ===
 def silence_asyncio_exceptions(loop, context):
@@ -69,7 +77,7 @@ except Exception:
 
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from tqdm.asyncio import tqdm_asyncio
 from playwright.async_api import async_playwright
 
@@ -79,16 +87,22 @@ LOG_DIR = Path("data/logs")
 SCREEN_DIR = Path("data/screenshots")
 DATA_FILE = Path("data/puzzle_data.jsonl")
 FAIL_DIR = Path("data/failures")
-FARM_STATE_FILE = Path("data/farm_state.json")
+FARM_STATE_FILE = Path("data/farm_checkpoint.jsonl")  # журнал завершённых uid прогона (services.checkpoint)
+LEGACY_FARM_STATE_FILE = Path("data/farm_state.json")  # старый формат (current_index), удаляется при сбросе
 # === Настройки ===
-CONCURRENT = 5  # количество аккаов
+CONCURRENT = 5  # количество аккаов на старте (дальше лимит подбирает services.concurrency)
+MAX_CONCURRENT = 12  # потолок адаптивного лимита на браузерном пути
 REQUEST_TIMEOUT = 30000  # время ожидания загрузки
 COOKIE_CAPTURE_WAIT = 3  # Ждёт пока установятся куки
-DELAY_BETWEEN_ACCOUNTS = 3  # Пауза (в секундах) между стартом обработки одного аккаунта и переходом к следующему.
-DELAY_BETWEEN_LOTTERY = 1.5  # Промежуток между запросами lottery
-
-# === Настройки батчей ===
-BATCH_RETRY_SIZE = 100  # батч для повторной обработки 403
+HTTP_ENGINE = True  # lottery через aiohttp (services.event_http); браузер — только при 403 / проверке Akamai
+HTTP_CONCURRENT = 30  # аккаунтов одновременно на HTTP-пути на старте (браузерных контекстов — не больше MAX_CONCURRENT на браузер)
+HTTP_MAX_CONCURRENT = 80  # потолок адаптивного лимита на HTTP-пути
+PROCESSES = 1  # дочерних процессов (services.process_pool, до DEFAULT_PROCESSES); у каждого свой адаптивный лимит — потолки складываются
+DAILY_EVENT = "puzzle2"  # ключ в services.daily_ledger: шансы lottery на сегодня израсходованы
+JOB_QUEUE = False  # True — аккаунты ставятся заданиями в services.job_queue (воркеры: python -m services.job_worker)
+
+# === Повторы 403 / таймаутов (services.retry_queue) ===
+RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=45.0, factor=2.0, max_delay=600.0)
 # ---------------- глобальные переменные ----------------
 puzzle_lock = asyncio.Lock()  # для безопасного доступа к батчу в async
 
@@ -99,21 +113,10 @@ HEADLESS = True
 # Путь к реальному Chrome (если хочешь использовать настоящий Chrome).
 # Если оставишь None — Playwright будет использовать свою сборку Chromium.
 # пример Windows: r"C:\Program Files\Google\Chrome\Application\chrome.exe"
-# Базовая папка для persistent профилей (user_data_dir)
-PROFILE_BASE_DIR = Path("data/chrome_profiles")
-PROFILE_BASE_DIR.mkdir(parents=True, exist_ok=True)
-# 🛠 Попытка автоматически исправить права на папку (Windows)
-try:
-    import subprocess
-
-    subprocess.run([
-        "icacls", str(PROFILE_BASE_DIR),
-        "/grant", f"{os.getlogin()}:(OI)(CI)F", "/T"
-    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-except Exception:
-    pass
 # Небольшая задержка между действиями (имитация человека)
 SLOW_MO = 50  # мс
+# Политика перехвата запросов (services.net_policy): ферме нужны только страница, скрипты и fetch
+NET_POLICY = "api-only"
 # === Логирование ===
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 FAIL_DIR.mkdir(parents=True, exist_ok=True)
@@ -128,21 +131,27 @@ LOG_DIR.mkdir(parents=True, exist_ok=True)
 LOG_FILE = LOG_DIR / "puzzle2_auto.log"
 
 logger = logging.getLogger("puzzle2_auto")
-logger.setLevel(logging.INFO)
-logger.handlers.clear()  # убираем старые handlers
-
-# RotatingFileHandler: макс. размер 2 МБ, хранить до 5 старых файлов
-file_handler = RotatingFileHandler(
-    LOG_FILE,
-    mode='a',
-    maxBytes=2 * 1024 * 1024,  # 2 МБ
-    backupCount=5,
-    encoding='utf-8',
-)
-
-formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S")
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+
+
+def setup_file_logging(log_file: Path = LOG_FILE) -> None:
+    """Файл лога фермы подключается при запуске фарма, а не при импорте модуля."""
+    if any(isinstance(h, RotatingFileHandler) for h in logger.handlers):
+        return
+    logger.setLevel(logging.INFO)
+    logger.handlers.clear()  # убираем старые handlers
+
+    # RotatingFileHandler: макс. размер 2 МБ, хранить до 5 старых файлов
+    file_handler = RotatingFileHandler(
+        log_file,
+        mode='a',
+        maxBytes=2 * 1024 * 1024,  # 2 МБ
+        backupCount=5,
+        encoding='utf-8',
+    )
+
+    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S")
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
 
 # ---------------- helpers ----------------
 def get_random_browser_profile():
@@ -236,32 +245,15 @@ def load_accounts() -> List[Dict[str, Any]]:
         except Exception as e:
             logger.warning("Не удалось прочитать %s: %s", f.name, e)
     return out
-def save_farm_state(index: int):
-    FARM_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(FARM_STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump({
-            "current_index": index,
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }, f, ensure_ascii=False, indent=2)
-
-
-def load_farm_state() -> int:
-    if not FARM_STATE_FILE.exists():
-        return 0
-    try:
-        with open(FARM_STATE_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return int(data.get("current_index", 0))
-    except Exception:
-        return 0
+def has_farm_state() -> bool:
+    """Есть ли незавершённый прогон, который можно продолжить."""
+    return FARM_STATE_FILE.exists()
+
 
 def reset_farm_state() -> None:
     """Сбрасывает сохранённое состояние фарма."""
-    try:
-        if FARM_STATE_FILE.exists():
-            FARM_STATE_FILE.unlink()
-    except Exception:
-        pass
+    checkpoint.reset(FARM_STATE_FILE)
+    checkpoint.reset(LEGACY_FARM_STATE_FILE)
 
 
 def cookies_to_playwright(cookies: Dict[str, str], domain: str = ".event-eu-cc.igg.com") -> List[Dict[str, Any]]:
@@ -270,60 +262,9 @@ def cookies_to_playwright(cookies: Dict[str, str], domain: str = ".event-eu-cc.i
 
 
 def save_puzzle_data(entry: dict, file_path: Path):
-    """Сохраняет или обновляет данные аккаунта в многострочном JSON-формате"""
-    file_path.parent.mkdir(parents=True, exist_ok=True)
+    """Сохраняет или обновляет данные аккаунта (дозапись в append-only лог по iggid)"""
     entry["time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    existing = []
-    updated = False
-
-    if file_path.exists():
-        with open(file_path, "r", encoding="utf-8") as f:
-            buffer = ""
-            for line in f:
-                if line.strip():
-                    buffer += line
-                else:
-                    try:
-                        data = json.loads(buffer)
-                        if data.get("iggid") == entry.get("iggid"):
-                            existing.append(entry)
-                            updated = True
-                        else:
-                            existing.append(data)
-                    except Exception:
-                        pass
-                    buffer = ""
-            if buffer.strip():
-                try:
-                    data = json.loads(buffer)
-                    if data.get("iggid") == entry.get("iggid"):
-                        existing.append(entry)
-                        updated = True
-                    else:
-                        existing.append(data)
-                except Exception:
-                    pass
-
-    if not updated:
-        existing.append(entry)
-
-    temp_fd, temp_path = tempfile.mkstemp(dir=file_path.parent)
-    with open(temp_fd, "w", encoding="utf-8") as tmp:
-        for obj in existing:
-            json.dump(obj, tmp, ensure_ascii=False, indent=2)
-            tmp.write("\n\n")
-    shutil.move(temp_path, file_path)
-
-
-def jitter(base: float, variance: float = 0.5):
-    """
-    Возвращает случайную задержку: base ± (0..variance*base)
-    Пример: jitter(3, 0.5) -> число в ~[1.5, 4.5]
-    """
-    # можно использовать random.uniform для равномерного разброса
-    delta = random.uniform(-variance * base, variance * base)
-    return max(0.1, base + delta)
+    get_puzzle_log(file_path).put(entry)
 
 
 # ---------------- per-account workflow ----------------
@@ -335,7 +276,80 @@ def is_403_response(status: int, text: str) -> bool:
     return "403 FORBIDDEN" in text.upper()
 
 
-async def process_account(account: Dict[str, Any], p) -> bool:
+def lottery_outcome(status: int, text: str) -> Optional[str]:
+    """"exhausted" — шансы закончились (error=1, status=0), "ok" — розыгрыш прошёл (status=1), иначе None."""
+    if status != 200 or is_403_response(status, text):
+        return None
+    try:
+        data = json.loads(text)
+    except Exception:
+        return None
+    if not isinstance(data, dict):
+        return None
+    err, st = data.get("error"), data.get("status")
+    if (err == 1 or err == "1") and st == 0:
+        return "exhausted"
+    return "ok" if st == 1 else None
+
+
+async def process_account_http(account: Dict[str, Any], engine: EventHttp) -> bool:
+    """
+    Те же запросы lottery, что и в браузерном пути, но через aiohttp.
+    403 / проверка Akamai — EscalateToBrowser (обрабатывает process_account).
+    """
+    uid = account.get("uid")
+    cookies = account.get("cookies", {})
+
+    async with engine.session(cookies, uid=str(uid)) as s:
+        try:
+            # темп page/lottery задаёт services.rate_limit (общий на все фермы)
+            await s.open_page()
+            status, text = await s.ajax("lottery")
+            logger.info(f"[{uid}] 🎯 HTTP lottery (1-й запрос): {status} | {text[:200]}")
+
+            try:
+                data = json.loads(text)
+            except Exception:
+                logger.warning(f"[{uid}] ⚠️ lottery: сервер вернул не JSON")
+                data = {}
+            err = data.get("error")
+            st = data.get("status")
+
+            if (err == 1 or err == "1") and st == 0:
+                logger.info(f"[{uid}] 🚫 Шансы закончились — пропускаем дополнительные lottery.")
+                get_daily_ledger().mark(DAILY_EVENT, uid)
+            elif st == 1:
+                # отметка «на сегодня всё» — только если доп. запросы дошли до конца шансов
+                spent = True
+                for j in range(2):
+                    status, text = await s.ajax("lottery")
+                    logger.info(f"[{uid}] 🎯 HTTP lottery ({j + 2}-й запрос): {status} | {text[:200]}")
+                    outcome = lottery_outcome(status, text)
+                    if outcome == "exhausted":
+                        break
+                    if outcome is None:
+                        spent = False
+                if spent:
+                    get_daily_ledger().mark(DAILY_EVENT, uid)
+        except EscalateToBrowser:
+            raise
+        except Exception as e:
+            logger.warning(f"[{uid}] ⚠️ Ошибка HTTP lottery: {e}")
+
+    return False
+
+
+async def process_account(account: Dict[str, Any], pool: BrowserPool, engine: EventHttp = None) -> bool:
+    """Сначала HTTP-путь; при 403 / проверке Akamai — браузер из пула."""
+    if engine is not None:
+        try:
+            return await process_account_http(account, engine)
+        except EscalateToBrowser as e:
+            logger.info("[%s] 🛡 %s — переключаюсь на браузер", account.get("uid"), e)
+    return await process_account_browser(account, pool)
+
+
+async def process_account_browser(account: Dict[str, Any], pool: BrowserPool) -> bool:
     uid = account.get("uid")
     mail = account.get("mail", "?")
     cookies = account.get("cookies", {})
@@ -345,49 +359,10 @@ async def process_account(account: Dict[str, Any], p) -> bool:
     try:
         # 1 / 3 / 4 — профиль + параметры при создании контекста
         profile = get_random_browser_profile()
-        ua = profile["user_agent"]
-        vp = profile["viewport"]
         locale = profile["locale"]
 
-        PROFILE_BASE_DIR.mkdir(parents=True, exist_ok=True)
-        user_data_dir = str(PROFILE_BASE_DIR / f"{uid}")
-
-        # === скрытый фоновый режим (headless masked) ===
-        window_args = [
-            "--headless=new",  # фон без окна
-            "--disable-gpu",
-            "--mute-audio",
-            "--no-sandbox",
-            "--disable-dev-shm-usage",
-            "--disable-blink-features=AutomationControlled",
-            "--disable-infobars",
-            "--hide-scrollbars",
-            "--window-size=1920,1080",
-            "--blink-settings=imagesEnabled=true",
-            "--disable-extensions",
-            "--disable-translate",
-            "--disable-background-timer-throttling",
-            "--disable-backgrounding-occluded-windows",
-            "--disable-renderer-backgrounding",
-        ]
-
-        launch_kwargs = dict(
-            headless=True,  # полностью фоновый режим
-            slow_mo=SLOW_MO,
-            viewport=vp,
-            user_agent=ua,
-            locale=locale,
-            timezone_id=profile["timezone"],
-            is_mobile=profile["is_mobile"],
-            device_scale_factor=profile["device_scale_factor"],
-            java_script_enabled=True,
-            args=window_args,
-        )
-
-        if BROWSER_PATH:
-            launch_kwargs["executable_path"] = BROWSER_PATH
-
-        context = await p.chromium.launch_persistent_context(user_data_dir, **launch_kwargs)
+        # === лёгкий контекст из общего пула браузеров (вместо запуска Chromium на аккаунт) ===
+        context = await pool.new_context(profile, policy=NET_POLICY, label=str(uid))
 
         # === Маскировка headless через JS ===
         try:
@@ -421,18 +396,6 @@ async def process_account(account: Dict[str, Any], p) -> bool:
 
         page = await context.new_page()
 
-        # === 🔥 Блокировка лишних ресурсов для ускорения ===
-        async def block_resources(page):
-            async def handler(route):
-                if route.request.resource_type in ["image", "media", "font"]:
-                    await route.abort()
-                else:
-                    await route.continue_()
-
-            await page.route("**/*", handler)
-
-        await block_resources(page)
-
         # Если есть cookies из файла аккаунтов — добавим (это НЕ пункт 10: мы не грузим внешние экспорты)
         try:
             if cookies:
@@ -496,6 +459,7 @@ async def process_account(account: Dict[str, Any], p) -> bool:
         await humanize_pre_action(page)
 
         # Переход на страницу и cookie banner
+        await throttle(base, "page")
         await page.goto("https://event-eu-cc.igg.com/event/puzzle2/", wait_until="networkidle", timeout=REQUEST_TIMEOUT)
 
         await asyncio.sleep(COOKIE_CAPTURE_WAIT)
@@ -510,7 +474,7 @@ async def process_account(account: Dict[str, Any], p) -> bool:
         await humanize_pre_action(page)
         # 🧩 Первый запрос lottery — проверяем, есть ли шансы
         try:
-            await asyncio.sleep(jitter(DELAY_BETWEEN_LOTTERY, variance=0.9))
+            await throttle(base, "lottery")
             js = f"""
                 async () => {{
                     const res = await fetch('{base}?action=lottery', {{
@@ -543,10 +507,12 @@ async def process_account(account: Dict[str, Any], p) -> bool:
                     # Если сервер вернул ошибку 1 — шансы закончились
                     if (err == 1 or err == "1") and st == 0:
                         logger.info(f"[{uid}] 🚫 Шансы закончились — пропускаем дополнительные lottery.")
+                        get_daily_ledger().mark(DAILY_EVENT, uid)
                     elif st == 1:
-                        # выполняем ещё 2 запроса
+                        # выполняем ещё 2 запроса; «на сегодня всё» — только если они дошли до конца шансов
+                        spent = True
                         for j in range(2):
-                            await asyncio.sleep(jitter(DELAY_BETWEEN_LOTTERY, variance=0.9))
+                            await throttle(base, "lottery")
                             resp = await page.evaluate(f"""
                                 async () => {{
                                     const res = await fetch('{base}?action=lottery', {{
@@ -564,6 +530,13 @@ async def process_account(account: Dict[str, Any], p) -> bool:
                             if is_403_response(status, text):
                                 logger.warning(f"[{uid}] 🚫 Получен 403 на lottery, добавляем в повтор.")
                                 return True
+                            outcome = lottery_outcome(status, text)
+                            if outcome == "exhausted":
+                                break
+                            if outcome is None:
+                                spent = False
+                        if spent:
+                            get_daily_ledger().mark(DAILY_EVENT, uid)
 
                 except Exception as e:
                     logger.warning(f"[{uid}] ⚠️ Ошибка при разборе lottery, пропускаем: {e}")
@@ -581,98 +554,164 @@ async def process_account(account: Dict[str, Any], p) -> bool:
         except Exception:
             pass
 
-        # 🧹 Автоудаление профиля браузера после завершения аккаунта
+    return False
+
+
+# ---------------- main ----------------
+def _get_limiter():
+    return (
+        get_limiter("puzzle2_http", HTTP_CONCURRENT, max_limit=HTTP_MAX_CONCURRENT) if HTTP_ENGINE
+        else get_limiter("puzzle2", CONCURRENT, max_limit=MAX_CONCURRENT)
+    )
+
+
+async def _run_account(acc, pool, engine, limiter, stop=None):
+    """Один аккаунт под слотом лимитера; причина неудачи (R403 / TIMEOUT / ERROR), SKIP или None."""
+    uid = acc.get("uid")
+    async with limiter.slot() as slot:
+        if stop is not None and stop():
+            slot.skip()
+            logger.info("[%s] ⏹ Завершаем перед стартом", uid)
+            return SKIP
+        reason = None
         try:
-            user_data_dir_path = PROFILE_BASE_DIR / f"{uid}"
-            if user_data_dir_path.exists():
-                shutil.rmtree(user_data_dir_path, ignore_errors=True)
+            if await process_account(acc, pool, engine):
+                reason = R403
         except Exception as e:
-            logger.warning("[%s] ⚠️ Не удалось удалить профиль: %s", uid, e)
-
-        await asyncio.sleep(jitter(DELAY_BETWEEN_ACCOUNTS, variance=0.6))
+            reason = classify_exception(e)
+            logger.error(f"[{uid}] ❌ Ошибка: {e}")
+        if reason is not None:
+            slot.fail(reason)
+        return reason
+
+
+async def _farm(accounts, *, stop, on_final):
+    """Прогон аккаунтов в текущем процессе; on_final(uid, ok) — аккаунт завершён окончательно."""
+    limiter = _get_limiter()
+    workers = min(limiter.max_limit, len(accounts)) if isinstance(accounts, list) else limiter.max_limit
+
+    async with async_playwright() as p:
+        pool = BrowserPool(p, max_contexts=MAX_CONCURRENT, slow_mo=SLOW_MO)
+        engine = EventHttp() if HTTP_ENGINE else None
+
+        queue = RetryQueue(accounts, RETRY_POLICY, key=lambda acc: acc.get("uid"), name="puzzle2")
+
+        async def handle(job):
+            return await _run_account(job.item, pool, engine, limiter, stop)
+
+        # повторы 403 / таймаутов идут вперемешку со свежими аккаунтами
+        await drain(queue, handle, workers=workers, stop=stop,
+                    on_final=lambda job, reason: on_final(job.key, reason is None))
+
+        logger.info("🧭 Пул браузеров: %s", pool.stats())
+        logger.info("📈 Параллелизм: %s", limiter.stats())
+        logger.info("🪣 Темп запросов: %s", rate_stats())
+        logger.info("🔁 Повторы: %s", queue.stats())
+        logger.info("🚦 Сеть (%s): %s", NET_POLICY, policy_stats().get(NET_POLICY))
+        get_daily_ledger().flush()
+        await pool.close()
+        if engine is not None:
+            logger.info("⚡ HTTP-движок: %s", engine.stats())
+            await engine.close()
+
+
+async def farm_shard(items, ctx):
+    """Точка входа дочернего процесса (services.process_pool): аккаунты из общей очереди."""
+    setup_file_logging(LOG_DIR / f"puzzle2_auto.p{ctx.child_id}.log")
+    await _farm(items, stop=ctx.stop_requested,
+                on_final=lambda uid, ok: ctx.progress(uid=uid, ok=ok))
+
+
+@asynccontextmanager
+async def job_runner():
+    """Ресурсы воркера очереди заданий (services.job_worker): run(acc) -> (reason, None)."""
+    setup_file_logging(LOG_DIR / "puzzle2_auto.worker.log")
+    limiter = _get_limiter()
+    async with async_playwright() as p:
+        pool = BrowserPool(p, max_contexts=MAX_CONCURRENT, slow_mo=SLOW_MO)
+        engine = EventHttp() if HTTP_ENGINE else None
+
+        async def run(acc):
+            return await _run_account(acc, pool, engine, limiter), None
 
-    return False
+        try:
+            yield run
+        finally:
+            logger.info("🧭 Пул браузеров: %s", pool.stats())
+            logger.info("📈 Параллелизм: %s", limiter.stats())
+            get_daily_ledger().flush()
+            await pool.close()
+            if engine is not None:
+                logger.info("⚡ HTTP-движок: %s", engine.stats())
+                await engine.close()
 
 
-# ---------------- main ----------------
 async def main():
     global FARM_RUNNING
+    setup_file_logging()
     clear_stop_request()
     FARM_RUNNING = True
     try:
         accounts = load_accounts()
-        start_index = load_farm_state()
-
-        if start_index >= len(accounts):
-            start_index = 0
-
-        accounts = accounts[start_index:]
-
         if not accounts:
             logger.error("Аккаунты не найдены в %s", DATA_DIR)
-            logger.info("▶️ Старт фарма с аккаунта #%d", start_index)
+            return
 
+        # журнал прогона: завершённые uid не повторяются, в каком бы порядке они ни закончились
+        ledger = checkpoint.CheckpointLedger(FARM_STATE_FILE).open(resume=True)
+        skipped = len(accounts)
+        accounts = [acc for acc in accounts if not ledger.is_done(acc.get("uid"))]
+        skipped -= len(accounts)
+        if skipped:
+            logger.info("▶️ Продолжение: пропущено %d уже обработанных аккаунтов", skipped)
+
+        # шансы на сегодня израсходованы — сессия аккаунту не нужна
+        daily = get_daily_ledger()
+        exhausted = len(accounts)
+        accounts = [acc for acc in accounts if not daily.is_done(DAILY_EVENT, acc.get("uid"))]
+        exhausted -= len(accounts)
+        if exhausted:
+            logger.info("📅 Шансы на сегодня уже израсходованы у %d аккаунтов — пропускаем", exhausted)
+        if not accounts:
+            ledger.close()
+            logger.info("Все аккаунты на сегодня уже обработаны.")
             return
 
         start_time = time.perf_counter()
         stats = {"total": len(accounts), "success": 0, "fail": 0}
-        processed_total = 0
         logger.info("Всего аккаунтов: %d", len(accounts))
-        sem = asyncio.Semaphore(CONCURRENT)
-
-        async with async_playwright() as p:
-
-            async def run_batch(batch_accounts, allow_retry: bool, count_for_state: bool):
-                retry_accounts = []
-
-                async def worker(acc):
-                    nonlocal processed_total
-                    uid = acc.get("uid")
-                    if STOP_EVENT.is_set():
-                        logger.info("[%s] ⏹ Остановка. Сохраняем позицию %d", uid, start_index + processed_total)
-                        save_farm_state(start_index + processed_total)
-                        return
-                    async with sem:
-                        if STOP_EVENT.is_set():
-                            logger.info("[%s] ⏹ Завершаем перед стартом", uid)
-                            return
-
-                        try:
-                            needs_retry = await process_account(acc, p)
-                            if needs_retry:
-                                if allow_retry:
-                                    retry_accounts.append(acc)
-                                else:
-                                    stats["fail"] += 1
-                            else:
-                                stats["success"] += 1
-                        except Exception as e:
-                            stats["fail"] += 1
-                            logger.error(f"[{uid}] ❌ Ошибка: {e}")
-                        finally:
-                            if count_for_state:
-                                processed_total += 1
-                                save_farm_state(start_index + processed_total)
-
-                tasks = [asyncio.create_task(worker(acc)) for acc in batch_accounts]
+        progress = tqdm_asyncio(total=len(accounts), desc="Обработка аккаунтов")
 
-                try:
-                    await tqdm_asyncio.gather(*tasks, desc="Обработка аккаунтов", total=len(tasks))
-                except asyncio.CancelledError:
-                    for t in tasks:
-                        t.cancel()
-                    await asyncio.gather(*tasks, return_exceptions=True)
-                    raise
-
-                return retry_accounts
-
-            for batch_start in range(0, len(accounts), BATCH_RETRY_SIZE):
-                if STOP_EVENT.is_set():
-                    break
-                batch = accounts[batch_start:batch_start + BATCH_RETRY_SIZE]
-                retry_accounts = await run_batch(batch, allow_retry=True, count_for_state=True)
-                if retry_accounts and not STOP_EVENT.is_set():
-                    await run_batch(retry_accounts, allow_retry=False, count_for_state=False)
+        def on_final(uid, ok: bool):
+            ledger.mark(uid, ok)
+            stats["success" if ok else "fail"] += 1
+            progress.update(1)
+
+        def on_job(job):
+            # в очереди заданий повторы — забота воркера: аккаунт приходит сюда один раз
+            if job["status"] != "cancelled":
+                on_final(job["key"], job["status"] == "done")
+
+        try:
+            if JOB_QUEUE:
+                await run_batch(
+                    "puzzle2", [(acc.get("uid"), acc) for acc in accounts],
+                    max_attempts=RETRY_POLICY.max_attempts, stop=STOP_EVENT.is_set, on_done=on_job,
+                )
+            elif PROCESSES > 1:
+                await run_sharded(
+                    "services.puzzle2_auto:farm_shard", accounts, processes=PROCESSES,
+                    stop=STOP_EVENT.is_set,
+                    on_progress=lambda _child, msg: on_final(msg.get("uid"), bool(msg.get("ok"))),
+                )
+            else:
+                await _farm(accounts, stop=STOP_EVENT.is_set, on_final=on_final)
+        finally:
+            progress.close()
+            ledger.close()
+
+        if STOP_EVENT.is_set():
+            logger.info("⏹ Остановка. В журнале %s", ledger.stats())
 
         total_time = round(time.perf_counter() - start_time, 2)
         logger.info("=== ✅ Итог ===")
@@ -680,6 +719,7 @@ async def main():
         logger.info(f"Успешно: {stats['success']}")
         logger.info(f"Ошибок: {stats['fail']}")
         logger.info(f"Время выполнения: {total_time} сек.")
+        logger.info(f"Скорость: {round(stats['total'] / max(total_time, 1) * 60, 1)} акк/мин")
         logger.info("Все аккаунты обработаны.")
     finally:
         FARM_RUNNING = False
@@ -1,15 +1,22 @@
 # services/puzzle2_auto
-import os
 import asyncio
 import warnings
 import logging
 import json
-import tempfile
-import shutil
 import time
 import random
 import inspect
-from services.browser_patches import BROWSER_PATH
+from contextlib import asynccontextmanager
+from services.browser_patches import BrowserPool
+from services.concurrency import R403, SKIP, classify_exception, get_limiter
+from services.event_http import EscalateToBrowser, EventHttp
+from services.net_policy import policy_stats
+from services.job_queue import run_batch
+from services.process_pool import run_sharded
+from services.rate_limit import rate_stats, throttle
+from services.retry_queue import RetryPolicy, RetryQueue, drain
+from services import persist
+from services.puzzle_log import get_log as get_puzzle_log
 
 # === Настройка тишины для asyncio и Playwright ===
 def silence_asyncio_exceptions(loop, context):
@@ -77,17 +84,23 @@ DATA_FILE = Path("data/puzzle_data.jsonl")
 FAIL_DIR = Path("data/failures_dupes")
 
 # === Настройки ===
-CONCURRENT = 4  # количество аккаов
+CONCURRENT = 4  # количество аккаов на старте (дальше лимит подбирает services.concurrency)
+MAX_CONCURRENT = 10  # потолок адаптивного лимита на браузерном пути
 REQUEST_TIMEOUT = 30000  #время ожидания загрузки
 COOKIE_CAPTURE_WAIT = 3     #Ждёт пока установятся куки
-DELAY_BETWEEN_ACCOUNTS = 3   #Пауза (в секундах) между стартом обработки одного аккаунта и переходом к следующему.
-DELAY_BETWEEN_LOTTERY = 1.5    #Промежуток между запросами lottery
+HTTP_ENGINE = True  # get_resource через aiohttp (services.event_http); браузер — только при 403 / проверке Akamai
+HTTP_CONCURRENT = 30  # аккаунтов одновременно на HTTP-пути на старте (браузерных контекстов — не больше MAX_CONCURRENT на браузер)
+HTTP_MAX_CONCURRENT = 80  # потолок адаптивного лимита на HTTP-пути
+PROCESSES = 1  # дочерних процессов (services.process_pool, до DEFAULT_PROCESSES); у каждого свой адаптивный лимит — потолки складываются
+JOB_QUEUE = False  # True — аккаунты ставятся заданиями в services.job_queue (воркеры: python -m services.job_worker)
 
 # === Настройки батчей ===
 BATCH_SIZE = 20  # после этого числа аккаунтов данные будут сохраняться
-BATCH_RETRY_SIZE = 100  # батч для повторной обработки 403
+RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=45.0, factor=2.0, max_delay=600.0)  # повторы 403 / таймаутов
 puzzle_batch: List[dict] = []  # буфер для новых данных
 processed_count = 0           # счётчик обработанных аккаунтов
+interim_totals = True         # промежуточные итоги каждые BATCH_SIZE; дочерние процессы и воркеры очереди
+                              # видят лишь часть прогона — итоги пишет только main()
 puzzle_lock = asyncio.Lock()  # защита батчей при CONCURRENT > 1
 
 
@@ -96,29 +109,27 @@ HEADLESS = True
 # Путь к реальному Chrome (если хочешь использовать настоящий Chrome).
 # Если оставишь None — Playwright будет использовать свою сборку Chromium.
 # пример Windows: r"C:\Program Files\Google\Chrome\Application\chrome.exe"
-# Базовая папка для persistent профилей (user_data_dir)
-PROFILE_BASE_DIR = Path("data/chrome_profiles_dupes")
-PROFILE_BASE_DIR.mkdir(parents=True, exist_ok=True)
-# 🛠 Попытка автоматически исправить права на папку (Windows)
-try:
-    import subprocess
-    subprocess.run([
-        "icacls", str(PROFILE_BASE_DIR),
-        "/grant", f"{os.getlogin()}:(OI)(CI)F", "/T"
-    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-except Exception:
-    pass
 # Небольшая задержка между действиями (имитация человека)
 SLOW_MO = 50  # мс
+# Политика перехвата запросов (services.net_policy): ферме нужны только страница, скрипты и fetch
+NET_POLICY = "api-only"
 # === Логирование ===
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 FAIL_DIR.mkdir(parents=True, exist_ok=True)
 logger = logging.getLogger("puzzle3_auto")
 logger.setLevel(logging.INFO)
-file_handler = logging.FileHandler(LOG_DIR / "puzzle3_auto.log", encoding="utf-8", mode="w")
-file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S"))
-logger.handlers.clear()
-logger.addHandler(file_handler)
+LOG_FILE = LOG_DIR / "puzzle3_auto.log"
+
+
+def setup_file_logging(log_file: Path = LOG_FILE) -> None:
+    """Лог фермы (перезаписывается на каждый запуск) открывается при запуске, а не при импорте."""
+    file_handler = logging.FileHandler(log_file, encoding="utf-8", mode="w")
+    file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S"))
+    for h in logger.handlers[:]:
+        logger.removeHandler(h)
+        h.close()
+    logger.addHandler(file_handler)
+
 
 # ---------------- helpers ----------------
 def get_random_browser_profile():
@@ -220,59 +231,10 @@ def cookies_to_playwright(cookies: Dict[str, str], domain: str = ".event-eu-cc.i
 
 
 def save_puzzle_data(entry: dict, file_path: Path):
-    """Сохраняет или обновляет данные аккаунта в многострочном JSON-формате"""
-    file_path.parent.mkdir(parents=True, exist_ok=True)
+    """Сохраняет или обновляет данные аккаунта (дозапись в append-only лог по iggid)"""
     entry["time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    get_puzzle_log(file_path).put(entry)
 
-    existing = []
-    updated = False
-
-    if file_path.exists():
-        with open(file_path, "r", encoding="utf-8") as f:
-            buffer = ""
-            for line in f:
-                if line.strip():
-                    buffer += line
-                else:
-                    try:
-                        data = json.loads(buffer)
-                        if data.get("iggid") == entry.get("iggid"):
-                            existing.append(entry)
-                            updated = True
-                        else:
-                            existing.append(data)
-                    except Exception:
-                        pass
-                    buffer = ""
-            if buffer.strip():
-                try:
-                    data = json.loads(buffer)
-                    if data.get("iggid") == entry.get("iggid"):
-                        existing.append(entry)
-                        updated = True
-                    else:
-                        existing.append(data)
-                except Exception:
-                    pass
-
-    if not updated:
-        existing.append(entry)
-
-    temp_fd, temp_path = tempfile.mkstemp(dir=file_path.parent)
-    with open(temp_fd, "w", encoding="utf-8") as tmp:
-        for obj in existing:
-            json.dump(obj, tmp, ensure_ascii=False, indent=2)
-            tmp.write("\n\n")
-    shutil.move(temp_path, file_path)
-
-def jitter(base: float, variance: float = 0.5):
-    """
-    Возвращает случайную задержку: base ± (0..variance*base)
-    Пример: jitter(3, 0.5) -> число в ~[1.5, 4.5]
-    """
-    # можно использовать random.uniform для равномерного разброса
-    delta = random.uniform(-variance * base, variance * base)
-    return max(0.1, base + delta)
 
 def calculate_puzzle_totals(file_path: Path, accounts_processed: int = None):
     """Считает общее количество каждого пазла (1–9) по всем аккаунтам (только дубликаты)."""
@@ -283,33 +245,15 @@ def calculate_puzzle_totals(file_path: Path, accounts_processed: int = None):
         logger.warning("Файл %s не найден для подсчёта пазлов", file_path)
         return totals
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        buffer = ""
-        for line in f:
-            if line.strip():
-                buffer += line
-            else:
-                if buffer.strip():
-                    try:
-                        data = json.loads(buffer)
-                        puzzle_data = data.get("puzzle", {})
-                        for pid, count in puzzle_data.items():
-                            if pid in totals:
-                                totals[pid] += int(count)
-                        count_accounts += 1
-                    except Exception:
-                        pass
-                    buffer = ""
-        if buffer.strip():
-            try:
-                data = json.loads(buffer)
-                puzzle_data = data.get("puzzle", {})
-                for pid, count in puzzle_data.items():
-                    if pid in totals:
-                        totals[pid] += int(count)
-                count_accounts += 1
-            except Exception:
-                pass
+    for data in get_puzzle_log(file_path).records():
+        try:
+            puzzle_data = data.get("puzzle", {})
+            for pid, count in puzzle_data.items():
+                if pid in totals:
+                    totals[pid] += int(count)
+            count_accounts += 1
+        except Exception:
+            pass
 
     total_sum = sum(totals.values())
     logger.info("=== 🧩 Итоги по пазлам (только дубликаты) ===")
@@ -323,13 +267,12 @@ def calculate_puzzle_totals(file_path: Path, accounts_processed: int = None):
         logger.info(f"🔢 Аккаунтов с дубликатами: {count_accounts}")
 
     summary_path = Path("data/puzzle_summary.json")
-    with open(summary_path, "w", encoding="utf-8") as out:
-        json.dump({
-            "totals": totals,
-            "accounts": count_accounts,
-            "all_duplicates": total_sum,
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }, out, ensure_ascii=False, indent=2)
+    persist.write_json(summary_path, {
+        "totals": totals,
+        "accounts": count_accounts,
+        "all_duplicates": total_sum,
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
 
     return totals
 
@@ -342,7 +285,122 @@ def is_403_response(status: int, text: str) -> bool:
     return "403 FORBIDDEN" in text.upper()
 
 
-async def process_account(account: Dict[str, Any], p) -> bool:
+def record_resource(uid: str, text: str) -> None:
+    """Разбирает ответ get_resource и кладёт запись аккаунта в батч (общий для HTTP- и браузерного пути)."""
+    if not text.strip().startswith("{"):
+        logger.error("[%s] ⚠️ get_resource: сервер вернул не JSON", uid)
+        return
+
+    # ✅ Парсим JSON
+    data = json.loads(text)
+    data_section = data.get("data", {})
+
+    if isinstance(data_section, list) and data_section:
+        user = data_section[0].get("user", {})
+    elif isinstance(data_section, dict):
+        user = data_section.get("user", {})
+    else:
+        user = {}
+
+    # ec_free
+    ec_free = user.get("ec_free", "0")
+
+    # puzzle
+    puzzle_data = {}
+    extra_info = user.get("extra_info")
+    if isinstance(extra_info, dict):
+        puzzle_data = extra_info.get("puzzle", {})
+    else:
+        ec_extra = user.get("ec_extra_info", "{}")
+        try:
+            ec_extra_json = json.loads(ec_extra)
+            puzzle_data = ec_extra_json.get("puzzle", {})
+        except Exception:
+            puzzle_data = {}
+
+    puzzle_data = {str(k): v for k, v in puzzle_data.items()}
+
+    # ✅ ЭТОТ ЛОГ ТЕПЕРЬ БУДЕТ ПИСАТЬСЯ В ФАЙЛ
+    logger.info("[%s] 🧩 Попытки: %s | Пазлы: %s", uid, ec_free, puzzle_data)
+
+    # --- формируем entry для батча ---
+    entry = {
+        "iggid": user.get("iggid"),
+        "ec_param": user.get("ec_param"),
+        "puzzle": puzzle_data,
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+    global processed_count
+    puzzle_batch.append(entry)
+    processed_count += 1
+
+    # --- батчинг: каждые BATCH_SIZE аккаунтов ---
+    if processed_count % BATCH_SIZE == 0:
+        logger.info(f"💾 Пройдено {processed_count} аккаунтов — сохраняем batch")
+
+        # сохраняем в файл только дубликаты
+        for e in puzzle_batch:
+            duplicates = {}
+            for pid, count in e["puzzle"].items():
+                try:
+                    if int(count) >= 2:
+                        duplicates[pid] = int(count) - 1
+                except Exception:
+                    continue
+
+            if duplicates:
+                e_to_save = e.copy()
+                e_to_save["puzzle"] = duplicates
+                save_puzzle_data(e_to_save, DATA_FILE)
+
+        if interim_totals:
+            try:
+                calculate_puzzle_totals(
+                    DATA_FILE,
+                    accounts_processed=processed_count
+                )
+            except Exception as e:
+                logger.warning(
+                    "⚠️ Не удалось обновить puzzle_summary.json: %s", e
+                )
+
+        puzzle_batch.clear()
+
+
+async def process_account_http(account: Dict[str, Any], engine: EventHttp) -> bool:
+    """
+    get_resource через aiohttp вместо fetch() из страницы.
+    403 / проверка Akamai — EscalateToBrowser (обрабатывает process_account).
+    """
+    uid = account.get("uid")
+    cookies = account.get("cookies", {})
+
+    async with engine.session(cookies, uid=str(uid)) as s:
+        try:
+            # темп page/get_resource задаёт services.rate_limit (общий на все фермы)
+            await s.open_page()
+            _, text = await s.ajax("get_resource", method="POST")
+            record_resource(uid, text)
+        except EscalateToBrowser:
+            raise
+        except Exception as e:
+            logger.error("[%s] ❌ Ошибка HTTP get_resource: %s", uid, e)
+
+    return False
+
+
+async def process_account(account: Dict[str, Any], pool: BrowserPool, engine: EventHttp = None) -> bool:
+    """Сначала HTTP-путь; при 403 / проверке Akamai — браузер из пула."""
+    if engine is not None:
+        try:
+            return await process_account_http(account, engine)
+        except EscalateToBrowser as e:
+            logger.info("[%s] 🛡 %s — переключаюсь на браузер", account.get("uid"), e)
+    return await process_account_browser(account, pool)
+
+
+async def process_account_browser(account: Dict[str, Any], pool: BrowserPool) -> bool:
     uid = account.get("uid")
     mail = account.get("mail", "?")
     cookies = account.get("cookies", {})
@@ -354,50 +412,10 @@ async def process_account(account: Dict[str, Any], p) -> bool:
 
         # 1 / 3 / 4 — профиль + параметры при создании контекста
         profile = get_random_browser_profile()
-        ua = profile["user_agent"]
-        vp = profile["viewport"]
         locale = profile["locale"]
 
-        PROFILE_BASE_DIR.mkdir(parents=True, exist_ok=True)
-        user_data_dir = str(PROFILE_BASE_DIR / f"{uid}")
-
-        # === скрытый фоновый режим (headless masked) ===
-        window_args = [
-            "--headless=new",  # фон без окна
-            "--disable-gpu",
-            "--mute-audio",
-            "--no-sandbox",
-            "--disable-dev-shm-usage",
-            "--disable-blink-features=AutomationControlled",
-            "--disable-infobars",
-            "--hide-scrollbars",
-            "--window-size=1920,1080",
-            "--blink-settings=imagesEnabled=true",
-            "--disable-extensions",
-            "--disable-translate",
-            "--disable-background-timer-throttling",
-            "--disable-backgrounding-occluded-windows",
-            "--disable-renderer-backgrounding",
-        ]
-
-        launch_kwargs = dict(
-            headless=True,  # полностью фоновый режим
-            slow_mo=SLOW_MO,
-            viewport=vp,
-            user_agent=ua,
-            locale=locale,
-            timezone_id=profile["timezone"],
-            is_mobile=profile["is_mobile"],
-            device_scale_factor=profile["device_scale_factor"],
-            java_script_enabled=True,
-            args=window_args,
-        )
-
-        if BROWSER_PATH:
-            launch_kwargs["executable_path"] = BROWSER_PATH
-
-        #logger.info("[%s] 🕶 Запуск браузера в фоновом режиме (headless masked)", uid)
-        context = await p.chromium.launch_persistent_context(user_data_dir, **launch_kwargs)
+        # === лёгкий контекст из общего пула браузеров (вместо запуска Chromium на аккаунт) ===
+        context = await pool.new_context(profile, policy=NET_POLICY, label=str(uid))
 
         # === Маскировка headless через JS ===
         try:
@@ -432,18 +450,6 @@ async def process_account(account: Dict[str, Any], p) -> bool:
 
         page = await context.new_page()
 
-        # === 🔥 Блокировка лишних ресурсов для ускорения ===
-        async def block_resources(page):
-            async def handler(route):
-                if route.request.resource_type in ["image", "media", "font"]:
-                    await route.abort()
-                else:
-                    await route.continue_()
-
-            await page.route("**/*", handler)
-
-        await block_resources(page)
-
         # Если есть cookies из файла аккаунтов — добавим (это НЕ пункт 10: мы не грузим внешние экспорты)
         try:
             if cookies:
@@ -507,6 +513,7 @@ async def process_account(account: Dict[str, Any], p) -> bool:
         #await humanize_pre_action(page)
 
         # Переход на страницу и cookie banner
+        await throttle(base, "page")
         await page.goto(
             "https://event-eu-cc.igg.com/event/puzzle2/",
             wait_until="networkidle",
@@ -539,7 +546,7 @@ async def process_account(account: Dict[str, Any], p) -> bool:
             pass
 
         # === get_resource ===
-        await asyncio.sleep(jitter(1.5, variance=1.0))
+        await throttle(base, "get_resource")
         await humanize_pre_action(page)
         await asyncio.sleep(1.0 + random.random() * 2.0)
 
@@ -565,84 +572,7 @@ async def process_account(account: Dict[str, Any], p) -> bool:
             logger.warning("[%s] 🚫 Получен 403 на get_resource, добавляем в повтор.", uid)
             return True
 
-        if not text.strip().startswith("{"):
-            logger.error("[%s] ⚠️ get_resource: сервер вернул не JSON", uid)
-            return False
-
-        # ✅ Парсим JSON
-        data = json.loads(text)
-        data_section = data.get("data", {})
-
-        if isinstance(data_section, list) and data_section:
-            user = data_section[0].get("user", {})
-        elif isinstance(data_section, dict):
-            user = data_section.get("user", {})
-        else:
-            user = {}
-
-        # ec_free
-        ec_free = user.get("ec_free", "0")
-
-        # puzzle
-        puzzle_data = {}
-        extra_info = user.get("extra_info")
-        if isinstance(extra_info, dict):
-            puzzle_data = extra_info.get("puzzle", {})
-        else:
-            ec_extra = user.get("ec_extra_info", "{}")
-            try:
-                ec_extra_json = json.loads(ec_extra)
-                puzzle_data = ec_extra_json.get("puzzle", {})
-            except Exception:
-                puzzle_data = {}
-
-        puzzle_data = {str(k): v for k, v in puzzle_data.items()}
-
-        # ✅ ЭТОТ ЛОГ ТЕПЕРЬ БУДЕТ ПИСАТЬСЯ В ФАЙЛ
-        logger.info("[%s] 🧩 Попытки: %s | Пазлы: %s", uid, ec_free, puzzle_data)
-
-        # --- формируем entry для батча ---
-        entry = {
-            "iggid": user.get("iggid"),
-            "ec_param": user.get("ec_param"),
-            "puzzle": puzzle_data,
-            "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-
-        global puzzle_batch, processed_count
-        puzzle_batch.append(entry)
-        processed_count += 1
-
-        # --- батчинг: каждые BATCH_SIZE аккаунтов ---
-        if processed_count % BATCH_SIZE == 0:
-            logger.info(f"💾 Пройдено {processed_count} аккаунтов — сохраняем batch")
-
-            # сохраняем в файл только дубликаты
-            for e in puzzle_batch:
-                duplicates = {}
-                for pid, count in e["puzzle"].items():
-                    try:
-                        if int(count) >= 2:
-                            duplicates[pid] = int(count) - 1
-                    except Exception:
-                        continue
-
-                if duplicates:
-                    e_to_save = e.copy()
-                    e_to_save["puzzle"] = duplicates
-                    save_puzzle_data(e_to_save, DATA_FILE)
-
-            try:
-                calculate_puzzle_totals(
-                    DATA_FILE,
-                    accounts_processed=processed_count
-                )
-            except Exception as e:
-                logger.warning(
-                    "⚠️ Не удалось обновить puzzle_summary.json: %s", e
-                )
-
-            puzzle_batch.clear()
+        record_resource(uid, text)
 
     except Exception as e:
         # 9 — сохраняем артефакты и при общей ошибке
@@ -664,74 +594,63 @@ async def process_account(account: Dict[str, Any], p) -> bool:
                 await context.close()
         except Exception:
             pass
-        # 🧹 Автоудаление профиля браузера после завершения аккаунта
-        try:
-            user_data_dir_path = Path(PROFILE_BASE_DIR / f"{uid}")
-            if user_data_dir_path.exists():
-                shutil.rmtree(user_data_dir_path, ignore_errors=True)
-                #logger.info("[%s] 🧹 Папка профиля удалена: %s", uid, user_data_dir_path)
-        except Exception as e:
-            logger.warning("[%s] ⚠️ Не удалось удалить профиль: %s", uid, e)
-        await asyncio.sleep(jitter(DELAY_BETWEEN_ACCOUNTS, variance=0.6))
 
     return False
 # ---------------- main ----------------
-async def main():
-    clear_stop_request()
-    accounts = load_accounts()
-    if not accounts:
-        logger.error("Аккаунты не найдены в %s", DATA_DIR)
-        return
-    start_time = time.perf_counter()
-    stats = {"total": len(accounts), "success": 0, "fail": 0}
-    logger.info("Всего аккаунтов: %d", len(accounts))
-    sem = asyncio.Semaphore(CONCURRENT)
+def _get_limiter():
+    return (
+        get_limiter("puzzle3_http", HTTP_CONCURRENT, max_limit=HTTP_MAX_CONCURRENT) if HTTP_ENGINE
+        else get_limiter("puzzle3", CONCURRENT, max_limit=MAX_CONCURRENT)
+    )
+
+
+async def _run_account(acc, pool, engine, limiter, stop=None):
+    """Один аккаунт под слотом лимитера; причина неудачи (R403 / TIMEOUT / ERROR), SKIP или None."""
+    uid = acc.get("uid")
+    async with limiter.slot() as slot:
+        if stop is not None and stop():
+            slot.skip()
+            logger.info("[%s] ⏹ Завершаем перед стартом обработки", uid)
+            return SKIP
+        reason = None
+        try:
+            if await process_account(acc, pool, engine):
+                reason = R403
+        except Exception as e:
+            reason = classify_exception(e)
+            logger.error(f"[{uid}] ❌ Ошибка: {e}")
+        if reason is not None:
+            slot.fail(reason)
+        return reason
+
+
+async def _farm(accounts, *, stop, on_final):
+    """Прогон аккаунтов в текущем процессе; on_final(ok) — аккаунт завершён окончательно."""
+    limiter = _get_limiter()
+    workers = min(limiter.max_limit, len(accounts)) if isinstance(accounts, list) else limiter.max_limit
 
     async with async_playwright() as p:
+        pool = BrowserPool(p, max_contexts=MAX_CONCURRENT, slow_mo=SLOW_MO)
+        engine = EventHttp() if HTTP_ENGINE else None
 
-        async def run_batch(batch_accounts, allow_retry: bool):
-            retry_accounts = []
-
-            async def worker(acc):
-                uid = acc.get("uid")
-                if STOP_EVENT.is_set():
-                    logger.info("[%s] ⏹ Пропуск аккаунта: получен сигнал остановки", uid)
-                    return
-                async with sem:
-                    if STOP_EVENT.is_set():
-                        logger.info("[%s] ⏹ Завершаем перед стартом обработки", uid)
-                        return
-                    try:
-                        needs_retry = await process_account(acc, p)
-                        if needs_retry:
-                            if allow_retry:
-                                retry_accounts.append(acc)
-                            else:
-                                stats["fail"] += 1
-                        else:
-                            stats["success"] += 1
-                    except Exception as e:
-                        stats["fail"] += 1
-                        logger.error(f"[{acc.get('uid')}] ❌ Ошибка: {e}")
-
-            tasks = [asyncio.create_task(worker(acc)) for acc in batch_accounts]
-            try:
-                await tqdm_asyncio.gather(*tasks, desc="Обработка аккаунтов", total=len(tasks))
-            except asyncio.CancelledError:
-                for task in tasks:
-                    task.cancel()
-                await asyncio.gather(*tasks, return_exceptions=True)
-                raise
-
-            return retry_accounts
-
-        for batch_start in range(0, len(accounts), BATCH_RETRY_SIZE):
-            if STOP_EVENT.is_set():
-                break
-            batch = accounts[batch_start:batch_start + BATCH_RETRY_SIZE]
-            retry_accounts = await run_batch(batch, allow_retry=True)
-            if retry_accounts and not STOP_EVENT.is_set():
-                await run_batch(retry_accounts, allow_retry=False)
+        queue = RetryQueue(accounts, RETRY_POLICY, key=lambda acc: acc.get("uid"), name="puzzle3")
+
+        async def handle(job):
+            return await _run_account(job.item, pool, engine, limiter, stop)
+
+        # повторы 403 / таймаутов идут вперемешку со свежими аккаунтами
+        await drain(queue, handle, workers=workers, stop=stop,
+                    on_final=lambda job, reason: on_final(reason is None))
+
+        logger.info("🧭 Пул браузеров: %s", pool.stats())
+        logger.info("📈 Параллелизм: %s", limiter.stats())
+        logger.info("🪣 Темп запросов: %s", rate_stats())
+        logger.info("🔁 Повторы: %s", queue.stats())
+        logger.info("🚦 Сеть (%s): %s", NET_POLICY, policy_stats().get(NET_POLICY))
+        await pool.close()
+        if engine is not None:
+            logger.info("⚡ HTTP-движок: %s", engine.stats())
+            await engine.close()
 
         # Сохраняем остатки, которые не дотянули до BATCH_SIZE
         async with puzzle_lock:
@@ -745,6 +664,80 @@ async def main():
         for e in puzzle_batch:
             save_puzzle_data(e, DATA_FILE)
 
+
+async def farm_shard(items, ctx):
+    """Точка входа дочернего процесса (services.process_pool): аккаунты из общей очереди."""
+    global interim_totals
+    interim_totals = False
+    setup_file_logging(LOG_DIR / f"puzzle3_auto.p{ctx.child_id}.log")
+    await _farm(items, stop=ctx.stop_requested, on_final=lambda ok: ctx.progress(ok=ok))
+
+
+@asynccontextmanager
+async def job_runner():
+    """Ресурсы воркера очереди заданий (services.job_worker): run(acc) -> (reason, None)."""
+    global interim_totals
+    interim_totals = False
+    setup_file_logging(LOG_DIR / "puzzle3_auto.worker.log")
+    limiter = _get_limiter()
+    async with async_playwright() as p:
+        pool = BrowserPool(p, max_contexts=MAX_CONCURRENT, slow_mo=SLOW_MO)
+        engine = EventHttp() if HTTP_ENGINE else None
+
+        async def run(acc):
+            return await _run_account(acc, pool, engine, limiter), None
+
+        try:
+            yield run
+        finally:
+            logger.info("🧭 Пул браузеров: %s", pool.stats())
+            logger.info("📈 Параллелизм: %s", limiter.stats())
+            await pool.close()
+            if engine is not None:
+                logger.info("⚡ HTTP-движок: %s", engine.stats())
+                await engine.close()
+        async with puzzle_lock:
+            if puzzle_batch:
+                logger.info(f"💾 Сохраняем остаток данных: {len(puzzle_batch)} аккаунтов")
+                for e in puzzle_batch:
+                    save_puzzle_data(e, DATA_FILE)
+                puzzle_batch.clear()
+
+
+
+async def main():
+    setup_file_logging()
+    clear_stop_request()
+    accounts = load_accounts()
+    if not accounts:
+        logger.error("Аккаунты не найдены в %s", DATA_DIR)
+        return
+    start_time = time.perf_counter()
+    stats = {"total": len(accounts), "success": 0, "fail": 0}
+    logger.info("Всего аккаунтов: %d", len(accounts))
+    progress = tqdm_asyncio(total=len(accounts), desc="Обработка аккаунтов")
+
+    def on_final(ok: bool):
+        stats["success" if ok else "fail"] += 1
+        progress.update(1)
+
+    try:
+        if JOB_QUEUE:
+            await run_batch(
+                "puzzle3", [(acc.get("uid"), acc) for acc in accounts],
+                max_attempts=RETRY_POLICY.max_attempts, stop=STOP_EVENT.is_set,
+                on_done=lambda job: job["status"] != "cancelled" and on_final(job["status"] == "done"),
+            )
+        elif PROCESSES > 1:
+            await run_sharded(
+                "services.puzzle3_auto:farm_shard", accounts, processes=PROCESSES,
+                stop=STOP_EVENT.is_set, on_progress=lambda _child, msg: on_final(bool(msg.get("ok"))),
+            )
+        else:
+            await _farm(accounts, stop=STOP_EVENT.is_set, on_final=on_final)
+    finally:
+        progress.close()
+
     # ✅ После обработки всех аккаунтов — пересчитываем общие итоги пазлов
     try:
         calculate_puzzle_totals(DATA_FILE, accounts_processed=stats["success"])
@@ -758,6 +751,7 @@ async def main():
     logger.info(f"Успешно: {stats['success']}")
     logger.info(f"Ошибок: {stats['fail']}")
     logger.info(f"Время выполнения: {total_time} сек.")
+    logger.info(f"Скорость: {round(stats['total'] / max(total_time, 1) * 60, 1)} акк/мин")
     logger.info("Все аккаунты обработаны.")
 
 
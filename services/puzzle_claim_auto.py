@@ -1,5 +1,4 @@
 # tg_zov/services/puzzle_claim_auto.py
-import os
 import json
 import asyncio
 import logging
@@ -9,18 +8,18 @@ from html import escape
 from pathlib import Path
 from typing import Optional, Dict, Any, Tuple, List
 
-from playwright.async_api import async_playwright
 from services.logger import logger
+from services import cookie_store
+from services.puzzle_log import get_log as get_puzzle_log
+from services.donor_index import get_donor_index
+from services.claim_ledger import get_ledger
 from services.browser_patches import (
-    BROWSER_PATH,
-    get_random_browser_profile,
-    humanize_pre_action,
+    browser_handoff,
     cookies_to_playwright,
-    launch_masked_persistent_context,
+    get_browser_pool,
 )
 
 # === Пути и настройки ===
-COOKIES_FILE = Path("data/cookies.json")
 PUZZLE_DATA_FILE = Path("data/puzzle_data.jsonl")
 EVENT_PAGE = "https://event-eu-cc.igg.com/event/puzzle2/"
 EVENT_API = f"{EVENT_PAGE}ajax.req.php"
@@ -32,73 +31,30 @@ log.setLevel(logging.INFO)
 
 # ---------------- utilities ----------------
 def load_cookies_file() -> dict:
-    if not COOKIES_FILE.exists():
-        return {}
+    """Все cookies в формате cookies.json (данные лежат в cookie_store)."""
     try:
-        with open(COOKIES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return cookie_store.load_all()
     except Exception as e:
-        logger.warning(f"[PUZZLE_CLAIM] Ошибка чтения cookies.json: {e}")
+        logger.warning(f"[PUZZLE_CLAIM] Ошибка чтения cookies: {e}")
         return {}
 
 def save_cookies_file(data: dict):
-    COOKIES_FILE.parent.mkdir(parents=True, exist_ok=True)
-    tmp = COOKIES_FILE.with_suffix(".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, COOKIES_FILE)
+    cookie_store.put_many(data)
 
 def parse_jsonl_blocks(path: Path) -> List[Dict[str, Any]]:
-    if not path.exists():
-        return []
-    blocks, buf = [], ""
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                buf += line
-            else:
-                if buf.strip():
-                    try:
-                        blocks.append(json.loads(buf))
-                    except Exception:
-                        pass
-                    buf = ""
-        if buf.strip():
-            try:
-                blocks.append(json.loads(buf))
-            except Exception:
-                pass
-    return blocks
+    return get_puzzle_log(path).records()
 
 def write_jsonl_blocks(path: Path, blocks: List[Dict[str, Any]]):
-    tmp = path.with_suffix(".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        for b in blocks:
-            json.dump(b, f, ensure_ascii=False, indent=2)
-            f.write("\n\n")
-    os.replace(tmp, path)
+    get_puzzle_log(path).replace_all(blocks)
 
 def find_donor_for_puzzle(puzzle_num: int) -> Optional[Tuple[Dict[str, Any], int]]:
-    blocks = parse_jsonl_blocks(PUZZLE_DATA_FILE)
-    for i, entry in enumerate(blocks):
-        puzzle = entry.get("puzzle", {})
-        if str(puzzle_num) in puzzle and int(puzzle[str(puzzle_num)]) > 0:
-            return entry, i
-    return None
+    return get_donor_index(PUZZLE_DATA_FILE).find(puzzle_num)
 
 
-def find_donor_for_puzzle_exclude(puzzle_num: int, exclude_iggids: set) -> Optional[
+def find_donor_for_puzzle_exclude(puzzle_num: int, exclude_iggids: set, owner: Optional[str] = None) -> Optional[
     Tuple[Dict[str, Any], int]]:
-    """Ищет донора для пазла, пропуская уже использованных."""
-    blocks = parse_jsonl_blocks(PUZZLE_DATA_FILE)
-    for i, entry in enumerate(blocks):
-        iggid = entry.get("iggid")
-        if iggid in exclude_iggids:
-            continue
-        puzzle = entry.get("puzzle", {})
-        if str(puzzle_num) in puzzle and int(puzzle[str(puzzle_num)]) > 0:
-            return entry, i
-    return None
+    """Ищет донора для пазла, пропуская уже использованных (owner — ключ курсора в индексе)."""
+    return get_donor_index(PUZZLE_DATA_FILE).find(puzzle_num, exclude=exclude_iggids, owner=owner)
 
 
 # ---------------- main logic ----------------
@@ -114,39 +70,11 @@ async def claim_puzzle(
     tg_user_id = str(tg_user_id)
     logger.info(f"[PUZZLE_CLAIM] 🔍 Поиск пазла {puzzle_num} для user={tg_user_id}")
 
-    CLAIM_LOG_FILE = Path("data/puzzle_claim_log.json")
-
-    # ===== ЛОГ =====
-    def load_claim_log() -> dict:
-        if CLAIM_LOG_FILE.exists():
-            try:
-                with open(CLAIM_LOG_FILE, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception:
-                return {}
-        return {}
-
-    def save_claim_log(data: dict):
-        CLAIM_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        tmp = CLAIM_LOG_FILE.with_suffix(".tmp")
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        os.replace(tmp, CLAIM_LOG_FILE)
-
-    log_data = load_claim_log()
-    users_meta = log_data.setdefault("users_meta", {})
-    if user_name or user_tag:
-        users_meta[str(tg_user_id)] = {
-            "name": user_name or users_meta.get(str(tg_user_id), {}).get("name", ""),
-            "tag": user_tag or users_meta.get(str(tg_user_id), {}).get("tag", ""),
-        }
+    ledger = get_ledger()
+    ledger.set_user_meta(tg_user_id, user_name, user_tag)
 
     # ===== Проверка лимитов и повторов =====
-    user_entry = log_data.setdefault("users", {}).setdefault(tg_user_id, {}).setdefault(
-        target_iggid, {"donors": [], "count": 0, "claimed_puzzles": [], "last_messages": {}}
-    )
-    if user_name or user_tag:
-        save_claim_log(log_data)
+    user_entry = ledger.account(tg_user_id, target_iggid)
 
     # если достигнут лимит 30 пазлов
     if user_entry["count"] >= 30:
@@ -158,7 +86,8 @@ async def claim_puzzle(
         return
 
     used_donors = set(user_entry["donors"])
-    donor_data = find_donor_for_puzzle_exclude(puzzle_num, used_donors)
+    cursor_key = f"{tg_user_id}:{target_iggid}"
+    donor_data = find_donor_for_puzzle_exclude(puzzle_num, used_donors, owner=cursor_key)
     if not donor_data:
         await bot.send_message(
             tg_user_id,
@@ -172,9 +101,7 @@ async def claim_puzzle(
         await bot.send_message(tg_user_id, "⚠️ Ошибка: у донора нет IGGID.")
         return
 
-    cookies_db = load_cookies_file()
-    user_cookies = cookies_db.get(tg_user_id, {})
-    acc_cookies = user_cookies.get(str(target_iggid), {})
+    acc_cookies = cookie_store.get_cookies(tg_user_id, target_iggid)
     if not acc_cookies:
         await bot.send_message(tg_user_id, "⚠️ У выбранного аккаунта нет cookies. Сначала обнови их.")
         return
@@ -186,52 +113,13 @@ async def claim_puzzle(
   #  )
 
     try:
-        async with async_playwright() as p:
-            profile = get_random_browser_profile()
-            ctx = await launch_masked_persistent_context(
-                p,
-                user_data_dir=str(PROFILE_DIR / f"{target_iggid}"),
-                browser_path=BROWSER_PATH,
-                headless=True,
-                slow_mo=50,
-                profile=profile
-            )
-            context, page = ctx["context"], ctx["page"]
-
-            # добавляем старые куки
-            await context.add_cookies(cookies_to_playwright(acc_cookies))
-            await page.goto(EVENT_PAGE, wait_until="domcontentloaded", timeout=30000)
-            await asyncio.sleep(1.5)
-            await humanize_pre_action(page)
-
-            # обновляем куки
-            fresh = await context.cookies()
-            fresh_map = {c["name"]: c["value"] for c in fresh if "name" in c}
-            if fresh_map:
-                cookies_db.setdefault(tg_user_id, {})[str(target_iggid)] = fresh_map
-                save_cookies_file(cookies_db)
-
+        # 🔥 cookies/UA снимаются с тёплой сессии (она сразу отпускается), запросы перебора доноров — по HTTP
+        async with browser_handoff(tg_user_id, target_iggid, EVENT_PAGE, warm=True) as handoff:
             # === Основной запрос ===
             claim_url = f"{EVENT_API}?action=claim_friend_puzzle&friend_iggid={donor_iggid}&puzzle={puzzle_num}"
             logger.info(f"[PUZZLE_CLAIM] 🎯 Запрос: {claim_url}")
 
-            js = f"""
-                async () => {{
-                    const res = await fetch("{claim_url}", {{
-                        method: 'GET',
-                        credentials: 'include',
-                        headers: {{
-                            'X-Requested-With': 'XMLHttpRequest',
-                            'Referer': '{EVENT_PAGE}'
-                        }}
-                    }});
-                    const txt = await res.text();
-                    return {{status: res.status, text: txt}};
-                }}
-            """
-            resp = await page.evaluate(js)
-            text = resp.get("text", "")
-            status = resp.get("status", 0)
+            status, text = await handoff.fetch(claim_url)
             logger.info(f"[PUZZLE_CLAIM] Ответ: {status} | {text[:200]}")
 
             # --- 🔁 Перебор доноров ---
@@ -256,10 +144,9 @@ async def claim_puzzle(
                     elif parsed_json.get("error") == 4:
                         logger.info(f"[PUZZLE_CLAIM] ⚠️ Донор {donor_iggid} уже использован, ищем другого...")
                         used_donors.add(donor_iggid)
-                        user_entry["donors"].append(donor_iggid)
-                        save_claim_log(log_data)
+                        ledger.add_used_donor(tg_user_id, target_iggid, donor_iggid)
 
-                        donor_data = find_donor_for_puzzle_exclude(puzzle_num, used_donors)
+                        donor_data = find_donor_for_puzzle_exclude(puzzle_num, used_donors, owner=cursor_key)
                         if not donor_data:
                             last_error = 4
                             break
@@ -269,22 +156,7 @@ async def claim_puzzle(
                         logger.info(f"[PUZZLE_CLAIM] 🔁 Попытка #{attempt} — новый донор {donor_iggid}")
 
                         claim_url = f"{EVENT_API}?action=claim_friend_puzzle&friend_iggid={donor_iggid}&puzzle={puzzle_num}"
-                        js = f"""
-                            async () => {{
-                                const res = await fetch("{claim_url}", {{
-                                    method: 'GET',
-                                    credentials: 'include',
-                                    headers: {{
-                                        'X-Requested-With': 'XMLHttpRequest',
-                                        'Referer': '{EVENT_PAGE}'
-                                    }}
-                                }});
-                                const txt = await res.text();
-                                return {{status: res.status, text: txt}};
-                            }}
-                        """
-                        resp = await page.evaluate(js)
-                        text = resp.get("text", "")
+                        _, text = await handoff.fetch(claim_url)
                         continue
 
 
@@ -295,14 +167,7 @@ async def claim_puzzle(
                         logger.info(
                             f"[PUZZLE_CLAIM] 🚫 Лимит 30 пазлов достигнут для {target_iggid}. Устанавливаю count=30.")
 
-                        user_entry["count"] = 30
-
-                        # гарантируем наличие словаря сообщений
-
-                        if "last_messages" not in user_entry or not isinstance(user_entry["last_messages"], dict):
-                            user_entry["last_messages"] = {}
-
-                        save_claim_log(log_data)
+                        ledger.mark_limit(tg_user_id, target_iggid)
 
                         last_error = 5
 
@@ -338,8 +203,7 @@ async def claim_puzzle(
 
                             else:
                                 msg = await bot.send_message(tg_user_id, err_text, parse_mode="HTML")
-                                user_entry["last_messages"][str(puzzle_num)] = msg.message_id
-                                save_claim_log(log_data)
+                                ledger.set_message(tg_user_id, target_iggid, puzzle_num, msg.message_id)
                         except Exception as e:
                             logger.warning(f"[PUZZLE_CLAIM] Ошибка отправки уведомления о лимите: {e}")
                         break
@@ -353,26 +217,10 @@ async def claim_puzzle(
 
             # --- 📘 Обновление данных ---
             if success:
-                blocks = parse_jsonl_blocks(PUZZLE_DATA_FILE)
-                if 0 <= donor_index < len(blocks):
-                    puzzles = blocks[donor_index].get("puzzle", {})
-                    count = int(puzzles.get(str(puzzle_num), 0))
-                    if count > 1:
-                        puzzles[str(puzzle_num)] = count - 1
-                    else:
-                        puzzles.pop(str(puzzle_num), None)
-                    if not puzzles:
-                        blocks.pop(donor_index)
-                    else:
-                        blocks[donor_index]["puzzle"] = puzzles
-                    write_jsonl_blocks(PUZZLE_DATA_FILE, blocks)
+                get_donor_index(PUZZLE_DATA_FILE).claim(donor_iggid, puzzle_num)
 
-                if donor_iggid not in user_entry["donors"]:
-                    user_entry["donors"].append(donor_iggid)
-                    user_entry["count"] += 1
-                if puzzle_num not in user_entry.get("claimed_puzzles", []):
-                    user_entry["claimed_puzzles"].append(puzzle_num)
-                save_claim_log(log_data)
+                ledger.record_claim(tg_user_id, target_iggid, donor_iggid, puzzle_num)
+                user_entry = ledger.account(tg_user_id, target_iggid)
 
                 remaining = 30 - user_entry["count"]
                 puzzles_list = ", ".join(map(str, user_entry["claimed_puzzles"]))
@@ -403,12 +251,10 @@ async def claim_puzzle(
                     except Exception:
                         # если вдруг удалено — создаём заново
                         m = await bot.send_message(tg_user_id, text_out, parse_mode="HTML")
-                        user_entry["last_messages"]["summary"] = m.message_id
-                        save_claim_log(log_data)
+                        ledger.set_message(tg_user_id, target_iggid, "summary", m.message_id)
                 else:
                     m = await bot.send_message(tg_user_id, text_out, parse_mode="HTML")
-                    user_entry["last_messages"]["summary"] = m.message_id
-                    save_claim_log(log_data)
+                    ledger.set_message(tg_user_id, target_iggid, "summary", m.message_id)
 
                 if remaining <= 0:
                     await bot.send_message(
@@ -437,34 +283,21 @@ async def claim_puzzle(
                     await bot.edit_message_text(chat_id=tg_user_id, message_id=msg_id, text=err_text, parse_mode="HTML")
                 else:
                     msg = await bot.send_message(tg_user_id, err_text, parse_mode="HTML")
-                    user_entry["last_messages"][str(puzzle_num)] = msg.message_id
-                    save_claim_log(log_data)
+                    ledger.set_message(tg_user_id, target_iggid, puzzle_num, msg.message_id)
 
     except Exception as e:
         logger.exception(f"[PUZZLE_CLAIM] Ошибка claim_puzzle: {e}")
         await bot.send_message(tg_user_id, f"❌ Ошибка при выполнении запроса: {e}")
 
-    finally:
-        try:
-            if 'page' in locals():
-                await page.close()
-            if 'context' in locals():
-                await context.close()
-        except Exception:
-            pass
-
 # ---------------- Проверка активности события Puzzle2 ----------------
 async def check_puzzle2_active(user_id: str) -> bool:
     """
     Проверяет, активна ли акция «Пазлы».
     Возвращает True, если страница реально содержит элементы Puzzle2.
     """
-    from services.cookies_io import load_all_cookies
-
     EVENT_URL = "https://event-eu-cc.igg.com/event/puzzle2/"
     user_id = str(user_id)
-    cookies_db = load_all_cookies()
-    user_cookies = cookies_db.get(user_id, {})
+    user_cookies = cookie_store.get_user_cookies(user_id)
 
     if not user_cookies:
         logger.warning(f"[puzzle_check] ⚠️ Нет cookies для user_id={user_id}")
@@ -477,15 +310,7 @@ async def check_puzzle2_active(user_id: str) -> bool:
         logger.warning(f"[puzzle_check] ⚠️ Нет cookies для первого аккаунта {first_uid}")
         return False
 
-    async with async_playwright() as p:
-        ctx_info = await launch_masked_persistent_context(
-            p,
-            user_data_dir=str(PROFILE_DIR / first_uid),
-            browser_path=BROWSER_PATH,
-            headless=True,
-            slow_mo=30,
-            profile=get_random_browser_profile(),
-        )
+    async with get_browser_pool().session(policy="api-only", label=first_uid) as ctx_info:
         context, page = ctx_info["context"], ctx_info["page"]
 
         try:
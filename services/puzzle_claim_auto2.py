@@ -1,15 +1,15 @@
 # tg_zov/services/puzzle_claim_auto2.py
 
-import os
 import json
-import asyncio
-import random
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
-from playwright.async_api import async_playwright
 from html import escape
 
 from services.logger import logger
+from services import cookie_store, persist
+from services.puzzle_log import get_log as get_puzzle_log
+from services.donor_index import get_donor_index
+from services.claim_ledger import get_ledger
 from services.event_checker import get_event_status
 from services.puzzle_files import (
     PUZZLE_CLAIM_LOG_FILE,
@@ -18,15 +18,13 @@ from services.puzzle_files import (
     clear_puzzle_runtime_files,
 )
 from services.browser_patches import (
-    BROWSER_PATH,
-    get_random_browser_profile,
     cookies_to_playwright,
-    launch_masked_persistent_context,
+    get_browser_pool,
     humanize_pre_action,
 )
+from services.rate_limit import throttle
 
 # ================== PATHS ==================
-COOKIES_FILE = Path("data/cookies.json")
 PUZZLE_CLAIM_LOG = PUZZLE_CLAIM_LOG_FILE
 PROFILE_DIR = Path("data/chrome_profiles")
 PROFILE_DIR.mkdir(parents=True, exist_ok=True)
@@ -46,41 +44,16 @@ def load_json(path: Path, default):
         return default
 
 def save_json(path: Path, data):
-    tmp = path.with_suffix(".tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    os.replace(tmp, path)
+    persist.write_json(path, data)
 
 def parse_jsonl(path: Path) -> List[Dict[str, Any]]:
-    if not path.exists():
-        return []
-    blocks, buf = [], ""
-    for line in path.read_text(encoding="utf-8").splitlines():
-        if line.strip():
-            buf += line
-        else:
-            if buf.strip():
-                blocks.append(json.loads(buf))
-            buf = ""
-    if buf.strip():
-        blocks.append(json.loads(buf))
-    return blocks
+    return get_puzzle_log(path).records()
 
 def write_jsonl(path: Path, blocks: List[Dict[str, Any]]):
-    tmp = path.with_suffix(".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        for b in blocks:
-            json.dump(b, f, ensure_ascii=False, indent=2)
-            f.write("\n\n")
-    os.replace(tmp, path)
-
-def find_donor(puzzle_id: int, exclude: set) -> Optional[Tuple[Dict, int]]:
-    blocks = parse_jsonl(PUZZLE_DATA_FILE)
-    for i, b in enumerate(blocks):
-        if b.get("iggid") in exclude:
-            continue
-        if str(puzzle_id) in b.get("puzzle", {}):
-            return b, i
-    return None
+    get_puzzle_log(path).replace_all(blocks)
+
+def find_donor(puzzle_id: int, exclude: set, owner: Optional[str] = None) -> Optional[Tuple[Dict, int]]:
+    return get_donor_index(PUZZLE_DATA_FILE).find(puzzle_id, exclude=exclude, owner=owner)
 
 # ================== AUTO CLAIM PUZZLE ==================
 async def auto_claim_puzzle2(user_id: str, bot, target_iggid: Optional[str] = None, amount: int = 30) -> bool:
@@ -95,15 +68,13 @@ async def auto_claim_puzzle2(user_id: str, bot, target_iggid: Optional[str] = No
             return False
 
         tg_user_id = str(user_id)
-        claim_log = load_json(PUZZLE_CLAIM_LOG, {})
-        user_entry = claim_log.setdefault("users", {}).setdefault(tg_user_id, {})
+        ledger = get_ledger()
 
         received_total = 0
         puzzle_idx = 0
 
         # Загружаем cookies пользователя
-        cookies_db = load_json(COOKIES_FILE, {})
-        accounts = cookies_db.get(tg_user_id)
+        accounts = cookie_store.get_user_cookies(tg_user_id)
         if not accounts:
             await bot.send_message(tg_user_id, "⚠️ Нет cookies для пользователя.")
             return False
@@ -117,23 +88,15 @@ async def auto_claim_puzzle2(user_id: str, bot, target_iggid: Optional[str] = No
 
         amount = min(amount, 30)
 
-        async with async_playwright() as p:
-            ctx_info = await launch_masked_persistent_context(
-                p,
-                user_data_dir=str(PROFILE_DIR / target_iggid),
-                browser_path=BROWSER_PATH,
-                headless=True,
-                slow_mo=50,
-                profile=get_random_browser_profile()
-            )
+        async with get_browser_pool().session(policy="api-only", label=target_iggid) as ctx_info:
             context, page = ctx_info["context"], ctx_info["page"]
 
             await context.add_cookies(cookies_to_playwright(acc_cookies))
+            await throttle(EVENT_PAGE, "page")
             await page.goto(EVENT_PAGE, wait_until="domcontentloaded", timeout=30000)
-            await asyncio.sleep(1.5)
             await humanize_pre_action(page)
 
-            while received_total < amount and user_entry.get("count", 0) < 30:
+            while received_total < amount and ledger.account(tg_user_id, target_iggid)["count"] < 30:
                 puzzle_id = PUZZLE_ORDER[puzzle_idx % 9]
                 puzzle_idx += 1
 
@@ -142,7 +105,8 @@ async def auto_claim_puzzle2(user_id: str, bot, target_iggid: Optional[str] = No
                 last_error = None
 
                 while retries < 3 and not success:
-                    donor_data = find_donor(puzzle_id, set(user_entry.get("donors", [])))
+                    used_donors = set(ledger.account(tg_user_id, target_iggid)["donors"])
+                    donor_data = find_donor(puzzle_id, used_donors, owner=f"{tg_user_id}:{target_iggid}")
                     if not donor_data:
                         break
 
@@ -151,6 +115,8 @@ async def auto_claim_puzzle2(user_id: str, bot, target_iggid: Optional[str] = No
 
                     url = f"{EVENT_API}?action=claim_friend_puzzle&friend_iggid={donor_iggid}&puzzle={puzzle_id}"
 
+                    # темп claim_friend_puzzle — services.rate_limit (общий с другими пользователями)
+                    await throttle(url)
                     resp = await page.evaluate(f"""
                         async () => {{
                             const r = await fetch("{url}", {{
@@ -174,38 +140,26 @@ async def auto_claim_puzzle2(user_id: str, bot, target_iggid: Optional[str] = No
                         success = True
 
                         # --- update puzzle_data ---
-                        blocks = parse_jsonl(PUZZLE_DATA_FILE)
-                        puzzles = blocks[donor_index]["puzzle"]
-                        puzzles[str(puzzle_id)] -= 1
-                        if puzzles[str(puzzle_id)] <= 0:
-                            puzzles.pop(str(puzzle_id))
-                        if not puzzles:
-                            blocks.pop(donor_index)
-                        write_jsonl(PUZZLE_DATA_FILE, blocks)
+                        get_donor_index(PUZZLE_DATA_FILE).claim(donor_iggid, puzzle_id)
 
                         # --- update summary ---
-                        summary = load_json(PUZZLE_SUMMARY_FILE, {"totals": {}, "all_duplicates": 0})
-                        summary["totals"][str(puzzle_id)] = summary["totals"].get(str(puzzle_id), 1) - 1
-                        summary["all_duplicates"] = summary.get("all_duplicates", 1) - 1
-                        save_json(PUZZLE_SUMMARY_FILE, summary)
+                        with persist.transaction(PUZZLE_SUMMARY_FILE, {"totals": {}, "all_duplicates": 0}) as summary:
+                            totals = summary.setdefault("totals", {})
+                            totals[str(puzzle_id)] = totals.get(str(puzzle_id), 1) - 1
+                            summary["all_duplicates"] = summary.get("all_duplicates", 1) - 1
 
-                        user_entry.setdefault("donors", []).append(donor_iggid)
-                        user_entry["count"] = user_entry.get("count", 0) + 1
-                        save_json(PUZZLE_CLAIM_LOG, claim_log)
+                        ledger.record_claim(tg_user_id, target_iggid, donor_iggid, puzzle_id)
 
                         received_total += 1
-                        await asyncio.sleep(random.uniform(1.5, 3.0))
                         break
 
                     else:
                         last_error = data.get("error")
-                        user_entry.setdefault("donors", []).append(donor_iggid)
-                        save_json(PUZZLE_CLAIM_LOG, claim_log)
+                        ledger.add_used_donor(tg_user_id, target_iggid, donor_iggid)
                         retries += 1
 
                         if last_error == 5:
-                            user_entry["count"] = 30
-                            save_json(PUZZLE_CLAIM_LOG, claim_log)
+                            ledger.mark_limit(tg_user_id, target_iggid)
                             await bot.send_message(
                                 tg_user_id,
                                 f"🚫 Аккаунт <code>{target_iggid}</code> достиг лимита 30 пазлов.",
@@ -224,7 +178,7 @@ async def auto_claim_puzzle2(user_id: str, bot, target_iggid: Optional[str] = No
 
             await bot.send_message(
                 tg_user_id,
-                f"✅ Все пазлы собраны\nПолучено: <b>{user_entry.get('count', 0)}</b> / 30",
+                f"✅ Все пазлы собраны\nПолучено: <b>{ledger.account(tg_user_id, target_iggid)['count']}</b> / 30",
                 parse_mode="HTML"
             )
 
@@ -6,16 +6,11 @@ import random
 from pathlib import Path
 from typing import Dict, Any, Optional
 from html import escape
-from playwright.async_api import async_playwright, Playwright, BrowserContext, Page
+from playwright.async_api import Page
 
 from services.logger import logger
-from services.browser_patches import (
-    BROWSER_PATH,
-    get_random_browser_profile,
-    cookies_to_playwright,
-    launch_masked_persistent_context,
-    humanize_pre_action,
-)
+from services.browser_patches import humanize_pre_action
+from services.warm_sessions import get_warm_sessions
 
 LOG = logger
 FAIL_DIR = Path("data/fails")
@@ -27,8 +22,8 @@ PROFILE_DIR = Path("data/chrome_profiles")
 PROFILE_DIR.mkdir(parents=True, exist_ok=True)
 
 # ---------------- SESSION STORAGE ----------------
-# user_id -> {"page": Page, "context": BrowserContext, "playwright": Playwright, "timer": Task}
-active_sessions: Dict[str, Dict[str, Any]] = {}
+# user_id -> uid аккаунта, на котором идёт обмен; сами страницы живут в кэше тёплых сессий
+active_sessions: Dict[str, str] = {}
 
 
 async def _extract_exchange_items(page: Page) -> Dict[str, Dict[str, Any]]:
@@ -121,26 +116,6 @@ def parse_json(text: str):
     except Exception:
         return None
 
-async def keep_browser_open(user_id: str, timeout: int = 60):
-    await asyncio.sleep(timeout)
-    session = active_sessions.get(user_id)
-    if session:
-        page = session.get("page")
-        context = session.get("context")
-        p: Playwright = session.get("playwright")
-        if page:
-            try: await page.close()
-            except Exception as e: LOG.warning(f"[keep_browser_open] Ошибка при закрытии page: {e}")
-        if context:
-            try: await context.close()
-            except Exception as e: LOG.warning(f"[keep_browser_open] Ошибка при закрытии context: {e}")
-        if p:
-            try: await p.stop()
-            except Exception as e: LOG.warning(f"[keep_browser_open] Ошибка при остановке playwright: {e}")
-        if session.get("timer"): session["timer"].cancel()
-        del active_sessions[user_id]
-        LOG.info(f"[keep_browser_open] Сессия для user {user_id} закрыта по таймауту")
-
 # ---------------- HANDLERS ----------------
 async def handle_get_fragment_count(page: Page):
     js = f"""
@@ -204,84 +179,47 @@ async def handle_exchange_item(page: Page, item_id: str):
     return {"success": False, "message": parsed.get("msg", "Обмен не выполнен")}
 
 # ---------------- PUBLIC API ----------------
-async def start_session(user_id: str, iggid: str, cookies: list):
+async def start_session(user_id: str, iggid: str, cookies: Dict[str, str]):
     LOG.info(f"[start_session] user_id={user_id}, iggid={iggid}")
 
-    if user_id in active_sessions:
-        LOG.info(f"[start_session] Используем существующую сессию для {user_id}")
-        return active_sessions[user_id]
+    session = await get_warm_sessions().get(user_id, iggid, EVENT_PAGE, cookies=cookies)
+    active_sessions[user_id] = str(iggid)
 
-    # ---- Запуск Playwright без async with ----
-    p: Playwright = await async_playwright().start()
-    ctx_info = await launch_masked_persistent_context(
-        p,
-        user_data_dir=str(PROFILE_DIR / iggid),
-        browser_path=BROWSER_PATH,
-        headless=True,
-        slow_mo=50,
-        profile=get_random_browser_profile()
-    )
-    context: BrowserContext = ctx_info["context"]
-    page: Page = ctx_info["page"]
+    LOG.info(f"[start_session] Сессия готова для {user_id} (страница {'загружена' if session.navigated else 'уже открыта'})")
+    return {"page": session.page, "context": session.context}
 
-    await context.add_cookies(cookies_to_playwright(cookies))
-    await page.goto(EVENT_PAGE, wait_until="domcontentloaded", timeout=30000)
-    await asyncio.sleep(1.5)
-    await humanize_pre_action(page)
-
-    timer_task = asyncio.create_task(keep_browser_open(user_id, 60))
-    active_sessions[user_id] = {
-        "page": page,
-        "context": context,
-        "playwright": p,  # сохраняем Playwright, чтобы не закрывался
-        "timer": timer_task
-    }
-
-    LOG.info(f"[start_session] Сессия успешно создана для {user_id}")
-    return active_sessions[user_id]
+def _session_uid(user_id: str) -> Optional[str]:
+    return active_sessions.get(user_id)
 
 async def get_fragments(user_id: str):
-    session = active_sessions.get(user_id)
-    if not session: return {"success": False, "message": "Нет активной сессии"}
-    return await handle_get_fragment_count(session["page"])
+    uid = _session_uid(user_id)
+    if not uid: return {"success": False, "message": "Нет активной сессии"}
+    async with get_warm_sessions().acquire(user_id, uid, EVENT_PAGE) as session:
+        return await handle_get_fragment_count(session.page)
 
 async def get_exchange_items(user_id: str) -> Dict[str, Dict[str, Any]]:
-    session = active_sessions.get(user_id)
-    if not session:
+    uid = _session_uid(user_id)
+    if not uid:
         return {}
-    page: Page = session["page"]
     try:
-        return await _extract_exchange_items(page)
+        async with get_warm_sessions().acquire(user_id, uid, EVENT_PAGE) as session:
+            return await _extract_exchange_items(session.page)
     except Exception as exc:
         LOG.warning("[exchange_items] ⚠️ Ошибка загрузки предметов: %s", exc)
         return {}
 
 async def exchange(user_id: str, item_id: str, times: int):
-    session = active_sessions.get(user_id)
-    if not session: return {"success": False, "message": "Нет активной сессии"}
-    page: Page = session["page"]
+    uid = _session_uid(user_id)
+    if not uid: return {"success": False, "message": "Нет активной сессии"}
     results = []
-    for _ in range(times):
-        results.append(await handle_exchange_item(page, item_id))
-        await asyncio.sleep(random.uniform(0.5, 1.0))
+    async with get_warm_sessions().acquire(user_id, uid, EVENT_PAGE) as session:
+        for _ in range(times):
+            results.append(await handle_exchange_item(session.page, item_id))
+            await asyncio.sleep(random.uniform(0.5, 1.0))
     return results
 
 async def close_session(user_id: str):
-    session = active_sessions.get(user_id)
-    if not session: return
-    page: Page = session.get("page")
-    context: BrowserContext = session.get("context")
-    p: Playwright = session.get("playwright")
-
-    if page:
-        try: await page.close()
-        except Exception as e: LOG.warning(f"[close_session] Ошибка при закрытии page: {e}")
-    if context:
-        try: await context.close()
-        except Exception as e: LOG.warning(f"[close_session] Ошибка при закрытии context: {e}")
-    if p:
-        try: await p.stop()
-        except Exception as e: LOG.warning(f"[close_session] Ошибка при остановке playwright: {e}")
-    if session.get("timer"): session["timer"].cancel()
-    del active_sessions[user_id]
-    LOG.info(f"[close_session] Сессия для user {user_id} закрыта вручную")
\ No newline at end of file
+    """Завершает обмен. Страница остаётся в кэше тёплых сессий и закроется по простою."""
+    if active_sessions.pop(user_id, None) is None:
+        return
+    LOG.info(f"[close_session] Обмен для user {user_id} завершён")
@@ -1,13 +1,15 @@
 from __future__ import annotations
 
-import json
 from pathlib import Path
 
+from services import persist
 from services.logger import logger
 
 PUZZLE_SUMMARY_FILE = Path("data/puzzle_summary.json")
 PUZZLE_DATA_FILE = Path("data/puzzle_data.jsonl")
 PUZZLE_CLAIM_LOG_FILE = Path("data/puzzle_claim_log.json")
+# Журнал операций выдачи поверх снимка puzzle_claim_log.json (см. services.claim_ledger)
+PUZZLE_CLAIM_JOURNAL_FILE = Path("data/puzzle_claim_log.journal.jsonl")
 
 # Старые/лишние варианты, которые больше не используем.
 LEGACY_PUZZLE_FILES: tuple[Path, ...] = (
@@ -15,28 +17,30 @@ LEGACY_PUZZLE_FILES: tuple[Path, ...] = (
 )
 
 
-def canonical_puzzle_files() -> tuple[Path, Path, Path]:
-    return (PUZZLE_CLAIM_LOG_FILE, PUZZLE_DATA_FILE, PUZZLE_SUMMARY_FILE)
+def canonical_puzzle_files() -> tuple[Path, ...]:
+    return (PUZZLE_CLAIM_LOG_FILE, PUZZLE_CLAIM_JOURNAL_FILE, PUZZLE_DATA_FILE, PUZZLE_SUMMARY_FILE)
 
 
 def clear_puzzle_runtime_files(reason: str = "") -> None:
     """
     Очищает рабочие файлы пазлов.
     - puzzle_claim_log.json -> {}
+    - puzzle_claim_log.journal.jsonl -> пусто
     - puzzle_data.jsonl -> пусто
     - puzzle_summary.json -> {}
     """
-    for path in canonical_puzzle_files():
-        try:
-            path.parent.mkdir(parents=True, exist_ok=True)
-            if path.suffix == ".json":
-                with path.open("w", encoding="utf-8") as f:
-                    json.dump({}, f, ensure_ascii=False, indent=2)
-            else:
-                path.write_text("", encoding="utf-8")
-            logger.info("[PUZZLE-FILES] 🧹 Очищен %s (%s)", path, reason or "без причины")
-        except Exception as exc:
-            logger.warning("[PUZZLE-FILES] ⚠️ Не удалось очистить %s: %s", path, exc)
+    # снимок и журнал выдачи очищаются под одной блокировкой (ей же пользуется claim_ledger)
+    with persist.locked(PUZZLE_CLAIM_LOG_FILE), persist.locked(PUZZLE_DATA_FILE):
+        for path in canonical_puzzle_files():
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if path.suffix == ".json":
+                    persist.write_json(path, {})
+                else:
+                    path.write_text("", encoding="utf-8")
+                logger.info("[PUZZLE-FILES] 🧹 Очищен %s (%s)", path, reason or "без причины")
+            except Exception as exc:
+                logger.warning("[PUZZLE-FILES] ⚠️ Не удалось очистить %s: %s", path, exc)
 
     _cleanup_legacy_files(reason=reason)
 
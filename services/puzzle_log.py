@@ -0,0 +1,423 @@
+# tg_zov/services/puzzle_log.py
+"""
+🧩 Append-only лог записей puzzle_data.jsonl
+
+Формат файла — настоящий JSONL: одна компактная JSON-запись на строку.
+Ключ записи — iggid, последняя запись с тем же iggid побеждает.
+Удаление — строка-«надгробие» {"iggid": ..., "_deleted": true}.
+
+В памяти держится индекс iggid -> (offset, length), поэтому:
+  • put()/delete() — одна дозапись в конец файла, O(1);
+  • get() — один seek + чтение строки;
+  • records() — записи в порядке первого появления iggid.
+
+Когда мёртвых строк становится больше живых, лог сжимается в фоновом
+потоке (перезапись живых записей во .tmp + os.replace).
+Изменения делаются под межпроцессной блокировкой services.persist, а дозаписи
+других процессов подхватываются по изменению stat файла: если файл только
+вырос (тот же inode), индексируется лишь новый кусок.
+Чтение без блокировки индексирует до последнего \n и файл не трогает —
+недописанная строка может быть чужой дозаписью в процессе. Хвост без \n
+отрезается только под блокировкой (перед изменением), там он точно мусор
+после падения. Старый многострочный формат (блоки через пустую строку)
+конвертируется автоматически — тоже под блокировкой.
+
+changes_since(version) отдаёт iggid, изменённые после version, — производные
+индексы (services.donor_index) обновляют только их, а не перестраиваются.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from services import persist
+from services.puzzle_files import PUZZLE_DATA_FILE
+
+logger = logging.getLogger("puzzle_log")
+
+# Сжимать, когда строк в файле больше, чем COMPACT_RATIO × живых записей
+COMPACT_RATIO = 2.0
+COMPACT_MIN_LINES = 1000
+
+_DELETED = "_deleted"
+
+
+class PuzzleLog:
+    def __init__(self, path: Path = PUZZLE_DATA_FILE):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._lines = 0
+        self._stat: Optional[Tuple[int, int, int]] = None
+        self._good_end = 0          # байт файла проиндексировано (до последнего \n)
+        self._legacy = False
+        self._compacting = False
+        # растёт при любом изменении содержимого — по нему производные индексы понимают, что устарели
+        self.version = 0
+        self._reset_version = 0     # версия последнего полного перечитывания/замены
+        self._changed: Dict[str, int] = {}   # iggid -> версия, в которой запись менялась
+        self._reload()
+
+    # ───── служебное ─────
+    def _file_stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+            return st.st_ino, st.st_size, st.st_mtime_ns
+        except OSError:
+            return None
+
+    @contextmanager
+    def _txn(self):
+        """Изменение лога: блокировка потоков и других процессов (фермы пишут параллельно)."""
+        with self._lock, persist.locked(self.path):
+            self._check_external_change(locked=True)
+            yield
+
+    def _check_external_change(self, locked: bool = False):
+        """
+        Дозаписи других процессов — индексируем новый кусок; файл очистили/перезаписали
+        снаружи (clear_puzzle_runtime_files, сжатие в другом процессе) — перечитываем целиком.
+        locked — держим persist.locked: можно чинить хвост и конвертировать формат.
+        """
+        stat = self._file_stat()
+        if stat != self._stat:
+            old = self._stat
+            if (stat is not None and old is not None and stat[0] == old[0]
+                    and stat[1] > old[1] and stat[1] >= self._good_end):
+                self._index_tail(stat)
+            elif locked:
+                self._load(repair=True)
+            else:
+                self._reload()
+        if locked:
+            stat = self._file_stat()
+            if stat is not None and stat[1] > self._good_end:
+                self._truncate_tail(stat[1])
+
+    def _reload(self):
+        """Полное перечитывание без блокировки; старый формат конвертируется уже под ней."""
+        self._load(repair=False)
+        if self._legacy:
+            # конвертация переписывает файл — только под межпроцессной блокировкой
+            with persist.locked(self.path):
+                self._load(repair=True)
+
+    @staticmethod
+    def _parse_legacy_blocks(text: str) -> List[Dict[str, Any]]:
+        blocks, buf = [], ""
+        for line in text.splitlines():
+            if line.strip():
+                buf += line
+            else:
+                if buf.strip():
+                    try:
+                        blocks.append(json.loads(buf))
+                    except Exception:
+                        pass
+                buf = ""
+        if buf.strip():
+            try:
+                blocks.append(json.loads(buf))
+            except Exception:
+                pass
+        return blocks
+
+    def _reset_changes(self):
+        """Содержимое заменено целиком — по-записному производные индексы не обновить."""
+        self._reset_version = self.version
+        self._changed = {}
+
+    def _load(self, repair: bool = False):
+        try:
+            self._load_file(repair)
+        finally:
+            self._reset_changes()
+
+    def _load_file(self, repair: bool):
+        self._index = {}
+        self._lines = 0
+        self._good_end = 0
+        self._legacy = False
+        self.version += 1
+        if not self.path.exists():
+            self._stat = None
+            return
+
+        stat = self._file_stat()
+        with open(self.path, "rb") as f:
+            raw = f.read()
+
+        first = raw.lstrip()[:1]
+        if first and not self._looks_like_jsonl(raw):
+            self._legacy = True
+            self._stat = stat
+            if not repair:
+                return
+            blocks = self._parse_legacy_blocks(raw.decode("utf-8", errors="replace"))
+            logger.info(f"[PUZZLE-LOG] 🔁 Конвертация {self.path} в JSONL ({len(blocks)} записей)")
+            self._rewrite([b for b in blocks if isinstance(b, dict) and b.get("iggid")])
+            self._legacy = False
+            return
+
+        self._index_bytes(raw, 0)
+        # stat снят до чтения: дописанное после него подхватит _index_tail
+        self._stat = stat
+        if repair and self._good_end != len(raw):
+            self._truncate_tail(len(raw))
+
+    def _index_bytes(self, raw: bytes, base: int) -> int:
+        """Индексирует полные строки raw, лежащие в файле с позиции base; возвращает число записей."""
+        offset = base
+        added = 0
+        for line in raw.splitlines(keepends=True):
+            length = len(line)
+            if not line.endswith(b"\n"):
+                break  # недописанный хвост: чужая дозапись в процессе или мусор после падения
+            body = line.strip()
+            if body:
+                try:
+                    rec = json.loads(body)
+                except Exception:
+                    rec = None
+                if isinstance(rec, dict) and rec.get("iggid"):
+                    self._apply_index(str(rec["iggid"]), offset, length, rec.get(_DELETED, False))
+                    self._lines += 1
+                    added += 1
+            offset += length
+        self._good_end = offset
+        return added
+
+    def _index_tail(self, stat):
+        """Файл только вырос — дочитываем с последней полной строки."""
+        with open(self.path, "rb") as f:
+            f.seek(self._good_end)
+            raw = f.read()
+        if self._index_bytes(raw, self._good_end):
+            self.version += 1
+        self._stat = stat
+
+    def _truncate_tail(self, size: int):
+        """Только под persist.locked: хвост без \n — мусор после падения писавшего процесса."""
+        logger.warning(f"[PUZZLE-LOG] ✂️ Отрезан повреждённый хвост {self.path} ({size - self._good_end} байт)")
+        with open(self.path, "r+b") as f:
+            f.truncate(self._good_end)
+        self._stat = self._file_stat()
+
+    @staticmethod
+    def _looks_like_jsonl(raw: bytes) -> bool:
+        for line in raw.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # недописанная строка ничего не говорит о формате
+            if line.strip():
+                try:
+                    json.loads(line)
+                    return True
+                except Exception:
+                    return False
+        return True
+
+    def _apply_index(self, iggid: str, offset: int, length: int, deleted: bool):
+        # вызывающий (_append/_index_tail) затем поднимает version ровно на 1
+        self._changed[iggid] = self.version + 1
+        if deleted:
+            self._index.pop(iggid, None)
+        else:
+            # dict сохраняет порядок первой вставки — порядок доноров не «прыгает» при обновлении
+            self._index[iggid] = (offset, length)
+
+    def _append(self, records: Iterable[Dict[str, Any]]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            for rec in records:
+                line = (json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+                f.write(line)
+                self._apply_index(str(rec["iggid"]), offset, len(line), rec.get(_DELETED, False))
+                self._lines += 1
+                offset += len(line)
+            f.flush()
+        self._good_end = offset
+        self.version += 1
+        self._stat = self._file_stat()
+        self._maybe_compact()
+
+    def _read_at(self, f, offset: int, length: int) -> Optional[Dict[str, Any]]:
+        f.seek(offset)
+        try:
+            return json.loads(f.read(length))
+        except Exception:
+            return None
+
+    def _rewrite(self, records: List[Dict[str, Any]], bump_version: bool = True):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        index: Dict[str, Tuple[int, int]] = {}
+        offset = 0
+        with open(tmp, "wb") as f:
+            for rec in records:
+                line = (json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+                f.write(line)
+                index[str(rec["iggid"])] = (offset, len(line))
+                offset += len(line)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._index = index
+        self._lines = len(records)
+        self._good_end = offset
+        if bump_version:
+            self.version += 1
+            self._reset_changes()
+        self._stat = self._file_stat()
+
+    # ───── сжатие ─────
+    def _maybe_compact(self):
+        if self._compacting:
+            return
+        live = len(self._index)
+        if self._lines < COMPACT_MIN_LINES or self._lines <= COMPACT_RATIO * max(live, 1):
+            return
+        self._compacting = True
+        threading.Thread(target=self._compact_bg, name="puzzle-log-compact", daemon=True).start()
+
+    def _compact_bg(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.warning(f"[PUZZLE-LOG] ⚠️ Ошибка сжатия {self.path}: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """Переписывает файл, оставляя только живые записи."""
+        with self._txn():
+            before = self._lines
+            records = self.records()
+            # содержимое не меняется — производным индексам перестраиваться незачем
+            self._rewrite(records, bump_version=False)
+            logger.info(f"[PUZZLE-LOG] 🗜 {self.path}: {before} → {self._lines} строк")
+
+    # ───── публичное API ─────
+    def put(self, entry: Dict[str, Any]):
+        """Добавляет/обновляет запись по iggid."""
+        if not entry.get("iggid"):
+            raise ValueError("запись без iggid")
+        with self._txn():
+            self._append([entry])
+
+    def put_many(self, entries: Iterable[Dict[str, Any]]):
+        with self._txn():
+            self._append([e for e in entries if e.get("iggid")])
+
+    def delete(self, iggid: str) -> bool:
+        with self._txn():
+            iggid = str(iggid)
+            if iggid not in self._index:
+                return False
+            self._append([{"iggid": iggid, _DELETED: True}])
+            return True
+
+    def get(self, iggid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._check_external_change()
+            pos = self._index.get(str(iggid))
+            if pos is None:
+                return None
+            with open(self.path, "rb") as f:
+                return self._read_at(f, *pos)
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Все живые записи в порядке первого появления."""
+        with self._lock:
+            self._check_external_change()
+            if not self._index:
+                return []
+            out: List[Dict[str, Any]] = []
+            with open(self.path, "rb") as f:
+                for offset, length in self._index.values():
+                    rec = self._read_at(f, offset, length)
+                    if rec is not None:
+                        out.append(rec)
+            return out
+
+    def decrement(self, iggid: str, puzzle_id) -> Optional[Dict[str, Any]]:
+        """
+        Списывает один пазл puzzle_id у донора iggid.
+        Пустой пазл убирается из записи, донор без пазлов — удаляется.
+        Возвращает запись до списания или None, если списывать нечего.
+        """
+        key = str(puzzle_id)
+        with self._txn():
+            rec = self.get(iggid)
+            if not rec:
+                return None
+            puzzles = dict(rec.get("puzzle") or {})
+            try:
+                count = int(puzzles.get(key, 0))
+            except (TypeError, ValueError):
+                count = 0
+            if count < 1:
+                return None
+
+            if count > 1:
+                puzzles[key] = count - 1
+            else:
+                puzzles.pop(key, None)
+
+            if puzzles:
+                self._append([{**rec, "puzzle": puzzles}])
+            else:
+                self._append([{"iggid": str(iggid), _DELETED: True}])
+            return rec
+
+    def replace_all(self, records: List[Dict[str, Any]]):
+        """Полная замена содержимого (для редких массовых правок)."""
+        with self._txn():
+            self._rewrite([r for r in records if isinstance(r, dict) and r.get("iggid")])
+
+    def refresh(self) -> int:
+        """Перечитывает файл, если его изменили снаружи, и возвращает текущую версию."""
+        with self._lock:
+            self._check_external_change()
+            return self.version
+
+    def changes_since(self, version: int) -> Tuple[int, Optional[Set[str]]]:
+        """
+        (текущая версия, iggid, изменённые после version).
+        None вместо множества — файл перечитывался или заменялся целиком.
+        """
+        with self._lock:
+            self._check_external_change()
+            if version < self._reset_version:
+                return self.version, None
+            return self.version, {iggid for iggid, v in self._changed.items() if v > version}
+
+    def __contains__(self, iggid: str) -> bool:
+        with self._lock:
+            self._check_external_change()
+            return str(iggid) in self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._check_external_change()
+            return len(self._index)
+
+
+_logs: Dict[Path, PuzzleLog] = {}
+_logs_lock = threading.Lock()
+
+
+def get_log(path: Path = PUZZLE_DATA_FILE) -> PuzzleLog:
+    """Общий на процесс экземпляр лога для файла."""
+    key = Path(path).resolve()
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            log = _logs[key] = PuzzleLog(Path(path))
+        return log
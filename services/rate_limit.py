@@ -0,0 +1,198 @@
+# tg_zov/services/rate_limit.py
+"""
+🪣 Общий на процесс ограничитель частоты запросов (token bucket)
+
+Темп запросов раньше задавали asyncio.sleep по месту: DELAY_BETWEEN_LOTTERY,
+DELAY_BETWEEN_ACCOUNTS, sleep(1.5–3) перед fetch в колёсах и claim'ах,
+три копии jitter(). Паузы разных ферм друг о друге не знали: две фермы
+на event-eu-cc.igg.com давали двойную нагрузку, а одна ферма впустую
+спала даже тогда, когда запас по частоте был.
+
+Здесь каждый запрос (aiohttp в services.event_http и fetch() из страницы)
+перед отправкой вызывает throttle(url, action):
+  • корзина хоста — общий потолок частоты на хост;
+  • корзина (хост, action) — темп конкретного действия (lottery, claim, …);
+  • у правила есть rate (запросов/с), burst (запас) и jitter (сек. случайной
+    добавки, чтобы одновременные запросы не уходили строем).
+
+Пока токены есть — запрос уходит сразу; паузы появляются только тогда,
+когда суммарная частота упирается в правило.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger("rate_limit")
+
+ANY = "*"
+EVENT_HOST = "event-eu-cc.igg.com"
+
+
+@dataclass(frozen=True)
+class RateRule:
+    rate: float          # токенов в секунду
+    burst: float = 1.0   # ёмкость корзины
+    jitter: float = 0.0  # до стольких секунд случайной добавки к каждому запросу
+
+
+# (хост, action) → правило; ANY — любое значение. Ищется от точного к общему.
+RULES: Dict[Tuple[str, str], RateRule] = {
+    (ANY, ANY): RateRule(rate=5.0, burst=10.0),
+    (EVENT_HOST, ANY): RateRule(rate=8.0, burst=12.0),
+    # заход на страницу события = старт аккаунта (бывший DELAY_BETWEEN_ACCOUNTS)
+    (EVENT_HOST, "page"): RateRule(rate=2.0, burst=4.0, jitter=0.5),
+    (EVENT_HOST, "lottery"): RateRule(rate=3.0, burst=3.0, jitter=0.6),
+    (EVENT_HOST, "get_resource"): RateRule(rate=3.0, burst=3.0, jitter=0.6),
+    (EVENT_HOST, "claim_friend_puzzle"): RateRule(rate=0.5, burst=1.0, jitter=1.0),
+    # Bot API: общий потолок бота ~30 сообщений/с (по одному чату — см. event_manager.CHAT_INTERVAL)
+    ("api.telegram.org", ANY): RateRule(rate=25.0, burst=25.0),
+}
+
+
+def jitter(base: float, variance: float = 0.5) -> float:
+    """Случайная задержка: base ± (0..variance*base)."""
+    delta = random.uniform(-variance * base, variance * base)
+    return max(0.1, base + delta)
+
+
+class TokenBucket:
+    """
+    Корзина с резервированием: reserve() сразу списывает токен (баланс может
+    уйти в минус) и возвращает, сколько ждать. Так корзина не привязана
+    к event loop и одинаково работает из любых циклов и потоков процесса.
+    """
+
+    def __init__(self, rule: RateRule):
+        self.rule = rule
+        self.tokens = float(rule.burst)
+        self.updated = time.monotonic()
+        self.requests = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rule.burst, self.tokens + (now - self.updated) * self.rule.rate)
+            self.updated = now
+            self.tokens -= 1.0
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rule.rate
+            self.requests += 1
+            self.waited += wait
+            self.max_wait = max(self.max_wait, wait)
+            return wait
+
+
+class RateLimiter:
+    def __init__(self, rules: Optional[Dict[Tuple[str, str], RateRule]] = None):
+        self.rules = dict(RULES if rules is None else rules)
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _rule(self, host: str, action: str) -> RateRule:
+        for key in ((host, action), (host, ANY), (ANY, action), (ANY, ANY)):
+            rule = self.rules.get(key)
+            if rule is not None:
+                return rule
+        return RateRule(rate=5.0, burst=10.0)
+
+    def _bucket(self, host: str, action: str) -> TokenBucket:
+        key = (host, action)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self._rule(host, action))
+            return bucket
+
+    def configure(self, host: str = ANY, action: str = ANY, *, rate: float,
+                  burst: float = 1.0, jitter: float = 0.0):
+        """Новое правило; уже созданные корзины, к которым оно подходит, пересоздаются."""
+        with self._lock:
+            self.rules[(host, action)] = RateRule(rate=rate, burst=burst, jitter=jitter)
+            self._buckets.clear()
+
+    def scale(self, factor: float):
+        """Умножает темп и запас всех правил (доля процесса при работе в N процессах)."""
+        with self._lock:
+            self.rules = {
+                key: RateRule(rate=rule.rate * factor, burst=max(1.0, rule.burst * factor), jitter=rule.jitter)
+                for key, rule in self.rules.items()
+            }
+            self._buckets.clear()
+
+    def reserve(self, host: str, action: str = ANY) -> float:
+        """Секунды ожидания перед запросом (токены уже списаны)."""
+        wait = self._bucket(host, ANY).reserve()
+        rule = None
+        if action != ANY:
+            bucket = self._bucket(host, action)
+            wait = max(wait, bucket.reserve())
+            rule = bucket.rule
+        rule = rule or self._rule(host, ANY)
+        if rule.jitter:
+            wait += random.uniform(0, rule.jitter)
+        return wait
+
+    async def wait(self, url: str, action: Optional[str] = None) -> float:
+        host, action = _split(url, action)
+        delay = self.reserve(host, action)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            buckets = list(self._buckets.items())
+        return {
+            f"{host}|{action}": {
+                "requests": b.requests,
+                "waited_s": round(b.waited, 1),
+                "max_wait_s": round(b.max_wait, 2),
+                "rate": b.rule.rate,
+                "burst": b.rule.burst,
+            }
+            for (host, action), b in buckets
+        }
+
+
+def _split(url: str, action: Optional[str]) -> Tuple[str, str]:
+    parts = urlsplit(url)
+    host = (parts.hostname or url).lower()
+    if action is None:
+        action = (parse_qs(parts.query).get("action") or [ANY])[0]
+    return host, action or ANY
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Общий на процесс ограничитель."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
+
+
+async def throttle(url: str, action: Optional[str] = None) -> float:
+    """
+    await throttle(url)                 # action берётся из ?action=...
+    await throttle(page_url, "page")    # заход на страницу события
+    Возвращает фактическую паузу в секундах.
+    """
+    return await get_rate_limiter().wait(url, action)
+
+
+def rate_stats() -> Dict[str, Dict[str, Any]]:
+    return get_rate_limiter().stats()
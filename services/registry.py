@@ -0,0 +1,198 @@
+# tg_zov/services/registry.py
+"""
+🗃 Ленивый реестр сервисов + отчёт о времени старта
+
+handlers/start.py и bot.py при импорте тянули почти все сервисы: Playwright,
+обе копии login_and_refresh, фермы пазлов, castle_api. Бот поднимался
+заметно дольше, чем нужно для старта polling.
+
+Здесь:
+  • lazy_module("services.x") — прокси модуля, импорт при первом обращении к атрибуту;
+  • lazy_callable("services.x", "func") — функция-заглушка, импорт при первом вызове
+    (подходит и для async-функций: возвращает корутину настоящей функции);
+  • loaded("services.x") — модуль, если он уже загружен (для закрытия ресурсов при остановке);
+  • start_import_timer() / startup_report() — аналог «python -X importtime»:
+    собственное и накопленное время каждого импорта за время старта.
+"""
+
+from __future__ import annotations
+
+import importlib
+import logging
+import sys
+import threading
+import time
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("registry")
+
+# Модули, которые при старте бота грузиться не должны (видно в startup_report)
+HEAVY_MODULES = ("playwright", "aiohttp", "tqdm", "playwright_stealth", "colorama")
+
+_deferred: Dict[str, float] = {}   # модуль -> мс отложенного импорта
+_deferred_lock = threading.Lock()
+
+
+# ───── ленивые импорты ─────
+def load(name: str) -> ModuleType:
+    """importlib.import_module с учётом времени первого (отложенного) импорта."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    t0 = time.perf_counter()
+    module = importlib.import_module(name)
+    ms = (time.perf_counter() - t0) * 1000
+    with _deferred_lock:
+        _deferred.setdefault(name, ms)
+    logger.info("[LAZY] 📦 %s загружен при первом использовании за %.0f мс", name, ms)
+    return module
+
+
+def loaded(name: str) -> Optional[ModuleType]:
+    return sys.modules.get(name)
+
+
+class LazyModule:
+    __slots__ = ("_name",)
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(load(self._name), attr)
+
+    def __setattr__(self, attr: str, value: Any):
+        setattr(load(self._name), attr, value)
+
+    def __repr__(self) -> str:
+        state = "загружен" if self._name in sys.modules else "не загружен"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def lazy_callable(module: str, attr: str) -> Callable[..., Any]:
+    def _call(*args, **kwargs):
+        return getattr(load(module), attr)(*args, **kwargs)
+
+    _call.__name__ = _call.__qualname__ = attr
+    _call.__module__ = module
+    _call.__doc__ = f"Ленивая ссылка на {module}.{attr}"
+    return _call
+
+
+def deferred_imports() -> Dict[str, float]:
+    with _deferred_lock:
+        return {k: round(v, 1) for k, v in _deferred.items()}
+
+
+# ───── отчёт о старте (аналог -X importtime) ─────
+class _ImportTimer:
+    """
+    meta_path-обёртка: засекает exec_module каждого модуля.
+    Загрузчик не подменяется — на экземпляр вешается обёртка exec_module,
+    поэтому __loader__/__spec__ модулей остаются прежними.
+    """
+
+    def __init__(self):
+        self.records: List[Tuple[str, float, float]] = []   # (модуль, своё мс, накопленное мс)
+        self.started = time.perf_counter()
+        self.active = True
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        if not self.active:
+            return None
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find = getattr(finder, "find_spec", None)
+            if find is None:
+                continue
+            spec = find(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # BuiltinImporter/FrozenImporter — классы, их не трогаем
+        if loader is None or isinstance(loader, type) or not hasattr(loader, "exec_module"):
+            return spec
+        try:
+            loader.exec_module = self._wrap(loader.exec_module, fullname)
+        except (AttributeError, TypeError):
+            pass
+        return spec
+
+    def _wrap(self, exec_module, name: str):
+        def _timed(module):
+            stack = getattr(self._local, "stack", None)
+            if stack is None:
+                stack = self._local.stack = []
+            stack.append(0.0)
+            t0 = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                total = time.perf_counter() - t0
+                children = stack.pop()
+                if stack:
+                    stack[-1] += total
+                self.records.append((name, (total - children) * 1000, total * 1000))
+        return _timed
+
+
+_timer: Optional[_ImportTimer] = None
+
+
+def start_import_timer():
+    """Вызывать как можно раньше в bot.py — до импорта aiogram и handlers."""
+    global _timer
+    if _timer is None:
+        _timer = _ImportTimer()
+        sys.meta_path.insert(0, _timer)
+
+
+def stop_import_timer():
+    if _timer is not None:
+        _timer.active = False
+        try:
+            sys.meta_path.remove(_timer)
+        except ValueError:
+            pass
+
+
+def startup_report(top: int = 15) -> Dict[str, Any]:
+    """Останавливает таймер импортов и пишет в лог, что и сколько грузилось при старте."""
+    stop_import_timer()
+    if _timer is None:
+        return {}
+    records = _timer.records
+    elapsed = (time.perf_counter() - _timer.started) * 1000
+    by_package: Dict[str, float] = {}
+    for name, self_ms, _cum in records:
+        pkg = name.split(".", 1)[0]
+        by_package[pkg] = by_package.get(pkg, 0.0) + self_ms
+
+    heavy_loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    report = {
+        "boot_ms": round(elapsed, 1),
+        "modules": len(records),
+        "packages": {k: round(v, 1) for k, v in sorted(by_package.items(), key=lambda kv: -kv[1])[:top]},
+        "slowest": [(n, round(s, 1), round(c, 1))
+                    for n, s, c in sorted(records, key=lambda r: -r[1])[:top]],
+        "heavy_loaded": heavy_loaded,
+    }
+
+    logger.info("[BOOT] ⏱ Старт: %.0f мс, импортировано модулей: %s", elapsed, len(records))
+    logger.info("[BOOT] 📦 По пакетам (собственное время, мс): %s", report["packages"])
+    for name, self_ms, cum_ms in report["slowest"]:
+        logger.info("[BOOT]   %8.1f | %8.1f | %s", self_ms, cum_ms, name)
+    if heavy_loaded:
+        logger.warning("[BOOT] ⚠️ При старте загружены тяжёлые модули: %s", ", ".join(heavy_loaded))
+    else:
+        logger.info("[BOOT] ✅ Тяжёлые модули (%s) отложены до первого использования", ", ".join(HEAVY_MODULES))
+    return report
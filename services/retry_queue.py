@@ -0,0 +1,270 @@
+# tg_zov/services/retry_queue.py
+"""
+⏳ Отложенные повторы (403 / таймауты) вперемешку со свежей работой
+
+Раньше puzzle2_auto и login_and_refresh собирали 403 в батче из 100
+аккаунтов и сразу же прогоняли их второй раз. Повтор попадал ровно
+в то время, когда сервер только что отказал, а вторая неудача
+считалась окончательной.
+
+RetryQueue раздаёт задания воркерам:
+  • свежие аккаунты — по порядку из исходного списка (или асинхронного
+    итератора: его следующий элемент ждёт один воркер, остальные берут повторы);
+  • неудачные — в куче по времени (heapq) с экспоненциальной задержкой
+    и джиттером на каждый аккаунт (RetryPolicy);
+  • созревший повтор выдаётся раньше свежего аккаунта, пока повтор
+    не созрел — воркеры берут свежую работу и не простаивают;
+  • после max_attempts попыток задание уходит в dead.
+
+drain(queue, handle, workers=N) — пул воркеров поверх очереди: handle(job)
+возвращает None (успех), причину неудачи (R403 / TIMEOUT — повтор позже,
+прочее — окончательно) или SKIP (задание не выполнялось).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from services.concurrency import ERROR, R403, SKIP, TIMEOUT
+
+logger = logging.getLogger("retry_queue")
+
+RETRYABLE = (R403, TIMEOUT)
+STOP_POLL = 0.5   # сек. между проверками флага остановки
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3       # всего попыток на задание, включая первую
+    base_delay: float = 30.0    # сек. до первого повтора
+    factor: float = 2.0         # множитель задержки на каждую следующую неудачу
+    max_delay: float = 600.0
+    jitter: float = 0.3         # ± доля задержки
+
+    def delay(self, attempt: int) -> float:
+        """Задержка после неудачной попытки номер attempt (1, 2, …)."""
+        base = min(self.max_delay, self.base_delay * self.factor ** max(0, attempt - 1))
+        return max(0.0, base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+@dataclass
+class Job:
+    item: Any
+    key: str = ""
+    attempt: int = 1            # номер текущей попытки
+    last_error: str = ""
+
+    @property
+    def is_retry(self) -> bool:
+        return self.attempt > 1
+
+
+class RetryQueue:
+    def __init__(self, items: Union[Iterable[Any], AsyncIterable[Any]], policy: Optional[RetryPolicy] = None, *,
+                 key: Optional[Callable[[Any], Any]] = None, name: str = ""):
+        self.policy = policy or RetryPolicy()
+        self.name = name
+        self._key = key or (lambda item: "")
+        if hasattr(items, "__aiter__"):
+            self._fresh, self._afresh = iter(()), items.__aiter__()
+        else:
+            self._fresh, self._afresh = iter(items), None
+        self._pulling = False
+        self._fresh_done = False
+        self._heap: List[Tuple[float, int, Job]] = []
+        self._seq = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self.closed = False
+        self.in_flight = 0
+        self.fresh = 0
+        self.retried = 0
+        self.completed = 0
+        self.dead: List[Job] = []
+
+    # ───── выдача ─────
+    def pop_ready(self) -> Optional[Job]:
+        """Созревший повтор, иначе следующий свежий аккаунт, иначе None (без ожидания)."""
+        job = None
+        if self._heap and self._heap[0][0] <= time.monotonic():
+            job = heapq.heappop(self._heap)[2]
+        elif not self._fresh_done and self._afresh is None:
+            try:
+                item = next(self._fresh)
+            except StopIteration:
+                self._fresh_done = True
+            else:
+                self.fresh += 1
+                job = Job(item, str(self._key(item) or ""))
+        if job is not None:
+            self.in_flight += 1
+        return job
+
+    async def _pull_fresh(self) -> Optional[Job]:
+        """Следующий свежий аккаунт из асинхронного источника; None — источник кончился."""
+        self._pulling = True
+        try:
+            item = await self._afresh.__anext__()
+        except StopAsyncIteration:
+            self._fresh_done = True
+            return None
+        finally:
+            self._pulling = False
+            self._notify()
+        self.fresh += 1
+        self.in_flight += 1
+        return Job(item, str(self._key(item) or ""))
+
+    def next_delay(self) -> Optional[float]:
+        """Через сколько секунд созреет ближайший повтор (None — повторов нет)."""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    @property
+    def exhausted(self) -> bool:
+        return self._fresh_done and not self._heap and self.in_flight == 0
+
+    async def get(self) -> Optional[Job]:
+        """
+        Следующее задание; ждёт созревания повтора, если свежих нет.
+        None — работы больше не будет (свежие кончились, повторов нет, никто не работает).
+        """
+        while not self.closed:
+            job = self.pop_ready()
+            if job is not None:
+                return job
+            if self._afresh is not None and not self._fresh_done and not self._pulling:
+                job = await self._pull_fresh()
+                if job is not None:
+                    return job
+                continue
+            if self.exhausted:
+                self._notify()  # будим остальных воркеров — им тоже пора завершаться
+                return None
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=self.next_delay())
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    # ───── итоги заданий ─────
+    def done(self, job: Job):
+        self.in_flight -= 1
+        self.completed += 1
+        self._notify()
+
+    def retry(self, job: Job, reason: str = "") -> bool:
+        """Отложить повтор; False — попытки кончились (задание в dead)."""
+        self.in_flight -= 1
+        job.last_error = reason
+        if job.attempt >= self.policy.max_attempts:
+            self.dead.append(job)
+            logger.warning("[RETRY] %s %s: %s — попытки исчерпаны (%s)", self.name, job.key, reason, job.attempt)
+            self._notify()
+            return False
+        delay = self.policy.delay(job.attempt)
+        job.attempt += 1
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job))
+        self.retried += 1
+        logger.info("[RETRY] %s %s: %s — попытка %s через %.0f с", self.name, job.key, reason, job.attempt, delay)
+        self._notify()
+        return True
+
+    def release(self, job: Job):
+        """Задание взято, но не выполнялось (остановка) — не считается ни успехом, ни ошибкой."""
+        self.in_flight -= 1
+        self._notify()
+
+    def close(self):
+        """Остановка: ждущие get() возвращают None, отложенные повторы остаются в pending()."""
+        self.closed = True
+        self._notify()
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fresh": self.fresh,
+            "retried": self.retried,
+            "completed": self.completed,
+            "dead": len(self.dead),
+            "pending_retries": len(self._heap),
+            "in_flight": self.in_flight,
+        }
+
+
+# ───── пул воркеров ─────
+async def _close_on_stop(queue: RetryQueue, stop: Callable[[], bool]):
+    while not queue.closed:
+        if stop():
+            queue.close()
+            return
+        await asyncio.sleep(STOP_POLL)
+
+
+async def drain(
+    queue: RetryQueue,
+    handle: Callable[[Job], Awaitable[Optional[str]]],
+    *,
+    workers: int,
+    stop: Optional[Callable[[], bool]] = None,
+    retry_on: Tuple[str, ...] = RETRYABLE,
+    on_final: Optional[Callable[[Job, Optional[str]], Any]] = None,
+):
+    """
+    Раздаёт задания очереди workers воркерам до её исчерпания (или stop()).
+    on_final(job, reason) — задание завершено окончательно (успех, неповторяемая
+    ошибка или исчерпаны попытки); может быть корутиной.
+    """
+
+    async def worker():
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            try:
+                reason = await handle(job)
+            except Exception as e:  # handle ловит свои ошибки сам; здесь — непредвиденные
+                logger.exception("[RETRY] %s %s: %s", queue.name, job.key, e)
+                reason = ERROR
+            if reason == SKIP:
+                queue.release(job)
+                continue
+            if reason in retry_on:
+                if queue.retry(job, reason):
+                    continue
+            else:
+                queue.done(job)
+            if on_final is not None:
+                result = on_final(job, reason)
+                if inspect.isawaitable(result):
+                    await result
+
+    watcher = asyncio.ensure_future(_close_on_stop(queue, stop)) if stop is not None else None
+    tasks = [asyncio.ensure_future(worker()) for _ in range(max(1, workers))]
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
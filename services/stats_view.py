@@ -0,0 +1,266 @@
+# tg_zov/services/stats_view.py
+"""
+📊 Материализованное представление админской статистики
+
+Раньше каждое перелистывание «📊 Статистика» заново читало
+user_accounts.json, журнал выдачи пазлов и start_users.json, сливало их
+и ещё вызывало ensure_users_exist (с возможной перезаписью файла аккаунтов).
+
+Здесь строки пользователей считаются заранее и лежат в отсортированном
+списке, поэтому страница — это срез O(page_size). Перед показом
+представление спрашивает источники, что изменилось:
+  • AccountStore и ClaimLedger сами говорят, каких пользователей затронули
+    (changes_since) — пересчитываются только их строки;
+  • start_users.json, puzzle_summary.json и отчёт о рассылке отслеживаются по stat файла.
+Полная пересборка — только при первом показе или если источник перечитан целиком.
+Время последней пересборки доступно через metrics() и выводится внизу страницы.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.accounts_manager import store as account_store
+from services.claim_ledger import get_ledger
+from services.puzzle_files import PUZZLE_SUMMARY_FILE
+
+logger = logging.getLogger("stats_view")
+
+
+def _sort_key(user_id: str) -> Tuple[int, Any]:
+    return (0, int(user_id)) if user_id.isdigit() else (1, user_id)
+
+
+def _file_stat(path: Path) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+        return st.st_ino, st.st_size, st.st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_json(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as exc:
+        logger.warning("[STATS] ⚠️ Не удалось прочитать %s: %s", path.name, exc)
+        return {}
+
+
+class StatsView:
+    def __init__(self, start_users_path: Path, broadcast_report_path: Path,
+                 summary_path: Path = PUZZLE_SUMMARY_FILE):
+        self.start_users_path = Path(start_users_path)
+        self.broadcast_report_path = Path(broadcast_report_path)
+        self.summary_path = Path(summary_path)
+        self._lock = threading.Lock()
+
+        self._order: List[Tuple[Tuple[int, Any], str]] = []
+        self._rows: Dict[str, List[str]] = {}
+        self._account_counts: Dict[str, int] = {}
+        self._total_accounts = 0
+        self._footer: List[str] = []
+
+        self._accounts_version = -1
+        self._ledger_version = -1
+        self._started: Dict[str, Dict[str, Any]] = {}
+        self._started_stat: Optional[Tuple[int, int, int]] = None
+        self._footer_stats: Optional[Tuple] = None
+        self._built = False
+
+        self.last_rebuild_ms = 0.0
+        self.last_rebuild_kind = ""
+        self.last_rebuild_rows = 0
+        self.rebuilds = 0
+
+    # ───── источники ─────
+    def _load_started(self) -> Set[str]:
+        """Перечитывает start_users.json, если он изменился. Возвращает изменённых пользователей."""
+        stat = _file_stat(self.start_users_path)
+        if stat == self._started_stat and self._built:
+            return set()
+        data = _read_json(self.start_users_path).get("users", {})
+        started = {str(k): v for k, v in data.items() if isinstance(v, dict)} if isinstance(data, dict) else {}
+        changed = {u for u in started.keys() | self._started.keys() if started.get(u) != self._started.get(u)}
+        self._started, self._started_stat = started, stat
+        return changed
+
+    def _build_footer(self):
+        stats = (_file_stat(self.summary_path), _file_stat(self.broadcast_report_path))
+        if stats == self._footer_stats:
+            return
+        self._footer_stats = stats
+        lines: List[str] = []
+
+        if self.summary_path.exists():
+            try:
+                with open(self.summary_path, "r", encoding="utf-8") as f:
+                    summary = json.load(f)
+                totals = summary.get("totals", {})
+                all_dup = summary.get("all_duplicates", 0)
+                lines.extend([
+                    "",
+                    "🧩 <b>Пазлы (итоги)</b>",
+                    f"Всего дубликатов: <b>{all_dup}</b>",
+                    " | ".join(f"{pid}🧩x{totals.get(str(pid), 0)}" for pid in range(1, 10)),
+                ])
+            except Exception:
+                lines.append("\n⚠️ Не удалось прочитать puzzle_summary.json")
+
+        report = _read_json(self.broadcast_report_path)
+        if report:
+            lines.extend([
+                "",
+                "📣 <b>Последняя рассылка</b>",
+                f"🕒 {report.get('timestamp', '—')}",
+                f"👥 Известно пользователей: <b>{report.get('known_total', 0)}</b>",
+                f"✅ Доставлено: <b>{report.get('sent', 0)}</b>",
+                f"❌ Ошибок: <b>{report.get('failed', 0)}</b>",
+            ])
+        self._footer = lines
+
+    # ───── строки пользователей ─────
+    def _render_row(self, user_id: str, accs: List[Dict[str, Any]]) -> List[str]:
+        ledger = get_ledger()
+        account_counts = ledger.account_counts(user_id)
+        total_puzzles = ledger.user_total(user_id)
+        direct_name, direct_tag = ledger.user_names(user_id)
+        meta = ledger.user_meta(user_id)
+        started = self._started.get(user_id, {})
+
+        first_account_name = ""
+        if accs and isinstance(accs[0], dict):
+            first_account_name = str(accs[0].get("username", "") or "")
+
+        display_name = (
+            meta.get("name")
+            or started.get("name")
+            or direct_name
+            or first_account_name
+        )
+        display_tag = (
+            meta.get("tag")
+            or started.get("tag")
+            or direct_tag
+            or meta.get("username")
+            or started.get("username")
+        )
+        display_bits = " ".join(bit for bit in [display_name, f"@{display_tag}" if display_tag else ""] if bit)
+        label = f"{user_id}"
+        if display_bits:
+            label = f"{label} ({display_bits})"
+
+        lines = [f"• <code>{label}</code> — <b>{len(accs)}</b> аккаунтов, 🧩 <b>{total_puzzles}</b>"]
+        acc_details = []
+        for acc in accs:
+            uid = str(acc.get("uid", ""))
+            acc_details.append(f"{uid}:{account_counts.get(uid, 0)}")
+        if acc_details:
+            lines.append(f"  └ {', '.join(acc_details)}")
+        return lines
+
+    def _update_row(self, user_id: str):
+        accs = account_store.accounts(user_id)
+        if user_id not in self._rows:
+            bisect.insort(self._order, (_sort_key(user_id), user_id))
+        self._total_accounts += len(accs) - self._account_counts.get(user_id, 0)
+        self._account_counts[user_id] = len(accs)
+        self._rows[user_id] = self._render_row(user_id, accs)
+
+    def _ensure_known(self, user_ids: Set[str]):
+        # «Исторические» пользователи (только получали пазлы / жали /start) попадают
+        # в user_accounts.json один раз — при появлении, а не на каждом перелистывании.
+        missing = [u for u in user_ids if not account_store.has_user(u)]
+        if missing:
+            account_store.ensure_users(missing)
+
+    def refresh(self):
+        """Подтягивает изменения источников; пересчитывает только затронутые строки."""
+        with self._lock:
+            t0 = time.perf_counter()
+            ledger = get_ledger()
+            started_changed = self._load_started()
+            ledger_version, ledger_changed = ledger.changes_since(self._ledger_version)
+            full = not self._built or ledger_changed is None
+
+            if full:
+                known = set(account_store.user_ids()) | ledger.user_ids() | set(self._started)
+                self._ensure_known(known)
+            else:
+                self._ensure_known(ledger_changed | started_changed)
+
+            accounts_version, accounts_changed = account_store.changes_since(self._accounts_version)
+            full = full or accounts_changed is None
+
+            if full:
+                self._order, self._rows, self._account_counts = [], {}, {}
+                self._total_accounts = 0
+                users = set(account_store.user_ids()) | ledger.user_ids() | set(self._started)
+            else:
+                users = set(accounts_changed) | ledger_changed | started_changed
+
+            for user_id in users:
+                self._update_row(str(user_id))
+            self._build_footer()
+
+            self._ledger_version = ledger_version
+            self._accounts_version = accounts_version
+            self._built = True
+
+            if full or users:
+                self.rebuilds += 1
+                self.last_rebuild_ms = (time.perf_counter() - t0) * 1000
+                self.last_rebuild_kind = "full" if full else "incremental"
+                self.last_rebuild_rows = len(users)
+                logger.info(
+                    "[STATS] 🔄 Пересборка (%s): строк %s, %.1f мс",
+                    self.last_rebuild_kind, self.last_rebuild_rows, self.last_rebuild_ms,
+                )
+
+    # ───── чтение ─────
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "rebuild_ms": round(self.last_rebuild_ms, 1),
+            "rebuild_kind": self.last_rebuild_kind,
+            "rebuild_rows": self.last_rebuild_rows,
+            "rebuilds": self.rebuilds,
+            "users": len(self._order),
+        }
+
+    def render_page(self, page: int, page_size: int = 7) -> Tuple[str, int, int]:
+        """Текст страницы статистики. Возвращает (text, page, total_pages)."""
+        self.refresh()
+        with self._lock:
+            total_users = len(self._order)
+            total_pages = max(1, (total_users + page_size - 1) // page_size)
+            page = max(0, min(page, total_pages - 1))
+            start = page * page_size
+
+            lines = [
+                "📊 <b>Статистика аккаунтов</b>",
+                f"👥 Пользователей в базе: <b>{total_users}</b>",
+                f"👤 Всего аккаунтов: <b>{self._total_accounts}</b>",
+                "",
+                f"👥 <b>Аккаунты по пользователям (страница {page + 1}/{total_pages}):</b>",
+            ]
+            if total_users == 0:
+                lines.append("— нет данных")
+            else:
+                for _, user_id in self._order[start:start + page_size]:
+                    lines.extend(self._rows[user_id])
+
+            lines.extend(self._footer)
+            kind = "полная" if self.last_rebuild_kind == "full" else "частичная"
+            lines.extend(["", f"⏱ Пересборка статистики: {self.last_rebuild_ms:.1f} мс ({kind})"])
+            return "\n".join(lines), page, total_pages
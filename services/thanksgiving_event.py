@@ -2,12 +2,12 @@
 import asyncio
 import json
 import logging
-import aiohttp
 from datetime import datetime
 
-from services.browser_patches import run_event_with_browser
+from services.browser_patches import run_event_with_handoff
 from services.accounts_manager import get_all_accounts
 from services.castle_api import load_cookies_for_account
+from services.daily_ledger import records_daily
 
 logger = logging.getLogger("thanksgiving_event")
 from pathlib import Path
@@ -36,6 +36,7 @@ ACHIEVE_IDS = ["achieve-6", "achieve-12", "achieve-18", "achieve-24"]
 NORMAL_IDS = [f"normal-{i}" for i in range(1, 25)]
 
 
+@records_daily("thanksgiving_event")
 async def run_thanksgiving_event(user_id: str, uid: str = None, context=None) -> dict:
     """
     🎉 Акция "10 дней призов"
@@ -72,10 +73,20 @@ async def run_thanksgiving_event(user_id: str, uid: str = None, context=None) ->
     if not cookies_dict:
         return {"success": False, "message": f"⚠️ Cookies не найдены ({username})."}
 
-    async def handler(page):
-        """Выполняется внутри запущенного браузера с маскировкой."""
+    async def read_page(page):
+        """📅 Даты события — со страницы, пока она открыта (дальше работаем по HTTP)."""
         try:
-            html = (await page.content()).lower()
+            elem = await page.query_selector("div.chance span.event-time")
+            if elem:
+                return (await elem.inner_text()).strip()
+        except Exception:
+            pass
+        return None
+
+    async def handler(h):
+        """Запросы идут по HTTP с cookies и User-Agent, снятыми с замаскированного браузера."""
+        try:
+            html = h.html.lower()
 
             # 🕓 Проверка статуса события
             if any(x in html for x in ["событие еще не началось", "уже завершилось"]):
@@ -84,76 +95,59 @@ async def run_thanksgiving_event(user_id: str, uid: str = None, context=None) ->
                     "message": f"⚠️ <b>{username}</b> ({uid}) — событие ещё не началось или уже завершилось."
                 }
 
-            # 📅 Извлекаем даты события
-            event_period = "неизвестно"
-            try:
-                elem = await page.query_selector("div.chance span.event-time")
-                if elem:
-                    event_period = (await elem.inner_text()).strip()
-            except Exception:
-                pass
+            # 📅 Даты события
+            event_period = h.page_data or "неизвестно"
 
             # 🕒 Проверяем текущий день, чтобы не спамить наградами вне диапазона
             current_day = datetime.utcnow().day
             logger.info(f"[thanksgiving_event] {username} ({uid}) — проверка дня: {current_day}")
 
-            # --- Подготавливаем сессию для API-запросов ---
-            cookies = {name: value for name, value in cookies_dict.items()}
-            headers = {
-                "User-Agent": "Mozilla/5.0",
-                "Referer": BASE_URL,
-                "X-Requested-With": "XMLHttpRequest",
-                "Accept": "application/json, text/javascript, */*; q=0.01",
-            }
-
             rewards_normal, rewards_achieve = [], []
 
-            async with aiohttp.ClientSession(headers=headers, cookies=cookies) as session:
-                async def claim(apid: str):
-                    """Выполняет запрос получения награды."""
+            async def claim(apid: str):
+                """Выполняет запрос получения награды."""
+                try:
+                    _, text = await h.fetch(f"{API_URL}{apid}")
                     try:
-                        async with session.get(f"{API_URL}{apid}", timeout=15) as resp:
-                            text = await resp.text()
-                            try:
-                                data = json.loads(text)
-                            except Exception:
-                                data = None
-
-                            if not data:
-                                return False, f"⚠️ {apid}: неизвестный ответ"
-
-                            status = str(data.get("status"))
-                            msg = data.get("msg") or "Неизвестный ответ"
-
-                            # 🎯 Состояния награды
-                            if status == "1":
-                                return True, f"✅ {apid}: {msg}"
-                            elif status == "0":
-                                if any(w in msg.lower() for w in ["через", "позже", "hours", "hour", "ещё недоступна"]):
-                                    return None, f"⏸️ {apid}: {msg}"
-                                elif any(w in msg.lower() for w in ["уже получена", "already claimed"]):
-                                    return False, f"🔹 {apid}: уже получена"
-                                return True, f"🟢 {apid}: {msg}"
-                            return False, f"⚠️ {apid}: {text[:120]}"
-                    except Exception as e:
-                        return False, f"❌ {apid}: ошибка {e}"
-
-                # --- Проверяем доступные обычные награды ---
-                logger.info(f"[thanksgiving_event] {username} ({uid}) — начинаю сбор обычных наград")
-                for apid in NORMAL_IDS:
-                    result, msg = await claim(apid)
-                    rewards_normal.append(msg)
-                    if result is None:  # награда ещё недоступна
-                        rewards_normal.append("⏸️ Следующая награда станет доступна позже (возможно через 12 часов).")
-                        break
-                    await asyncio.sleep(0.5)
-
-                # --- Проверяем бонусные награды ---
-                logger.info(f"[thanksgiving_event] {username} ({uid}) — начинаю сбор бонусных наград")
-                for apid in ACHIEVE_IDS:
-                    _, msg = await claim(apid)
-                    rewards_achieve.append(msg)
-                    await asyncio.sleep(0.5)
+                        data = json.loads(text)
+                    except Exception:
+                        data = None
+
+                    if not data:
+                        return False, f"⚠️ {apid}: неизвестный ответ"
+
+                    status = str(data.get("status"))
+                    msg = data.get("msg") or "Неизвестный ответ"
+
+                    # 🎯 Состояния награды
+                    if status == "1":
+                        return True, f"✅ {apid}: {msg}"
+                    elif status == "0":
+                        if any(w in msg.lower() for w in ["через", "позже", "hours", "hour", "ещё недоступна"]):
+                            return None, f"⏸️ {apid}: {msg}"
+                        elif any(w in msg.lower() for w in ["уже получена", "already claimed"]):
+                            return False, f"🔹 {apid}: уже получена"
+                        return True, f"🟢 {apid}: {msg}"
+                    return False, f"⚠️ {apid}: {text[:120]}"
+                except Exception as e:
+                    return False, f"❌ {apid}: ошибка {e}"
+
+            # --- Проверяем доступные обычные награды ---
+            logger.info(f"[thanksgiving_event] {username} ({uid}) — начинаю сбор обычных наград")
+            for apid in NORMAL_IDS:
+                result, msg = await claim(apid)
+                rewards_normal.append(msg)
+                if result is None:  # награда ещё недоступна
+                    rewards_normal.append("⏸️ Следующая награда станет доступна позже (возможно через 12 часов).")
+                    break
+                await asyncio.sleep(0.5)
+
+            # --- Проверяем бонусные награды ---
+            logger.info(f"[thanksgiving_event] {username} ({uid}) — начинаю сбор бонусных наград")
+            for apid in ACHIEVE_IDS:
+                _, msg = await claim(apid)
+                rewards_achieve.append(msg)
+                await asyncio.sleep(0.5)
 
             # 🧾 Формируем итог
             summary = (
@@ -180,5 +174,7 @@ async def run_thanksgiving_event(user_id: str, uid: str = None, context=None) ->
             logger.exception(f"[thanksgiving_event] ❌ Ошибка в handler: {e}")
             return {"success": False, "message": f"❌ Ошибка выполнения: {e}"}
 
-    # 🧠 Запускаем универсально через browser_patches
-    return await run_event_with_browser(user_id, uid, BASE_URL, "10 дней призов", handler, context=context)
\ No newline at end of file
+    # 🧠 Браузер — только для cookies/UA, награды собираются по HTTP (browser_patches.run_event_with_handoff)
+    return await run_event_with_handoff(
+        user_id, uid, BASE_URL, "10 дней призов", handler, context=context, page_fn=read_page
+    )
\ No newline at end of file
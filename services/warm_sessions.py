@@ -0,0 +1,325 @@
+# tg_zov/services/warm_sessions.py
+"""
+🔥 Кэш «тёплых» браузерных сессий для интерактивных действий
+
+Раньше держать страницу открытой умел только обмен пазлов
+(puzzle_exchange_auto.active_sessions + жёсткий таймер на 60 с), а каждое
+нажатие «получить пазл» / «Найди пару» / промокод заново поднимало браузер,
+ставило cookies и грузило страницу события.
+
+Здесь сессия (контекст из общего BrowserPool + открытая страница) живёт
+в кэше по ключу (user_id, uid):
+  • повторное действие того же пользователя берёт уже загруженную страницу;
+  • TTL простоя продлевается при каждом использовании;
+  • LRU-вытеснение по числу сессий и по общему «бюджету памяти»
+    (базовая оценка на контекст + JS-heap страницы);
+  • prewarm() заранее открывает страницу события, пока пользователь
+    ещё выбирает пазл в меню;
+  • при закрытии свежие cookies сохраняются в cookie_store.
+
+Одновременно сессией пользуется только один обработчик (asyncio.Lock сессии).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from services import cookie_store
+from services.browser_patches import (
+    BrowserPool,
+    get_browser_pool,
+    humanize_pre_action,
+)
+
+logger = logging.getLogger("warm_sessions")
+
+MAX_WARM_SESSIONS = 8        # больше — вытесняется давно не использованная
+MEMORY_BUDGET_MB = 800       # оценка памяти всех тёплых сессий
+SESSION_BASE_MB = 60         # оценка «веса» контекста без учёта JS-heap страницы
+IDLE_TTL = 120               # сек. простоя до закрытия
+REAP_EVERY = 15              # период проверки простаивающих сессий
+NAV_TIMEOUT = 30_000
+# Политика перехвата запросов (services.net_policy): сессией пользуются и fetch-сценарии, и клики по странице
+SESSION_POLICY = "render-light"
+
+Key = Tuple[str, str]
+
+
+class WarmSession:
+    __slots__ = ("user_id", "uid", "context", "page", "profile", "lock",
+                 "created", "last_used", "uses", "cost_mb", "navigated")
+
+    def __init__(self, user_id: str, uid: str, ctx: Dict[str, Any]):
+        self.user_id = user_id
+        self.uid = uid
+        self.context = ctx["context"]
+        self.page = ctx["page"]
+        self.profile = ctx.get("profile")
+        self.lock = asyncio.Lock()
+        self.created = self.last_used = time.monotonic()
+        self.uses = 0
+        self.cost_mb = float(SESSION_BASE_MB)
+        # страница была (пере)загружена в рамках текущего get()/acquire()
+        self.navigated = False
+
+    @property
+    def key(self) -> Key:
+        return self.user_id, self.uid
+
+    @property
+    def alive(self) -> bool:
+        try:
+            return not self.page.is_closed()
+        except Exception:
+            return False
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+
+class WarmSessionCache:
+    def __init__(
+        self,
+        pool: Optional[BrowserPool] = None,
+        *,
+        max_sessions: int = MAX_WARM_SESSIONS,
+        memory_budget_mb: float = MEMORY_BUDGET_MB,
+        idle_ttl: float = IDLE_TTL,
+    ):
+        self._pool = pool
+        self.max_sessions = max(1, max_sessions)
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[Key, WarmSession]" = OrderedDict()
+        self._creating: Dict[Key, asyncio.Lock] = {}
+        self._creating_refs: Dict[Key, int] = {}     # сколько _obtain ждут/держат замок — без них замок удаляется
+        self._reaper: Optional[asyncio.Task] = None
+        self.closed = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def pool(self) -> BrowserPool:
+        return self._pool or get_browser_pool()
+
+    # ───── создание / навигация ─────
+    async def _open(self, user_id: str, uid: str, cookies: Optional[Dict[str, str]]) -> WarmSession:
+        if cookies is None:
+            cookies = cookie_store.get_cookies(user_id, uid)
+        ctx = await self.pool.new_session(cookies=cookies or None, policy=SESSION_POLICY, label=uid)
+        return WarmSession(user_id, uid, ctx)
+
+    async def _navigate(self, session: WarmSession, url: str, fresh: bool):
+        await session.page.goto(url, wait_until="domcontentloaded", timeout=NAV_TIMEOUT)
+        session.navigated = True
+        if fresh:
+            await asyncio.sleep(1.0)
+            await humanize_pre_action(session.page)
+        try:
+            heap = await session.page.evaluate(
+                "() => (performance.memory && performance.memory.usedJSHeapSize) || 0"
+            )
+            session.cost_mb = SESSION_BASE_MB + float(heap or 0) / (1024 * 1024)
+        except Exception:
+            pass
+
+    async def _obtain(self, key: Key, cookies: Optional[Dict[str, str]]) -> Tuple[WarmSession, bool]:
+        if self.closed:
+            raise RuntimeError("WarmSessionCache закрыт")
+        creating = self._creating.setdefault(key, asyncio.Lock())
+        self._creating_refs[key] = self._creating_refs.get(key, 0) + 1
+        try:
+            async with creating:
+                session = self._sessions.get(key)
+                if session is not None and not session.alive:
+                    await self._drop(key, save_cookies=False)
+                    session = None
+                if session is not None:
+                    self.hits += 1
+                    self._sessions.move_to_end(key)
+                    return session, False
+                self.misses += 1
+                session = await self._open(key[0], key[1], cookies)
+                self._sessions[key] = session
+                self._ensure_reaper()
+                return session, True
+        finally:
+            self._creating_refs[key] -= 1
+            if not self._creating_refs[key]:
+                del self._creating_refs[key]
+                self._creating.pop(key, None)
+
+    async def _prepare(self, session: WarmSession, url: Optional[str], fresh: bool):
+        """Вызывается под session.lock: ставит страницу на url и следит за бюджетом."""
+        session.navigated = False
+        if url and (fresh or not session.page.url.startswith(url)):
+            try:
+                await self._navigate(session, url, fresh)
+            except Exception:
+                await self._drop(session.key, save_cookies=False)
+                raise
+        session.touch()
+        await self._enforce_budget(keep=session.key)
+
+    async def get(self, user_id: str, uid: str, url: Optional[str] = None,
+                  cookies: Optional[Dict[str, str]] = None) -> WarmSession:
+        """
+        Тёплая сессия для (user_id, uid); при отсутствии — создаётся.
+        url — страница, на которой сессия должна стоять (перезагружается, только если страница другая).
+        """
+        key: Key = (str(user_id), str(uid))
+        session, fresh = await self._obtain(key, cookies)
+        async with session.lock:
+            await self._prepare(session, url, fresh)
+        return session
+
+    @asynccontextmanager
+    async def acquire(self, user_id: str, uid: str, url: Optional[str] = None,
+                      cookies: Optional[Dict[str, str]] = None):
+        """
+        async with cache.acquire(user_id, uid, url) as session:
+            session.page ...
+
+        Сессия занята на время блока; при исключении внутри она закрывается
+        (страница могла остаться в неизвестном состоянии).
+        """
+        key: Key = (str(user_id), str(uid))
+        while True:
+            session, fresh = await self._obtain(key, cookies)
+            await session.lock.acquire()
+            if self._sessions.get(key) is session:
+                break
+            # пока ждали, сессию закрыли (ошибка у предыдущего владельца) — берём новую
+            session.lock.release()
+        try:
+            await self._prepare(session, url, fresh)
+            session.uses += 1
+            try:
+                yield session
+            except BaseException:
+                await self._drop(key, save_cookies=False)
+                raise
+            finally:
+                session.touch()
+        finally:
+            session.lock.release()
+
+    def prewarm(self, user_id: str, uid: str, url: Optional[str] = None,
+                cookies: Optional[Dict[str, str]] = None) -> Optional[asyncio.Task]:
+        """Заранее открывает сессию в фоне (например, пока пользователь выбирает пазл)."""
+        if self.closed:
+            return None
+
+        async def _warm():
+            try:
+                await self.get(user_id, uid, url, cookies)
+            except Exception as e:
+                logger.warning("[WARM] ⚠️ Не удалось прогреть сессию %s:%s: %s", user_id, uid, e)
+
+        return asyncio.ensure_future(_warm())
+
+    # ───── вытеснение ─────
+    def _memory_mb(self) -> float:
+        return sum(s.cost_mb for s in self._sessions.values())
+
+    async def _enforce_budget(self, keep: Optional[Key] = None):
+        while len(self._sessions) > self.max_sessions or (
+            len(self._sessions) > 1 and self._memory_mb() > self.memory_budget_mb
+        ):
+            victim = next(
+                (k for k, s in self._sessions.items() if k != keep and not s.lock.locked()),
+                None,
+            )
+            if victim is None:
+                break
+            self.evictions += 1
+            logger.info("[WARM] ♻️ Вытесняю сессию %s:%s (LRU)", *victim)
+            await self._drop(victim)
+
+    async def _drop(self, key: Key, save_cookies: bool = True):
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return
+        if save_cookies and session.alive:
+            try:
+                fresh = await session.context.cookies()
+                fresh_map = {c["name"]: c["value"] for c in fresh if "name" in c and "value" in c}
+                if fresh_map:
+                    cookie_store.put_cookies(session.user_id, session.uid, fresh_map, merge=True)
+            except Exception as e:
+                logger.warning("[WARM] ⚠️ Не удалось сохранить cookies %s: %s", session.uid, e)
+        try:
+            await session.context.close()
+        except Exception:
+            pass
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.ensure_future(self._reap_loop())
+
+    async def _reap_loop(self):
+        while not self.closed and self._sessions:
+            await asyncio.sleep(REAP_EVERY)
+            now = time.monotonic()
+            idle = [
+                k for k, s in list(self._sessions.items())
+                if not s.lock.locked() and now - s.last_used > self.idle_ttl
+            ]
+            for key in idle:
+                logger.info("[WARM] ⌛ Сессия %s:%s закрыта по простою", *key)
+                await self._drop(key)
+
+    # ───── управление ─────
+    def peek(self, user_id: str, uid: str) -> Optional[WarmSession]:
+        """Существующая сессия без создания и без продления TTL."""
+        session = self._sessions.get((str(user_id), str(uid)))
+        return session if session is not None and session.alive else None
+
+    async def close_session(self, user_id: str, uid: str):
+        await self._drop((str(user_id), str(uid)))
+
+    async def close_user(self, user_id: str):
+        for key in [k for k in self._sessions if k[0] == str(user_id)]:
+            await self._drop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "memory_mb": round(self._memory_mb(), 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    async def close(self):
+        self.closed = True
+        for key in list(self._sessions):
+            await self._drop(key)
+        if self._reaper is not None:
+            self._reaper.cancel()
+
+
+# Общий кэш на event loop (как и пул браузеров)
+_caches: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, WarmSessionCache]" = weakref.WeakKeyDictionary()
+
+
+def get_warm_sessions() -> WarmSessionCache:
+    loop = asyncio.get_running_loop()
+    cache = _caches.get(loop)
+    if cache is None or cache.closed:
+        cache = _caches[loop] = WarmSessionCache()
+    return cache
+
+
+async def close_warm_sessions():
+    loop = asyncio.get_running_loop()
+    cache = _caches.pop(loop, None)
+    if cache is not None:
+        await cache.close()